@@ -0,0 +1,153 @@
+"""
+Benchmark du ballon mémoire : VMs admises par hôte avec et sans memory_balancer.
+
+Simulation (aucun hyperviseur) : un hôte de --host-mb MB reçoit des demandes de VM
+en continu (modèles debian-client et debian-serveur mélangés). L'admission suit
+l'ordonnanceur (mémoire engagée + mémoire du modèle <= mémoire de l'hôte - réserve,
+et mémoire réellement utilisée comme MemAvailable ; au plus --boots-per-tick
+démarrages par passage) :
+- static : mémoire engagée = maximum des domaines = mémoire du modèle ;
+- balloon : domaines démarrés à la mémoire du modèle, maximum à
+  MEMORY_BALLOON_MAX_FACTOR x le modèle, ballons ajustés
+  à chaque passage par memory_balancer.balance_once à partir de statistiques invitées
+  simulées (même forme que virConnectGetAllDomainStats) ; mémoire engagée =
+  réservations du contrôleur (comme scheduler.committed_mb).
+
+Chaque invité a un usage au repos et des séances de travail aléatoires (graine fixe).
+Mesures : VMs admises (densité), mémoire des invités, passages où un invité voulait
+plus que sa mémoire (pression : swap dans l'invité) et pic d'usage réel de l'hôte.
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_balloon [--host-mb 65536] [--ticks 720] [--seed 1]
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import config  # noqa: E402
+import memory_balancer  # noqa: E402
+import scheduler  # noqa: E402
+
+# Modèle -> (mémoire du modèle MB, usage au repos MB, usage supplémentaire en séance MB)
+PROFILES = {
+    'debian-client': (4096, 900, (600, 2200)),
+    'debian-serveur': (2048, 350, (200, 900)),
+}
+SESSION_START = 0.005  # probabilité par passage qu'une séance commence
+SESSION_TICKS = (30, 240)
+
+
+class SimGuest:
+    """Invité simulé : usage mémoire (MB) au repos, séances de travail aléatoires."""
+
+    def __init__(self, name, template, maximum_mb, rng):
+        self.name, self.template, self.rng = name, template, rng
+        self.nominal, self.idle, self.extra = PROFILES[template]
+        self.maximum = maximum_mb
+        self.current = min(self.nominal, maximum_mb)  # démarrage : mémoire du modèle (lv.memory)
+        self.session = 0
+        self.session_extra = 0
+        self.age = 0
+
+    def step(self):
+        self.age += 1
+        if self.session:
+            self.session -= 1
+        elif self.rng.random() < SESSION_START:
+            self.session = self.rng.randint(*SESSION_TICKS)
+            self.session_extra = self.rng.randint(*self.extra)
+
+    @property
+    def demand(self):
+        """Usage voulu par l'invité (montée progressive au démarrage)."""
+        boot = min(1.0, self.age / 3)
+        return (self.idle + (self.session_extra if self.session else 0)) * boot
+
+    def stats(self):
+        """Statistiques 'balloon' du domaine (KiB) ; celles de l'invité après son démarrage."""
+        values = {'balloon.current': int(self.current * 1024), 'balloon.maximum': int(self.maximum * 1024)}
+        if self.age >= 2:
+            values['balloon.available'] = int(self.current * 1024)
+            values['balloon.usable'] = int(max(0.0, self.current - self.demand) * 1024)
+        return values
+
+
+def simulate(mode, host_mb, ticks, boots_per_tick, seed):
+    rng = random.Random(seed)
+    guests = {}
+    state = memory_balancer.new_state()
+    factor = max(1.0, config.MEMORY_BALLOON_MAX_FACTOR) if mode == 'balloon' else 1.0
+    capacity = host_mb * scheduler.MEMORY_OVERCOMMIT - scheduler.RESERVED_HOST_MB
+    pressure_ticks = guest_ticks = 0
+    peak_used = 0.0
+    next_id = 0
+    reserved = {}
+
+    def apply(name, kib):
+        guests[name].current = kib / 1024
+        return True, ''
+
+    for tick in range(ticks):
+        # Admission (comme scheduler.fits, partie mémoire)
+        for _ in range(boots_per_tick):
+            template = rng.choice(('debian-client', 'debian-client', 'debian-serveur'))
+            nominal = PROFILES[template][0]
+            committed = sum(max(g.current, reserved.get(name, 0)) for name, g in guests.items())
+            used = sum(min(g.demand, g.current) for g in guests.values())
+            free = min(capacity - committed, host_mb - scheduler.RESERVED_HOST_MB - used)
+            if nominal > free:
+                break
+            name = f"sim-{next_id:04d}_default"
+            next_id += 1
+            guests[name] = SimGuest(name, template, int(nominal * factor), rng)
+        for guest in guests.values():
+            guest.step()
+        if mode == 'balloon':
+            summary = memory_balancer.balance_once(
+                state, stats={name: g.stats() for name, g in guests.items()},
+                nominal={name: g.nominal for name, g in guests.items()},
+                host_memory_mb=host_mb, apply=apply, request_stats=lambda name, seconds: (True, ''),
+                now=1_000_000 + tick * memory_balancer.INTERVAL,
+            )
+            reserved = {name: d['reserved_mb'] for name, d in summary['domains'].items()}
+        for guest in guests.values():
+            guest_ticks += 1
+            if guest.demand > guest.current:
+                pressure_ticks += 1
+        peak_used = max(peak_used, sum(min(g.demand, g.current) for g in guests.values()))
+
+    return {
+        'mode': mode,
+        'host_mb': host_mb,
+        'vms': len(guests),
+        'vms_per_64gb': round(len(guests) * 65536 / host_mb, 1),
+        'guests_mb': int(sum(g.current for g in guests.values())),
+        'guests_nominal_mb': sum(g.nominal for g in guests.values()),
+        'pressure_pct': round(pressure_ticks / guest_ticks * 100, 3) if guest_ticks else 0.0,
+        'peak_used_mb': int(peak_used),
+        'balloon_adjustments': state['adjustments'],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host-mb', type=int, default=65536)
+    parser.add_argument('--ticks', type=int, default=720, help='passages du contrôleur (720 x 10 s = 2 h)')
+    parser.add_argument('--boots-per-tick', type=int, default=scheduler.MAX_CONCURRENT_BOOTS)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    results = [simulate(mode, args.host_mb, args.ticks, args.boots_per_tick, args.seed)
+               for mode in ('static', 'balloon')]
+    for result in results:
+        print(json.dumps(result))
+    static, balloon = results
+    print(json.dumps({'density_gain': round(balloon['vms'] / static['vms'], 2) if static['vms'] else None}))
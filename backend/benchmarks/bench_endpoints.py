@@ -0,0 +1,294 @@
+"""
+Benchmark des endpoints : débit et latences p50/p99 à 10/100/1000 VMs.
+
+Pour chaque taille, une arborescence student_vms/<user>/<vm> synthétique (une VM
+sur deux démarrée) et des faux `virsh`, `vagrant` et `websockify` sur le PATH,
+de latence réglable, puis N requêtes réparties sur C clients connectés :
+
+- list_vms_admin, list_vms_student : GET /api/list_vms (admin, puis alice) ;
+- get_vnc_url : GET /api/get_vnc_url/<vm> (VM démarrée d'alice, proxy websockify) ;
+- request_vm_capacity : POST /api/request_vm_capacity (RAM, alice) ;
+- create_vm : POST /api/create_vm (Debian serveur, noms uniques ; la tâche reste en file).
+
+Deux serveurs :
+- flask (défaut) : client de test Flask, un processus neuf par taille ;
+- gunicorn : vrai serveur (--workers, --threads), requêtes HTTP locales.
+
+Les services de fond sont désactivés (VM_MANAGER_BACKGROUND=0) : seul le chemin
+de la requête est mesuré. Résultats en JSON (--output) ; --compare signale les
+écarts à un résultat précédent au-delà de --tolerance (code de sortie 1).
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_endpoints [--sizes 10,100,1000] [--requests 200] [--concurrency 4]
+    python -m benchmarks.bench_endpoints --virsh-latency 0.02 --vagrant-latency 0.5 --output base.json
+    python -m benchmarks.bench_endpoints --server gunicorn --workers 3 --threads 32 --compare base.json
+"""
+from http.cookiejar import CookieJar
+from pathlib import Path
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from benchmarks.fakes import (install_fake_vagrant, install_fake_virsh,  # noqa: E402
+                              install_fake_websockify, make_vm_tree)
+
+USERS = {'admin': 'admin123', 'alice': 'password123'}
+BOXES = ('generic/debian12', 'peru/windows-server-2022-standard-x64-eval')
+WARMUP = 3
+
+
+def _endpoints(running_vm):
+    """(nom, utilisateur, méthode, chemin, corps(n)) de chaque endpoint mesuré."""
+    return [
+        ('list_vms_admin', 'admin', 'GET', '/api/list_vms', None),
+        ('list_vms_student', 'alice', 'GET', '/api/list_vms', None),
+        ('get_vnc_url', 'alice', 'GET', f'/api/get_vnc_url/{running_vm}', None),
+        ('request_vm_capacity', 'alice', 'POST', '/api/request_vm_capacity',
+         lambda n: {'vm_name': running_vm, 'resource': 'ram', 'value': '8GB', 'reason': f'benchmark {n}'}),
+        ('create_vm', 'alice', 'POST', '/api/create_vm',
+         lambda n: {'vm_name': f'bench-new-{n:05d}', 'os': 'debian', 'vm_type': 'serveur',
+                    'vm_username': 'etu', 'vm_password': 'secret123', 'root_password': 'secret123'}),
+    ]
+
+
+# -------------------- Environnement synthétique --------------------
+def prepare(tmp, size, args):
+    """
+    Arborescence de `size` VMs (alice en possède deux, le reste à ~2 VMs par étudiant)
+    et faux exécutables ; retourne (variables d'environnement du serveur, VM démarrée d'alice).
+    """
+    users = ('alice', *(f"etu{i:04d}" for i in range(max(2, size // 2))))
+    domains = make_vm_tree(tmp / 'student_vms', size, users)
+    install_fake_virsh(tmp / 'bin', domains, latency=args.virsh_latency)
+    install_fake_vagrant(tmp / 'bin', startup=args.vagrant_latency, boxes=BOXES)
+    install_fake_websockify(tmp / 'bin', startup=args.websockify_latency, lifetime=600)
+    env = {
+        **os.environ,
+        'VM_MANAGER_DATA_DIR': str(tmp / 'data'),
+        'VM_MANAGER_VMS_DIR': str(tmp / 'student_vms'),
+        'VM_MANAGER_BACKGROUND': '0',
+        'LIBVIRT_BACKEND': 'virsh',
+        'VNC_GATEWAY_ENABLED': '0',
+        'GOLDEN_IMAGES_ENABLED': '0',
+    }
+    running = sorted(d[:-len('_default')] for d, state in domains.items()
+                     if state == 'running' and d.startswith('alice-'))
+    return env, running[0]
+
+
+# -------------------- Clients --------------------
+class FlaskClient:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        return self.client.open(path, method=method, json=body).status_code
+
+
+class HTTPClient:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()))
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with self.opener.open(req, timeout=60) as res:
+                res.read()
+                return res.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered) + 0.5)) - 1))]
+
+
+def measure(make_client, endpoints, requests, concurrency):
+    """Mesure chaque endpoint : `requests` requêtes réparties sur `concurrency` clients."""
+    results = []
+    counter = itertools.count()
+    for name, user, method, path, body in endpoints:
+        clients = []
+        for _ in range(concurrency):
+            client = make_client()
+            assert client.request('POST', '/api/login', {'username': user, 'password': USERS[user]}) == 200
+            clients.append(client)
+        for _ in range(WARMUP):
+            clients[0].request(method, path, body(next(counter)) if body else None)
+
+        latencies, errors, lock = [], [], threading.Lock()
+        share = [requests // concurrency + (1 if i < requests % concurrency else 0) for i in range(concurrency)]
+
+        def worker(client, count):
+            local, failed = [], []
+            for _ in range(count):
+                payload = body(next(counter)) if body else None
+                t0 = time.perf_counter()
+                status = client.request(method, path, payload)
+                local.append(time.perf_counter() - t0)
+                if status >= 300:
+                    failed.append(status)
+            with lock:
+                latencies.extend(local)
+                errors.extend(failed)
+
+        threads = [threading.Thread(target=worker, args=(c, n)) for c, n in zip(clients, share)]
+        started = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+        results.append({
+            'endpoint': name, 'requests': len(latencies), 'errors': len(errors),
+            'error_statuses': sorted(set(errors)),
+            'throughput_rps': round(len(latencies) / elapsed, 1),
+            'p50_ms': round(_percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(_percentile(latencies, 99) * 1000, 2),
+            'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        })
+    return results
+
+
+# -------------------- Serveurs --------------------
+def run_flask_child(size, args):
+    """Dans un processus neuf (environnement déjà préparé) : mesure via le client de test."""
+    import main
+    import vnc_proxies
+    running_vm = os.environ['BENCH_RUNNING_VM']
+    try:
+        results = measure(lambda: FlaskClient(main.app), _endpoints(running_vm), args.requests, args.concurrency)
+    finally:
+        vnc_proxies.release(f"{running_vm}_default")
+    print(json.dumps(results))
+
+
+def run_flask(size, args):
+    with tempfile.TemporaryDirectory(prefix='vm_manager_bench_') as tmp:
+        env, running_vm = prepare(Path(tmp), size, args)
+        cmd = [sys.executable, '-m', 'benchmarks.bench_endpoints', '--child', str(size),
+               '--requests', str(args.requests), '--concurrency', str(args.concurrency)]
+        out = subprocess.run(cmd, cwd=BACKEND_DIR, env={**env, 'BENCH_RUNNING_VM': running_vm},
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            raise RuntimeError(f"Mesure à {size} VMs en échec:\n{out.stderr[-2000:]}")
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run_gunicorn(size, args):
+    with tempfile.TemporaryDirectory(prefix='vm_manager_bench_') as tmp:
+        env, running_vm = prepare(Path(tmp), size, args)
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-k', 'gthread', '-w', str(args.workers), '--threads', str(args.threads),
+             '-b', f'127.0.0.1:{port}', 'main:app'],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=open(Path(tmp) / 'gunicorn.log', 'w')
+        )
+        base_url = f'http://127.0.0.1:{port}'
+        try:
+            deadline = time.time() + 60
+            while True:
+                try:
+                    HTTPClient(base_url).request('GET', '/api/login')
+                    break
+                except OSError:
+                    if server.poll() is not None or time.time() > deadline:
+                        raise RuntimeError((Path(tmp) / 'gunicorn.log').read_text()[-2000:])
+                    time.sleep(0.2)
+            return measure(lambda: HTTPClient(base_url), _endpoints(running_vm), args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+
+# -------------------- Comparaison --------------------
+def compare(previous, current, tolerance):
+    """Écarts (p50, p99 plus lents ou débit plus faible) au-delà de `tolerance` ; retourne les régressions."""
+    before = {(r['vms'], r['endpoint']): r for r in previous['results']}
+    regressions = []
+    for r in current['results']:
+        old = before.get((r['vms'], r['endpoint']))
+        if old is None:
+            continue
+        for key, worse in (('p50_ms', 1), ('p99_ms', 1), ('throughput_rps', -1)):
+            if not old[key]:
+                continue
+            change = (r[key] - old[key]) / old[key]
+            if change * worse > tolerance:
+                regressions.append({'vms': r['vms'], 'endpoint': r['endpoint'], 'metric': key,
+                                    'before': old[key], 'after': r[key], 'change_pct': round(change * 100, 1)})
+    return regressions
+
+
+def main(args):
+    runner = run_gunicorn if args.server == 'gunicorn' else run_flask
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'host': platform.node(), 'python': platform.python_version(),
+            'server': args.server, 'requests': args.requests, 'concurrency': args.concurrency,
+            'workers': args.workers if args.server == 'gunicorn' else None,
+            'threads': args.threads if args.server == 'gunicorn' else None,
+            'virsh_latency': args.virsh_latency, 'vagrant_latency': args.vagrant_latency,
+            'websockify_latency': args.websockify_latency,
+        },
+        'results': [],
+    }
+    for size in args.sizes:
+        for result in runner(size, args):
+            report['results'].append({'vms': size, **result})
+            print(json.dumps(report['results'][-1]))
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + '\n')
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), report, args.tolerance)
+        for r in regressions:
+            print(f"RÉGRESSION {r['endpoint']} à {r['vms']} VMs : {r['metric']} {r['before']} → {r['after']} "
+                  f"({r['change_pct']:+}%)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10,100,1000', type=lambda s: [int(x) for x in s.split(',')])
+    parser.add_argument('--requests', type=int, default=200, help='requêtes mesurées par endpoint')
+    parser.add_argument('--concurrency', type=int, default=4, help='clients simultanés')
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--virsh-latency', type=float, default=0.0, help='secondes par appel virsh')
+    parser.add_argument('--vagrant-latency', type=float, default=0.0, help='démarrage de vagrant (s)')
+    parser.add_argument('--websockify-latency', type=float, default=0.0, help='démarrage de websockify (s)')
+    parser.add_argument('--output', help='fichier JSON des résultats')
+    parser.add_argument('--compare', help='résultats JSON précédents à comparer')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='écart relatif toléré (0.2 = 20 %%)')
+    parser.add_argument('--child', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child is not None:
+        run_flask_child(args.child, args)
+    else:
+        sys.exit(main(args))
@@ -0,0 +1,94 @@
+"""
+Benchmark du cycle de vie : latence par opération, backend vagrant contre native.
+
+Exécute les gestionnaires de tâches réels (lancement, arrêt, suppression) sur
+des VMs en basculant la ligne "Backend:" de vm_info.txt. Deux modes :
+
+- par défaut, sans hyperviseur : faux virsh/vagrant (benchmarks.fakes), le coût
+  de démarrage Ruby de Vagrant étant simulé par --vagrant-startup secondes ;
+- --vm-path DIR : VM réelle déjà créée (cycles lancement/arrêt uniquement,
+  la suppression n'est pas mesurée).
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_lifecycle [--rounds 5] [--vagrant-startup 1.0]
+    python -m benchmarks.bench_lifecycle --vm-path ../student_vms/alice/vm1 --rounds 3
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+from benchmarks.fakes import install_fake_vagrant, install_fake_virsh  # noqa: E402
+
+
+def _set_backend(vm_path, backend):
+    info = vm_path / 'vm_info.txt'
+    lines = [l for l in info.read_text().splitlines() if not l.startswith('Backend:')] if info.exists() else []
+    info.write_text('\n'.join(lines + [f'Backend: {backend}']) + '\n')
+
+
+def _timed(handler, vm_path, kind):
+    job = {'id': 0, 'kind': kind, 'vm_name': vm_path.name, 'payload': {'path': str(vm_path)}}
+    t0 = time.perf_counter()
+    handler(job, lambda line: None)
+    return (time.perf_counter() - t0) * 1000
+
+
+def _summary(samples):
+    return {'median_ms': round(statistics.median(samples), 1), 'min_ms': round(min(samples), 1)} if samples else None
+
+
+def run(rounds, vm_path=None, vagrant_startup=1.0):
+    import libvirt_conn
+    import main
+    import vm_state_cache
+    vm_state_cache.refresh_domain = lambda domain_name: None  # hors mesure
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        if vm_path is None:
+            libvirt_conn.BACKEND = 'virsh'
+            install_fake_virsh(tmp / 'bin', {})
+            install_fake_vagrant(tmp / 'bin', vagrant_startup)
+            main.environment.refresh()
+        domains_file = Path(os.environ.get('FAKE_VIRSH_DOMAINS', tmp / 'none'))
+        original = main.lifecycle.read_backend(vm_path) if vm_path else None
+
+        results = []
+        for backend in ('vagrant', 'native'):
+            samples = {'launch': [], 'halt': [], 'delete': []}
+            for i in range(rounds):
+                if vm_path is None:
+                    path = tmp / 'vms' / f"bench-{backend}-{i}"
+                    path.mkdir(parents=True)
+                    domains_file.write_text(domains_file.read_text() + f"{path.name}_default shut off\n")
+                else:
+                    path = Path(vm_path)
+                _set_backend(path, backend)
+                samples['launch'].append(_timed(main._job_launch_vm, path, 'launch'))
+                samples['halt'].append(_timed(main._job_halt_vm, path, 'halt'))
+                if vm_path is None:
+                    samples['delete'].append(_timed(main._job_delete_vm, path, 'delete'))
+            results.append({'backend': backend, **{op: _summary(v) for op, v in samples.items()}})
+            print(json.dumps(results[-1]))
+        if vm_path is not None:
+            _set_backend(Path(vm_path), original)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--vm-path', default=None)
+    parser.add_argument('--vagrant-startup', type=float, default=1.0)
+    args = parser.parse_args()
+    run(args.rounds, args.vm_path, args.vagrant_startup)
@@ -0,0 +1,92 @@
+"""
+Benchmark /api/list_vms : latence pour 10/100/1000 domaines factices.
+
+Compare l'ancien parcours (un `virsh domstate` par VM) au service de la liste
+depuis le cache d'états (alimenté par un seul `virsh list --all`), et la
+vérification de propriété d'un admin : parcours de tous les dossiers
+utilisateurs contre recherche indexée dans vm_store. Usage, depuis backend/ :
+
+    python -m benchmarks.bench_list_vms [--sizes 10,100,1000] [--repeat 5]
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from benchmarks.fakes import install_fake_virsh, make_vm_tree  # noqa: E402
+
+
+def _timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return {'median_ms': round(statistics.median(samples), 2), 'min_ms': round(min(samples), 2)}
+
+
+def run(sizes, repeat):
+    data_dir = tempfile.mkdtemp(prefix='vm_manager_bench_')
+    os.environ.setdefault('VM_MANAGER_DATA_DIR', data_dir)
+    os.environ['VM_MANAGER_BACKGROUND'] = '0'
+    import libvirt_conn
+    import main
+    import vm_state_cache
+    libvirt_conn.BACKEND = 'virsh'  # forcer le pilote virsh (faux exécutable)
+
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            users = tuple(f"etu{i:04d}" for i in range(max(3, size // 2)))  # ~2 VMs par étudiant
+            domains = make_vm_tree(tmp / 'student_vms', size, users)
+            install_fake_virsh(tmp / 'bin', domains)
+            main.VMS_BASE_DIR = tmp / 'student_vms'
+            main.vm_store.import_tree(main.VMS_BASE_DIR)
+            vm_state_cache.resync()
+            last_vm = sorted(domains)[-1][:-len('_default')]
+
+            client = main.app.test_client()
+            client.post('/api/login', json={'username': 'admin', 'password': 'admin123'})
+
+            def bulk():
+                res = client.get('/api/list_vms')
+                assert res.status_code == 200 and len(res.get_json()['vms']) == size
+
+            def per_vm():
+                for user_dir in main.VMS_BASE_DIR.iterdir():
+                    for vm_dir in user_dir.iterdir():
+                        main.get_vm_state(vm_dir.name)
+
+            def ownership_scan():
+                # Ancienne vérification admin : chercher le nom dans chaque dossier utilisateur
+                for user_dir in main.VMS_BASE_DIR.iterdir():
+                    if user_dir.is_dir() and (user_dir / last_vm).exists():
+                        return user_dir / last_vm
+
+            def ownership_indexed():
+                assert main.check_vm_ownership('admin', last_vm)[0]
+
+            results.append({
+                'vms': size,
+                'list_vms_cached': _timed(bulk, repeat),
+                'per_vm_domstate': _timed(per_vm, 1 if size >= 1000 else repeat),
+                'ownership_scan': _timed(ownership_scan, repeat * 20),
+                'ownership_indexed': _timed(ownership_indexed, repeat * 20),
+            })
+            print(json.dumps(results[-1]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10,100,1000')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run([int(x) for x in args.sizes.split(',')], args.repeat)
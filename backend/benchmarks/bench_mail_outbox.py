@@ -0,0 +1,166 @@
+"""
+Benchmark des emails de demande de capacité : envoi dans la requête contre file d'envoi.
+
+Un faux relais SMTP local (benchmarks.fakes.FakeSMTPServer), dont la poignée de
+main est ralentie de --latency secondes, reçoit N demandes :
+- inline : une connexion SMTP par demande, dans la requête (ancien comportement) ;
+- outbox : mail_outbox.enqueue dans la requête, puis l'expéditeur vide la file
+  sur une seule connexion réutilisée ;
+- digest : MAIL_DIGEST_INTERVAL > 0, les N demandes partent en un seul résumé ;
+- retry : relais en échec (451) puis rétabli ; le message reste en file, puis part.
+
+Mesures : temps passé dans la requête, temps de vidage de la file, connexions
+SMTP ouvertes et messages reçus par le relais.
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_mail_outbox [--count 50] [--latency 0.2]
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import smtplib
+import statistics
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import config  # noqa: E402
+import db  # noqa: E402
+import mail_outbox  # noqa: E402
+from benchmarks.fakes import FakeSMTPServer  # noqa: E402
+
+
+def _configure(server):
+    config.SMTP_HOST, config.SMTP_PORT = server.host, server.port
+    config.SMTP_USER = config.SMTP_PASSWORD = None
+    config.SMTP_FROM = 'no-reply@example.com'
+    config.SMTP_USE_TLS = config.SMTP_USE_SSL = False
+    config.ADMIN_EMAILS = ['admin@example.com']
+
+
+def _reset():
+    db.get_db().execute("DELETE FROM mail_outbox")
+
+
+def _summary(samples):
+    return {'median_ms': round(statistics.median(samples), 2), 'max_ms': round(max(samples), 2)}
+
+
+def _request(i):
+    return f"[VM Request] alice/vm{i} → RAM 8192 MB", f"Demande {i}\n- Motif: benchmark\n"
+
+
+def _send_inline(subject, body):
+    """Ancien chemin : connexion, EHLO, envoi et QUIT pendant la requête."""
+    msg = EmailMessage()
+    msg['Subject'], msg['From'], msg['To'] = subject, config.SMTP_FROM, ', '.join(config.ADMIN_EMAILS)
+    msg.set_content(body)
+    with smtplib.SMTP(config.SMTP_HOST, config.SMTP_PORT, timeout=30) as s:
+        s.ehlo()
+        s.send_message(msg)
+
+
+def bench_inline(server, count):
+    latencies = []
+    for i in range(count):
+        t0 = time.perf_counter()
+        _send_inline(*_request(i))
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return {'mode': 'inline', 'request': _summary(latencies), 'total_ms': round(sum(latencies), 1)}
+
+
+def _enqueue_all(count, digest):
+    latencies = []
+    for i in range(count):
+        t0 = time.perf_counter()
+        mail_outbox.enqueue(*_request(i), digest=digest)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return latencies
+
+
+def bench_outbox(server, count):
+    _reset()
+    latencies = _enqueue_all(count, digest=True)
+    connection = mail_outbox._Connection()
+    t0 = time.perf_counter()
+    sent = mail_outbox.drain(connection)
+    drain_ms = (time.perf_counter() - t0) * 1000
+    connection.close()
+    return {'mode': 'outbox', 'request': _summary(latencies), 'drain_ms': round(drain_ms, 1),
+            'sent': sent, 'smtp_connections': connection.opened}
+
+
+def bench_digest(server, count):
+    _reset()
+    mail_outbox.DIGEST_INTERVAL = 0.5
+    try:
+        latencies = _enqueue_all(count, digest=True)
+        connection = mail_outbox._Connection()
+        early = mail_outbox.drain(connection)  # intervalle non écoulé : rien ne part
+        time.sleep(0.5)
+        received = len(server.messages)
+        sent = mail_outbox.drain(connection)
+        connection.close()
+    finally:
+        mail_outbox.DIGEST_INTERVAL = config.MAIL_DIGEST_INTERVAL
+    return {'mode': 'digest', 'request': _summary(latencies), 'sent_before_interval': early,
+            'sent': sent, 'emails_received': len(server.messages) - received,
+            'smtp_connections': connection.opened}
+
+
+def bench_retry(server):
+    _reset()
+    retry_base = mail_outbox.RETRY_BASE
+    mail_outbox.RETRY_BASE = 0.2
+    try:
+        message_id = mail_outbox.enqueue(*_request(0))
+        connection = mail_outbox._Connection()
+        server.fail = True
+        failed = mail_outbox.drain(connection)
+        row = db.get_db().execute("SELECT * FROM mail_outbox WHERE id = ?", (message_id,)).fetchone()
+        server.fail = False
+        immediate = mail_outbox.drain(connection)  # attente non écoulée
+        time.sleep(0.25)
+        sent = mail_outbox.drain(connection)
+        connection.close()
+    finally:
+        mail_outbox.RETRY_BASE = retry_base
+    final = db.get_db().execute("SELECT state, attempts FROM mail_outbox WHERE id = ?", (message_id,)).fetchone()
+    return {'mode': 'retry', 'sent_while_failing': failed, 'state_after_failure': row['state'],
+            'last_error': row['last_error'], 'sent_before_backoff': immediate, 'sent_after_backoff': sent,
+            'final_state': final['state'], 'attempts': final['attempts']}
+
+
+def run(count, latency):
+    server = FakeSMTPServer(latency=latency).start()
+    _configure(server)
+    results = []
+    try:
+        for bench in (bench_inline, bench_outbox, bench_digest):
+            connections, messages = server.connections, len(server.messages)
+            result = bench(server, count)
+            result.update({'count': count, 'relay_latency_s': latency,
+                           'relay_connections': server.connections - connections,
+                           'relay_messages': len(server.messages) - messages})
+            results.append(result)
+            print(json.dumps(results[-1]))
+        results.append(bench_retry(server))
+        print(json.dumps(results[-1]))
+    finally:
+        server.stop()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.2)
+    args = parser.parse_args()
+    run(args.count, args.latency)
@@ -0,0 +1,115 @@
+"""
+Benchmark de l'instrumentation (/metrics) : surcoût par mesure et agrégation multi-workers.
+
+- observe_request / observe_command : coût d'un enregistrement (µs) ;
+- requête Flask : route minimale avec et sans les crochets before/after_request ;
+- agrégation : 3 processus (comme les workers gunicorn) enregistrent chacun des
+  requêtes, un quatrième lit /metrics ; les totaux doivent correspondre, y compris
+  après la fin d'un worker (archive) ;
+- render() : durée de génération du texte d'exposition.
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_metrics [--iterations 100000]
+"""
+from pathlib import Path
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import metrics  # noqa: E402
+
+
+def _per_call_us(fn, iterations):
+    t0 = time.perf_counter()
+    for i in range(iterations):
+        fn(i)
+    return round((time.perf_counter() - t0) / iterations * 1e6, 3)
+
+
+def bench_record(iterations):
+    routes = [f'/api/route{i}' for i in range(20)]
+    argv = ['virsh', '-c', 'qemu:///system', 'domstate', 'alice-vm_default']
+    return {
+        'observe_request_us': _per_call_us(
+            lambda i: metrics.observe_request(routes[i % 20], 'GET', 200, 0.004), iterations),
+        'observe_command_us': _per_call_us(lambda i: metrics.observe_command(argv, 0.03, True), iterations),
+    }
+
+
+def bench_flask(iterations, rounds=3):
+    """Route minimale, avec et sans crochets ; meilleur de `rounds` passages alternés."""
+    from flask import Flask, g, request
+    clients = {}
+    for instrumented in (False, True):
+        app = Flask(__name__)
+
+        @app.route('/ping')
+        def ping():
+            return 'ok'
+
+        if instrumented:
+            @app.before_request
+            def start():
+                g.request_started = time.perf_counter()
+
+            @app.after_request
+            def record(response):
+                started = g.pop('request_started', None)
+                route = request.url_rule.rule if request.url_rule else 'unmatched'
+                metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+                return response
+
+        clients['instrumented_us' if instrumented else 'baseline_us'] = app.test_client()
+    results = {}
+    for _ in range(rounds):
+        for key, client in clients.items():
+            us = _per_call_us(lambda i: client.get('/ping'), iterations)
+            results[key] = min(results.get(key, us), us)
+    results['overhead_us'] = round(results['instrumented_us'] - results['baseline_us'], 2)
+    return results
+
+
+def _worker(args):
+    index, count = args
+    for i in range(count):
+        metrics.observe_request('/api/list_vms', 'GET', 200, 0.001 * (index + 1))
+    metrics.observe_command(['vagrant', 'box', 'list'], 1.5, index != 0)
+    metrics.flush()
+    return os.getpid()
+
+
+def bench_aggregation(count):
+    with multiprocessing.get_context('spawn').Pool(3) as pool:
+        pool.map(_worker, [(i, count) for i in range(3)])
+        text_live = metrics.render()
+    text_after = metrics.render()  # workers terminés : séries archivées
+    wanted = f'vm_manager_http_requests_total{{method="GET",route="/api/list_vms",status="200"}} {3 * count}'
+    failures = 'vm_manager_command_failures_total{command="vagrant box list"} 1'
+    t0 = time.perf_counter()
+    for _ in range(20):
+        metrics.render()
+    return {
+        'workers': 3,
+        'requests_per_worker': count,
+        'total_ok_live': wanted in text_live,
+        'total_ok_after_exit': wanted in text_after and failures in text_after,
+        'render_ms': round((time.perf_counter() - t0) / 20 * 1000, 2),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+    print(json.dumps({'record': bench_record(args.iterations)}))
+    print(json.dumps({'flask': bench_flask(max(1000, args.iterations // 20))}))
+    print(json.dumps({'aggregation': bench_aggregation(1000)}))
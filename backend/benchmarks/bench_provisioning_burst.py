@@ -0,0 +1,97 @@
+"""
+Simulation : temps jusqu'à "VM prête" pour une rafale de N créations.
+
+Modèle d'hôte simplifié (pas à pas d'une seconde) :
+- chaque démarrage demande `cpus` vCPU pendant `cpu_work` secondes-CPU
+  (apt-get, installation XFCE...) et écrit `io_work` MB sur disque ;
+- les CPU sont partagés équitablement ; le débit disque s'effondre avec le
+  nombre de flux concurrents (seek thrash : bw / (1 + contention * (k - 1))).
+
+Compare le lancement sans limite (ancien comportement : un `vagrant up` par
+clic) à l'ordonnanceur réel (scheduler.pick_next) avec différents plafonds.
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_provisioning_burst [--sizes 10,30,60] [--caps 0,4,8]
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import scheduler  # noqa: E402
+
+HOST = {'memory_mb': 256 * 1024, 'cpus': 16, 'disk_mb_s': 400.0, 'contention': 0.15}
+VM = {'memory': 4096, 'cpus': 2, 'cpu_work': 240.0, 'io_work': 1500.0}
+ARRIVAL_WINDOW = 60  # les N clics arrivent dans la première minute
+
+
+def simulate(count, cap):
+    """cap=0 : sans limite ; sinon ordonnanceur avec ce plafond de démarrages simultanés."""
+    queued = [
+        {'id': i, 'kind': 'create', 'owner': f'student{i}', 'arrival': i * ARRIVAL_WINDOW / count,
+         'payload': {'memory': VM['memory'], 'cpus': VM['cpus']}}
+        for i in range(count)
+    ]
+    running, ready = [], {}
+    now = 0
+    while len(ready) < count:
+        arrived = [j for j in queued if j['arrival'] <= now]
+        # Admission
+        while arrived:
+            if cap:
+                host = {
+                    'memory_mb': HOST['memory_mb'], 'available_mb': None, 'cpus': HOST['cpus'],
+                    'committed_mb': len(ready) * VM['memory'], 'committed_vcpus': len(ready) * VM['cpus'],
+                }
+                job = scheduler.pick_next(arrived, running, host, policy='fifo', max_boots=cap)
+            else:
+                job = arrived[0]
+            if job is None:
+                break
+            arrived.remove(job)
+            queued.remove(job)
+            job.update(cpu_left=VM['cpu_work'], io_left=VM['io_work'])
+            running.append(job)
+
+        # Plus rien ne peut être admis (mémoire de l'hôte épuisée)
+        if not running and queued and all(j['arrival'] <= now for j in queued):
+            break
+
+        # Progression d'une seconde
+        k = len(running)
+        if k:
+            cpu_share = VM['cpus'] * min(1.0, HOST['cpus'] / (VM['cpus'] * k))
+            io_share = HOST['disk_mb_s'] / (1 + HOST['contention'] * (k - 1)) / k
+            for job in list(running):
+                job['cpu_left'] -= cpu_share
+                job['io_left'] -= io_share
+                if job['cpu_left'] <= 0 and job['io_left'] <= 0:
+                    running.remove(job)
+                    ready[job['id']] = now + 1 - job['arrival']
+        now += 1
+
+    times = sorted(ready.values()) or [0]
+    return {
+        'vms': count,
+        'max_concurrent_boots': cap or 'unlimited',
+        'not_admitted': len(queued),
+        'all_ready_s': now,
+        'mean_time_to_ready_s': round(statistics.mean(times), 1),
+        'p50_s': times[len(times) // 2],
+        'p90_s': times[int(len(times) * 0.9) - 1],
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='10,30,60')
+    parser.add_argument('--caps', default='0,4,8')
+    args = parser.parse_args()
+    for size in (int(x) for x in args.sizes.split(',')):
+        for cap in (int(x) for x in args.caps.split(',')):
+            print(json.dumps(simulate(size, cap)))
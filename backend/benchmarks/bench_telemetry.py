@@ -0,0 +1,177 @@
+"""
+Benchmark de la télémétrie : coût d'un passage de collecte selon le nombre de VMs.
+
+Deux sources :
+- libvirt (par défaut si libvirt-python est installé) : pilote factice
+  test:///default, N domaines définis et démarrés. Compare l'interrogation VM par
+  VM (listAllDomains puis info() + memoryStats() par domaine) aux statistiques
+  groupées (un seul getAllDomainStats), puis mesure telemetry.collect_once ;
+- --source synthetic : statistiques groupées générées (aucun hyperviseur), pour
+  mesurer la part Python de collect_once (calcul des débits, tampons mmap, JSON).
+
+Mesures par passage : durée médiane, appels à l'hyperviseur, mémoire des tampons.
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_telemetry [--counts 10,100,500] [--rounds 10]
+    python -m benchmarks.bench_telemetry --source synthetic --counts 10,100,1000
+"""
+from pathlib import Path
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import coordination  # noqa: E402
+import libvirt_conn  # noqa: E402
+import telemetry  # noqa: E402
+
+DOMAIN_XML = """<domain type='test'>
+  <name>{name}</name>
+  <memory unit='MiB'>512</memory>
+  <vcpu>1</vcpu>
+  <os><type>hvm</type></os>
+</domain>"""
+
+
+def _median_ms(samples):
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def _ring_memory_kb():
+    return round(sum(p.stat().st_size for p in coordination.data_path(telemetry.RING_DIR).glob('*.ring')) / 1024, 1)
+
+
+def _clear_rings():
+    for path in coordination.data_path(telemetry.RING_DIR).glob('*.ring'):
+        path.unlink()
+
+
+def _collect_rounds(rounds):
+    """Durées de `rounds` passages de collect_once (le premier, sans débit, hors mesure)."""
+    state = telemetry.new_state()
+    now = time.time()
+    telemetry.collect_once(state, now=now)
+    durations = []
+    for i in range(1, rounds + 1):
+        t0 = time.perf_counter()
+        telemetry.collect_once(state, now=now + i * telemetry.INTERVAL)
+        durations.append(time.perf_counter() - t0)
+    return durations
+
+
+# -------------------- Source libvirt (test:///default) --------------------
+def _define_domains(conn, count):
+    existing = {dom.name() for dom in conn.listAllDomains()}
+    for i in range(count):
+        name = f"bench-{i:04d}"
+        if name not in existing:
+            conn.defineXML(DOMAIN_XML.format(name=name)).create()
+
+
+def _per_domain(conn, libvirt):
+    """Interrogation VM par VM ; retourne le nombre d'appels."""
+    calls = 1
+    for dom in conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE):
+        dom.info()
+        calls += 1
+        try:
+            dom.memoryStats()
+            calls += 1
+        except libvirt.libvirtError:
+            pass
+    return calls
+
+
+def bench_libvirt(counts, rounds):
+    import libvirt
+    libvirt_conn.URI, libvirt_conn.BACKEND = 'test:///default', 'libvirt'
+    conn = libvirt.open('test:///default')
+    flags = 0
+    for group in telemetry.STATS_GROUPS:
+        flags |= libvirt_conn.STATS_GROUPS[group]
+    results = []
+    for count in counts:
+        _define_domains(conn, count)
+        active = len(conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_ACTIVE))
+        per_domain, bulk = [], []
+        for _ in range(rounds):
+            t0 = time.perf_counter()
+            calls = _per_domain(conn, libvirt)
+            per_domain.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            conn.getAllDomainStats(flags, libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE)
+            bulk.append(time.perf_counter() - t0)
+        _clear_rings()
+        collect = _collect_rounds(rounds)
+        results.append({
+            'source': 'libvirt', 'domains': active,
+            'per_domain': {'median_ms': _median_ms(per_domain), 'calls': calls},
+            'bulk': {'median_ms': _median_ms(bulk), 'calls': 1},
+            'collect_once': {'median_ms': _median_ms(collect), 'per_domain_us': round(statistics.median(collect) / active * 1e6, 1)},
+            'ring_memory_kb': _ring_memory_kb(),
+        })
+        print(json.dumps(results[-1]))
+    return results
+
+
+# -------------------- Source synthétique --------------------
+def _synthetic_stats(count):
+    """Statistiques groupées d'un appel, à la forme de virConnectGetAllDomainStats."""
+    tick = {'n': 0}
+
+    def get_all_domain_stats(groups=('state',), active_only=False):
+        tick['n'] += 1
+        n = tick['n']
+        return {
+            f"bench-{i:04d}_default": {
+                'cpu.time': n * 10**9 * (1 + i % 4), 'vcpu.current': 2,
+                'balloon.current': 2097152, 'balloon.maximum': 2097152,
+                'balloon.available': 2000000, 'balloon.unused': 1000000 + i,
+                'block.count': 1, 'block.0.rd.bytes': n * 4096 * i, 'block.0.wr.bytes': n * 8192,
+                'net.count': 1, 'net.0.rx.bytes': n * 1500 * i, 'net.0.tx.bytes': n * 1500,
+            }
+            for i in range(count)
+        }
+    return get_all_domain_stats
+
+
+def bench_synthetic(counts, rounds):
+    original = libvirt_conn.get_all_domain_stats
+    results = []
+    try:
+        for count in counts:
+            libvirt_conn.get_all_domain_stats = _synthetic_stats(count)
+            _clear_rings()
+            collect = _collect_rounds(rounds)
+            t0 = time.perf_counter()
+            samples = telemetry.recent('bench-0000_default')
+            read_ms = (time.perf_counter() - t0) * 1000
+            results.append({
+                'source': 'synthetic', 'domains': count, 'calls': 1,
+                'collect_once': {'median_ms': _median_ms(collect), 'per_domain_us': round(statistics.median(collect) / count * 1e6, 1)},
+                'ring_memory_kb': _ring_memory_kb(),
+                'read_one_vm_ms': round(read_ms, 3), 'samples_read': len(samples),
+            })
+            print(json.dumps(results[-1]))
+    finally:
+        libvirt_conn.get_all_domain_stats = original
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--counts', default='10,100,500')
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--source', choices=('libvirt', 'synthetic'), default=None)
+    args = parser.parse_args()
+    source = args.source or ('libvirt' if libvirt_conn.libvirt is not None else 'synthetic')
+    counts = [int(c) for c in args.counts.split(',')]
+    (bench_libvirt if source == 'libvirt' else bench_synthetic)(counts, args.rounds)
@@ -0,0 +1,180 @@
+"""
+Benchmark des consoles noVNC : un websockify par VM contre la passerelle unique.
+
+Pour N consoles ouvertes simultanément (10, 50, 200 par défaut), chacune vers
+un faux serveur VNC local qui envoie la bannière RFB :
+- websockify : N processus (un port chacun), comme vnc_proxies.acquire ;
+- passerelle : un seul processus vnc_gateway.py, un jeton signé par console.
+
+Mesures : mémoire totale (somme des Pss des processus du groupe, y compris
+les fils que websockify crée par connexion ; les pages partagées après fork
+ne sont comptées qu'une fois), temps de démarrage des proxys et
+latence d'ouverture d'une console (connexion TCP + poignée de main websocket
+jusqu'à la bannière RFB).
+
+Usage, depuis backend/ :
+
+    python -m benchmarks.bench_vnc_gateway [--counts 10,50,200] [--mode both|websockify|gateway]
+"""
+from pathlib import Path
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault('VM_MANAGER_DATA_DIR', tempfile.mkdtemp(prefix='vm_manager_bench_'))
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+
+import vnc_gateway  # noqa: E402
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+VNC_BASE_PORT = 25900
+WS_BASE_PORT = 27080
+GATEWAY_PORT = 27079
+
+
+# -------------------- Faux serveurs VNC --------------------
+async def _fake_vnc(reader, writer):
+    writer.write(b'RFB 003.008\n')
+    await writer.drain()
+    while await reader.read(4096):
+        pass
+    writer.close()
+
+
+async def _start_fake_vnc(count):
+    return [await asyncio.start_server(_fake_vnc, '127.0.0.1', VNC_BASE_PORT + i) for i in range(count)]
+
+
+# -------------------- Processus --------------------
+def _group_pss_kb(pgid):
+    """Somme des Pss (ko) des processus du groupe `pgid`."""
+    total = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                if int(f.read().rsplit(')', 1)[1].split()[2]) != pgid:
+                    continue
+            with open(f'/proc/{entry}/smaps_rollup') as f:
+                total += next(int(l.split()[1]) for l in f if l.startswith('Pss:'))
+        except (OSError, StopIteration, ValueError, IndexError):
+            continue
+    return total
+
+
+def _spawn(cmd):
+    return subprocess.Popen(cmd, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            preexec_fn=os.setpgrp)
+
+
+async def _wait_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            _, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.close()
+            return True
+        except OSError:
+            await asyncio.sleep(0.02)
+    return False
+
+
+# -------------------- Client websocket minimal --------------------
+async def _open_console(port, path):
+    """Ouvre une console ; retourne (reader, writer, latence en ms jusqu'à la bannière RFB)."""
+    t0 = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+        f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\nSec-WebSocket-Protocol: binary\r\n\r\n".encode()
+    )
+    head = await reader.readuntil(b'\r\n\r\n')
+    if b' 101 ' not in head.split(b'\r\n', 1)[0]:
+        raise RuntimeError(head.split(b'\r\n', 1)[0].decode())
+    _, payload = await vnc_gateway._read_frame(reader)
+    if not payload.startswith(b'RFB'):
+        raise RuntimeError(f"bannière inattendue: {payload!r}")
+    return reader, writer, (time.perf_counter() - t0) * 1000
+
+
+def _summary(samples):
+    return {'median_ms': round(statistics.median(samples), 2), 'max_ms': round(max(samples), 2)}
+
+
+async def _bench(mode, count):
+    servers = await _start_fake_vnc(count)
+    processes = []
+    consoles = []
+    try:
+        t0 = time.perf_counter()
+        if mode == 'websockify':
+            for i in range(count):
+                processes.append(_spawn(['websockify', str(WS_BASE_PORT + i), f'127.0.0.1:{VNC_BASE_PORT + i}']))
+            ready = [await _wait_port(WS_BASE_PORT + i) for i in range(count)]
+            targets = [(WS_BASE_PORT + i, '/') for i in range(count)]
+        else:
+            processes.append(_spawn([sys.executable, 'vnc_gateway.py', '--host', '127.0.0.1', '--port', str(GATEWAY_PORT)]))
+            ready = [await _wait_port(GATEWAY_PORT)]
+            targets = [(GATEWAY_PORT, '/websockify?token=' + vnc_gateway.issue_token(f'bench-{i}', VNC_BASE_PORT + i, 'bench'))
+                       for i in range(count)]
+        startup_ms = (time.perf_counter() - t0) * 1000
+        if not all(ready):
+            raise RuntimeError(f"{mode}: proxy non démarré")
+
+        latencies = []
+        for port, path in targets:
+            reader, writer, ms = await _open_console(port, path)
+            consoles.append(writer)
+            latencies.append(ms)
+        await asyncio.sleep(0.5)  # laisser les fils websockify s'installer
+        pss_kb = sum(_group_pss_kb(p.pid) for p in processes)
+        return {
+            'mode': mode,
+            'consoles': count,
+            'processes': len(processes),
+            'ports': len(processes) if mode == 'websockify' else 1,
+            'memory_mb': round(pss_kb / 1024, 1),
+            'memory_per_console_mb': round(pss_kb / 1024 / count, 2),
+            'startup_ms': round(startup_ms, 1),
+            'connect': _summary(latencies),
+        }
+    finally:
+        for writer in consoles:
+            writer.close()
+        for process in processes:
+            try:
+                os.killpg(process.pid, 15)
+            except ProcessLookupError:
+                pass
+            process.wait()
+        await asyncio.sleep(0.2)  # fin des connexions côté faux serveurs VNC
+        for server in servers:
+            server.close()
+
+
+def run(counts, modes):
+    results = []
+    for count in counts:
+        for mode in modes:
+            results.append(asyncio.run(_bench(mode, count)))
+            print(json.dumps(results[-1]))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--counts', default='10,50,200')
+    parser.add_argument('--mode', choices=('both', 'websockify', 'gateway'), default='both')
+    args = parser.parse_args()
+    run([int(c) for c in args.counts.split(',')],
+        ('websockify', 'gateway') if args.mode == 'both' else (args.mode,))
@@ -0,0 +1,212 @@
+"""
+Outils communs aux benchmarks : faux exécutables `virsh`, `vagrant` et `websockify`,
+arborescence student_vms/ synthétique et faux relais SMTP, pour mesurer sans
+hyperviseur ni serveur de mail.
+"""
+from pathlib import Path
+import asyncio
+import os
+import stat
+import threading
+import time
+
+FAKE_VIRSH = r'''#!/bin/sh
+# Faux virsh pour benchmarks : lit "nom_domaine état" dans $FAKE_VIRSH_DOMAINS
+[ -n "$FAKE_VIRSH_LATENCY" ] && sleep "$FAKE_VIRSH_LATENCY"
+while [ "$1" = "-c" ]; do shift 2; done
+case "$1" in
+  list)
+    echo " Id   Name   State"
+    echo "----------------------"
+    awk '{ name=$1; $1=""; sub(/^ /, ""); id = ($0 == "running") ? NR : "-"; printf " %s    %s   %s\n", id, name, $0 }' "$FAKE_VIRSH_DOMAINS"
+    ;;
+  domstate)
+    line=$(grep "^$2 " "$FAKE_VIRSH_DOMAINS") || { echo "error: failed to get domain '$2'" >&2; exit 1; }
+    echo "${line#* }"
+    ;;
+  domid|vncdisplay)
+    # Domaine actif : identifiant = numéro de ligne, display VNC = identifiant
+    n=$(grep -n "^$2 running$" "$FAKE_VIRSH_DOMAINS" | cut -d: -f1)
+    [ -z "$n" ] && { grep -q "^$2 " "$FAKE_VIRSH_DOMAINS" && echo "-" && exit 0; echo "error: failed to get domain '$2'" >&2; exit 1; }
+    [ "$1" = "domid" ] && echo "$n" || echo "127.0.0.1:$n"
+    ;;
+  start)
+    sed -i "s/^$2 .*/$2 running/" "$FAKE_VIRSH_DOMAINS"
+    ;;
+  shutdown|destroy|managedsave)
+    sed -i "s/^$2 .*/$2 shut off/" "$FAKE_VIRSH_DOMAINS"
+    ;;
+  undefine)
+    sed -i "/^$2 /d" "$FAKE_VIRSH_DOMAINS"
+    ;;
+  --version)
+    echo "10.0.0"
+    ;;
+  *)
+    exit 0
+    ;;
+esac
+'''
+
+FAKE_VAGRANT = r'''#!/bin/sh
+# Faux vagrant pour benchmarks : coût de démarrage (Ruby + plugins) simulé par
+# $FAKE_VAGRANT_STARTUP, puis action sur le domaine "<dossier>_default" via virsh.
+[ -n "$FAKE_VAGRANT_STARTUP" ] && sleep "$FAKE_VAGRANT_STARTUP"
+domain="$(basename "$PWD")_default"
+case "$1" in
+  up) virsh start "$domain" ;;
+  halt) virsh shutdown "$domain" ;;
+  destroy) virsh undefine "$domain" ;;
+  --version) echo "Vagrant 2.4.1" ;;
+  plugin) echo "vagrant-libvirt (0.12.2, global)" ;;
+  box) for box in $FAKE_VAGRANT_BOXES; do echo "$box (libvirt, 0)"; done ;;
+esac
+exit 0
+'''
+
+FAKE_WEBSOCKIFY = r'''#!/bin/sh
+# Faux websockify pour benchmarks : délai de démarrage $FAKE_WEBSOCKIFY_STARTUP,
+# puis processus durable sans trafic (arrêté par vnc_proxies.release, ou de
+# lui-même après $FAKE_WEBSOCKIFY_LIFETIME secondes).
+[ -n "$FAKE_WEBSOCKIFY_STARTUP" ] && sleep "$FAKE_WEBSOCKIFY_STARTUP"
+exec sleep "${FAKE_WEBSOCKIFY_LIFETIME:-3600}"
+'''
+
+
+def _install(bin_dir, name, script_text):
+    bin_dir = Path(bin_dir)
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    script = bin_dir / name
+    script.write_text(script_text)
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    if str(bin_dir) not in os.environ.get('PATH', '').split(os.pathsep):
+        os.environ['PATH'] = f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"
+    return script
+
+
+def install_fake_virsh(bin_dir, domains, latency=0.0):
+    """
+    Installe le faux virsh dans bin_dir et prépare l'environnement.
+    domains: dict {nom_domaine: état}
+    """
+    domains_file = Path(bin_dir) / 'domains.txt'
+    script = _install(bin_dir, 'virsh', FAKE_VIRSH)
+    domains_file.write_text(''.join(f"{name} {state}\n" for name, state in domains.items()))
+    os.environ['FAKE_VIRSH_DOMAINS'] = str(domains_file)
+    os.environ['FAKE_VIRSH_LATENCY'] = str(latency) if latency else ''
+    return script
+
+
+def install_fake_vagrant(bin_dir, startup=1.0, boxes=()):
+    """
+    Installe le faux vagrant dans bin_dir (à combiner avec install_fake_virsh).
+    boxes: boxes libvirt listées par `vagrant box list` (le plugin vagrant-libvirt l'est toujours).
+    """
+    os.environ['FAKE_VAGRANT_STARTUP'] = str(startup) if startup else ''
+    os.environ['FAKE_VAGRANT_BOXES'] = ' '.join(boxes)
+    return _install(bin_dir, 'vagrant', FAKE_VAGRANT)
+
+
+def install_fake_websockify(bin_dir, startup=0.0, lifetime=3600):
+    """Installe le faux websockify dans bin_dir (proxys noVNC sans passerelle)."""
+    os.environ['FAKE_WEBSOCKIFY_STARTUP'] = str(startup) if startup else ''
+    os.environ['FAKE_WEBSOCKIFY_LIFETIME'] = str(int(lifetime))
+    return _install(bin_dir, 'websockify', FAKE_WEBSOCKIFY)
+
+
+def make_vm_tree(base_dir, count, users=('alice', 'bob', 'charlie')):
+    """
+    Crée une arborescence student_vms/<user>/<vm> de `count` VMs réparties sur `users`.
+    Retourne le dict {nom_domaine: état} correspondant (une VM sur deux démarrée).
+    """
+    base_dir = Path(base_dir)
+    domains = {}
+    for i in range(count):
+        user = users[i % len(users)]
+        vm_name = f"{user}-vm{i:04d}"
+        vm_dir = base_dir / user / vm_name
+        vm_dir.mkdir(parents=True, exist_ok=True)
+        (vm_dir / 'Vagrantfile').write_text('Vagrant.configure("2") do |config|\nend\n')
+        domains[f"{vm_name}_default"] = 'running' if i % 2 == 0 else 'shut off'
+    return domains
+
+
+class FakeSMTPServer:
+    """
+    Relais SMTP minimal (EHLO/HELO, MAIL, RCPT, DATA, NOOP, RSET, QUIT), à la manière
+    d'aiosmtpd, sur une boucle asyncio dans un thread. Enregistre les messages reçus et
+    le nombre de connexions. latency: délai (s) avant la bannière (poignée de main lente) ;
+    fail: si vrai, répond 451 à MAIL FROM (relais indisponible) ; un code (ex. 550) est
+    renvoyé tel quel (refus définitif).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        self.host, self.port, self.latency = host, port, latency
+        self.fail = False
+        self.messages = []
+        self.connections = 0
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+
+    async def _session(self, reader, writer):
+        self.connections += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(b'220 fake-smtp ESMTP\r\n')
+        envelope = {'from': None, 'to': []}
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            verb = line.decode(errors='replace').strip().split(' ', 1)[0].upper()
+            if verb == 'EHLO':
+                writer.write(b'250-fake-smtp\r\n250 8BITMIME\r\n')
+            elif verb in ('HELO', 'NOOP', 'RSET'):
+                envelope = {'from': None, 'to': []} if verb == 'RSET' else envelope
+                writer.write(b'250 OK\r\n')
+            elif verb == 'MAIL':
+                if self.fail:
+                    code = 451 if self.fail is True else int(self.fail)
+                    writer.write(f'{code} Relais indisponible\r\n'.encode())
+                else:
+                    envelope = {'from': line.decode().strip(), 'to': []}
+                    writer.write(b'250 OK\r\n')
+            elif verb == 'RCPT':
+                envelope['to'].append(line.decode().strip())
+                writer.write(b'250 OK\r\n')
+            elif verb == 'DATA':
+                writer.write(b'354 Fin par <CRLF>.<CRLF>\r\n')
+                await writer.drain()
+                data = []
+                while True:
+                    chunk = await reader.readline()
+                    if chunk in (b'.\r\n', b'.\n', b''):
+                        break
+                    data.append(chunk)
+                self.messages.append({**envelope, 'data': b''.join(data).decode(errors='replace'),
+                                      'received_at': time.time()})
+                envelope = {'from': None, 'to': []}
+                writer.write(b'250 Message accepte\r\n')
+            elif verb == 'QUIT':
+                writer.write(b'221 Bye\r\n')
+                await writer.drain()
+                break
+            else:
+                writer.write(b'502 Commande non reconnue\r\n')
+            await writer.drain()
+        writer.close()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._session, self.host, self.port))
+        self.port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    def start(self):
+        threading.Thread(target=self._run, name='fake-smtp', daemon=True).start()
+        self._ready.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,197 @@
+"""
+Opérations groupées sur les VMs (démarrage, arrêt, mise en veille, suppression, réinitialisation).
+
+Un sélecteur (propriétaires, motif de nom, OS/type, état) désigne les VMs ; chacune
+reçoit une tâche ordinaire de la file ('launch', 'halt', 'suspend', 'delete', 'reset'), avec
+le même journal et les mêmes garde-fous qu'une action unitaire. Les tâches portent
+l'identifiant de l'opération (payload 'bulk_id') et sa limite de parallélisme
+('parallel', au plus BULK_MAX_PARALLEL) : l'ordonnanceur ne laisse tourner
+qu'autant de tâches de l'opération à la fois (scheduler.bulk_slot_free), en plus de
+ses propres limites de démarrage et des créneaux par commande (COMMAND_CONCURRENCY).
+
+L'avancement est agrégé par opération à partir de la table `jobs` (get()).
+"""
+from fnmatch import fnmatchcase
+import json
+import time
+import config
+import db
+import idle_reaper
+import jobs
+import vm_state_cache
+import vm_store
+import vnc_proxies
+import warm_pool
+
+MAX_PARALLEL = config.BULK_MAX_PARALLEL
+ACTIONS = {'start': 'launch', 'halt': 'halt', 'suspend': 'suspend', 'delete': 'delete', 'reset': 'reset'}
+SELECTOR_KEYS = ('owners', 'name', 'os', 'vm_type', 'state')
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS bulk_operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    action TEXT NOT NULL,
+    selector TEXT NOT NULL DEFAULT '{}',
+    parallel INTEGER NOT NULL,
+    created_by TEXT,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bulk_items (
+    bulk_id INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    owner TEXT NOT NULL,
+    vm_name TEXT NOT NULL,
+    PRIMARY KEY (bulk_id, job_id)
+);
+""")
+
+
+# -------------------- Sélection --------------------
+def _as_list(value):
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(',') if v.strip()]
+    return [str(v).strip() for v in value if str(v).strip()]
+
+
+def normalize_selector(selector):
+    """
+    Sélecteur validé : {'owners': [...], 'name': motif, 'os': [...], 'vm_type': [...], 'state': [...]}.
+    ValueError si une clé est inconnue ou si aucun critère n'est donné.
+    """
+    selector = selector or {}
+    unknown = set(selector) - set(SELECTOR_KEYS)
+    if unknown:
+        raise ValueError(f"Critère inconnu: {', '.join(sorted(unknown))} (attendu: {', '.join(SELECTOR_KEYS)})")
+    normalized = {key: _as_list(selector.get(key)) for key in ('owners', 'os', 'vm_type', 'state')}
+    normalized['name'] = (selector.get('name') or '').strip()
+    if not any(normalized.values()):
+        raise ValueError("Sélecteur vide : indiquer au moins un critère (owners, name, os, vm_type, state).")
+    return normalized
+
+
+def select(selector):
+    """VMs (dicts vm_store + 'domain', 'state') correspondant au sélecteur normalisé."""
+    states = vm_state_cache.get_states()
+    aliases = warm_pool.domain_aliases()
+    selected = []
+    for vm in vm_store.list_vms():
+        if selector['owners'] and vm['owner'] not in selector['owners']:
+            continue
+        if selector['name'] and not fnmatchcase(vm['name'], selector['name']):
+            continue
+        if selector['os'] and vm['os'] not in selector['os']:
+            continue
+        if selector['vm_type'] and vm['vm_type'] not in selector['vm_type']:
+            continue
+        domain = aliases.get(vm['path'], f"{vm['name']}_default")
+        state = states.get(domain, 'unknown')
+        if selector['state'] and state not in selector['state']:
+            continue
+        selected.append({**vm, 'domain': domain, 'state': state})
+    return sorted(selected, key=lambda vm: (vm['owner'], vm['name']))
+
+
+# -------------------- Soumission --------------------
+def _payload(kind, vm, bulk_id, parallel):
+    payload = {'path': vm['path'], 'bulk_id': bulk_id, 'parallel': parallel}
+    if kind == 'launch':
+        payload.update(memory=vm['memory'], cpus=vm['cpus'])
+    return payload
+
+
+def create(action, created_by, selector, parallel=None):
+    """Enregistre une opération groupée, sans tâche (voir add()). Retourne son identifiant."""
+    parallel = max(1, min(int(parallel or MAX_PARALLEL), MAX_PARALLEL))
+    return db.get_db().execute(
+        "INSERT INTO bulk_operations (action, selector, parallel, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
+        (action, json.dumps(selector), parallel, created_by, time.time())
+    ).lastrowid
+
+
+def add(bulk_id, vms):
+    """Met en file une tâche par VM dans l'opération `bulk_id` ; retourne les identifiants des tâches."""
+    row = db.get_db().execute("SELECT action, parallel FROM bulk_operations WHERE id = ?", (bulk_id,)).fetchone()
+    kind = ACTIONS[row['action']]
+    items = []
+    for vm in vms:
+        if kind == 'launch':
+            idle_reaper.touch(vm['domain'])
+        elif kind in ('halt', 'suspend', 'delete'):
+            vnc_proxies.release(vm['domain'])
+        job_id = jobs.submit(kind, vm['name'], vm['owner'], _payload(kind, vm, bulk_id, row['parallel']))
+        items.append((bulk_id, job_id, vm['owner'], vm['name']))
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO bulk_items (bulk_id, job_id, owner, vm_name) VALUES (?, ?, ?, ?)", items)
+    return [item[1] for item in items]
+
+
+def submit(action, vms, created_by, selector, parallel=None):
+    """
+    Met en file une tâche par VM pour l'action ('start', 'halt', 'suspend', 'delete', 'reset').
+    Retourne l'identifiant de l'opération groupée.
+    """
+    bulk_id = create(action, created_by, selector, parallel)
+    add(bulk_id, vms)
+    return bulk_id
+
+
+def submitted(bulk_id):
+    """(propriétaire, nom) des VMs ayant déjà une tâche dans l'opération."""
+    rows = db.get_db().execute("SELECT owner, vm_name FROM bulk_items WHERE bulk_id = ?", (bulk_id,)).fetchall()
+    return {(r['owner'], r['vm_name']) for r in rows}
+
+
+# -------------------- Avancement --------------------
+def _summary(row, counts):
+    total = sum(counts.values())
+    finished = sum(counts.get(state, 0) for state in jobs.FINISHED_STATES)
+    return {
+        'id': row['id'],
+        'action': row['action'],
+        'selector': json.loads(row['selector']),
+        'parallel': row['parallel'],
+        'created_by': row['created_by'],
+        'created_at': row['created_at'],
+        'total': total,
+        'finished': finished,
+        'counts': counts,
+        'state': 'finished' if finished == total else 'running',
+    }
+
+
+def get(bulk_id):
+    """Opération groupée avec l'état de chaque VM (tâche, état, message, durée), ou None."""
+    conn = db.get_db()
+    row = conn.execute("SELECT * FROM bulk_operations WHERE id = ?", (bulk_id,)).fetchone()
+    if row is None:
+        return None
+    items = []
+    counts = {}
+    for item in conn.execute(
+        "SELECT i.owner, i.vm_name, j.id AS job_id, j.state, j.message, j.started_at, j.finished_at "
+        "FROM bulk_items i JOIN jobs j ON j.id = i.job_id WHERE i.bulk_id = ? ORDER BY j.id", (bulk_id,)
+    ).fetchall():
+        item = dict(item)
+        item['duration'] = ((item['finished_at'] or time.time()) - item['started_at']) if item['started_at'] else None
+        counts[item['state']] = counts.get(item['state'], 0) + 1
+        items.append(item)
+    return {**_summary(row, counts), 'items': items}
+
+
+def list_operations(limit=20):
+    """Dernières opérations groupées, avec leurs compteurs par état."""
+    conn = db.get_db()
+    rows = conn.execute("SELECT * FROM bulk_operations ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+    if not rows:
+        return []
+    counts = {}
+    for r in conn.execute(
+        f"SELECT i.bulk_id, j.state, COUNT(*) AS n FROM bulk_items i JOIN jobs j ON j.id = i.job_id "
+        f"WHERE i.bulk_id IN ({', '.join('?' for _ in rows)}) GROUP BY i.bulk_id, j.state",
+        [row['id'] for row in rows]
+    ).fetchall():
+        counts.setdefault(r['bulk_id'], {})[r['state']] = r['n']
+    return [_summary(row, counts.get(row['id'], {})) for row in rows]
@@ -0,0 +1,317 @@
+"""
+Registre des demandes d'augmentation de capacité (table SQLite `capacity_requests`).
+
+Remplace l'ajout de lignes à capacity_requests.csv depuis chaque worker :
+insertion atomique, statut suivi (pending → approved/rejected, approved → applied),
+index par utilisateur, VM et statut. Les listes sont paginées par curseur
+(identifiant décroissant) : une page ne lit que ses lignes, quelle que soit la
+taille de l'historique. L'export CSV est produit par lots, sans tout charger.
+
+Une demande approuvée est appliquée par une tâche 'capacity' (vm_resize) qui la
+passe à 'applied' ; les tâches de chaque demande sont gardées (capacity_request_jobs).
+
+L'ancien capacity_requests.csv est importé une fois (ensure_imported), avec le
+statut 'pending' : sa décision n'était pas enregistrée.
+"""
+from pathlib import Path
+import csv
+import datetime
+import io
+import re
+import time
+import db
+
+STATUSES = ('pending', 'approved', 'rejected', 'applied')
+RESOURCES = ('ram', 'storage')
+RESOURCE_ALIASES = {'ram': 'ram', 'storage': 'storage', 'stockage': 'storage', 'disk': 'storage'}
+RAM_LIMITS_MB = (512, 131072)      # 512 MB à 128 GB
+STORAGE_LIMITS_GB = (10, 1024)     # 10 GB à 1 TB
+
+# Transitions autorisées : statut actuel -> statuts suivants
+TRANSITIONS = {
+    'pending': ('approved', 'rejected'),
+    'approved': ('applied', 'rejected'),
+    'rejected': (),
+    'applied': (),
+}
+
+MAX_PAGE = 500
+EXPORT_BATCH = 1000
+EXPORT_FIELDS = ('id', 'created_at', 'user_dn', 'username', 'vm_name', 'resource', 'requested_value',
+                 'amount', 'reason', 'status', 'decided_by', 'decided_at', 'note', 'applied_at')
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS capacity_requests (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    user_dn TEXT NOT NULL DEFAULT '',
+    username TEXT NOT NULL,
+    vm_name TEXT NOT NULL,
+    resource TEXT NOT NULL,
+    requested_value TEXT NOT NULL,
+    amount INTEGER,
+    reason TEXT NOT NULL DEFAULT '',
+    status TEXT NOT NULL DEFAULT 'pending',
+    decided_by TEXT,
+    decided_at REAL,
+    note TEXT NOT NULL DEFAULT '',
+    applied_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_capacity_requests_user ON capacity_requests(username, id);
+CREATE INDEX IF NOT EXISTS idx_capacity_requests_vm ON capacity_requests(vm_name, id);
+CREATE INDEX IF NOT EXISTS idx_capacity_requests_status ON capacity_requests(status, id);
+
+CREATE TABLE IF NOT EXISTS capacity_request_jobs (
+    request_id INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (request_id, job_id)
+);
+
+CREATE TABLE IF NOT EXISTS capacity_request_imports (
+    path TEXT PRIMARY KEY,
+    imported_at REAL NOT NULL,
+    count INTEGER NOT NULL
+);
+""")
+
+
+# -------------------- Valeurs demandées --------------------
+def parse_ram_mb(value):
+    """
+    Convertit une valeur texte en Mégaoctets (MB) pour la RAM.
+    Exemples: '4096' -> 4096 MB, '4G'/'4GB'/'4Go' -> 4096 MB, '512M'/'512MB' -> 512 MB
+    """
+    if value is None:
+        return None
+    s = str(value).strip().lower().replace(',', '.')
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]{0,3})\s*$', s)
+    if not m:
+        return None
+    num = float(m.group(1))
+    unit = m.group(2)
+    if unit in ('', 'm', 'mb'):
+        mb = int(round(num))
+    elif unit in ('g', 'gb', 'go'):
+        mb = int(round(num * 1024))
+    else:
+        return None
+    return mb if mb > 0 else None
+
+
+def parse_storage_gb(value):
+    """
+    Convertit une valeur texte en Gigaoctets (GB) pour le stockage.
+    Par défaut: GB. Ex: '80' -> 80 GB, '80GB'/'80Go' -> 80 GB, '10240MB' -> 10 GB.
+    """
+    if value is None:
+        return None
+    s = str(value).strip().lower().replace(',', '.')
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]{0,3})\s*$', s)
+    if not m:
+        return None
+    num = float(m.group(1))
+    unit = m.group(2)
+    if unit in ('', 'g', 'gb', 'go'):
+        gb = int(round(num))
+    elif unit in ('m', 'mb'):
+        gb = int(round(num / 1024.0))
+    elif unit in ('t', 'tb'):
+        gb = int(round(num * 1024.0))
+    else:
+        return None
+    return gb if gb > 0 else None
+
+
+def validate(resource, value):
+    """
+    Ressource normalisée et quantité (MB pour la RAM, GB pour le stockage) d'une demande,
+    dans les limites RAM_LIMITS_MB / STORAGE_LIMITS_GB. ValueError (message pour l'utilisateur) sinon.
+    """
+    resource = RESOURCE_ALIASES.get((resource or '').strip().lower())
+    if resource is None:
+        raise ValueError("Ressource invalide. Utilisez 'ram' ou 'storage'.")
+    if resource == 'ram':
+        mb = parse_ram_mb(value)
+        if not mb:
+            raise ValueError("Valeur RAM invalide (ex: '8192' ou '8GB').")
+        if not RAM_LIMITS_MB[0] <= mb <= RAM_LIMITS_MB[1]:
+            raise ValueError('RAM demandée hors limites (512MB - 128GB).')
+        return resource, mb
+    gb = parse_storage_gb(value)
+    if not gb:
+        raise ValueError("Valeur stockage invalide (ex: '80' ou '80GB').")
+    if not STORAGE_LIMITS_GB[0] <= gb <= STORAGE_LIMITS_GB[1]:
+        raise ValueError('Stockage demandé hors limites (10GB - 1TB).')
+    return resource, gb
+
+
+def human_value(resource, amount):
+    """Valeur lisible : '8192 MB (8 GB)' pour la RAM, '80 GB' pour le stockage."""
+    if amount is None:
+        return None
+    return f"{amount} MB ({amount // 1024} GB)" if resource == 'ram' else f"{amount} GB"
+
+
+# -------------------- Écriture --------------------
+def _to_dict(row):
+    entry = dict(row)
+    entry['human_value'] = human_value(entry['resource'], entry['amount'])
+    return entry
+
+
+def record(user_dn, username, vm_name, resource, requested_value, amount, reason, created_at=None):
+    """Enregistre une demande (statut 'pending') et retourne son identifiant."""
+    cur = db.get_db().execute(
+        "INSERT INTO capacity_requests (created_at, user_dn, username, vm_name, resource, requested_value, amount, reason) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (created_at or time.time(), user_dn or '', username, vm_name, resource, requested_value, amount,
+         reason.replace('\n', ' ').strip()[:2000])
+    )
+    return cur.lastrowid
+
+
+def set_status(request_id, status, decided_by, note=''):
+    """
+    Change le statut d'une demande (transition vérifiée sous verrou de la base).
+    Retourne la demande mise à jour ; ValueError si la demande est introuvable ou la transition interdite.
+    """
+    if status not in STATUSES:
+        raise ValueError(f"Statut invalide: {status}")
+    now = time.time()
+    with db.transaction() as conn:
+        row = conn.execute("SELECT status FROM capacity_requests WHERE id = ?", (request_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Demande {request_id} introuvable.")
+        if status not in TRANSITIONS[row['status']]:
+            raise ValueError(f"Transition interdite: {row['status']} → {status}")
+        if status == 'applied':
+            conn.execute("UPDATE capacity_requests SET status = ?, applied_at = ? WHERE id = ?",
+                         (status, now, request_id))
+        else:
+            conn.execute(
+                "UPDATE capacity_requests SET status = ?, decided_by = ?, decided_at = ?, note = ? WHERE id = ?",
+                (status, decided_by, now, (note or '').strip()[:2000], request_id)
+            )
+    return get(request_id)
+
+
+def add_job(request_id, job_id):
+    """Rattache à la demande la tâche qui l'applique."""
+    db.get_db().execute("INSERT OR IGNORE INTO capacity_request_jobs (request_id, job_id, created_at) VALUES (?, ?, ?)",
+                        (request_id, job_id, time.time()))
+
+
+# -------------------- Lecture --------------------
+def get(request_id):
+    """Une demande, avec les identifiants des tâches qui l'ont appliquée ('jobs'), ou None."""
+    row = db.get_db().execute("SELECT * FROM capacity_requests WHERE id = ?", (request_id,)).fetchone()
+    if row is None:
+        return None
+    entry = _to_dict(row)
+    entry['jobs'] = [r['job_id'] for r in db.get_db().execute(
+        "SELECT job_id FROM capacity_request_jobs WHERE request_id = ? ORDER BY job_id", (request_id,)
+    ).fetchall()]
+    return entry
+
+
+def _where(username=None, vm_name=None, status=None, resource=None, before=None):
+    clauses, params = [], []
+    for column, value in (('username', username), ('vm_name', vm_name), ('status', status), ('resource', resource)):
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    if before:
+        clauses.append("id < ?")
+        params.append(before)
+    return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+
+def list_requests(username=None, vm_name=None, status=None, resource=None, before=None, limit=50):
+    """
+    Une page de demandes, des plus récentes aux plus anciennes.
+    before: curseur (identifiant) renvoyé par la page précédente.
+    Retourne (demandes, curseur suivant ou None).
+    """
+    limit = max(1, min(int(limit), MAX_PAGE))
+    where, params = _where(username, vm_name, status, resource, before)
+    rows = db.get_db().execute(
+        f"SELECT * FROM capacity_requests {where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+    ).fetchall()
+    page = [_to_dict(r) for r in rows[:limit]]
+    return page, (page[-1]['id'] if len(rows) > limit else None)
+
+
+def counts():
+    """Nombre de demandes par statut."""
+    rows = db.get_db().execute("SELECT status, COUNT(*) AS n FROM capacity_requests GROUP BY status").fetchall()
+    found = {row['status']: row['n'] for row in rows}
+    return {status: found.get(status, 0) for status in STATUSES}
+
+
+def _iso(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp).isoformat() if timestamp else ''
+
+
+def export_csv(**filters):
+    """Générateur de l'export CSV (en-tête puis lots de EXPORT_BATCH lignes, par curseur)."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    before = None
+    while True:
+        where, params = _where(before=before, **filters)
+        rows = db.get_db().execute(
+            f"SELECT * FROM capacity_requests {where} ORDER BY id DESC LIMIT ?", (*params, EXPORT_BATCH)
+        ).fetchall()
+        for row in rows:
+            writer.writerow([_iso(row[f]) if f.endswith('_at') else row[f] for f in EXPORT_FIELDS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(rows) < EXPORT_BATCH:
+            return
+        before = rows[-1]['id']
+
+
+# -------------------- Import de l'ancien CSV --------------------
+def _amount(resource, value):
+    return parse_ram_mb(value) if resource == 'ram' else parse_storage_gb(value)
+
+
+def _from_csv_row(row):
+    try:
+        created_at = datetime.datetime.fromisoformat(row['timestamp']).replace(
+            tzinfo=datetime.timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        created_at = time.time()
+    resource = (row.get('resource') or '').strip().lower()
+    resource = 'ram' if resource == 'ram' else 'storage'
+    value = (row.get('requested_value') or '').strip()
+    return (created_at, row.get('user_dn') or '', row.get('username') or '', row.get('vm_name') or '',
+            resource, value, _amount(resource, value), (row.get('reason') or '')[:2000])
+
+
+def ensure_imported(csv_path):
+    """
+    Importe une fois (tous workers confondus) l'ancien journal CSV.
+    Retourne le nombre de demandes importées (0 s'il était déjà importé ou absent).
+    """
+    csv_path = Path(csv_path)
+    if not csv_path.exists():
+        return 0
+    if db.get_db().execute("SELECT 1 FROM capacity_request_imports WHERE path = ?", (str(csv_path),)).fetchone():
+        return 0
+    with open(csv_path, encoding='utf-8', newline='') as f:
+        rows = [_from_csv_row(row) for row in csv.DictReader(f)]
+    with db.transaction() as conn:
+        if conn.execute("SELECT 1 FROM capacity_request_imports WHERE path = ?", (str(csv_path),)).fetchone():
+            return 0  # importé entre-temps par un autre worker
+        conn.executemany(
+            "INSERT INTO capacity_requests (created_at, user_dn, username, vm_name, resource, requested_value, amount, reason) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        conn.execute("INSERT INTO capacity_request_imports (path, imported_at, count) VALUES (?, ?, ?)",
+                     (str(csv_path), time.time(), len(rows)))
+    print(f"[capacity_requests] {len(rows)} demande(s) importée(s) depuis {csv_path}")
+    return len(rows)
@@ -0,0 +1,236 @@
+"""
+Exécution des commandes externes (virsh, vagrant, websockify...), tracée.
+
+Toutes les commandes du backend passent par ce module :
+- délai par défaut selon la classe de commande (COMMAND_TIMEOUTS, ex.
+  "virsh=60,vagrant halt=30") si l'appelant n'en donne pas ;
+- nombre d'exécutions simultanées par classe, tous workers confondus
+  (COMMAND_CONCURRENCY, ex. "vagrant=12,virsh=16") ;
+- chaque exécution (argv, dossier, attente d'un créneau, durée, code de sortie,
+  fin de stderr) alimente les métriques, la trace de la requête ou de la tâche
+  en cours (begin/end) et le journal partagé `command_log` (slowest()).
+
+La classe d'une commande est son libellé de métriques ("vagrant box list",
+"virsh domstate") ; le réglage le plus précis s'applique ("vagrant halt" avant
+"vagrant", puis '*').
+"""
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import subprocess
+import threading
+import time
+import config
+import coordination
+import db
+import metrics
+
+STDERR_CHARS = 500
+LOG_FLUSH_INTERVAL = 2.0
+LOG_RETENTION = config.COMMAND_LOG_RETENTION  # minutes
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS command_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time REAL NOT NULL,
+    pid INTEGER NOT NULL,
+    context TEXT,
+    command TEXT NOT NULL,
+    argv TEXT NOT NULL,
+    cwd TEXT,
+    wait REAL NOT NULL DEFAULT 0,
+    duration REAL NOT NULL,
+    returncode INTEGER,
+    timed_out INTEGER NOT NULL DEFAULT 0,
+    stderr TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_command_log_time ON command_log(time);
+""")
+
+
+def _parse_settings(text, cast):
+    """"classe=valeur,classe=valeur" -> {classe: valeur}."""
+    settings = {}
+    for item in (text or '').split(','):
+        key, sep, value = item.partition('=')
+        if sep and key.strip():
+            settings[key.strip()] = cast(value.strip())
+    return settings
+
+
+DEFAULT_TIMEOUTS = {
+    '*': 300,
+    'virsh': 60,
+    'vagrant': 600,
+    'vagrant up': config.VAGRANT_UP_TIMEOUT,
+    'vagrant halt': config.VAGRANT_HALT_TIMEOUT,
+    'vagrant destroy': config.VAGRANT_DESTROY_TIMEOUT,
+}
+TIMEOUTS = {**DEFAULT_TIMEOUTS, **_parse_settings(config.COMMAND_TIMEOUTS, float)}
+CONCURRENCY = _parse_settings(config.COMMAND_CONCURRENCY, int)
+
+_local = threading.local()   # trace du thread courant (requête ou tâche)
+_buffer = []                 # entrées à écrire dans command_log
+_buffer_lock = threading.Lock()
+_flusher = {'started': False}
+
+
+# -------------------- Réglages par classe --------------------
+def _setting(settings, label):
+    """Valeur la plus précise pour `label` : libellé complet, préfixes, puis '*'."""
+    words = label.split()
+    for n in range(len(words), 0, -1):
+        key = ' '.join(words[:n])
+        if key in settings:
+            return key, settings[key]
+    return '*', settings.get('*')
+
+
+def timeout_for(argv):
+    """Délai par défaut (secondes) de la commande, None si illimité."""
+    return _setting(TIMEOUTS, metrics.command_label(argv))[1] or None
+
+
+# -------------------- Traces --------------------
+def begin(context):
+    """Commence la trace du thread courant (requête "GET /api/...", tâche "job halt #12")."""
+    _local.context = context
+    _local.entries = []
+
+
+def end():
+    """Termine la trace du thread courant et retourne ses entrées."""
+    entries = getattr(_local, 'entries', None) or []
+    _local.context, _local.entries = None, None
+    return entries
+
+
+def format_trace(entries, limit=2000):
+    """Résumé d'une trace sur une ligne (en-tête X-Debug-Trace), borné à `limit` caractères."""
+    parts = []
+    for e in entries:
+        status = 'timeout' if e['timed_out'] else f"rc={e['returncode']}"
+        wait = f" wait={e['wait'] * 1000:.0f}ms" if e['wait'] >= 0.001 else ''
+        parts.append(f"{e['command']} {e['duration'] * 1000:.0f}ms {status}{wait}")
+    text = '; '.join(parts)
+    text = text.encode('ascii', 'backslashreplace').decode('ascii')
+    return text if len(text) <= limit else text[:limit - 3] + '...'
+
+
+def _record(entry):
+    metrics.observe_command(entry['argv'], entry['duration'], entry['returncode'] == 0 and not entry['timed_out'])
+    entries = getattr(_local, 'entries', None)
+    if entries is not None:
+        entries.append(entry)
+    with _buffer_lock:
+        _buffer.append(entry)
+    _start_flusher()
+
+
+# -------------------- Exécution --------------------
+@contextmanager
+def traced(argv, cwd=None):
+    """
+    Encadre l'exécution d'une commande : créneau de sa classe, mesure et trace.
+    Produit l'entrée de trace ; l'appelant y renseigne 'returncode' (et 'stderr').
+    """
+    argv = [str(a) for a in argv]
+    label = metrics.command_label(argv)
+    entry = {
+        'time': time.time(), 'context': getattr(_local, 'context', None), 'command': label,
+        'argv': argv, 'cwd': str(cwd) if cwd else None, 'wait': 0.0, 'duration': 0.0,
+        'returncode': None, 'timed_out': False, 'stderr': '',
+    }
+    key, limit = _setting(CONCURRENCY, label)
+    waited = time.perf_counter()
+    with coordination.slot(f"command-{key.replace(' ', '_')}", limit) if limit else nullcontext():
+        started = time.perf_counter()
+        entry['wait'] = started - waited
+        try:
+            yield entry
+        except subprocess.TimeoutExpired:
+            entry['timed_out'] = True
+            raise
+        except OSError as e:
+            entry['stderr'] = str(e)
+            raise
+        finally:
+            entry['duration'] = time.perf_counter() - started
+            entry['stderr'] = (entry['stderr'] or '')[-STDERR_CHARS:]
+            _record(entry)
+
+
+def run(argv, cwd=None, timeout=None, env=None, input=None):
+    """
+    subprocess.run tracé (sortie capturée, texte). timeout None : délai de la classe.
+    Lève subprocess.TimeoutExpired / OSError comme subprocess.run.
+    """
+    if timeout is None:
+        timeout = timeout_for(argv)
+    with traced(argv, cwd) as entry:
+        result = subprocess.run(argv, cwd=cwd, env=env, input=input, capture_output=True, text=True,
+                                timeout=timeout)
+        entry['returncode'] = result.returncode
+        entry['stderr'] = result.stderr
+    return result
+
+
+def popen(argv, **kwargs):
+    """
+    subprocess.Popen tracé pour les processus durables (websockify, virt-viewer) :
+    seul le lancement est mesuré.
+    """
+    with traced(argv, kwargs.get('cwd')) as entry:
+        process = subprocess.Popen(argv, **kwargs)
+        entry['returncode'] = 0
+    return process
+
+
+# -------------------- Journal partagé --------------------
+def flush():
+    """Écrit les entrées en attente dans command_log et purge celles de plus de LOG_RETENTION minutes."""
+    with _buffer_lock:
+        pending = _buffer[:]
+        del _buffer[:]
+    if not pending:
+        return
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO command_log (time, pid, context, command, argv, cwd, wait, duration, returncode, timed_out, stderr) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(e['time'], os.getpid(), e['context'], e['command'], json.dumps(e['argv']), e['cwd'], e['wait'],
+              e['duration'], e['returncode'], int(e['timed_out']), e['stderr']) for e in pending]
+        )
+        conn.execute("DELETE FROM command_log WHERE time < ?", (time.time() - LOG_RETENTION * 60,))
+
+
+def _flush_loop():
+    while True:
+        time.sleep(LOG_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"[commands] Journal: {e}")
+
+
+def _start_flusher():
+    if _flusher['started']:
+        return
+    with _buffer_lock:
+        if _flusher['started']:
+            return
+        _flusher['started'] = True
+    threading.Thread(target=_flush_loop, name='command-log', daemon=True).start()
+
+
+def slowest(minutes=15, limit=20, command=None):
+    """Exécutions les plus longues des `minutes` dernières minutes (tous workers)."""
+    flush()
+    clauses, params = ["time >= ?"], [time.time() - minutes * 60]
+    if command:
+        clauses.append("command = ?")
+        params.append(command)
+    rows = db.get_db().execute(
+        f"SELECT * FROM command_log WHERE {' AND '.join(clauses)} ORDER BY duration DESC LIMIT ?", (*params, limit)
+    ).fetchall()
+    return [dict(row, argv=json.loads(row['argv']), timed_out=bool(row['timed_out'])) for row in rows]
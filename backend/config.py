@@ -20,4 +20,117 @@ SMTP_PASSWORD = "motdepasse"
 SMTP_FROM = "no-reply@example.com"
 SMTP_USE_TLS = True      # True pour STARTTLS
 SMTP_USE_SSL = False     # True si vous utilisez le port 465
-ADMIN_EMAILS = ["admin@example.com"]  # destinataires des demandes
\ No newline at end of file
+ADMIN_EMAILS = ["admin@example.com"]  # destinataires des demandes
+
+# Libvirt
+LIBVIRT_URI = os.getenv('LIBVIRT_URI', 'qemu:///system')   # test:///default pour tester sans hyperviseur
+LIBVIRT_BACKEND = os.getenv('LIBVIRT_BACKEND', 'auto')     # auto | libvirt | virsh
+
+# Données partagées entre workers (caches, verrous, base SQLite)
+DATA_DIR = os.getenv('VM_MANAGER_DATA_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data'))
+VMS_DIR = os.getenv('VM_MANAGER_VMS_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'student_vms'))
+BACKGROUND_SERVICES = os.getenv('VM_MANAGER_BACKGROUND', '1') == '1'   # 0 pour désactiver les threads de fond
+
+# Cache des états de VMs (secondes)
+STATE_CACHE_MAX_AGE = int(os.getenv('STATE_CACHE_MAX_AGE', '30'))          # âge maximal d'un état servi
+STATE_CACHE_FULL_RESYNC = int(os.getenv('STATE_CACHE_FULL_RESYNC', '300'))  # resynchronisation complète (mode événements)
+STATE_CACHE_POLL_INTERVAL = int(os.getenv('STATE_CACHE_POLL_INTERVAL', '5'))  # interrogation (sans événements)
+
+# Tâches asynchrones (création/lancement/arrêt/suppression)
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '4'))                          # threads d'exécution par worker gunicorn
+VAGRANT_UP_TIMEOUT = int(os.getenv('VAGRANT_UP_TIMEOUT', '3600'))          # secondes
+VAGRANT_HALT_TIMEOUT = int(os.getenv('VAGRANT_HALT_TIMEOUT', '30'))
+VAGRANT_DESTROY_TIMEOUT = int(os.getenv('VAGRANT_DESTROY_TIMEOUT', '300'))
+
+# Ordonnanceur des démarrages (création/lancement)
+SCHEDULER_MAX_CONCURRENT_BOOTS = int(os.getenv('SCHEDULER_MAX_CONCURRENT_BOOTS', '4'))
+SCHEDULER_POLICY = os.getenv('SCHEDULER_POLICY', 'fair')                      # fifo | fair (équitable par utilisateur)
+SCHEDULER_RESERVED_MB = int(os.getenv('SCHEDULER_RESERVED_MB', '4096'))       # mémoire réservée à l'hôte
+SCHEDULER_MEMORY_OVERCOMMIT = float(os.getenv('SCHEDULER_MEMORY_OVERCOMMIT', '1.0'))
+SCHEDULER_CPU_OVERCOMMIT = float(os.getenv('SCHEDULER_CPU_OVERCOMMIT', '4.0'))
+SCHEDULER_MAX_QUEUE_WAIT = int(os.getenv('SCHEDULER_MAX_QUEUE_WAIT', '1800'))  # attente maximale d'un démarrage en file (secondes)
+BULK_MAX_PARALLEL = int(os.getenv('BULK_MAX_PARALLEL', '8'))                  # tâches simultanées d'une opération groupée
+
+# Golden images (clones liés d'une image pré-provisionnée)
+GOLDEN_IMAGES_ENABLED = os.getenv('GOLDEN_IMAGES_ENABLED', '1') == '1'   # 0 : toujours provisionner depuis la box d'origine
+
+# Pool de VMs préchauffées (démarrées et provisionnées, attribuées à la création)
+WARM_POOL_SIZES = os.getenv('WARM_POOL_SIZES', '')          # ex: debian-serveur=2,debian-client=2,windows=0
+WARM_POOL_SCHEDULE = os.getenv('WARM_POOL_SCHEDULE', '')    # ex: 1-5 07:30-12:00 debian-client=12; 3 13:00-17:00 windows=4
+WARM_POOL_INTERVAL = int(os.getenv('WARM_POOL_INTERVAL', '30'))  # secondes entre deux réajustements
+
+# Sondes de l'environnement (vagrant/virsh/box/réseau), mises en cache
+ENV_PROBE_TTL = int(os.getenv('ENV_PROBE_TTL', '600'))   # secondes
+
+# Cycle de vie des VMs créées : 'vagrant' (vagrant up/halt/destroy) ou 'native' (appels libvirt directs)
+LIFECYCLE_BACKEND = os.getenv('LIFECYCLE_BACKEND', 'vagrant')   # écrit dans vm_info.txt à la création
+NATIVE_SHUTDOWN_TIMEOUT = int(os.getenv('NATIVE_SHUTDOWN_TIMEOUT', '60'))  # ACPI puis arrêt forcé
+
+# Proxys websockify (noVNC), partagés entre workers
+VNC_PROXY_PORT_MIN = int(os.getenv('VNC_PROXY_PORT_MIN', '6080'))
+VNC_PROXY_PORT_MAX = int(os.getenv('VNC_PROXY_PORT_MAX', '6180'))          # exclu
+VNC_PROXY_IDLE_TIMEOUT = int(os.getenv('VNC_PROXY_IDLE_TIMEOUT', '900'))   # secondes sans connexion
+
+# Passerelle noVNC unique (un processus, un port, jetons signés) ; sinon repli sur les proxys websockify
+VNC_GATEWAY_ENABLED = os.getenv('VNC_GATEWAY_ENABLED', '1') == '1'
+VNC_GATEWAY_HOST = os.getenv('VNC_GATEWAY_HOST', '0.0.0.0')
+VNC_GATEWAY_PORT = int(os.getenv('VNC_GATEWAY_PORT', '6080'))
+VNC_GATEWAY_PUBLIC_URL = os.getenv('VNC_GATEWAY_PUBLIC_URL', '')            # ex: https://vm.iris.a3n.fr (défaut : http://localhost:PORT)
+VNC_GATEWAY_IDLE_TIMEOUT = int(os.getenv('VNC_GATEWAY_IDLE_TIMEOUT', '900'))  # secondes sans trafic
+VNC_TOKEN_TTL = int(os.getenv('VNC_TOKEN_TTL', '120'))                      # validité du jeton à l'ouverture
+VNC_NOVNC_DIR = os.getenv('VNC_NOVNC_DIR', '/usr/share/novnc')
+
+# Flux SSE de la liste des VMs (/api/vms/stream)
+VM_STREAM_POLL_INTERVAL = float(os.getenv('VM_STREAM_POLL_INTERVAL', '1'))  # secondes entre deux vérifications (par worker)
+VM_STREAM_KEEPALIVE = int(os.getenv('VM_STREAM_KEEPALIVE', '15'))           # commentaire SSE si rien ne change
+VM_STREAM_MAX_DURATION = int(os.getenv('VM_STREAM_MAX_DURATION', '300'))    # le navigateur se reconnecte ensuite
+VM_STREAM_MAX_CLIENTS = int(os.getenv('VM_STREAM_MAX_CLIENTS', '12'))       # flux simultanés par worker (un thread chacun, bien moins que --threads)
+
+# File d'envoi des emails (mail_outbox)
+MAIL_OUTBOX_POLL_INTERVAL = float(os.getenv('MAIL_OUTBOX_POLL_INTERVAL', '5'))  # secondes entre deux passages de l'expéditeur
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', '8'))                    # puis état 'failed'
+MAIL_RETRY_BASE = int(os.getenv('MAIL_RETRY_BASE', '30'))                       # secondes, doublées à chaque échec
+MAIL_RETRY_MAX = int(os.getenv('MAIL_RETRY_MAX', '3600'))
+MAIL_DIGEST_INTERVAL = int(os.getenv('MAIL_DIGEST_INTERVAL', '0'))              # 0 : un email par demande ; sinon résumé admin
+MAIL_SMTP_IDLE_TIMEOUT = int(os.getenv('MAIL_SMTP_IDLE_TIMEOUT', '60'))         # fermeture de la connexion SMTP inactive
+
+# Télémétrie des VMs (statistiques groupées libvirt, un appel par intervalle)
+TELEMETRY_ENABLED = os.getenv('TELEMETRY_ENABLED', '1') == '1'
+TELEMETRY_INTERVAL = float(os.getenv('TELEMETRY_INTERVAL', '10'))              # secondes entre deux échantillons
+TELEMETRY_RING_SIZE = int(os.getenv('TELEMETRY_RING_SIZE', '360'))             # échantillons gardés par VM (1 h à 10 s)
+TELEMETRY_HISTORY_INTERVAL = int(os.getenv('TELEMETRY_HISTORY_INTERVAL', '300'))  # moyennes écrites en base
+TELEMETRY_HISTORY_DAYS = int(os.getenv('TELEMETRY_HISTORY_DAYS', '30'))        # rétention de l'historique
+
+# Métriques Prometheus (/metrics)
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))  # publication des compteurs de chaque worker
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')   # jeton "Authorization: Bearer" ; vide : accès local ou admin
+
+# Commandes externes (module commands) : réglages par classe "classe=valeur,..." (ex. "vagrant halt=45,virsh=30")
+COMMAND_TIMEOUTS = os.getenv('COMMAND_TIMEOUTS', '')            # délais par défaut (s), en plus de VAGRANT_*_TIMEOUT
+COMMAND_CONCURRENCY = os.getenv('COMMAND_CONCURRENCY', 'vagrant=12,virsh=16')  # exécutions simultanées, tous workers
+COMMAND_TRACE_HEADER = os.getenv('COMMAND_TRACE_HEADER', '0') == '1'  # en-tête X-Debug-Trace sur toutes les réponses
+COMMAND_LOG_RETENTION = int(os.getenv('COMMAND_LOG_RETENTION', '60'))  # minutes gardées dans command_log
+
+# Mise en veille des VMs inactives (idle_reaper) : "modèle=action:secondes", action suspend | halt | off
+IDLE_REAPER_ENABLED = os.getenv('IDLE_REAPER_ENABLED', '1') == '1'
+IDLE_POLICIES = os.getenv('IDLE_POLICIES', 'debian-client=suspend:7200,windows=suspend:7200,debian-serveur=off')
+IDLE_CHECK_INTERVAL = int(os.getenv('IDLE_CHECK_INTERVAL', '60'))       # secondes entre deux passages
+IDLE_CPU_THRESHOLD = float(os.getenv('IDLE_CPU_THRESHOLD', '5'))        # % d'un vCPU en dessous duquel l'invité est inactif
+
+# Ballon mémoire des VMs (memory_balancer) : mémoire des invités ajustée à leur usage réel
+MEMORY_BALANCER_ENABLED = os.getenv('MEMORY_BALANCER_ENABLED', '1') == '1'
+MEMORY_BALANCER_INTERVAL = float(os.getenv('MEMORY_BALANCER_INTERVAL', '10'))   # secondes entre deux passages
+MEMORY_BALLOON_MAX_FACTOR = float(os.getenv('MEMORY_BALLOON_MAX_FACTOR', '1.5'))  # maximum du domaine / mémoire du modèle
+MEMORY_BALLOON_MIN_MB = int(os.getenv('MEMORY_BALLOON_MIN_MB', '512'))          # plancher d'un invité
+MEMORY_GUEST_HEADROOM = float(os.getenv('MEMORY_GUEST_HEADROOM', '0.25'))       # marge au-dessus de l'usage de l'invité
+MEMORY_GUEST_FREE_MB = int(os.getenv('MEMORY_GUEST_FREE_MB', '256'))            # mémoire libre minimale laissée à l'invité
+MEMORY_HOST_TARGET = float(os.getenv('MEMORY_HOST_TARGET', '0.95'))             # part de la mémoire hôte (hors réserve) pour les invités
+MEMORY_KSM_ENABLED = os.getenv('MEMORY_KSM_ENABLED', '0') == '1'                # réglage de KSM (fusion des pages identiques)
+
+# Séances de TP planifiées (lab_sessions) : VMs des participants pré-démarrées avant le début, arrêtées après la fin
+LAB_SESSIONS_ENABLED = os.getenv('LAB_SESSIONS_ENABLED', '1') == '1'
+LAB_CHECK_INTERVAL = int(os.getenv('LAB_CHECK_INTERVAL', '30'))         # secondes entre deux passages
+LAB_PREBOOT_LEAD = int(os.getenv('LAB_PREBOOT_LEAD', '1200'))           # début du pré-démarrage, secondes avant la séance
+LAB_PREBOOT_MARGIN = int(os.getenv('LAB_PREBOOT_MARGIN', '300'))        # dernières VMs en file au plus tard (s avant le début)
+LAB_PREBOOT_PARALLEL = int(os.getenv('LAB_PREBOOT_PARALLEL', '4'))      # démarrages simultanés d'une séance
+LAB_END_ACTION = os.getenv('LAB_END_ACTION', 'suspend')                 # fin de séance : suspend | halt | none
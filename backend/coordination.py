@@ -0,0 +1,121 @@
+"""
+Coordination entre les workers gunicorn (processus séparés).
+
+- Verrous fichiers (flock) dans config.DATA_DIR, et créneaux limitant le
+  nombre d'opérations simultanées d'un type (slot).
+- Élection d'un "leader" : un seul worker exécute une tâche de fond donnée ;
+  si ce worker meurt, le verrou est libéré et un autre prend le relais.
+- Lecture/écriture atomique de fichiers JSON partagés.
+"""
+from contextlib import contextmanager
+from pathlib import Path
+import fcntl
+import json
+import os
+import threading
+import time
+import config
+
+DATA_DIR = Path(config.DATA_DIR)
+
+
+def data_path(name):
+    """Chemin d'un fichier dans le dossier de données partagé (créé au besoin)."""
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    return DATA_DIR / name
+
+
+@contextmanager
+def locked(name):
+    """Verrou exclusif bloquant entre processus (ex: lecture-modification-écriture d'un fichier partagé)."""
+    with open(data_path(f"{name}.lock"), 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def slot(name, limit, timeout=None, poll_interval=0.05):
+    """
+    Occupe l'un des `limit` créneaux `name`, tous processus confondus (verrous
+    fichiers non bloquants). Attend qu'un créneau se libère ; TimeoutError après
+    `timeout` secondes. Un créneau est libéré automatiquement si le processus meurt.
+    """
+    deadline = time.time() + timeout if timeout else None
+    while True:
+        for i in range(limit):
+            f = open(data_path(f"{name}.slot{i}.lock"), 'a')
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            try:
+                yield i
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+                f.close()
+            return
+        if deadline and time.time() >= deadline:
+            raise TimeoutError(f"Aucun créneau '{name}' libre ({limit} occupés)")
+        time.sleep(poll_interval)
+
+
+def atomic_write_json(path, data):
+    """Écrit un JSON de façon atomique (fichier temporaire + rename)."""
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def read_json(path, default=None):
+    """Lit un JSON partagé ; retourne `default` s'il est absent ou illisible."""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# -------------------- Élection de leader --------------------
+_leader_files = {}
+
+
+def try_become_leader(name):
+    """
+    Tente de prendre (sans bloquer) le rôle de leader `name`.
+    Le verrou est conservé tant que le processus vit.
+    """
+    if name in _leader_files:
+        return True
+    f = open(data_path(f"{name}.leader"), 'a')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_files[name] = f
+    return True
+
+
+def run_as_leader(name, target, retry_interval=10):
+    """
+    Démarre un thread démon qui attend de devenir leader `name`, puis exécute target().
+    Un seul processus à la fois exécute target() ; les autres restent en attente.
+    """
+    def loop():
+        while not try_become_leader(name):
+            time.sleep(retry_interval)
+        print(f"[coordination] Worker {os.getpid()} leader '{name}'")
+        try:
+            target()
+        except Exception as e:
+            print(f"[coordination] Tâche leader '{name}' arrêtée: {e}")
+
+    thread = threading.Thread(target=loop, name=f"leader-{name}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,53 @@
+"""
+Base SQLite partagée par les workers gunicorn (mode WAL).
+
+Chaque module déclare ses tables avec register_schema() ; elles sont créées
+à la première connexion. Une connexion par thread (et par processus).
+"""
+from contextlib import contextmanager
+import os
+import sqlite3
+import threading
+import coordination
+
+DB_FILE = 'vm_manager.db'
+
+_schemas = []
+_local = threading.local()
+
+
+def register_schema(sql):
+    """Déclare des instructions CREATE ... IF NOT EXISTS à appliquer sur la base."""
+    _schemas.append(sql)
+
+
+def get_db():
+    """Retourne la connexion SQLite du thread courant (autocommit, lignes en sqlite3.Row)."""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(str(coordination.data_path(DB_FILE)), timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+        _local.conn, _local.pid, _local.applied = conn, os.getpid(), 0
+    # Schémas déclarés depuis la dernière connexion (imports tardifs)
+    if _local.applied < len(_schemas):
+        for sql in _schemas[_local.applied:]:
+            conn.executescript(sql)
+        _local.applied = len(_schemas)
+    return conn
+
+
+@contextmanager
+def transaction():
+    """Transaction en écriture (BEGIN IMMEDIATE : verrouille tout de suite entre processus)."""
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
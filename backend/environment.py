@@ -0,0 +1,180 @@
+"""
+Sondes de l'environnement Vagrant/libvirt, mises en cache et partagées entre workers.
+
+Chaque sonde (`vagrant --version`, `virsh --version`, `vagrant plugin list`,
+`vagrant box list`, réseau libvirt "default") coûte jusqu'à une seconde de
+démarrage Ruby. Les résultats sont gardés dans un instantané sur disque :
+- rafraîchi au démarrage puis toutes les ENV_PROBE_TTL/2 secondes par le
+  worker élu 'environment-probe' ;
+- invalidé explicitement après un changement connu (box ajoutée, réseau créé) ;
+- relu par les requêtes sans lancer de processus, tant qu'il a moins de ENV_PROBE_TTL.
+"""
+import os
+import re
+import subprocess
+import threading
+import time
+import commands
+import config
+import coordination
+import libvirt_conn
+
+SNAPSHOT_FILE = 'environment.json'
+TTL = config.ENV_PROBE_TTL
+PROBE_TIMEOUT = 60
+
+_local = {'mtime': None, 'snapshot': None}
+_local_lock = threading.Lock()
+
+
+# -------------------- Sondes --------------------
+def _run(cmd):
+    """Exécute une commande de sonde ; retourne (ok, stdout)."""
+    try:
+        result = commands.run(cmd, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        print(f"[environment] {' '.join(cmd)}: {e}")
+        return False, ''
+    return result.returncode == 0, result.stdout
+
+
+def _version(cmd):
+    ok, out = _run(cmd)
+    return out.strip() if ok else None
+
+
+def _plugins():
+    ok, out = _run(['vagrant', 'plugin', 'list'])
+    return [line.split()[0] for line in out.splitlines() if line.strip()] if ok else None
+
+
+def parse_box_list(text):
+    """
+    Lignes de `vagrant box list` -> [{'name', 'provider', 'version'}].
+    Format : "generic/debian12    (libvirt, 4.3.12, (amd64))"
+    """
+    boxes = []
+    for line in text.splitlines():
+        match = re.match(r'^(\S+)\s+\(([^,]+),\s*([^,)]+)', line)
+        if match:
+            boxes.append({'name': match.group(1), 'provider': match.group(2).strip(),
+                          'version': match.group(3).strip()})
+    return boxes
+
+
+def _boxes():
+    ok, out = _run(['vagrant', 'box', 'list'])
+    return parse_box_list(out) if ok else None
+
+
+PROBES = {
+    'vagrant_version': lambda: _version(['vagrant', '--version']),
+    'virsh_version': lambda: _version(['virsh', '--version']),
+    'plugins': _plugins,
+    'boxes': _boxes,
+    'default_network': lambda: libvirt_conn.network_exists('default'),
+}
+
+
+# -------------------- Instantané partagé --------------------
+def _path():
+    return coordination.data_path(SNAPSHOT_FILE)
+
+
+def _load():
+    """Instantané courant (relu uniquement si le fichier a changé)."""
+    path = _path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _local_lock:
+        if mtime != _local['mtime']:
+            _local['snapshot'] = coordination.read_json(path)
+            _local['mtime'] = mtime
+        return _local['snapshot']
+
+
+def refresh(*keys):
+    """Relance les sondes `keys` (toutes par défaut) et met à jour l'instantané."""
+    keys = keys or tuple(PROBES)
+    results = {key: PROBES[key]() for key in keys}
+    now = time.time()
+    with coordination.locked('environment'):
+        snapshot = coordination.read_json(_path()) or {'probes': {}, 'probed_at': {}}
+        snapshot['probes'].update(results)
+        snapshot['probed_at'].update({key: now for key in keys})
+        coordination.atomic_write_json(_path(), snapshot)
+    return snapshot
+
+
+def invalidate(*keys):
+    """Oublie les résultats `keys` (tous par défaut) : ils seront relus à la prochaine consultation."""
+    with coordination.locked('environment'):
+        snapshot = coordination.read_json(_path())
+        if not snapshot:
+            return
+        for key in keys or tuple(PROBES):
+            snapshot['probes'].pop(key, None)
+            snapshot['probed_at'].pop(key, None)
+        coordination.atomic_write_json(_path(), snapshot)
+
+
+def get(key):
+    """Résultat d'une sonde ; la relance seulement si elle est absente ou plus vieille que TTL."""
+    snapshot = _load()
+    if snapshot and key in snapshot['probes'] and time.time() - snapshot['probed_at'][key] < TTL:
+        return snapshot['probes'][key]
+    return refresh(key)['probes'][key]
+
+
+def snapshot():
+    """Instantané complet pour l'administration (sondes manquantes lancées au besoin)."""
+    for key in PROBES:
+        get(key)
+    current = _load()
+    return {
+        'probes': current['probes'],
+        'age': {key: round(time.time() - at, 1) for key, at in current['probed_at'].items()},
+        'ttl': TTL,
+    }
+
+
+# -------------------- Vérifications --------------------
+def provider_ready():
+    """Vrai si `vagrant` et `virsh` sont disponibles."""
+    return bool(get('vagrant_version')) and bool(get('virsh_version'))
+
+
+def box_installed(box_name, provider='libvirt', version=None):
+    """
+    Vrai si la box est installée pour ce provider (et cette version si donnée).
+    Une box absente du cache est recherchée une seconde fois après relecture (ajout récent).
+    """
+    def found(boxes):
+        return any(
+            b['name'] == box_name and b['provider'] == provider and (version is None or b['version'] == str(version))
+            for b in boxes or ()
+        )
+    if found(get('boxes')):
+        return True
+    return found(refresh('boxes')['probes']['boxes'])
+
+
+def network_ready():
+    """Vrai si le réseau libvirt "default" existe (d'après le cache)."""
+    return bool(get('default_network'))
+
+
+def _refresh_loop():
+    while True:
+        try:
+            refresh()
+        except Exception as e:
+            print(f"[environment] Sondes impossibles: {e}")
+        time.sleep(max(1, TTL // 2))
+
+
+def start():
+    """Lance les sondes au démarrage puis périodiquement, dans le worker élu."""
+    return coordination.run_as_leader('environment-probe', _refresh_loop)
@@ -0,0 +1,198 @@
+"""
+Images de référence (golden images) des VMs Debian.
+
+Une image est construite une fois par couple (os, type) : VM temporaire créée
+depuis la box d'origine, provisionnée avec la partie "base" du script
+(paquets, locale, bureau...), nettoyée puis empaquetée en box Vagrant
+versionnée `vm-manager/<os>-<type>`.
+
+Les VMs créées ensuite depuis cette box sont des clones liés : vagrant-libvirt
+importe une seule fois le disque de la box dans le pool de stockage et donne à
+chaque VM un disque qcow2 dont il est le backing file. Seule l'étape
+utilisateur (compte, mots de passe) reste exécutée au premier démarrage.
+"""
+import json
+import shutil
+import subprocess
+import time
+import config
+import coordination
+import db
+import environment
+import jobs
+import provisioning
+
+BOX_PREFIX = 'vm-manager'
+SUPPORTED = {('debian', 'client'), ('debian', 'serveur')}
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS golden_images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    os TEXT NOT NULL,
+    vm_type TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    box_name TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'building',
+    job_id INTEGER,
+    created_at REAL NOT NULL,
+    ready_at REAL,
+    UNIQUE (os, vm_type, version)
+);
+""")
+
+# Nettoyage avant empaquetage : chaque clone doit régénérer son machine-id
+# (sinon tous les clones obtiennent le même bail DHCP).
+CLEANUP_SCRIPT = """
+apt-get clean
+rm -rf /var/lib/apt/lists/*
+truncate -s 0 /etc/machine-id
+rm -f /var/lib/dbus/machine-id
+rm -f /var/lib/dhcp/*.leases
+"""
+
+
+def box_name_for(os_name, vm_type):
+    return f"{BOX_PREFIX}/{os_name}-{vm_type}"
+
+
+def _to_dict(row):
+    return {
+        'id': row['id'],
+        'os': row['os'],
+        'vm_type': row['vm_type'],
+        'version': str(row['version']),
+        'box_name': row['box_name'],
+        'state': row['state'],
+        'job_id': row['job_id'],
+        'created_at': row['created_at'],
+        'ready_at': row['ready_at'],
+    }
+
+
+def current_image(os_name, vm_type):
+    """Dernière image prête pour un couple (os, type), ou None."""
+    key = provisioning.template_key(os_name, vm_type)
+    if key not in SUPPORTED:
+        return None
+    row = db.get_db().execute(
+        "SELECT * FROM golden_images WHERE os = ? AND vm_type = ? AND state = 'ready' "
+        "ORDER BY version DESC LIMIT 1", key
+    ).fetchone()
+    return _to_dict(row) if row else None
+
+
+def list_images():
+    rows = db.get_db().execute("SELECT * FROM golden_images ORDER BY os, vm_type, version DESC").fetchall()
+    return [_to_dict(r) for r in rows]
+
+
+def build(os_name, vm_type, owner):
+    """
+    Réserve une nouvelle version et met sa construction en file.
+    Retourne (image, job_id) ; lève ValueError si le couple n'est pas supporté.
+    """
+    key = provisioning.template_key(os_name, vm_type)
+    if key not in SUPPORTED:
+        raise ValueError(f"Golden image non supportée pour {os_name}/{vm_type} (Debian uniquement)")
+    with db.transaction() as conn:
+        version = conn.execute(
+            "SELECT COALESCE(MAX(version), 0) + 1 FROM golden_images WHERE os = ? AND vm_type = ?", key
+        ).fetchone()[0]
+        image_id = conn.execute(
+            "INSERT INTO golden_images (os, vm_type, version, box_name, created_at) VALUES (?, ?, ?, ?, ?)",
+            (*key, version, box_name_for(*key), time.time())
+        ).lastrowid
+    template = provisioning.get_template(*key)
+    # Une seule construction à la fois par modèle (une tâche à la fois par "VM")
+    job_id = jobs.submit('golden_build', f"golden-{key[0]}-{key[1]}", owner, {
+        'image_id': image_id, 'memory': template['memory'], 'cpus': template['cpus'],
+    })
+    db.get_db().execute("UPDATE golden_images SET job_id = ? WHERE id = ?", (job_id, image_id))
+    row = db.get_db().execute("SELECT * FROM golden_images WHERE id = ?", (image_id,)).fetchone()
+    return _to_dict(row), job_id
+
+
+def retire(image_id):
+    """
+    Retire une image : plus utilisée pour les nouvelles VMs. La box et le volume
+    de base restent en place, ils servent de backing file aux clones existants.
+    Retourne False si l'image n'existe pas ou est en cours de construction.
+    """
+    cur = db.get_db().execute(
+        "UPDATE golden_images SET state = 'retired' WHERE id = ? AND state != 'building'", (image_id,)
+    )
+    return cur.rowcount > 0
+
+
+# -------------------- Construction --------------------
+def _set_state(image_id, state):
+    db.get_db().execute(
+        "UPDATE golden_images SET state = ?, ready_at = ? WHERE id = ?",
+        (state, time.time() if state == 'ready' else None, image_id)
+    )
+
+
+def _run_step(cmd, log, cwd, timeout, what):
+    try:
+        code = jobs.run_logged(cmd, log, cwd=cwd, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise jobs.JobFailed(f"{what} : délai dépassé ({timeout}s)")
+    if code != 0:
+        raise jobs.JobFailed(f"{what} : échec (code {code})", code)
+
+
+@jobs.handler('golden_build')
+def _job_build(job, log):
+    """Tâche: construit, empaquette et enregistre une golden image."""
+    image_id = job['payload']['image_id']
+    row = db.get_db().execute("SELECT * FROM golden_images WHERE id = ?", (image_id,)).fetchone()
+    if row is None:
+        raise jobs.JobFailed(f"Golden image #{image_id} introuvable")
+    image = _to_dict(row)
+    template = provisioning.get_template(image['os'], image['vm_type'])
+
+    build_dir = coordination.data_path('golden') / f"{image['os']}-{image['vm_type']}-v{image['version']}"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    build_dir.mkdir(parents=True)
+    box_file = build_dir / 'image.box'
+    script = provisioning.base_script(image['os'], image['vm_type']) + "\n" + CLEANUP_SCRIPT
+    (build_dir / 'Vagrantfile').write_text(provisioning.render_vagrantfile(
+        template['box'], f"golden-{image['os']}-{image['vm_type']}",
+        template['memory'], template['cpus'],
+        serial_console=template['serial_console'],
+        provision_script=script,
+        insert_key=False  # la box finale doit accepter la clé Vagrant publique
+    ))
+
+    try:
+        _run_step(['vagrant', 'up', '--provider', 'libvirt'], log, build_dir,
+                  config.VAGRANT_UP_TIMEOUT, "Provisioning de l'image")
+        _run_step(['vagrant', 'halt'], log, build_dir, config.VAGRANT_DESTROY_TIMEOUT, "Arrêt de la VM de construction")
+        _run_step(['vagrant', 'package', '--output', str(box_file)], log, build_dir,
+                  config.VAGRANT_UP_TIMEOUT, "Empaquetage")
+
+        # Métadonnées : permettent d'ajouter la box avec un numéro de version
+        metadata = {
+            'name': image['box_name'],
+            'versions': [{
+                'version': image['version'],
+                'providers': [{'name': 'libvirt', 'url': box_file.as_uri()}],
+            }],
+        }
+        (build_dir / 'metadata.json').write_text(json.dumps(metadata, indent=2))
+        _run_step(['vagrant', 'box', 'add', str(build_dir / 'metadata.json')], log, build_dir,
+                  config.VAGRANT_UP_TIMEOUT, "Enregistrement de la box")
+        environment.invalidate('boxes')
+    except Exception:
+        _set_state(image_id, 'failed')
+        raise
+    finally:
+        try:
+            jobs.run_logged(['vagrant', 'destroy', '-f'], log, cwd=build_dir, timeout=config.VAGRANT_DESTROY_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            log("Destruction de la VM de construction : délai dépassé")
+        # La box est copiée dans VAGRANT_HOME : l'archive n'est plus utile
+        box_file.unlink(missing_ok=True)
+
+    _set_state(image_id, 'ready')
+    return f"Golden image {image['box_name']} v{image['version']} prête."
@@ -0,0 +1,303 @@
+"""
+Mise en veille des VMs inactives, pour rendre leur mémoire à l'hôte.
+
+Un seul worker (leader "idle-reaper") examine les domaines actifs toutes les
+IDLE_CHECK_INTERVAL secondes. Une VM est inactive depuis le plus récent de :
+- le dernier passage où son CPU invité dépassait IDLE_CPU_THRESHOLD % d'un vCPU
+  (temps CPU des statistiques groupées libvirt, un appel par passage) ;
+- le dernier passage où une console noVNC était ouverte (passerelle ou proxy websockify) ;
+- la dernière action API la visant (touch()).
+
+Politique par modèle (IDLE_POLICIES, ex. "debian-client=suspend:7200,windows=halt:3600,*=off") :
+au-delà du délai, `suspend` fait une sauvegarde gérée (mémoire sur disque, domaine
+arrêté) et `halt` un arrêt propre. L'action passe par la file de tâches (une tâche
+à la fois par VM) et est annulée si la VM a servi entre-temps. Les admins peuvent
+exempter une VM ou tous les VMs d'un propriétaire.
+
+Une VM mise en veille reprend où elle en était au prochain lancement ou à
+l'ouverture de sa console (resume() : libvirt restaure la sauvegarde au démarrage).
+"""
+import time
+import config
+import coordination
+import db
+import jobs
+import libvirt_conn
+import lifecycle
+import provisioning
+import vm_state_cache
+import vm_store
+import vnc_gateway
+import vnc_proxies
+import warm_pool
+
+CHECK_INTERVAL = config.IDLE_CHECK_INTERVAL
+CPU_THRESHOLD = config.IDLE_CPU_THRESHOLD
+ACTIONS = ('suspend', 'halt', 'off')
+EXEMPTION_KINDS = ('vm', 'owner')
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS vm_activity (
+    domain TEXT PRIMARY KEY,
+    last_action_at REAL,
+    busy_at REAL,
+    cpu_time REAL,
+    cpu_pct REAL,
+    sampled_at REAL,
+    stopped_by TEXT,
+    stopped_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS idle_exemptions (
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    note TEXT NOT NULL DEFAULT '',
+    created_by TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (kind, value)
+);
+""")
+
+
+# -------------------- Politiques --------------------
+def parse_policies(text):
+    """"modèle=action:secondes,..." -> {modèle: (action, secondes)} ; '*' : autres modèles."""
+    policies = {}
+    for item in (text or '').split(','):
+        template, sep, rule = item.partition('=')
+        if not sep:
+            continue
+        action, _, seconds = rule.strip().partition(':')
+        action = action.strip()
+        if action not in ACTIONS:
+            print(f"[idle_reaper] Politique ignorée: {item.strip()}")
+            continue
+        policies[template.strip()] = (action, int(seconds or 0))
+    return policies
+
+
+POLICIES = parse_policies(config.IDLE_POLICIES)
+
+
+def policy_for(vm):
+    """(action, délai en secondes) applicable à une VM de vm_store."""
+    template = provisioning.template_name(vm['os'], vm['vm_type'])
+    return POLICIES.get(template) or POLICIES.get('*') or ('off', 0)
+
+
+# -------------------- Exemptions --------------------
+def list_exemptions():
+    rows = db.get_db().execute("SELECT * FROM idle_exemptions ORDER BY kind, value").fetchall()
+    return [dict(r) for r in rows]
+
+
+def add_exemption(kind, value, created_by, note=''):
+    """Exempte une VM (chemin) ou un propriétaire de la mise en veille."""
+    if kind not in EXEMPTION_KINDS:
+        raise ValueError(f"Type d'exemption invalide: {kind}")
+    db.get_db().execute(
+        "INSERT OR REPLACE INTO idle_exemptions (kind, value, note, created_by, created_at) VALUES (?, ?, ?, ?, ?)",
+        (kind, value, (note or '').strip()[:500], created_by, time.time())
+    )
+
+
+def remove_exemption(kind, value):
+    """Retire une exemption ; False si elle n'existait pas."""
+    cur = db.get_db().execute("DELETE FROM idle_exemptions WHERE kind = ? AND value = ?", (kind, value))
+    return cur.rowcount > 0
+
+
+def _exempt(vm, exemptions):
+    return ('vm', vm['path']) in exemptions or ('owner', vm['owner']) in exemptions
+
+
+# -------------------- Activité --------------------
+def touch(domain_name, now=None):
+    """Action API visant la VM (lancement, console...) : repousse sa mise en veille."""
+    db.get_db().execute(
+        "INSERT INTO vm_activity (domain, last_action_at) VALUES (?, ?) "
+        "ON CONFLICT(domain) DO UPDATE SET last_action_at = excluded.last_action_at",
+        (domain_name, now or time.time())
+    )
+
+
+def _row(domain_name):
+    row = db.get_db().execute("SELECT * FROM vm_activity WHERE domain = ?", (domain_name,)).fetchone()
+    return dict(row) if row else None
+
+
+def stopped_by(domain_name):
+    """'suspend' ou 'halt' si la VM a été mise en veille / arrêtée par le serveur (et pas relancée), sinon None."""
+    row = _row(domain_name)
+    return row['stopped_by'] if row else None
+
+
+def _mark_stopped(domain_name, action):
+    db.get_db().execute("UPDATE vm_activity SET stopped_by = ?, stopped_at = ?, cpu_time = NULL WHERE domain = ?",
+                        (action, time.time(), domain_name))
+
+
+def suspend(domain_name, log):
+    """
+    Mise en veille par sauvegarde gérée, reprise au prochain lancement (resume()).
+    Retourne (ok, message_erreur).
+    """
+    ok, error = lifecycle.suspend(domain_name, log)
+    if ok:
+        touch(domain_name)  # ligne d'activité présente même si le ramasseur ne tourne pas
+        _mark_stopped(domain_name, 'suspend')
+    return ok, error
+
+
+def resume(domain_name, log):
+    """
+    Relance une VM mise en veille par sauvegarde gérée (mémoire restaurée, sans
+    passer par Vagrant). Retourne True si elle a repris.
+    """
+    if stopped_by(domain_name) != 'suspend':
+        return False
+    log(f"Reprise de {domain_name} (mise en veille)")
+    ok, error = lifecycle.start(domain_name, log)
+    if not ok:
+        log(f"Reprise impossible: {error}")
+        return False
+    db.get_db().execute("UPDATE vm_activity SET stopped_by = NULL, stopped_at = NULL, last_action_at = ? "
+                        "WHERE domain = ?", (time.time(), domain_name))
+    return True
+
+
+def _consoles():
+    return vnc_gateway.active_domains() | vnc_proxies.active_domains()
+
+
+def _vms_by_domain():
+    aliases = warm_pool.domain_aliases()
+    return {aliases.get(vm['path'], f"{vm['name']}_default"): vm for vm in vm_store.list_vms()}
+
+
+# -------------------- Passage du ramasseur --------------------
+def check(now=None, submit=True):
+    """
+    Met à jour l'activité des domaines actifs et met en file la mise en veille des
+    VMs inactives au-delà de leur politique. Retourne les décisions prises.
+    """
+    now = now or time.time()
+    stats = libvirt_conn.get_all_domain_stats(('cpu-total',), active_only=True)
+    consoles = _consoles()
+    vms = _vms_by_domain()
+    exemptions = {(e['kind'], e['value']) for e in list_exemptions()}
+    decisions = []
+    with db.transaction() as conn:
+        rows = {r['domain']: dict(r) for r in conn.execute("SELECT * FROM vm_activity").fetchall()}
+        for domain, values in stats.items():
+            row = rows.get(domain) or {'last_action_at': None, 'busy_at': None, 'cpu_time': None, 'sampled_at': None}
+            cpu_time = values.get('cpu.time')
+            cpu_pct = None
+            if cpu_time is not None and row['cpu_time'] is not None and cpu_time >= row['cpu_time'] \
+                    and now > row['sampled_at']:
+                cpu_pct = (cpu_time - row['cpu_time']) / 1e9 / (now - row['sampled_at']) * 100
+            # Premier échantillon (démarrage, reprise) : compté comme une activité
+            busy_at = now if cpu_pct is None or cpu_pct >= CPU_THRESHOLD or domain in consoles else row['busy_at']
+            conn.execute(
+                "INSERT INTO vm_activity (domain, last_action_at, busy_at, cpu_time, cpu_pct, sampled_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(domain) DO UPDATE SET busy_at = excluded.busy_at, "
+                "cpu_time = excluded.cpu_time, cpu_pct = excluded.cpu_pct, sampled_at = excluded.sampled_at, "
+                "stopped_by = NULL, stopped_at = NULL",
+                (domain, row['last_action_at'], busy_at, cpu_time, cpu_pct, now)
+            )
+            vm = vms.get(domain)
+            if vm is None or _exempt(vm, exemptions):
+                continue
+            action, delay = policy_for(vm)
+            idle_for = now - max(busy_at, row['last_action_at'] or 0)
+            if action != 'off' and idle_for >= delay:
+                decisions.append({'domain': domain, 'vm': vm, 'action': action, 'idle_for': idle_for})
+                # Compteur remis à zéro : pas de nouvelle tâche avant un autre délai complet
+                conn.execute("UPDATE vm_activity SET busy_at = ? WHERE domain = ?", (now, domain))
+        # Domaines arrêtés : leur temps CPU repartira de zéro
+        active = list(stats)
+        conn.execute(f"UPDATE vm_activity SET cpu_time = NULL, cpu_pct = NULL "
+                     f"WHERE domain NOT IN ({','.join('?' for _ in active)})", active)
+    if submit:
+        for d in decisions:
+            vm = d['vm']
+            d['job_id'] = jobs.submit('idle', vm['name'], vm['owner'], {
+                'path': vm['path'], 'domain': d['domain'], 'action': d['action'], 'idle_for': round(d['idle_for']),
+            })
+            print(f"[idle_reaper] {vm['owner']}/{vm['name']} inactive depuis {d['idle_for'] / 60:.0f} min : "
+                  f"{d['action']} (tâche #{d['job_id']})")
+    return decisions
+
+
+@jobs.handler('idle')
+def _job_idle(job, log):
+    """Tâche: mise en veille (sauvegarde gérée) ou arrêt d'une VM inactive."""
+    payload = job['payload']
+    domain, action = payload['domain'], payload['action']
+    row = _row(domain) or {}
+    if (row.get('last_action_at') or 0) > job['created_at'] or domain in _consoles():
+        return f"VM {job['vm_name']} utilisée entre-temps, mise en veille annulée."
+    if libvirt_conn.get_domain_state(domain) != 'running':
+        return f"VM {job['vm_name']} déjà arrêtée."
+    log(f"Inactive depuis {payload['idle_for'] // 60} min (politique: {action})")
+    vnc_proxies.release(domain)
+    try:
+        if action == 'suspend':
+            ok, error = suspend(domain, log)
+            if ok:
+                return f"VM {job['vm_name']} mise en veille (inactive)."
+            log(f"Sauvegarde gérée impossible ({error}), arrêt propre")
+        ok, forced, error = lifecycle.stop(domain, log)
+        if not ok:
+            raise jobs.JobFailed(f"Arrêt impossible : {error}")
+        _mark_stopped(domain, 'halt')
+        return f"VM {job['vm_name']} arrêtée (inactive)."
+    finally:
+        vm_state_cache.refresh_domain(domain)
+
+
+def status(now=None):
+    """Activité des domaines suivis (inactivité, CPU, console, veille), politiques et exemptions."""
+    now = now or time.time()
+    vms = _vms_by_domain()
+    consoles = _consoles()
+    exemptions = list_exemptions()
+    exempt = {(e['kind'], e['value']) for e in exemptions}
+    domains = []
+    for row in db.get_db().execute("SELECT * FROM vm_activity ORDER BY domain").fetchall():
+        vm = vms.get(row['domain'])
+        last = max(row['busy_at'] or 0, row['last_action_at'] or 0)
+        domains.append({
+            'domain': row['domain'],
+            'vm_name': vm['name'] if vm else None,
+            'owner': vm['owner'] if vm else None,
+            'policy': policy_for(vm) if vm else None,
+            'exempt': bool(vm and _exempt(vm, exempt)),
+            'cpu_pct': round(row['cpu_pct'], 1) if row['cpu_pct'] is not None else None,
+            'console': row['domain'] in consoles,
+            'idle_for': round(now - last) if last and row['sampled_at'] and not row['stopped_by'] else None,
+            'stopped_by': row['stopped_by'],
+            'stopped_at': row['stopped_at'],
+        })
+    return {
+        'enabled': config.IDLE_REAPER_ENABLED,
+        'policies': POLICIES,
+        'cpu_threshold': CPU_THRESHOLD,
+        'interval': CHECK_INTERVAL,
+        'exemptions': exemptions,
+        'domains': domains,
+    }
+
+
+def _loop():
+    while True:
+        try:
+            check()
+        except Exception as e:
+            print(f"[idle_reaper] Passage impossible: {e}")
+        time.sleep(CHECK_INTERVAL)
+
+
+def start():
+    """Démarre le ramasseur dans le worker élu."""
+    return coordination.run_as_leader('idle-reaper', _loop)
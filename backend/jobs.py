@@ -0,0 +1,335 @@
+"""
+File de tâches asynchrones (création, lancement, arrêt, suppression de VMs).
+
+Les tâches sont stockées dans la table SQLite `jobs` (partagée entre workers) :
+état, horodatages, code de sortie et journal capturé. Chaque worker gunicorn
+exécute un nombre borné de threads qui réservent atomiquement la prochaine
+tâche en attente ; une seule tâche à la fois par VM (propriétaire, nom : les
+noms ne sont uniques que par propriétaire).
+"""
+import json
+import os
+import signal
+import subprocess
+import threading
+import time
+import commands
+import config
+import db
+
+MAX_LOG_CHARS = 64 * 1024  # seule la fin du journal est conservée
+LOG_FLUSH_INTERVAL = 1.0
+POLL_INTERVAL = 1.0
+
+FINISHED_STATES = ('succeeded', 'failed', 'interrupted')
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    vm_name TEXT,
+    owner TEXT,
+    state TEXT NOT NULL DEFAULT 'queued',
+    payload TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    exit_code INTEGER,
+    message TEXT NOT NULL DEFAULT '',
+    log TEXT NOT NULL DEFAULT '',
+    worker_pid INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_vm ON jobs(vm_name, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_state_vm ON jobs(state, owner, vm_name);
+CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, id);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs(state, id);
+""")
+
+_handlers = {}
+_wakeup = threading.Event()
+
+
+def _fifo(candidates, running):
+    return candidates[0] if candidates else None
+
+
+_selector = {'fn': _fifo, 'prepare': None}
+
+
+class JobFailed(Exception):
+    """Levée par un gestionnaire pour terminer la tâche en échec avec un message."""
+
+    def __init__(self, message, exit_code=1):
+        super().__init__(message)
+        self.exit_code = exit_code
+
+
+def handler(kind):
+    """
+    Décorateur : enregistre la fonction qui exécute les tâches `kind`.
+    Signature: fn(job, log) -> message ; `log(texte)` ajoute au journal de la tâche.
+    """
+    def decorator(fn):
+        _handlers[kind] = fn
+        return fn
+    return decorator
+
+
+def set_selector(fn, prepare=None):
+    """
+    Remplace la politique de choix de la prochaine tâche (FIFO par défaut).
+    fn(candidates, running) -> ligne choisie ou None ; appelée sous verrou de la base,
+    elle ne doit faire aucun appel externe. prepare() est appelée avant chaque
+    réservation, hors transaction (ressources de l'hôte, tâches à écarter...).
+    """
+    _selector['fn'] = fn
+    _selector['prepare'] = prepare
+
+
+def submit(kind, vm_name=None, owner=None, payload=None):
+    """Met une tâche en file et retourne son identifiant."""
+    with db.transaction() as conn:
+        cur = conn.execute(
+            "INSERT INTO jobs (kind, vm_name, owner, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+            (kind, vm_name, owner, json.dumps(payload or {}), time.time())
+        )
+    _wakeup.set()
+    return cur.lastrowid
+
+
+def fail_queued(job_id, message):
+    """Termine en échec une tâche encore en attente (jamais exécutée). Retourne True si elle l'était."""
+    cur = db.get_db().execute(
+        "UPDATE jobs SET state = 'failed', finished_at = ?, exit_code = ?, message = ? WHERE id = ? AND state = 'queued'",
+        (time.time(), -1, message, job_id)
+    )
+    return cur.rowcount > 0
+
+
+def _to_dict(row, with_log=False):
+    job = {
+        'id': row['id'],
+        'kind': row['kind'],
+        'vm_name': row['vm_name'],
+        'owner': row['owner'],
+        'state': row['state'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+        'duration': (row['finished_at'] or time.time()) - row['started_at'] if row['started_at'] else None,
+        'exit_code': row['exit_code'],
+        'message': row['message'],
+    }
+    if with_log:
+        job['log'] = row['log']
+    return job
+
+
+def get(job_id, with_log=True):
+    """Retourne une tâche (dict) ou None."""
+    row = db.get_db().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return _to_dict(row, with_log) if row else None
+
+
+def list_jobs(vm_name=None, owner=None, limit=50):
+    """Dernières tâches, filtrées par VM et/ou propriétaire."""
+    clauses, params = [], []
+    if vm_name:
+        clauses.append("vm_name = ?")
+        params.append(vm_name)
+    if owner:
+        clauses.append("owner = ?")
+        params.append(owner)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    rows = db.get_db().execute(
+        f"SELECT * FROM jobs {where} ORDER BY id DESC LIMIT ?", (*params, limit)
+    ).fetchall()
+    return [_to_dict(r) for r in rows]
+
+
+def counts():
+    """Nombre de tâches en file et en cours (tous workers)."""
+    rows = db.get_db().execute(
+        "SELECT state, COUNT(*) AS n FROM jobs WHERE state IN ('queued', 'running') GROUP BY state"
+    ).fetchall()
+    found = {row['state']: row['n'] for row in rows}
+    return {state: found.get(state, 0) for state in ('queued', 'running')}
+
+
+# -------------------- Exécution --------------------
+class _JobLog:
+    """Journal d'une tâche, écrit en base par lots (au plus une écriture par seconde)."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.text = ''
+        self._last_flush = 0.0
+
+    def __call__(self, line):
+        self.text = (self.text + line.rstrip('\n') + '\n')[-MAX_LOG_CHARS:]
+        if time.time() - self._last_flush >= LOG_FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        db.get_db().execute("UPDATE jobs SET log = ? WHERE id = ?", (self.text, self.job_id))
+        self._last_flush = time.time()
+
+
+def run_logged(cmd, log, cwd=None, timeout=None):
+    """
+    Exécute une commande en recopiant stdout/stderr dans le journal de la tâche.
+    timeout None : délai par défaut de la commande (commands.TIMEOUTS).
+    Retourne le code de sortie ; lève subprocess.TimeoutExpired si le délai est dépassé.
+    """
+    if timeout is None:
+        timeout = commands.timeout_for(cmd)
+    log(f"$ {' '.join(str(c) for c in cmd)}")
+    with commands.traced(cmd, cwd) as entry:
+        process = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors='replace',
+            preexec_fn=os.setpgrp
+        )
+        deadline = time.time() + timeout if timeout else None
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, _kill_group, (process,))
+            timer.start()
+        tail = []
+        try:
+            for line in process.stdout:
+                log(line)
+                tail = (tail + [line])[-10:]
+            process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            entry['returncode'] = process.returncode
+            entry['stderr'] = ''.join(tail)
+        if deadline and time.time() >= deadline and process.returncode < 0:
+            raise subprocess.TimeoutExpired(cmd, timeout)
+    return process.returncode
+
+
+def _kill_group(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _claim_next():
+    """
+    Réserve atomiquement la prochaine tâche en attente choisie par la politique
+    courante (jamais deux tâches sur la même VM, c'est-à-dire même propriétaire et même nom).
+    Une opération groupée (payload bulk_id/parallel, bulk_ops) ne propose que ses tâches
+    qui ont un créneau libre : des milliers de tâches en attente d'une même opération ne
+    masquent pas les demandes soumises après elles.
+    """
+    if _selector['prepare'] is not None:
+        _selector['prepare']()
+    with db.transaction() as conn:
+        candidates = conn.execute("""
+            WITH queued AS (
+                SELECT j.id, j.payload, json_extract(j.payload, '$.bulk_id') AS bulk_id,
+                       ROW_NUMBER() OVER (PARTITION BY json_extract(j.payload, '$.bulk_id') ORDER BY j.id) AS bulk_rank
+                FROM jobs j
+                WHERE j.state = 'queued'
+                  AND (j.vm_name IS NULL OR NOT EXISTS (
+                      SELECT 1 FROM jobs r
+                      WHERE r.state = 'running' AND r.owner IS j.owner AND r.vm_name = j.vm_name))
+            )
+            SELECT * FROM jobs WHERE id IN (
+                SELECT q.id FROM queued q
+                WHERE q.bulk_id IS NULL
+                   OR q.bulk_rank + (SELECT COUNT(*) FROM jobs r WHERE r.state = 'running'
+                                     AND json_extract(r.payload, '$.bulk_id') = q.bulk_id)
+                      <= MAX(1, COALESCE(json_extract(q.payload, '$.parallel'), 1))
+            )
+            ORDER BY id LIMIT 500
+        """).fetchall()
+        if not candidates:
+            return None
+        running = conn.execute("SELECT * FROM jobs WHERE state = 'running'").fetchall()
+        row = _selector['fn'](candidates, running)
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE jobs SET state = 'running', started_at = ?, worker_pid = ? WHERE id = ?",
+            (time.time(), os.getpid(), row['id'])
+        )
+    return row
+
+
+def _finish(job_id, state, exit_code, message, log):
+    db.get_db().execute(
+        "UPDATE jobs SET state = ?, finished_at = ?, exit_code = ?, message = ?, log = ? WHERE id = ?",
+        (state, time.time(), exit_code, message, log.text, job_id)
+    )
+
+
+def _log_commands(log):
+    """Termine la trace de la tâche : durée et issue de chaque commande en fin de journal."""
+    for e in commands.end():
+        status = 'délai dépassé' if e['timed_out'] else f"code {e['returncode']}"
+        log(f"[commande] {e['command']}: {e['duration']:.1f}s, {status}")
+
+
+def _run(row):
+    job = dict(row)
+    job['payload'] = json.loads(row['payload'] or '{}')
+    log = _JobLog(job['id'])
+    fn = _handlers.get(job['kind'])
+    commands.begin(f"job {job['kind']} #{job['id']}")
+    try:
+        if fn is None:
+            raise JobFailed(f"Type de tâche inconnu: {job['kind']}")
+        message = fn(job, log)
+        _log_commands(log)
+        _finish(job['id'], 'succeeded', 0, message or '', log)
+    except JobFailed as e:
+        log(f"Échec: {e}")
+        _log_commands(log)
+        _finish(job['id'], 'failed', e.exit_code, str(e), log)
+    except Exception as e:
+        log(f"Erreur: {e}")
+        _log_commands(log)
+        _finish(job['id'], 'failed', -1, f"Erreur : {e}", log)
+
+
+def _worker_loop():
+    while True:
+        try:
+            row = _claim_next()
+        except Exception as e:
+            print(f"[jobs] Réservation impossible: {e}")
+            row = None
+        if row is None:
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        _run(row)
+
+
+def _recover_interrupted():
+    """Marque 'interrupted' les tâches 'running' dont le processus a disparu (redémarrage)."""
+    rows = db.get_db().execute("SELECT id, worker_pid FROM jobs WHERE state = 'running'").fetchall()
+    for row in rows:
+        try:
+            os.kill(row['worker_pid'], 0)
+        except (OSError, TypeError):
+            db.get_db().execute(
+                "UPDATE jobs SET state = 'interrupted', finished_at = ?, message = ? WHERE id = ? AND state = 'running'",
+                (time.time(), 'Interrompue (redémarrage du service)', row['id'])
+            )
+
+
+def start_workers(count=None):
+    """Démarre le pool borné de threads d'exécution pour ce processus."""
+    _recover_interrupted()
+    for i in range(count or config.JOB_WORKERS):
+        threading.Thread(target=_worker_loop, name=f"job-worker-{i}", daemon=True).start()
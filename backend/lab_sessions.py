@@ -0,0 +1,246 @@
+"""
+Séances de TP planifiées : VMs des participants pré-démarrées avant le début, arrêtées après la fin.
+
+Une séance (nom, participants, modèle, début, fin) désigne les VMs de ses participants
+(propriétaires ; seulement celles du modèle s'il est donné). Un seul worker (leader
+"lab-sessions") suit les séances toutes les LAB_CHECK_INTERVAL secondes :
+- pré-démarrage : dès `preboot` secondes avant le début, les VMs non démarrées sont
+  mises en file ('launch', comme /api/launch_vm : une VM mise en veille reprend) par
+  vagues étalées jusqu'à LAB_PREBOOT_MARGIN secondes avant le début. Les tâches
+  forment une opération groupée (bulk_ops, au plus LAB_PREBOOT_PARALLEL à la fois),
+  l'ordonnanceur appliquant en plus ses limites de démarrage : la charge de démarrage
+  quitte la minute de pointe où tous les participants lanceraient leur VM ;
+- fin : les VMs encore démarrées sont mises en veille ('suspend', sauvegarde gérée)
+  ou arrêtées ('halt', comme /api/halt_vm) dans une seconde opération groupée.
+
+États : scheduled -> prebooting -> active -> finished (ou cancelled).
+"""
+import datetime
+import json
+import math
+import time
+import bulk_ops
+import config
+import coordination
+import db
+import provisioning
+
+CHECK_INTERVAL = config.LAB_CHECK_INTERVAL
+PREBOOT_LEAD = config.LAB_PREBOOT_LEAD
+PREBOOT_MARGIN = config.LAB_PREBOOT_MARGIN
+PREBOOT_PARALLEL = config.LAB_PREBOOT_PARALLEL
+END_ACTIONS = ('suspend', 'halt', 'none')
+OPEN_STATES = ('scheduled', 'prebooting', 'active')
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS lab_sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    owners TEXT NOT NULL,
+    template TEXT,
+    starts_at REAL NOT NULL,
+    ends_at REAL NOT NULL,
+    preboot INTEGER NOT NULL,
+    end_action TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'scheduled',
+    preboot_bulk_id INTEGER,
+    teardown_bulk_id INTEGER,
+    created_by TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_lab_sessions_state ON lab_sessions(state, starts_at);
+""")
+
+
+# -------------------- Séances --------------------
+def _as_dict(row):
+    session = dict(row)
+    session['owners'] = json.loads(row['owners'])
+    return session
+
+
+def parse_time(value):
+    """Horodatage (secondes) d'un nombre ou d'une date ISO 8601 (heure locale du serveur sans fuseau) ; ValueError sinon."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return datetime.datetime.fromisoformat(str(value).strip()).timestamp()
+    except ValueError:
+        raise ValueError(f"Date invalide: {value!r} (attendu: ISO 8601, ex. 2026-10-19T08:00)")
+
+
+def create(name, owners, starts_at, ends_at, created_by, template=None, preboot=None, end_action=None, now=None):
+    """
+    Planifie une séance ; retourne son identifiant.
+    ValueError si les participants, le modèle, les horaires ou l'action de fin sont invalides.
+    """
+    now = now or time.time()
+    name = (name or '').strip()[:200]
+    if isinstance(owners, str):
+        owners = owners.split(',')
+    owners = sorted({str(o).strip() for o in owners or () if str(o).strip()})
+    preboot = PREBOOT_LEAD if preboot is None else int(preboot)
+    end_action = end_action or config.LAB_END_ACTION
+    if not name:
+        raise ValueError("Nom de séance requis.")
+    if not owners:
+        raise ValueError("Participants requis (liste d'utilisateurs).")
+    templates = sorted({provisioning.template_name(*key) for key in provisioning.TEMPLATES})
+    if template and template not in templates:
+        raise ValueError(f"Modèle inconnu: {template} (attendu: {', '.join(templates)})")
+    if ends_at <= starts_at:
+        raise ValueError("La fin de la séance doit suivre son début.")
+    if ends_at <= now:
+        raise ValueError("Séance déjà terminée.")
+    if preboot < 0:
+        raise ValueError("preboot : nombre de secondes positif attendu.")
+    if end_action not in END_ACTIONS:
+        raise ValueError(f"Action de fin invalide (attendu: {', '.join(END_ACTIONS)}).")
+    return db.get_db().execute(
+        "INSERT INTO lab_sessions (name, owners, template, starts_at, ends_at, preboot, end_action, created_by, "
+        "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, json.dumps(owners), template or None, starts_at, ends_at, preboot, end_action, created_by, now)
+    ).lastrowid
+
+
+def get(session_id):
+    """Séance avec l'avancement de ses opérations groupées, ou None."""
+    row = db.get_db().execute("SELECT * FROM lab_sessions WHERE id = ?", (session_id,)).fetchone()
+    if row is None:
+        return None
+    session = _as_dict(row)
+    session['preboot_operation'] = bulk_ops.get(row['preboot_bulk_id']) if row['preboot_bulk_id'] else None
+    session['teardown_operation'] = bulk_ops.get(row['teardown_bulk_id']) if row['teardown_bulk_id'] else None
+    return session
+
+
+def list_sessions(include_past=False, limit=50, now=None):
+    """Séances à venir ou en cours (triées par début) ; avec include_past, aussi les terminées/annulées."""
+    now = now or time.time()
+    if include_past:
+        rows = db.get_db().execute("SELECT * FROM lab_sessions ORDER BY starts_at DESC LIMIT ?", (limit,)).fetchall()
+    else:
+        rows = db.get_db().execute(
+            f"SELECT * FROM lab_sessions WHERE state IN ({', '.join('?' for _ in OPEN_STATES)}) "
+            f"ORDER BY starts_at LIMIT ?", (*OPEN_STATES, limit)
+        ).fetchall()
+    sessions = []
+    for row in rows:
+        session = _as_dict(row)
+        session['preboot_at'] = row['starts_at'] - row['preboot']
+        session['starts_in'] = round(row['starts_at'] - now)
+        sessions.append(session)
+    return sessions
+
+
+def cancel(session_id):
+    """Annule une séance pas encore terminée ; False si elle n'existe pas ou est déjà close."""
+    cur = db.get_db().execute(
+        f"UPDATE lab_sessions SET state = 'cancelled' WHERE id = ? AND state IN ({', '.join('?' for _ in OPEN_STATES)})",
+        (session_id, *OPEN_STATES)
+    )
+    return cur.rowcount > 0
+
+
+def _set(session_id, **fields):
+    db.get_db().execute(f"UPDATE lab_sessions SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                        (*fields.values(), session_id))
+
+
+# -------------------- VMs des participants --------------------
+def participants_vms(session):
+    """VMs (dicts de bulk_ops.select) des participants, filtrées par modèle s'il est donné."""
+    vms = bulk_ops.select(bulk_ops.normalize_selector({'owners': session['owners']}))
+    if session['template']:
+        vms = [vm for vm in vms if provisioning.template_name(vm['os'], vm['vm_type']) == session['template']]
+    return vms
+
+
+def _operation_selector(session):
+    return {'owners': session['owners'], 'template': session['template'], 'lab_session': session['id']}
+
+
+def wave_size(pending, now, deadline, interval=CHECK_INTERVAL):
+    """VMs à mettre en file ce passage : les `pending` restantes réparties sur les passages avant `deadline`."""
+    if pending <= 0:
+        return 0
+    passes_left = max(1, math.ceil((deadline - now) / interval))
+    return math.ceil(pending / passes_left)
+
+
+def preboot_wave(session, now, log=print):
+    """Met en file la vague de lancements due pour la séance ; retourne le nombre de tâches soumises."""
+    bulk_id = session['preboot_bulk_id']
+    if bulk_id is None:
+        bulk_id = bulk_ops.create('start', session['created_by'], _operation_selector(session), PREBOOT_PARALLEL)
+        _set(session['id'], preboot_bulk_id=bulk_id)
+        session['preboot_bulk_id'] = bulk_id
+    done = bulk_ops.submitted(bulk_id)
+    pending = [vm for vm in participants_vms(session)
+               if vm['state'] != 'running' and (vm['owner'], vm['name']) not in done]
+    wave = pending[:wave_size(len(pending), now, session['starts_at'] - PREBOOT_MARGIN)]
+    if wave:
+        bulk_ops.add(bulk_id, wave)
+        log(f"[lab_sessions] Séance #{session['id']} ({session['name']}) : {len(wave)} VM(s) en lancement, "
+            f"{len(pending) - len(wave)} restante(s) (opération #{bulk_id})")
+    return len(wave)
+
+
+def teardown(session, log=print):
+    """Met en veille ou arrête les VMs démarrées de la séance ; retourne le nombre de tâches soumises."""
+    if session['end_action'] == 'none':
+        return 0
+    running = [vm for vm in participants_vms(session) if vm['state'] == 'running']
+    if not running:
+        return 0
+    bulk_id = bulk_ops.submit(session['end_action'], running, session['created_by'], _operation_selector(session))
+    _set(session['id'], teardown_bulk_id=bulk_id)
+    log(f"[lab_sessions] Séance #{session['id']} ({session['name']}) terminée : "
+        f"{session['end_action']} de {len(running)} VM(s) (opération #{bulk_id})")
+    return len(running)
+
+
+# -------------------- Passage --------------------
+def check(now=None, log=print):
+    """Fait avancer les séances ouvertes (pré-démarrage, début, fin). Retourne {id: état}."""
+    now = now or time.time()
+    rows = db.get_db().execute(
+        f"SELECT * FROM lab_sessions WHERE state IN ({', '.join('?' for _ in OPEN_STATES)}) AND starts_at - preboot <= ? "
+        f"ORDER BY starts_at", (*OPEN_STATES, now)
+    ).fetchall()
+    states = {}
+    for row in rows:
+        session = _as_dict(row)
+        try:
+            if now >= session['ends_at']:
+                teardown(session, log)
+                state = 'finished'
+            elif now >= session['starts_at']:
+                if session['state'] != 'active':
+                    # Dernière vague : VMs pas encore en file (service arrêté pendant le pré-démarrage...)
+                    preboot_wave(session, session['starts_at'], log)
+                state = 'active'
+            else:
+                preboot_wave(session, now, log)
+                state = 'prebooting'
+        except Exception as e:
+            log(f"[lab_sessions] Séance #{session['id']} : passage impossible: {e}")
+            continue
+        if state != session['state']:
+            _set(session['id'], state=state)
+        states[session['id']] = state
+    return states
+
+
+def _loop():
+    while True:
+        try:
+            check()
+        except Exception as e:
+            print(f"[lab_sessions] Passage impossible: {e}")
+        time.sleep(CHECK_INTERVAL)
+
+
+def start():
+    """Démarre le suivi des séances dans le worker élu."""
+    return coordination.run_as_leader('lab-sessions', _loop)
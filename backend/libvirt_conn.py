@@ -0,0 +1,761 @@
+"""
+Couche d'accès libvirt : une connexion persistante par worker gunicorn.
+
+- Pilote `libvirt` (libvirt-python) : connexion ouverte une fois par processus,
+  reconnexion automatique si elle tombe (redémarrage de libvirtd, fork...).
+- Pilote `virsh` : repli quand libvirt-python n'est pas installé/utilisable.
+
+L'URI vient de config.LIBVIRT_URI (qemu:///system par défaut). Avec
+LIBVIRT_URI=test:///default, les deux pilotes fonctionnent sans hyperviseur.
+"""
+import base64
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import commands
+import config
+
+try:
+    import libvirt  # libvirt-python (optionnel : repli sur virsh si absent)
+    import libvirt_qemu
+except ImportError:
+    libvirt = None
+    libvirt_qemu = None
+
+URI = config.LIBVIRT_URI
+BACKEND = config.LIBVIRT_BACKEND  # 'auto', 'libvirt' ou 'virsh'
+
+# Libellés virsh des états libvirt (virDomainState)
+STATE_NAMES = {
+    0: 'no state',
+    1: 'running',
+    2: 'idle',
+    3: 'paused',
+    4: 'in shutdown',
+    5: 'shut off',
+    6: 'crashed',
+    7: 'pmsuspended',
+}
+
+# Groupes de statistiques groupées (virConnectGetAllDomainStats / virsh domstats)
+STATS_GROUPS = {
+    'state': 1,
+    'cpu-total': 2,
+    'balloon': 4,
+    'vcpu': 8,
+    'interface': 16,
+    'block': 32,
+}
+
+
+# Élément <graphics type='vnc' ...> de la description XML (recherche ciblée, sans analyse complète)
+_VNC_GRAPHICS_RE = re.compile(r"<graphics\b[^>]*\btype=['\"]vnc['\"][^>]*>")
+_PORT_ATTR_RE = re.compile(r"\bport=['\"](\d+)['\"]")
+
+
+def vnc_port_from_xml(domain_xml):
+    """Port VNC attribué dans la description XML d'un domaine actif, ou None (autoport non résolu : -1)."""
+    graphics = _VNC_GRAPHICS_RE.search(domain_xml or '')
+    port = _PORT_ATTR_RE.search(graphics.group(0)) if graphics else None
+    return int(port.group(1)) if port else None
+
+
+_UNIT_KIB = {'b': 1 / 1024, 'bytes': 1 / 1024, 'k': 1, 'kib': 1, 'kb': 1000 / 1024,
+             'm': 1024, 'mib': 1024, 'mb': 1000**2 / 1024, 'g': 1024**2, 'gib': 1024**2, 'gb': 1000**3 / 1024}
+
+
+def memory_from_xml(domain_xml):
+    """(maximum, actuelle) en KiB d'après la description XML d'un domaine, ou (None, None)."""
+    import xml.etree.ElementTree as ET
+    try:
+        root = ET.fromstring(domain_xml or '')
+    except ET.ParseError:
+        return None, None
+    values = []
+    for tag in ('memory', 'currentMemory'):
+        element = root.find(tag)
+        if element is None or not (element.text or '').strip().isdigit():
+            values.append(None)
+            continue
+        values.append(int(int(element.text) * _UNIT_KIB.get(element.get('unit', 'KiB').lower(), 1)))
+    return values[0], values[1] or values[0]
+
+
+def disks_from_xml(domain_xml):
+    """Disques (device='disk') d'un domaine : [(cible 'vda', chemin du volume)], dans l'ordre de la description."""
+    import xml.etree.ElementTree as ET
+    try:
+        root = ET.fromstring(domain_xml or '')
+    except ET.ParseError:
+        return []
+    disks = []
+    for disk in root.findall("./devices/disk[@device='disk']"):
+        target, source = disk.find('target'), disk.find('source')
+        if target is not None and source is not None and (source.get('file') or source.get('dev')):
+            disks.append((target.get('dev'), source.get('file') or source.get('dev')))
+    return disks
+
+
+def active_id(dom):
+    """Identifiant libvirt d'un domaine actif (nouveau à chaque démarrage), None s'il est arrêté."""
+    domain_id = dom.ID()
+    return domain_id if 0 <= domain_id < 0xFFFFFFFF else None
+
+
+def normalize_state(state):
+    """
+    Normalise un état libvirt/virsh (français ou anglais) : 'running', 'shut off', 'paused', etc.
+    """
+    state = (state or '').strip().lower()
+    if 'exécution' in state or 'execution' in state or state == 'running':
+        return 'running'
+    elif 'arrêt' in state or 'shut' in state or 'fermé' in state:
+        return 'shut off'
+    elif 'pause' in state or 'paused' in state:
+        return 'paused'
+    else:
+        return state or 'unknown'
+
+
+# -------------------- Pilote libvirt-python --------------------
+class LibvirtDriver:
+    """Connexion libvirt persistante, rouverte à la demande (par processus)."""
+
+    name = 'libvirt'
+
+    def __init__(self, uri):
+        self.uri = uri
+        self._conn = None
+        self._closed = None  # connexion signalée fermée par le rappel libvirt, écartée sous verrou
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def connection(self):
+        """Retourne la connexion du processus courant, en la (ré)ouvrant si nécessaire."""
+        with self._lock:
+            # Après un fork (workers gunicorn), la connexion du parent est inutilisable
+            if self._conn is not None and (self._closed is self._conn or self._pid != os.getpid()
+                                           or not self._is_alive(self._conn)):
+                self._conn = None
+            if self._conn is None:
+                self._conn = libvirt.open(self.uri)
+                self._closed = None
+                self._pid = os.getpid()
+                try:
+                    self._conn.registerCloseCallback(self._on_close, None)
+                except libvirt.libvirtError:
+                    pass  # pilotes sans support (test://)
+            return self._conn
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            return conn.isAlive() == 1
+        except libvirt.libvirtError:
+            return False
+
+    def _on_close(self, conn, reason, opaque):
+        # Fil d'événements libvirt : pas de verrou ici (le rappel peut survenir pendant un appel
+        # qui le tient) ; connection() écarte la connexion marquée au prochain appel.
+        print(f"[libvirt_conn] Connexion {self.uri} fermée (raison {reason}), reconnexion au prochain appel")
+        self._closed = conn
+
+    def _drop(self, conn):
+        """Écarte `conn` si c'est toujours la connexion courante (un autre fil a pu la rouvrir)."""
+        with self._lock:
+            if self._conn is conn:
+                self._conn = None
+
+    def _call(self, fn):
+        """Exécute fn(conn) ; en cas de connexion perdue, reconnecte et réessaie une fois."""
+        conn = self.connection()
+        try:
+            return fn(conn)
+        except libvirt.libvirtError:
+            if self._is_alive(conn):
+                raise
+            self._drop(conn)
+            return fn(self.connection())
+
+    def _lookup(self, conn, domain_name):
+        try:
+            return conn.lookupByName(domain_name)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                return None
+            raise
+
+    def all_domains(self):
+        return self._call(lambda conn: {
+            dom.name(): {'state': normalize_state(STATE_NAMES.get(dom.state()[0], 'unknown')), 'id': active_id(dom)}
+            for dom in conn.listAllDomains(0)
+        })
+
+    def state(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return 'unknown'
+            return normalize_state(STATE_NAMES.get(dom.state()[0], 'unknown'))
+        return self._call(fn)
+
+    def xml(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            return dom.XMLDesc(0) if dom is not None else None
+        return self._call(fn)
+
+    def domain_id(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            return active_id(dom) if dom is not None else None
+        return self._call(fn)
+
+    def vnc_port(self, domain_name):
+        return vnc_port_from_xml(self.xml(domain_name))
+
+    def start(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            if not dom.isActive():
+                dom.create()
+            return True, ''
+        return self._call(fn)
+
+    def shutdown(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            if dom.isActive():
+                dom.shutdown()
+            return True, ''
+        return self._call(fn)
+
+    def destroy(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            if dom.isActive():
+                dom.destroy()
+            return True, ''
+        return self._call(fn)
+
+    def reset(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            dom.reset(0)
+            return True, ''
+        return self._call(fn)
+
+    def managed_save(self, domain_name):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            if dom.isActive():
+                dom.managedSave(0)
+            return True, ''
+        return self._call(fn)
+
+    def set_memory(self, domain_name, kib):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            dom.setMemoryFlags(kib, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+            return True, ''
+        return self._call(fn)
+
+    def set_memory_stats_period(self, domain_name, seconds):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            dom.setMemoryStatsPeriod(seconds, libvirt.VIR_DOMAIN_AFFECT_LIVE)
+            return True, ''
+        return self._call(fn)
+
+    def set_memory_config(self, domain_name, maximum_kib, kib):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            dom.setMemoryFlags(maximum_kib, libvirt.VIR_DOMAIN_AFFECT_CONFIG | libvirt.VIR_DOMAIN_MEM_MAXIMUM)
+            dom.setMemoryFlags(kib, libvirt.VIR_DOMAIN_AFFECT_CONFIG)
+            return True, ''
+        return self._call(fn)
+
+    def disk_capacity(self, domain_name, disk):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            return dom.blockInfo(disk)[0] if dom is not None else None  # [capacité, allocation, physique]
+        return self._call(fn)
+
+    def block_resize(self, domain_name, disk, size_bytes):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            dom.blockResize(disk, size_bytes, libvirt.VIR_DOMAIN_BLOCK_RESIZE_BYTES)
+            return True, ''
+        return self._call(fn)
+
+    def volume_resize(self, path, size_bytes):
+        def fn(conn):
+            conn.storageVolLookupByPath(path).resize(size_bytes, 0)
+            return True, ''
+        return self._call(fn)
+
+    def undefine(self, domain_name, remove_storage=True):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                return False, f"Domaine introuvable: {domain_name}"
+            if dom.isActive():
+                dom.destroy()
+            if remove_storage:
+                _delete_domain_volumes(conn, dom.XMLDesc(0))
+            flags = (libvirt.VIR_DOMAIN_UNDEFINE_MANAGED_SAVE
+                     | libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA
+                     | libvirt.VIR_DOMAIN_UNDEFINE_NVRAM)
+            try:
+                dom.undefineFlags(flags)
+            except libvirt.libvirtError:
+                dom.undefine()
+            return True, ''
+        return self._call(fn)
+
+    def all_stats(self, groups, active_only):
+        flags = 0
+        for group in groups:
+            flags |= STATS_GROUPS[group]
+        list_flags = libvirt.VIR_CONNECT_GET_ALL_DOMAINS_STATS_ACTIVE if active_only else 0
+        return self._call(lambda conn: {
+            dom.name(): stats for dom, stats in conn.getAllDomainStats(flags, list_flags)
+        })
+
+    def node_info(self):
+        def fn(conn):
+            info = conn.getInfo()  # [modèle, mémoire (MB), CPUs, MHz, ...]
+            return {'memory_mb': info[1], 'cpus': info[2]}
+        return self._call(fn)
+
+    def network_exists(self, network_name):
+        def fn(conn):
+            try:
+                conn.networkLookupByName(network_name)
+                return True
+            except libvirt.libvirtError as e:
+                if e.get_error_code() == libvirt.VIR_ERR_NO_NETWORK:
+                    return False
+                raise
+        return self._call(fn)
+
+    def create_network(self, network_xml):
+        def fn(conn):
+            net = conn.networkDefineXML(network_xml)
+            if not net.isActive():
+                net.create()
+            net.setAutostart(1)
+            return True
+        return self._call(fn)
+
+    def agent_command(self, domain_name, command, timeout):
+        def fn(conn):
+            dom = self._lookup(conn, domain_name)
+            if dom is None:
+                raise RuntimeError(f"domaine introuvable: {domain_name}")
+            return libvirt_qemu.qemuAgentCommand(dom, command, timeout, 0)
+        return json.loads(self._call(fn))
+
+
+def _delete_domain_volumes(conn, domain_xml):
+    """Supprime les volumes de stockage référencés par les disques du domaine."""
+    import xml.etree.ElementTree as ET
+    root = ET.fromstring(domain_xml)
+    for source in root.findall("./devices/disk[@device='disk']/source"):
+        path = source.get('file') or source.get('dev')
+        if not path:
+            continue
+        try:
+            conn.storageVolLookupByPath(path).delete(0)
+        except libvirt.libvirtError as e:
+            print(f"[libvirt_conn] Volume {path} non supprimé: {e}")
+
+
+# -------------------- Pilote virsh (repli) --------------------
+class VirshDriver:
+    """Repli sans libvirt-python : un processus `virsh` par appel."""
+
+    name = 'virsh'
+
+    def __init__(self, uri):
+        self.uri = uri
+
+    def _virsh(self, *args, sudo=False, timeout=None):
+        cmd = ['virsh', '-c', self.uri, *args]
+        if sudo:
+            cmd.insert(0, 'sudo')
+        try:
+            return commands.run(cmd, timeout=timeout, env={**os.environ, 'LC_ALL': 'C'})
+        except subprocess.TimeoutExpired:
+            # Même convention que timeout(1) : l'appelant voit un échec ordinaire
+            return subprocess.CompletedProcess(cmd, 124, '', f"virsh {args[0]}: délai dépassé")
+
+    def all_domains(self):
+        result = self._virsh('list', '--all')
+        if result.returncode != 0:
+            print(f"[libvirt_conn] virsh list: {result.stderr.strip()}")
+            return {}
+        # Format:
+        #  Id   Name            State
+        # --------------------------------
+        #  1    alice-vm_default   running
+        #  -    bob-vm_default     shut off
+        domains = {}
+        for line in result.stdout.splitlines()[2:]:
+            parts = line.split(None, 2)
+            if len(parts) == 3:
+                domains[parts[1]] = {'state': normalize_state(parts[2]),
+                                     'id': int(parts[0]) if parts[0].isdigit() else None}
+        return domains
+
+    def state(self, domain_name):
+        result = self._virsh('domstate', domain_name)
+        if result.returncode != 0:
+            return 'unknown'
+        return normalize_state(result.stdout)
+
+    def xml(self, domain_name):
+        result = self._virsh('dumpxml', domain_name)
+        return result.stdout if result.returncode == 0 else None
+
+    def domain_id(self, domain_name):
+        result = self._virsh('domid', domain_name)
+        domain_id = result.stdout.strip()
+        return int(domain_id) if result.returncode == 0 and domain_id.isdigit() else None
+
+    def vnc_port(self, domain_name):
+        # "127.0.0.1:1" ou ":1" -> display 1 -> port 5901
+        result = self._virsh('vncdisplay', domain_name)
+        display = result.stdout.strip().rsplit(':', 1)[-1]
+        return 5900 + int(display) if result.returncode == 0 and display.isdigit() else None
+
+    def start(self, domain_name):
+        result = self._virsh('start', domain_name)
+        if result.returncode != 0 and 'already active' in result.stderr:
+            return True, ''
+        return result.returncode == 0, result.stderr.strip()
+
+    def shutdown(self, domain_name):
+        result = self._virsh('shutdown', domain_name)
+        return result.returncode == 0, result.stderr.strip()
+
+    def destroy(self, domain_name):
+        result = self._virsh('destroy', domain_name)
+        return result.returncode == 0, result.stderr.strip()
+
+    def reset(self, domain_name):
+        result = self._virsh('reset', domain_name)
+        return result.returncode == 0, result.stderr.strip()
+
+    def managed_save(self, domain_name):
+        result = self._virsh('managedsave', domain_name)
+        return result.returncode == 0, result.stderr.strip()
+
+    def set_memory(self, domain_name, kib):
+        result = self._virsh('setmem', domain_name, str(kib), '--live')
+        return result.returncode == 0, result.stderr.strip()
+
+    def set_memory_stats_period(self, domain_name, seconds):
+        result = self._virsh('dommemstat', domain_name, '--period', str(seconds), '--live')
+        return result.returncode == 0, result.stderr.strip()
+
+    def set_memory_config(self, domain_name, maximum_kib, kib):
+        result = self._virsh('setmaxmem', domain_name, str(maximum_kib), '--config')
+        if result.returncode == 0:
+            result = self._virsh('setmem', domain_name, str(kib), '--config')
+        return result.returncode == 0, result.stderr.strip()
+
+    def disk_capacity(self, domain_name, disk):
+        # "Capacity:       85899345920"
+        result = self._virsh('domblkinfo', domain_name, disk)
+        for line in result.stdout.splitlines() if result.returncode == 0 else ():
+            key, _, value = line.partition(':')
+            if key.strip().lower() in ('capacity', 'capacité') and value.strip().isdigit():
+                return int(value.strip())
+        return None
+
+    def block_resize(self, domain_name, disk, size_bytes):
+        result = self._virsh('blockresize', domain_name, disk, f'{size_bytes}B')
+        return result.returncode == 0, result.stderr.strip()
+
+    def volume_resize(self, path, size_bytes):
+        result = self._virsh('vol-resize', path, f'{size_bytes}B')
+        return result.returncode == 0, result.stderr.strip()
+
+    def undefine(self, domain_name, remove_storage=True):
+        self._virsh('destroy', domain_name)
+        args = ['undefine', domain_name, '--managed-save', '--snapshots-metadata']
+        if remove_storage:
+            args.append('--remove-all-storage')
+        result = self._virsh(*args)
+        return result.returncode == 0, result.stderr.strip()
+
+    def all_stats(self, groups, active_only):
+        args = ['domstats', *(f'--{group}' for group in groups)]
+        if active_only:
+            args.append('--list-active')
+        result = self._virsh(*args)
+        if result.returncode != 0:
+            print(f"[libvirt_conn] virsh domstats: {result.stderr.strip()}")
+            return {}
+        # Format:
+        # Domain: 'alice-vm_default'
+        #   balloon.current=2097152
+        #   vcpu.current=2
+        stats, current = {}, None
+        for line in result.stdout.splitlines():
+            line = line.strip()
+            if line.startswith('Domain:'):
+                current = stats.setdefault(line.split(':', 1)[1].strip().strip("'"), {})
+            elif '=' in line and current is not None:
+                key, value = line.split('=', 1)
+                try:
+                    current[key] = int(value)
+                except ValueError:
+                    current[key] = value
+        return stats
+
+    def node_info(self):
+        result = self._virsh('nodeinfo')
+        info = {}
+        for line in result.stdout.splitlines():
+            key, _, value = line.partition(':')
+            if key.strip() == 'CPU(s)':
+                info['cpus'] = int(value)
+            elif key.strip() == 'Memory size':
+                info['memory_mb'] = int(value.split()[0]) // 1024  # KiB
+        return info if len(info) == 2 else None
+
+    def network_exists(self, network_name):
+        result = self._virsh('net-info', network_name)
+        return result.returncode == 0
+
+    def create_network(self, network_xml):
+        tmp = "/tmp/default-net.xml"
+        with open(tmp, "w") as f:
+            f.write(network_xml)
+        name = network_xml.split('<name>', 1)[1].split('</name>', 1)[0]
+        for args in (('net-define', tmp), ('net-start', name), ('net-autostart', name)):
+            result = self._virsh(*args, sudo=True)
+            if result.returncode != 0 and args[0] != 'net-start':
+                raise RuntimeError(result.stderr.strip())
+        return True
+
+    def agent_command(self, domain_name, command, timeout):
+        result = self._virsh('qemu-agent-command', domain_name, '--timeout', str(timeout), command,
+                             timeout=timeout + 10)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip())
+        return json.loads(result.stdout)
+
+
+# -------------------- Sélection du pilote --------------------
+_drivers = {}
+
+
+def get_driver():
+    """Retourne le pilote du processus courant selon BACKEND ('auto' = libvirt si disponible)."""
+    use_libvirt = BACKEND == 'libvirt' or (BACKEND == 'auto' and libvirt is not None)
+    key = ('libvirt' if use_libvirt else 'virsh', URI)
+    if key not in _drivers:
+        _drivers[key] = LibvirtDriver(URI) if use_libvirt else VirshDriver(URI)
+    return _drivers[key]
+
+
+def _with_fallback(method, *args, default=None, **kwargs):
+    """Appelle le pilote courant ; si libvirt échoue, repli ponctuel sur virsh."""
+    driver = get_driver()
+    try:
+        return getattr(driver, method)(*args, **kwargs)
+    except Exception as e:
+        if isinstance(driver, VirshDriver):
+            print(f"[libvirt_conn] {method}: {e}")
+            return default
+        print(f"[libvirt_conn] {method} via libvirt échoué, repli sur virsh: {e}")
+        try:
+            return getattr(VirshDriver(URI), method)(*args, **kwargs)
+        except Exception as e2:
+            print(f"[libvirt_conn] {method}: {e2}")
+            return default
+
+
+# -------------------- API typée --------------------
+def get_all_domains() -> dict:
+    """Retourne {nom_domaine: {'state', 'id'}} pour tous les domaines, en un seul appel (id None si arrêté)."""
+    return _with_fallback('all_domains', default={})
+
+
+def get_all_domain_states() -> dict:
+    """Retourne {nom_domaine: état normalisé} pour tous les domaines, en un seul appel."""
+    return {name: domain['state'] for name, domain in get_all_domains().items()}
+
+
+def get_domain_state(domain_name: str) -> str:
+    """Retourne l'état normalisé d'un domaine, 'unknown' s'il est introuvable."""
+    return _with_fallback('state', domain_name, default='unknown')
+
+
+def get_domain_xml(domain_name: str):
+    """Retourne la description XML du domaine, ou None s'il est introuvable."""
+    return _with_fallback('xml', domain_name, default=None)
+
+
+def get_domain_id(domain_name: str):
+    """Identifiant du domaine actif (change à chaque démarrage), None s'il est arrêté ou introuvable."""
+    return _with_fallback('domain_id', domain_name, default=None)
+
+
+def get_vnc_port(domain_name: str):
+    """Port VNC du domaine actif (virsh vncdisplay / recherche ciblée dans le XML), ou None."""
+    return _with_fallback('vnc_port', domain_name, default=None)
+
+
+def start_domain(domain_name: str) -> tuple:
+    """Démarre un domaine défini (sans effet s'il tourne déjà). Retourne (ok, message_erreur)."""
+    return _with_fallback('start', domain_name, default=(False, 'libvirt indisponible'))
+
+
+def shutdown_domain(domain_name: str) -> tuple:
+    """Demande d'arrêt ACPI (l'invité s'éteint lui-même). Retourne (ok, message_erreur)."""
+    return _with_fallback('shutdown', domain_name, default=(False, 'libvirt indisponible'))
+
+
+def destroy_domain(domain_name: str) -> tuple:
+    """Arrêt forcé (débranchement). Retourne (ok, message_erreur)."""
+    return _with_fallback('destroy', domain_name, default=(False, 'libvirt indisponible'))
+
+
+def reset_domain(domain_name: str) -> tuple:
+    """Réinitialisation matérielle d'un domaine actif (bouton reset, sans arrêt de l'invité). Retourne (ok, message_erreur)."""
+    return _with_fallback('reset', domain_name, default=(False, 'libvirt indisponible'))
+
+
+def managed_save_domain(domain_name: str) -> tuple:
+    """
+    Sauvegarde gérée : mémoire écrite sur disque puis domaine arrêté ; le prochain
+    démarrage du domaine reprend là où il en était. Retourne (ok, message_erreur).
+    """
+    return _with_fallback('managed_save', domain_name, default=(False, 'libvirt indisponible'))
+
+
+def set_domain_memory(domain_name: str, kib: int) -> tuple:
+    """
+    Cible du ballon mémoire d'un domaine actif (KiB, au plus son maximum) : l'invité
+    rend ou reprend la différence. Retourne (ok, message_erreur).
+    """
+    return _with_fallback('set_memory', domain_name, int(kib), default=(False, 'libvirt indisponible'))
+
+
+def set_memory_stats_period(domain_name: str, seconds: int) -> tuple:
+    """
+    Période de collecte des statistiques mémoire de l'invité (pilote virtio-balloon) :
+    sans elle, seules balloon.current/maximum sont disponibles. Retourne (ok, message_erreur).
+    """
+    return _with_fallback('set_memory_stats_period', domain_name, int(seconds),
+                          default=(False, 'libvirt indisponible'))
+
+
+def set_domain_memory_config(domain_name: str, maximum_kib: int, kib: int) -> tuple:
+    """
+    Mémoire de la définition persistante (prochain démarrage) : maximum et mémoire
+    actuelle, en KiB. Retourne (ok, message_erreur).
+    """
+    return _with_fallback('set_memory_config', domain_name, int(maximum_kib), int(kib),
+                          default=(False, 'libvirt indisponible'))
+
+
+def get_disk_capacity(domain_name: str, disk: str):
+    """Capacité (octets) d'un disque du domaine ('vda'), ou None."""
+    return _with_fallback('disk_capacity', domain_name, disk, default=None)
+
+
+def resize_disk(domain_name: str, disk: str, size_bytes: int) -> tuple:
+    """Agrandit à chaud le disque d'un domaine actif (virDomainBlockResize). Retourne (ok, message_erreur)."""
+    return _with_fallback('block_resize', domain_name, disk, int(size_bytes), default=(False, 'libvirt indisponible'))
+
+
+def resize_volume(path: str, size_bytes: int) -> tuple:
+    """Agrandit un volume de stockage (domaine arrêté), désigné par son chemin. Retourne (ok, message_erreur)."""
+    return _with_fallback('volume_resize', path, int(size_bytes), default=(False, 'libvirt indisponible'))
+
+
+def undefine_domain(domain_name: str, remove_storage: bool = True) -> tuple:
+    """Arrête, supprime la définition du domaine et (optionnellement) ses volumes. Retourne (ok, message_erreur)."""
+    return _with_fallback('undefine', domain_name, remove_storage, default=(False, 'libvirt indisponible'))
+
+
+def get_all_domain_stats(groups=('state',), active_only=False) -> dict:
+    """
+    Statistiques de tous les domaines en un seul appel : {nom_domaine: {'balloon.current': ..., ...}}.
+    groups: clés de STATS_GROUPS ('state', 'cpu-total', 'balloon', 'vcpu', 'interface', 'block').
+    """
+    return _with_fallback('all_stats', tuple(groups), active_only, default={})
+
+
+def get_node_info():
+    """Ressources de l'hôte : {'memory_mb', 'cpus'}, ou None si indisponible."""
+    return _with_fallback('node_info', default=None)
+
+
+def network_exists(network_name: str) -> bool:
+    """Vérifie qu'un réseau libvirt est défini."""
+    return bool(_with_fallback('network_exists', network_name, default=False))
+
+
+def create_network(network_xml: str) -> bool:
+    """Définit, démarre et met en autostart un réseau libvirt."""
+    return bool(_with_fallback('create_network', network_xml, default=False))
+
+
+def guest_agent_command(domain_name: str, command: dict, timeout: int = 10):
+    """Envoie une commande à l'agent invité (canal org.qemu.guest_agent.0). Retourne 'return', ou None."""
+    reply = _with_fallback('agent_command', domain_name, json.dumps(command), timeout, default=None)
+    return reply.get('return') if reply else None
+
+
+def guest_exec(domain_name: str, path: str, args=(), input_data: str = None, timeout: int = 300) -> tuple:
+    """
+    Exécute une commande dans l'invité via l'agent (guest-exec) et attend sa fin.
+    `input_data` est passé sur l'entrée standard. Retourne (code_sortie, sortie) ; code None si échec.
+    """
+    arguments = {'path': path, 'arg': list(args), 'capture-output': True}
+    if input_data is not None:
+        arguments['input-data'] = base64.b64encode(input_data.encode()).decode()
+    started = guest_agent_command(domain_name, {'execute': 'guest-exec', 'arguments': arguments})
+    if not started:
+        return None, "agent invité injoignable"
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = guest_agent_command(domain_name, {'execute': 'guest-exec-status',
+                                                   'arguments': {'pid': started['pid']}})
+        if status is None:
+            return None, "agent invité injoignable"
+        if status.get('exited'):
+            output = ''.join(
+                base64.b64decode(status.get(key, '')).decode(errors='replace') for key in ('out-data', 'err-data')
+            )
+            return status.get('exitcode'), output
+        time.sleep(1)
+    return None, f"délai dépassé ({timeout}s)"
@@ -0,0 +1,80 @@
+"""
+Backend "native" du cycle de vie des VMs déjà créées : appels libvirt directs
+au lieu de `vagrant up` / `vagrant halt` / `vagrant destroy`, sans démarrage
+de Ruby ni chargement des plugins Vagrant.
+
+Le backend se choisit par VM (colonne `backend` de vm_store, importée de la
+ligne "Backend: native" / "Backend: vagrant" de vm_info.txt ; défaut : vagrant).
+La création initiale passe toujours par Vagrant (ou par une VM du pool préchauffé).
+"""
+from pathlib import Path
+import time
+import config
+import libvirt_conn
+import vm_store
+
+BACKENDS = ('vagrant', 'native')
+DEFAULT_BACKEND = config.LIFECYCLE_BACKEND if config.LIFECYCLE_BACKEND in BACKENDS else 'vagrant'
+SHUTDOWN_TIMEOUT = config.NATIVE_SHUTDOWN_TIMEOUT
+SHUTDOWN_POLL_INTERVAL = 1.0
+
+
+def read_backend(vm_path):
+    """Backend de cycle de vie de la VM (base de métadonnées, sinon vm_info.txt ; 'vagrant' par défaut)."""
+    vm = vm_store.for_path(vm_path)
+    if vm is not None:
+        return vm['backend']
+    try:
+        with open(Path(vm_path) / "vm_info.txt") as f:
+            for line in f:
+                key, _, value = line.partition(':')
+                if key.strip() == 'Backend' and value.strip() in BACKENDS:
+                    return value.strip()
+    except OSError:
+        pass
+    return 'vagrant'
+
+
+def start(domain_name, log):
+    """Démarre le domaine. Retourne (ok, message_erreur)."""
+    log(f"libvirt: démarrage de {domain_name}")
+    return libvirt_conn.start_domain(domain_name)
+
+
+def stop(domain_name, log, timeout=None):
+    """
+    Arrêt ACPI puis, si l'invité ne s'est pas éteint dans `timeout` secondes, arrêt forcé.
+    Retourne (ok, forcé, message_erreur).
+    """
+    timeout = timeout or SHUTDOWN_TIMEOUT
+    log(f"libvirt: arrêt ACPI de {domain_name}")
+    ok, error = libvirt_conn.shutdown_domain(domain_name)
+    if ok:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if libvirt_conn.get_domain_state(domain_name) in ('shut off', 'unknown'):
+                return True, False, ''
+            time.sleep(SHUTDOWN_POLL_INTERVAL)
+        log(f"Pas d'arrêt après {timeout}s, arrêt forcé...")
+    else:
+        log(f"Arrêt ACPI refusé ({error}), arrêt forcé...")
+    ok, error = libvirt_conn.destroy_domain(domain_name)
+    return ok, True, error
+
+
+def reset(domain_name, log):
+    """Réinitialisation matérielle du domaine actif. Retourne (ok, message_erreur)."""
+    log(f"libvirt: réinitialisation de {domain_name}")
+    return libvirt_conn.reset_domain(domain_name)
+
+
+def suspend(domain_name, log):
+    """Sauvegarde gérée du domaine (reprise au prochain démarrage). Retourne (ok, message_erreur)."""
+    log(f"libvirt: sauvegarde gérée de {domain_name}")
+    return libvirt_conn.managed_save_domain(domain_name)
+
+
+def delete(domain_name, log):
+    """Arrêt forcé, suppression de la définition et des volumes du domaine. Retourne (ok, message_erreur)."""
+    log(f"libvirt: suppression de {domain_name} et de ses volumes")
+    return libvirt_conn.undefine_domain(domain_name, remove_storage=True)
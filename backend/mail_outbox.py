@@ -0,0 +1,257 @@
+"""
+File d'envoi des emails (table SQLite `mail_outbox`, partagée entre workers).
+
+Les requêtes HTTP ne font que mettre le message en file (enqueue) et répondent
+aussitôt. Un seul worker (leader "mail-outbox") vide la file :
+- une connexion SMTP réutilisée d'un message à l'autre (vérifiée par NOOP,
+  refermée après MAIL_SMTP_IDLE_TIMEOUT secondes d'inactivité) ;
+- en cas d'échec temporaire, nouvel essai avec attente exponentielle (MAIL_RETRY_BASE,
+  plafonnée à MAIL_RETRY_MAX), abandon (état 'failed') après MAIL_MAX_ATTEMPTS essais ;
+  un refus définitif du relais (code 5xx) passe le message en 'failed' aussitôt ;
+- résumé optionnel : si MAIL_DIGEST_INTERVAL > 0, les messages "regroupables"
+  (demandes de capacité aux admins) partent en un seul email par destinataires,
+  au plus une fois par intervalle.
+"""
+from email.message import EmailMessage
+import json
+import smtplib
+import ssl
+import threading
+import time
+import config
+import coordination
+import db
+
+POLL_INTERVAL = config.MAIL_OUTBOX_POLL_INTERVAL
+MAX_ATTEMPTS = config.MAIL_MAX_ATTEMPTS
+RETRY_BASE = config.MAIL_RETRY_BASE
+RETRY_MAX = config.MAIL_RETRY_MAX
+DIGEST_INTERVAL = config.MAIL_DIGEST_INTERVAL
+SMTP_IDLE_TIMEOUT = config.MAIL_SMTP_IDLE_TIMEOUT
+SMTP_TIMEOUT = 30
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS mail_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    recipients TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    digest INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT NOT NULL DEFAULT '',
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_mail_outbox_state ON mail_outbox(state, next_attempt_at);
+""")
+
+_wakeup = threading.Event()
+
+
+def _smtp_settings():
+    return {
+        'host': getattr(config, 'SMTP_HOST', None),
+        'port': int(getattr(config, 'SMTP_PORT', 587)),
+        'user': getattr(config, 'SMTP_USER', None),
+        'password': getattr(config, 'SMTP_PASSWORD', None),
+        'sender': getattr(config, 'SMTP_FROM', None),
+        'use_tls': bool(getattr(config, 'SMTP_USE_TLS', True)),
+        'use_ssl': bool(getattr(config, 'SMTP_USE_SSL', False)),
+    }
+
+
+# -------------------- Mise en file --------------------
+def enqueue(subject, body, recipients=None, digest=False):
+    """
+    Met un email en file et retourne son identifiant (aucun accès réseau).
+    recipients: liste d'adresses (ADMIN_EMAILS par défaut) ; digest: regroupable dans un résumé.
+    """
+    recipients = list(recipients if recipients is not None else getattr(config, 'ADMIN_EMAILS', []))
+    if not recipients:
+        raise ValueError("Aucun destinataire (ADMIN_EMAILS vide).")
+    now = time.time()
+    cur = db.get_db().execute(
+        "INSERT INTO mail_outbox (recipients, subject, body, digest, next_attempt_at, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (json.dumps(sorted(recipients)), subject, body, int(digest), now, now)
+    )
+    _wakeup.set()
+    return cur.lastrowid
+
+
+def status(limit=20):
+    """Nombre de messages par état, âge du plus ancien en attente et derniers échecs."""
+    conn = db.get_db()
+    counts = {row['state']: row['n'] for row in
+              conn.execute("SELECT state, COUNT(*) AS n FROM mail_outbox GROUP BY state")}
+    oldest = conn.execute("SELECT MIN(created_at) AS t FROM mail_outbox WHERE state = 'queued'").fetchone()['t']
+    errors = conn.execute(
+        "SELECT id, subject, state, attempts, next_attempt_at, last_error FROM mail_outbox "
+        "WHERE last_error != '' AND state != 'sent' ORDER BY id DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return {
+        'counts': {state: counts.get(state, 0) for state in ('queued', 'sent', 'failed')},
+        'oldest_queued_age': round(time.time() - oldest, 1) if oldest else None,
+        'digest_interval': DIGEST_INTERVAL,
+        'errors': [dict(row) for row in errors],
+    }
+
+
+# -------------------- Connexion SMTP réutilisée --------------------
+class _Connection:
+    """Connexion SMTP ouverte à la demande et gardée entre deux messages."""
+
+    def __init__(self):
+        self.smtp = None
+        self.last_used = 0.0
+        self.opened = 0  # nombre de connexions ouvertes (statistiques)
+
+    def get(self):
+        if self.smtp is not None:
+            try:
+                if self.smtp.noop()[0] == 250:
+                    return self.smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.close()
+        settings = _smtp_settings()
+        if not settings['host'] or not settings['sender']:
+            raise RuntimeError("configuration SMTP incomplète (voir config.py)")
+        if settings['use_ssl']:
+            smtp = smtplib.SMTP_SSL(settings['host'], settings['port'],
+                                    context=ssl.create_default_context(), timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(settings['host'], settings['port'], timeout=SMTP_TIMEOUT)
+            smtp.ehlo()
+            if settings['use_tls']:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+        if settings['user'] and settings['password']:
+            smtp.login(settings['user'], settings['password'])
+        self.smtp = smtp
+        self.opened += 1
+        return smtp
+
+    def send(self, recipients, subject, body):
+        msg = EmailMessage()
+        msg['Subject'] = subject
+        msg['From'] = _smtp_settings()['sender']
+        msg['To'] = ', '.join(recipients)
+        msg.set_content(body)
+        try:
+            self.get().send_message(msg)
+        except Exception:
+            self.close()  # état du dialogue SMTP incertain : nouvelle connexion au prochain envoi
+            raise
+        self.last_used = time.time()
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.time() - self.last_used > SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+
+# -------------------- Envoi --------------------
+def _retry_delay(attempts):
+    return min(RETRY_MAX, RETRY_BASE * 2 ** (attempts - 1))
+
+
+def _mark_sent(ids):
+    db.get_db().execute(
+        f"UPDATE mail_outbox SET state = 'sent', sent_at = ?, attempts = attempts + 1, last_error = '' "
+        f"WHERE id IN ({', '.join('?' for _ in ids)})", (time.time(), *ids)
+    )
+
+
+def is_permanent(error):
+    """Refus définitif du relais (5xx : destinataire ou expéditeur rejeté...) : inutile de réessayer."""
+    if isinstance(error, smtplib.SMTPAuthenticationError):
+        return False  # configuration à corriger, les messages repartiront ensuite
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(500 <= code < 600 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and 500 <= error.smtp_code < 600
+
+
+def _mark_failed(rows, error):
+    permanent = is_permanent(error)
+    with db.transaction() as conn:
+        for row in rows:
+            attempts = row['attempts'] + 1
+            state = 'failed' if permanent or attempts >= MAX_ATTEMPTS else 'queued'
+            conn.execute(
+                "UPDATE mail_outbox SET state = ?, attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                (state, attempts, time.time() + _retry_delay(attempts), str(error)[:1000], row['id'])
+            )
+    print(f"[mail_outbox] Envoi {'refusé' if permanent else 'échoué'} ({len(rows)} message(s)): {error}")
+
+
+def _digest(rows):
+    """(sujet, corps) d'un résumé regroupant plusieurs messages."""
+    subject = f"[VM Request] {len(rows)} demande(s) en attente"
+    parts = [f"{len(rows)} message(s) regroupé(s) depuis le dernier envoi.\n"]
+    for row in rows:
+        parts.append(f"=== {row['subject']} ===\n{row['body']}")
+    return subject, '\n'.join(parts)
+
+
+def _batches(now):
+    """
+    Lots à envoyer maintenant : [(lignes, destinataires, sujet, corps)].
+    Messages individuels dus, puis résumés dont le plus ancien message a attendu DIGEST_INTERVAL.
+    """
+    rows = db.get_db().execute(
+        "SELECT * FROM mail_outbox WHERE state = 'queued' AND next_attempt_at <= ? ORDER BY id", (now,)
+    ).fetchall()
+    batches, digests = [], {}
+    for row in rows:
+        if DIGEST_INTERVAL > 0 and row['digest']:
+            digests.setdefault(row['recipients'], []).append(row)
+        else:
+            batches.append(([row], json.loads(row['recipients']), row['subject'], row['body']))
+    for recipients, group in digests.items():
+        if now - min(r['created_at'] for r in group) < DIGEST_INTERVAL:
+            continue
+        subject, body = (group[0]['subject'], group[0]['body']) if len(group) == 1 else _digest(group)
+        batches.append((group, json.loads(recipients), subject, body))
+    return batches
+
+
+def drain(connection):
+    """Envoie tous les messages dus sur `connection` ; retourne le nombre de messages envoyés."""
+    sent = 0
+    for rows, recipients, subject, body in _batches(time.time()):
+        try:
+            connection.send(recipients, subject, body)
+        except Exception as e:
+            _mark_failed(rows, e)
+            continue
+        _mark_sent([row['id'] for row in rows])
+        sent += len(rows)
+    return sent
+
+
+def _sender():
+    connection = _Connection()
+    while True:
+        try:
+            drain(connection)
+            connection.close_if_idle()
+        except Exception as e:
+            print(f"[mail_outbox] Expéditeur: {e}")
+        # Réveil immédiat pour les messages de ce worker ; les autres sont vus au prochain passage
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+
+
+def start():
+    """Démarre l'expéditeur dans le worker élu (les autres ne font que mettre en file)."""
+    return coordination.run_as_leader('mail-outbox', _sender)
@@ -1,21 +1,40 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, g, render_template, jsonify, request
 from flask_ldap3_login import LDAP3LoginManager
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from pathlib import Path
 import datetime
+import json
+import time
 import subprocess
 import shutil
 import os
 import re
-import signal
-import socket
 import sys
-import xml.etree.ElementTree as ET
+import threading
 import config
-import csv
-import smtplib
-import ssl
-from email.message import EmailMessage
+import libvirt_conn
+import vm_state_cache
+import jobs
+import scheduler
+import provisioning
+import golden_images
+import warm_pool
+import environment
+import lifecycle
+import vnc_proxies
+import vnc_gateway
+import vm_inventory
+import vm_store
+import mail_outbox
+import capacity_requests
+import telemetry
+import metrics
+import commands
+import idle_reaper
+import memory_balancer
+import vm_resize
+import bulk_ops
+import lab_sessions
 
 # Éviter l'avertissement du plugin vagrant-winrm (inutile)
 os.environ.setdefault('VAGRANT_IGNORE_WINRM_PLUGIN', '1')
@@ -36,6 +55,7 @@ if not os.environ.get('TMPDIR') and os.path.isdir('/data/tmp'):
 BASE_DIR = Path(__file__).resolve().parent.parent
 TEMPLATE_DIR = BASE_DIR / 'frontend'
 STATIC_DIR = TEMPLATE_DIR / 'static'
+VMS_BASE_DIR = Path(config.VMS_DIR)
 
 app = Flask(
     __name__,
@@ -87,13 +107,31 @@ def load_user(user_id):
 def save_user(dn, username, data, memberships):
     return User(dn, username, data)
 
+# -------------------- Mesure des requêtes (métriques) --------------------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    commands.begin(f"{request.method} {request.path}")
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(route, request.method, response.status_code, time.perf_counter() - started)
+    entries = commands.end()
+    if config.COMMAND_TRACE_HEADER or (request.headers.get('X-Debug-Trace') and current_user.is_authenticated
+                                       and is_admin(current_user.username)):
+        response.headers['X-Debug-Trace'] = commands.format_trace(entries) or '-'
+    return response
+
 # -------------------- Fonctions helper pour isolation --------------------
 def get_user_vm_dir(username):
     """
     Retourne le dossier des VMs pour un utilisateur donné.
     Exemple: student_vms/alice/
     """
-    base = Path(__file__).parent.parent / 'student_vms' / username
+    base = VMS_BASE_DIR / username
     base.mkdir(parents=True, exist_ok=True)
     return base
 
@@ -110,70 +148,36 @@ def check_vm_ownership(username, vm_name):
     Vérifie si l'utilisateur a le droit d'accéder à cette VM.
     Retourne (True, vm_path) si autorisé, (False, None) sinon.
     """
-    if is_admin(username):
-        # Admin : chercher dans tous les sous-dossiers
-        base = Path(__file__).parent.parent / 'student_vms'
-        for user_dir in base.iterdir():
-            if user_dir.is_dir():
-                vm_path = user_dir / vm_name
-                if vm_path.exists():
-                    return True, vm_path
-        return False, None
-    else:
-        # Utilisateur normal : uniquement son dossier
-        vm_path = get_user_vm_dir(username) / vm_name
-        if vm_path.exists():
-            return True, vm_path
+    # Recherche indexée dans la base (admin : tous propriétaires, sinon uniquement les siennes)
+    vm = vm_store.find(vm_name) if is_admin(username) else vm_store.get(username, vm_name)
+    if vm is None:
         return False, None
+    return True, Path(vm['path'])
 
 def get_vm_state(vm_name):
     """
     Retourne l'état d'une VM : 'running', 'shut off', 'paused', etc.
     Retourne 'unknown' si introuvable.
     """
-    try:
-        domain_name = f"{vm_name}_default"
-        result = subprocess.run(
-            ['virsh', '-c', 'qemu:///system', 'domstate', domain_name],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        state = result.stdout.strip().lower()
-        
-        # Normaliser l'état (français → anglais)
-        if 'exécution' in state or 'execution' in state:
-            return 'running'
-        elif 'arrêt' in state or 'shut' in state:
-            return 'shut off'
-        elif 'pause' in state or 'paused' in state:
-            return 'paused'
-        else:
-            return state
-    except subprocess.CalledProcessError:
-        return 'unknown'
+    return libvirt_conn.get_domain_state(f"{vm_name}_default")
+
+def vm_owner(vm_path):
+    """Propriétaire d'une VM (<VMS_BASE_DIR>/<propriétaire>/<vm>) : les tâches sont sérialisées par VM sur son nom."""
+    return Path(vm_path).parent.name
+
+def vm_domain_name(vm_name, vm_path=None):
+    """
+    Nom du domaine libvirt d'une VM : "<vm>_default" (vagrant-libvirt), sauf pour
+    les VMs issues du pool préchauffé qui gardent le domaine de leur démarrage.
+    """
+    return (vm_path and warm_pool.domain_for(vm_path)) or f"{vm_name}_default"
 
 def ensure_box_installed(box_name, provider="libvirt"):
     """
-    Vérifie si une box Vagrant est installée.
+    Vérifie si une box Vagrant est installée (liste des box en cache, cf. environment).
     Retourne True si présente, False sinon.
     """
-    try:
-        result = subprocess.run(
-            ['vagrant', 'box', 'list'],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        # Chercher la box avec le provider spécifié
-        # Format: "generic/debian12                           (libvirt, 4.3.12, (amd64))"
-        # On vérifie ligne par ligne pour gérer les espaces multiples
-        for line in result.stdout.splitlines():
-            if line.startswith(box_name) and f"({provider}," in line:
-                return True
-        return False
-    except subprocess.CalledProcessError:
-        return False
+    return environment.box_installed(box_name, provider)
 
 # -------------------- Page principale --------------------
 @app.route('/')
@@ -217,11 +221,7 @@ def api_cowsay():
     """Easter egg: exécute cowsay avec le message."""
     try:
         # Vérifier si cowsay est installé
-        result = subprocess.run(
-            ['which', 'cowsay'],
-            capture_output=True,
-            text=True
-        )
+        result = commands.run(['which', 'cowsay'])
         
         if result.returncode != 0:
             # cowsay n'est pas installé, renvoyer une version ASCII art simple
@@ -237,12 +237,8 @@ def api_cowsay():
 """
         else:
             # cowsay est installé, l'exécuter
-            result = subprocess.run(
-                ['cowsay', 'Réalisé par Edib'],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            result = commands.run(['cowsay', 'Réalisé par Edib'])
+            result.check_returncode()
             output = result.stdout
         
         return jsonify({'output': output})
@@ -264,39 +260,72 @@ def api_cowsay():
 @app.route('/api/list_vms')
 @login_required
 def list_vms():
+    """
+    Liste des VMs visibles (toutes pour un admin), depuis l'inventaire partagé.
+    ETag : une liste inchangée depuis la dernière requête (If-None-Match) répond 304.
+    """
     username = current_user.username
-    vms = []
-    
-    if is_admin(username):
-        # Admin voit TOUTES les VMs de tous les utilisateurs
-        base = Path(__file__).parent.parent / 'student_vms'
-        if base.exists():
-            for user_dir in sorted(base.iterdir()):
-                if user_dir.is_dir():
-                    for vm_dir in sorted(user_dir.iterdir()):
-                        if vm_dir.is_dir():
-                            vm_info = {
-                                'name': vm_dir.name,
-                                'owner': user_dir.name,
-                                'path': str(vm_dir),
-                                'state': get_vm_state(vm_dir.name)
-                            }
-                            vms.append(vm_info)
+    admin = is_admin(username)
+    if not admin:
+        get_user_vm_dir(username)  # crée le dossier de l'utilisateur au premier accès
+
+    snapshot = vm_inventory.current(VMS_BASE_DIR)
+    tag = vm_inventory.etag(snapshot, username)
+    if request.if_none_match.contains(tag):
+        response = Response(status=304)
     else:
-        # Utilisateur normal voit uniquement SES VMs
-        user_dir = get_user_vm_dir(username)
-        if user_dir.exists():
-            for vm_dir in sorted(user_dir.iterdir()):
-                if vm_dir.is_dir():
-                    vm_info = {
-                        'name': vm_dir.name,
-                        'owner': username,
-                        'path': str(vm_dir),
-                        'state': get_vm_state(vm_dir.name)
-                    }
-                    vms.append(vm_info)
-    
-    return jsonify({'vms': vms, 'user': username, 'is_admin': is_admin(username)})
+        vms = list(vm_inventory.visible(snapshot, username, admin).values())
+        response = jsonify({'vms': vms, 'user': username, 'is_admin': admin})
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Chaque flux occupe un thread gunicorn : au-delà, 503 et le navigateur repasse à l'interrogation (ETag)
+_vm_streams = threading.BoundedSemaphore(config.VM_STREAM_MAX_CLIENTS)
+
+@app.route('/api/vms/stream')
+@login_required
+def stream_vms():
+    """
+    Flux SSE de la liste des VMs : événement 'snapshot' (liste complète) à la connexion,
+    puis 'delta' ({'changed': [VMs nouvelles ou modifiées], 'removed': [dossiers]}) à chaque changement.
+    Le flux se termine après VM_STREAM_MAX_DURATION secondes (EventSource se reconnecte).
+    Au plus VM_STREAM_MAX_CLIENTS flux par worker : au-delà, 503 (repli sur /api/list_vms).
+    """
+    if not _vm_streams.acquire(blocking=False):
+        return jsonify({'success': False, 'message': 'Trop de flux ouverts, utilisez /api/list_vms.'}), 503
+    username = current_user.username
+    admin = is_admin(username)
+    base = VMS_BASE_DIR
+
+    def events():
+        snapshot = vm_inventory.current(base)
+        sent = vm_inventory.visible(snapshot, username, admin)
+        yield "retry: 3000\n\n"
+        yield _sse('snapshot', {'version': snapshot['version'], 'vms': list(sent.values()),
+                                'user': username, 'is_admin': admin})
+        deadline = time.time() + config.VM_STREAM_MAX_DURATION
+        while time.time() < deadline:
+            latest = vm_inventory.wait_for_change(base, snapshot, config.VM_STREAM_KEEPALIVE)
+            if latest is None:
+                yield ": keepalive\n\n"
+                continue
+            snapshot = latest
+            vms = vm_inventory.visible(snapshot, username, admin)
+            changed, removed = vm_inventory.diff(sent, vms)
+            if changed or removed:
+                yield _sse('delta', {'version': snapshot['version'], 'changed': changed, 'removed': removed})
+            sent = vms
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # pas de mise en tampon par nginx
+    })
+    response.call_on_close(_vm_streams.release)
+    return response
 
 # -------------------- Créer une VM --------------------
 @app.route('/api/create_vm', methods=['POST'])
@@ -317,13 +346,6 @@ def create_vm():
         if len(root_password) < 6:
             return jsonify({'message': 'Le mot de passe root doit contenir au moins 6 caractères'}), 400
 
-    # Snippet pour définir le mot de passe root (Debian uniquement)
-    root_pass_snippet = ""
-    if os_name != "windows" and root_password:
-        root_pass_snippet = f'''echo "root:{root_password}" | chpasswd
-usermod -U root || true
-'''
-
     # Validation basique
     if not vm_username or not vm_password:
         return jsonify({'message': 'Nom d\'utilisateur et mot de passe requis'}), 400
@@ -346,7 +368,7 @@ usermod -U root || true
     # Nom de VM normalisé
     vm_name = re.sub(r'[^A-Za-z0-9._-]', '-', vm_name)[:64] if vm_name else f"vm-{int(datetime.datetime.utcnow().timestamp())}"
 
-    base = Path(__file__).parent.parent / 'student_vms'
+    base = VMS_BASE_DIR
     base.mkdir(parents=True, exist_ok=True)
     vmdir = base / vm_name
 
@@ -354,7 +376,7 @@ usermod -U root || true
     base = get_user_vm_dir(current_user.username)
     vmdir = base / vm_name
 
-    if vmdir.exists():
+    if vmdir.exists() or vm_store.get(current_user.username, vm_name):
         return jsonify({'message': f'Nom de VM déjà utilisé : {vm_name}'}), 400
 
     # Vérifs provider + réseau avant toute création
@@ -362,282 +384,46 @@ usermod -U root || true
         return jsonify({'message': "Plugin vagrant-libvirt manquant. Installez-le:\n  env VAGRANT_HOME=/data/vagrant.d vagrant plugin install vagrant-libvirt"}), 500
     ensure_libvirt_network()
 
+    # Modèle plus gros que ce que l'hôte peut admettre : refus immédiat plutôt qu'une tâche jamais admise
+    template = provisioning.get_template(os_name, vm_type)
+    capacity = scheduler.capacity_error(template['memory'], template['cpus'])
+    if capacity:
+        return jsonify({'message': f'Création impossible : {capacity}'}), 400
+
+    # Pool préchauffé : une VM déjà démarrée et provisionnée est attribuée tout de suite
+    pooled = warm_pool.claim(provisioning.template_name(os_name, vm_type), vmdir, current_user.username)
+
     try:
-        vmdir.mkdir()
+        if not pooled:
+            vmdir.mkdir()
 
         # Choix de la box et ressources
-        if os_name == "debian":
-            box_name = "generic/debian12"
-            if vm_type == "client":
-                memory, cpus, serial_console = 4096, 2, False
-                # Provisioning script pour Debian (client)
-                provision_script = f"""
-export DEBIAN_FRONTEND=noninteractive
-apt-get update
-
-# Préselectionner LightDM comme display manager (évite l'invite non-interactive)
-echo "lightdm shared/default-x-display-manager select lightdm" | debconf-set-selections
-
-# Paquets clavier/locale
-apt-get install -y kbd console-setup keyboard-configuration locales
-
-# Locale FR
-sed -i 's/# fr_FR.UTF-8 UTF-8/fr_FR.UTF-8 UTF-8/' /etc/locale.gen
-locale-gen
-update-locale LANG=fr_FR.UTF-8
-
-# Clavier FR (console + X11)
-cat > /etc/default/keyboard << 'EOF'
-XKBMODEL="pc105"
-XKBLAYOUT="fr"
-XKBVARIANT=""
-XKBOPTIONS=""
-BACKSPACE="guess"
-EOF
-dpkg-reconfigure -f noninteractive keyboard-configuration || true
-setupcon --force --save || true
-loadkeys fr 2>/dev/null || true
-mkdir -p /etc/X11/xorg.conf.d
-cat > /etc/X11/xorg.conf.d/00-keyboard.conf << 'EOF'
-Section "InputClass"
-    Identifier "system-keyboard"
-    MatchIsKeyboard "on"
-    Option "XkbModel" "pc105"
-    Option "XkbLayout" "fr"
-    Option "XkbVariant" ""
-    Option "XkbOptions" ""
-EndSection
-EOF
-
-# Bureau XFCE + LightDM + Xorg (+ greeter) + drivers utiles
-apt-get install -y xorg dbus-x11 policykit-1 \
-    lightdm lightdm-gtk-greeter lightdm-gtk-greeter-settings \
-    xfce4 xfce4-goodies \
-    xserver-xorg-input-libinput xserver-xorg-video-qxl \
-    network-manager-gnome fonts-dejavu
-
-# S'assurer que LightDM est le display manager par défaut
-echo "/usr/sbin/lightdm" > /etc/X11/default-display-manager
-
-# Démarrage graphique par défaut et démarrage immédiat
-systemctl set-default graphical.target
-systemctl enable lightdm
-systemctl restart lightdm || systemctl start display-manager || true
-
-# Utilisateur
-useradd -m -s /bin/bash {vm_username} || true
-echo "{vm_username}:{vm_password}" | chpasswd
-usermod -aG sudo {vm_username}
-mkdir -p /home/{vm_username}
-echo "startxfce4" > /home/{vm_username}/.xsession
-chown -R {vm_username}:{vm_username} /home/{vm_username}
-
-# Autologin LightDM (optionnel)
-mkdir -p /etc/lightdm/lightdm.conf.d
-cat > /etc/lightdm/lightdm.conf.d/50-autologin.conf << 'EOF'
-[Seat:*]
-autologin-user={vm_username}
-autologin-user-timeout=0
-EOF
-
-# Mot de passe root obligatoire (déjà validé côté backend)
-{root_pass_snippet}
-
-echo "✅ XFCE + LightDM installés et démarrés (mode graphique)."
-                """.strip()
-                provision_script = provision_script.replace("{vm_username}", vm_username).replace("{vm_password}", vm_password).replace("{root_password}", root_password).replace("{root_pass_snippet}", root_pass_snippet)
-            else:
-                memory, cpus, serial_console = 2048, 2, True
-                # Provisioning script pour Debian (serveur)
-                provision_script = f"""
-export DEBIAN_FRONTEND=noninteractive
-apt-get update
-apt-get install -y kbd console-setup keyboard-configuration locales
-
-# Locale FR
-sed -i 's/# fr_FR.UTF-8 UTF-8/fr_FR.UTF-8 UTF-8/' /etc/locale.gen
-locale-gen
-update-locale LANG=fr_FR.UTF-8
-
-# Clavier FR (console)
-cat > /etc/default/keyboard << 'EOF'
-XKBMODEL="pc105"
-XKBLAYOUT="fr"
-XKBVARIANT=""
-XKBOPTIONS=""
-BACKSPACE="guess"
-EOF
-
-debconf-set-selections << 'DEB'
-keyboard-configuration keyboard-configuration/layoutcode string fr
-keyboard-configuration keyboard-configuration/modelcode string pc105
-DEB
-dpkg-reconfigure -f noninteractive keyboard-configuration
-setupcon --force --save || true
-loadkeys fr 2>/dev/null || true
-udevadm trigger --subsystem-match=input --action=change || true
-
-# Exemple d’injection dans le provisioning Debian (client/serveur)
-{root_pass_snippet}# mot de passe root défini
-# utilisateur
-useradd -m -s /bin/bash {vm_username} || true
-echo "{vm_username}:{vm_password}" | chpasswd
-usermod -aG sudo {vm_username}
-
-# Console série
-systemctl enable serial-getty@ttyS0.service
-systemctl start serial-getty@ttyS0.service
-echo "ttyS0" >> /etc/securetty
-
-echo "✅ Clavier FR activé (console)"
-                """.strip()
-                provision_script = provision_script.replace("{vm_username}", vm_username).replace("{vm_password}", vm_password).replace("{root_password}", root_password).replace("{root_pass_snippet}", root_pass_snippet)
-
-        elif os_name == "windows":
-            # TEMP: forcer Server 2022 pour client/serveur (Win10/11 trop lourdes / indisponibles)
-            box_name = "peru/windows-server-2022-standard-x64-eval"
-            memory, cpus, serial_console = 6144, 2, False
-            provision_script = f"""
-# Configuration Windows - Clavier AZERTY uniquement
-# Interface reste en anglais pour eviter redemarrage
-
-Write-Host "=== Configuration Windows ==="
-
-# 1. Desactiver la complexite des mots de passe
-Write-Host "Desactivation complexite mots de passe..."
-secedit /export /cfg C:\\secpol.cfg | Out-Null
-(Get-Content C:\\secpol.cfg).replace("PasswordComplexity = 1", "PasswordComplexity = 0") | Out-File C:\\secpol.cfg
-secedit /configure /db C:\\windows\\security\\local.sdb /cfg C:\\secpol.cfg /areas SECURITYPOLICY | Out-Null
-Remove-Item -Force C:\\secpol.cfg -ErrorAction SilentlyContinue
-
-# 2. Configuration clavier AZERTY SYSTEME (pour toute la VM)
-Write-Host "Configuration clavier AZERTY systeme..."
-
-# METHODE PRINCIPALE: Forcer le clavier par defaut au niveau systeme
-# Cette commande force AZERTY pour TOUS les utilisateurs (y compris ecran de connexion)
-Set-WinDefaultInputMethodOverride -InputTip "040c:0000040c"
-
-# Configuration culture/region
-Set-Culture fr-FR -ErrorAction SilentlyContinue
-Set-WinHomeLocation -GeoId 84 -ErrorAction SilentlyContinue
-Set-TimeZone -Id "Romance Standard Time" -ErrorAction SilentlyContinue
-
-# Monter le registre HKU
-$null = New-PSDrive -Name HKU -PSProvider Registry -Root HKEY_USERS -ErrorAction SilentlyContinue
-
-# Configuration registre .DEFAULT (ecran de connexion et nouveaux comptes)
-New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Force -ErrorAction SilentlyContinue | Out-Null
-Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Name "1" -Value "0000040c" -Force
-
-# Substitutes pour forcer AZERTY
-New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Substitutes" -Force -ErrorAction SilentlyContinue | Out-Null
-Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Substitutes" -Name "00000409" -Value "0000040c" -Force
-
-# Configuration machine globale
-New-Item -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Keyboard Layout\\DosKeybCodes" -Force -ErrorAction SilentlyContinue | Out-Null
-Set-ItemProperty -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Keyboard Layout\\DosKeybCodes" -Name "0000040c" -Value "fr" -Force
-
-# Definir AZERTY comme clavier par defaut dans le profil par defaut
-New-Item -Path "HKU:\\.DEFAULT\\Control Panel\\International" -Force -ErrorAction SilentlyContinue | Out-Null
-Set-ItemProperty -Path "HKU:\\.DEFAULT\\Control Panel\\International" -Name "LocaleName" -Value "fr-FR" -Force
-
-# Configuration du clavier au niveau systeme (Apply to all users)
-$LangList = New-WinUserLanguageList fr-FR
-Set-WinUserLanguageList $LangList -Force
-Set-Culture fr-FR
-Set-WinSystemLocale fr-FR
-Set-WinUILanguageOverride fr-FR
-Set-TimeZone -Id "Romance Standard Time"
-
-# Clavier FR pour l'écran de logon
-New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Force | Out-Null
-Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Name "1" -Value "0000040C"
-
-# Définir le mot de passe Administrator (obligatoire)
-$adminPass = ConvertTo-SecureString "{root_password}" -AsPlainText -Force
-Set-LocalUser -Name "Administrator" -Password $adminPass
-
-# Créer l'utilisateur élève si absent et l'ajouter aux admins
-$username = "{vm_username}"
-$password = ConvertTo-SecureString "{vm_password}" -AsPlainText -Force
-
-$userExists = Get-LocalUser -Name $username -ErrorAction SilentlyContinue
-if (-not $userExists) {{
-  New-LocalUser -Name $username -Password $password -FullName "{vm_username}" -PasswordNeverExpires
-  Add-LocalGroupMember -Group "Administrators" -Member $username
-}}
-
-# Activer RDP (utile pour debug)
-Set-ItemProperty -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Terminal Server" -Name "fDenyTSConnections" -Value 0
-Enable-NetFirewallRule -DisplayGroup "Remote Desktop" -ErrorAction SilentlyContinue
-Set-Service -Name TermService -StartupType Automatic
-Start-Service TermService -ErrorAction SilentlyContinue
-
-Write-Host "✅ Windows configuré (FR + Admin + RDP)."
-            """.strip()
-            provision_script = provision_script.replace("{vm_username}", vm_username).replace("{vm_password}", vm_password).replace("{root_password}", root_password).replace("{root_pass_snippet}", root_pass_snippet)
-
+        template = provisioning.get_template(os_name, vm_type)
+        box_name, box_version = template['box'], None
+        memory, cpus, serial_console = template['memory'], template['cpus'], template['serial_console']
+
+        # Golden image disponible : clone lié de l'image, seule l'étape utilisateur reste à faire
+        golden = golden_images.current_image(os_name, vm_type) if config.GOLDEN_IMAGES_ENABLED else None
+        if pooled:
+            box_name, box_version = pooled['box_name'], pooled['box_version']
+            provision_script = provisioning.user_script(os_name, vm_type, vm_username, vm_password, root_password)
+        elif golden:
+            box_name, box_version = golden['box_name'], golden['version']
+            provision_script = provisioning.user_script(os_name, vm_type, vm_username, vm_password, root_password)
         else:
-            box_name, memory, cpus, serial_console, provision_script = "generic/debian12", 2048, 2, False, ""
+            provision_script = provisioning.full_script(os_name, vm_type, vm_username, vm_password, root_password)
 
         # Génération du Vagrantfile
-        vagrantfile_content = f"""# -*- mode: ruby -*-
-# vi: set ft=ruby :
-
-Vagrant.configure("2") do |config|
-  config.vm.box = "{box_name}"
-  config.vm.hostname = "{vm_name}"
-"""
-
-        # Windows: communicator WinRM
-        if os_name == "windows":
-            vagrantfile_content += """
-  config.vm.guest = :windows
-  config.vm.communicator = "winrm"
-  config.winrm.username = "vagrant"
-  config.winrm.password = "vagrant"
-  config.vm.boot_timeout = 1800
-  config.vm.graceful_halt_timeout = 900
-"""
-
-        vagrantfile_content += f"""
-  config.vm.provider :libvirt do |lv|
-    lv.memory = {memory}
-    lv.cpus = {cpus}
-    lv.graphics_type = "vnc"
-    lv.graphics_websocket = -1
-    lv.graphics_ip = "127.0.0.1"
-    lv.video_type = "qxl"
-    lv.keymap = "fr"
-    lv.storage_pool_name = "default"
-    lv.channel :type => 'unix', :target_name => 'org.qemu.guest_agent.0', :target_type => 'virtio'
-"""
-        if serial_console:
-            vagrantfile_content += """    lv.serial :type => "pty", :target_port => "0"
-"""
-        vagrantfile_content += """  end
-
-  config.vm.synced_folder ".", "/vagrant", type: "rsync", rsync__auto: true, disabled: true
-  config.vm.network "private_network", type: "dhcp", libvirt__network_name: "default"
-"""
-
-        # Provisioning
-        if provision_script:
-            if os_name == "windows":
-                script_file = vmdir / "provision.ps1"
-                with open(script_file, "w", encoding="utf-8") as f:
-                    f.write(provision_script)
-                vagrantfile_content += """
-  config.vm.provision "shell", privileged: true, path: "provision.ps1"
-"""
-            else:
-                vagrantfile_content += f"""
-  config.vm.provision "shell", inline: <<-SHELL
-{provision_script}
-  SHELL
-"""
-
-        vagrantfile_content += "end\n"
+        if provision_script and os_name == "windows":
+            with open(vmdir / "provision.ps1", "w", encoding="utf-8") as f:
+                f.write(provision_script)
+        vagrantfile_content = provisioning.render_vagrantfile(
+            box_name, vm_name, memory, cpus,
+            serial_console=serial_console,
+            windows=(os_name == "windows"),
+            provision_script=provision_script,
+            box_version=box_version
+        )
 
         # Écriture des fichiers
         with open(vmdir / "Vagrantfile", "w") as f:
@@ -648,20 +434,39 @@ Vagrant.configure("2") do |config|
             f.write(f"Username: {vm_username}\n")
             f.write(f"OS: {os_name}\n")
             f.write(f"Type: {vm_type}\n")
+            f.write(f"Backend: {lifecycle.DEFAULT_BACKEND}\n")
+            if pooled:
+                f.write(f"Warm pool: {pooled['name']} (domaine {pooled['domain']})\n")
+            elif golden:
+                f.write(f"Golden image: {box_name} v{box_version}\n")
             f.write(f"Created: {datetime.datetime.now()}\n")
+        vm_store.register(vmdir, current_user.username, vm_name, os_name, vm_type, memory, cpus,
+                          lifecycle.DEFAULT_BACKEND)
+
+        # VM du pool : seule la personnalisation (compte, nom d'hôte) reste à faire, via l'agent invité
+        if pooled:
+            warm_pool.stage_personalization(vmdir, os_name, vm_type, vm_name, provision_script)
+            job_id = jobs.submit('pool_claim', vm_name, current_user.username, {
+                'path': str(vmdir), 'domain': pooled['domain'], 'os': os_name, 'vm_type': vm_type,
+            })
+            return jsonify({
+                'success': True,
+                'message': f'VM {vm_name} attribuée depuis le pool préchauffé, personnalisation en cours (tâche #{job_id}).',
+                'vm_name': vm_name,
+                'job_id': job_id,
+                'queue_position': None
+            }), 202
 
         # S’assurer que la box est installée (message clair si échec)
-        if not ensure_box_installed(box_name, provider="libvirt"):
+        if not golden and not ensure_box_installed(box_name, provider="libvirt"):
+            shutil.rmtree(vmdir, ignore_errors=True)
+            vm_store.remove(vmdir)
             return jsonify({'message': f"Box introuvable: {box_name}. Installez-la d'abord:\n  vagrant box add {box_name} --provider libvirt"}), 400
 
-        # Lancement ASYNCHRONE en arrière-plan
-        subprocess.Popen(
-            ['vagrant', 'up', '--provider', 'libvirt'],
-            cwd=vmdir,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            preexec_fn=os.setpgrp
-        )
+        # Lancement ASYNCHRONE : tâche en file (journal et code de sortie consultables)
+        job_id = jobs.submit('create', vm_name, current_user.username,
+                             {'path': str(vmdir), 'memory': memory, 'cpus': cpus})
+        position = scheduler.queue_position(job_id)
 
         vm_description = ""
         if os_name == "debian" and vm_type == "client":
@@ -669,24 +474,58 @@ Vagrant.configure("2") do |config|
         elif os_name == "debian" and vm_type == "serveur":
             vm_description = f" (utilisateur: {vm_username}, console texte)"
 
-        return jsonify({'message': f'VM {vm_name} en cours de création{vm_description}. Actualisez dans quelques minutes.', 'vm_name': vm_name})
+        return jsonify({
+            'success': True,
+            'message': f'VM {vm_name} en cours de création{vm_description} (tâche #{job_id}'
+                       + (f', position {position} dans la file' if position and position > 1 else '') + ').',
+            'vm_name': vm_name,
+            'job_id': job_id,
+            'queue_position': position
+        }), 202
 
-    except subprocess.CalledProcessError as e:
-        if vmdir.exists():
-            try:
-                subprocess.run(['vagrant', 'destroy', '-f'], cwd=vmdir, check=False)
-                shutil.rmtree(vmdir)
-            except:
-                pass
-        return jsonify({'message': f'Erreur Vagrant : {e}'}), 500
     except Exception as e:
-        if vmdir.exists():
-            try:
-                shutil.rmtree(vmdir)
-            except:
-                pass
+        if pooled:
+            # VM du pool déjà démarrée : suppression complète (domaine compris)
+            jobs.submit('delete', vm_name, current_user.username, {'path': str(vmdir)})
+        else:
+            if vmdir.exists():
+                try:
+                    shutil.rmtree(vmdir)
+                except:
+                    pass
+            vm_store.remove(vmdir)
         return jsonify({'message': f'Erreur création VM : {e}'}), 500
 
+@jobs.handler('create')
+def _job_create_vm(job, log):
+    """Tâche: premier `vagrant up` (provisioning compris)."""
+    vm_path = Path(job['payload']['path'])
+    try:
+        code = jobs.run_logged(['vagrant', 'up', '--provider', 'libvirt'], log, cwd=vm_path,
+                               timeout=config.VAGRANT_UP_TIMEOUT)
+    finally:
+        vm_state_cache.refresh_domain(vm_domain_name(job['vm_name'], vm_path))
+    if code != 0:
+        raise jobs.JobFailed(f"Échec création VM {job['vm_name']} (vagrant up code {code})", code)
+    memory_balancer.ensure_maximum(vm_domain_name(job['vm_name'], vm_path), job['payload']['memory'], log)
+    return f"VM {job['vm_name']} créée."
+
+def _job_accepted(job_id, message):
+    """Réponse commune des endpoints de cycle de vie : retour immédiat avec l'id de tâche."""
+    position = scheduler.queue_position(job_id)
+    if position and position > 1:
+        message = f'{message}, position {position} dans la file'
+    return jsonify({'success': True, 'message': f'{message} (tâche #{job_id})', 'job_id': job_id,
+                    'queue_position': position}), 202
+
+def read_vm_resources(vm_path):
+    """
+    Mémoire (MB) et nombre de CPUs d'une VM, d'après la base de métadonnées.
+    Retourne (memory, cpus), avec (2048, 2) par défaut.
+    """
+    vm = vm_store.for_path(vm_path)
+    return (vm['memory'], vm['cpus']) if vm else (2048, 2)
+
 # -------------------- Lancer une VM --------------------
 @app.route('/api/launch_vm', methods=['POST'])
 @login_required
@@ -702,14 +541,50 @@ def launch_vm():
     if not allowed:
         return jsonify({'message': 'VM introuvable ou accès refusé.'}), 403
     
+    idle_reaper.touch(vm_domain_name(vm_name, vm_path))
+    memory, cpus = read_vm_resources(vm_path)
+    capacity = scheduler.capacity_error(memory, cpus)
+    if capacity:
+        return jsonify({'message': f'Lancement impossible : {capacity}'}), 400
+    job_id = jobs.submit('launch', vm_name, vm_owner(vm_path),
+                         {'path': str(vm_path), 'memory': memory, 'cpus': cpus,
+                          'requested_by': current_user.username})
+    return _job_accepted(job_id, f'Lancement de {vm_name} en cours')
+
+@jobs.handler('launch')
+def _job_launch_vm(job, log):
+    vm_name = job['vm_name']
+    vm_path = Path(job['payload']['path'])
+    domain_name = vm_domain_name(vm_name, vm_path)
+    # VM mise en veille pour inactivité : restauration de la sauvegarde gérée, sans Vagrant
+    if idle_reaper.resume(domain_name, log):
+        vm_state_cache.refresh_domain(domain_name)
+        return f'VM {vm_name} reprise.'
+    # Ballon mémoire : un domaine déjà défini démarre aussi par libvirt, `vagrant up`
+    # ramènerait son maximum à lv.memory (vagrant-libvirt)
+    if lifecycle.read_backend(vm_path) == 'native' or (
+            config.MEMORY_BALANCER_ENABLED and libvirt_conn.get_domain_state(domain_name) != 'unknown'):
+        memory_balancer.ensure_maximum(domain_name, job['payload']['memory'], log)
+        ok, error = lifecycle.start(domain_name, log)
+        vm_state_cache.refresh_domain(domain_name)
+        if ok:
+            vm_resize.after_start(domain_name, log)
+            return f'VM {vm_name} lancée.'
+        # Domaine absent ou non démarrable : Vagrant sait le (re)créer
+        log(f"Démarrage libvirt impossible ({error}), repli sur vagrant up")
+    if not ensure_libvirt_provider():
+        raise jobs.JobFailed('Plugin libvirt manquant')
+    ensure_libvirt_network()
     try:
-        if not ensure_libvirt_provider():
-            return jsonify({'message': 'Plugin libvirt manquant'}), 500
-        ensure_libvirt_network()
-        subprocess.run(['vagrant', 'up', '--provider', 'libvirt'], cwd=vm_path, check=True)
-        return jsonify({'message': f'VM {vm_name} lancée.'})
-    except subprocess.CalledProcessError as e:
-        return jsonify({'message': f'Erreur lancement VM : {e}'}), 500
+        code = jobs.run_logged(['vagrant', 'up', '--provider', 'libvirt'], log, cwd=vm_path,
+                               timeout=config.VAGRANT_UP_TIMEOUT)
+    finally:
+        vm_state_cache.refresh_domain(vm_domain_name(vm_name, vm_path))
+    if code != 0:
+        raise jobs.JobFailed(f'Erreur lancement VM (vagrant up code {code})', code)
+    memory_balancer.ensure_maximum(domain_name, job['payload']['memory'], log)
+    vm_resize.after_start(domain_name, log)
+    return f'VM {vm_name} lancée.'
 
 # -------------------- Arrêter une VM --------------------
 @app.route('/api/halt_vm', methods=['POST'])
@@ -726,47 +601,81 @@ def halt_vm():
     if not allowed:
         return jsonify({'message': 'VM introuvable ou accès refusé.'}), 403
     
+    # Arrêter websockify si actif (lancé par n'importe quel worker)
+    vnc_proxies.release(vm_domain_name(vm_name, vm_path))
+
+    job_id = jobs.submit('halt', vm_name, vm_owner(vm_path),
+                         {'path': str(vm_path), 'requested_by': current_user.username})
+    return _job_accepted(job_id, f'Arrêt de {vm_name} en cours')
+
+@jobs.handler('halt')
+def _job_halt_vm(job, log):
+    vm_name = job['vm_name']
+    vm_path = Path(job['payload']['path'])
+    domain_name = vm_domain_name(vm_name, vm_path)
+    if lifecycle.read_backend(vm_path) == 'native':
+        try:
+            ok, forced, error = lifecycle.stop(domain_name, log)
+        finally:
+            vm_state_cache.refresh_domain(domain_name)
+        if not ok:
+            raise jobs.JobFailed(f"Erreur lors de l'arrêt forcé : {error}")
+        return f'VM {vm_name} arrêtée (forcé).' if forced else f'VM {vm_name} arrêtée.'
     try:
-        # Arrêter websockify si actif
-        stop_websockify(vm_name)
-        
-        # Tentative d'arrêt propre d'abord
-        result = subprocess.run(
-            ['vagrant', 'halt', '--provider', 'libvirt'],
-            cwd=vm_path,
-            capture_output=True,
-            text=True,
-            timeout=30  # Timeout réduit
-        )
-        
-        # Si l'arrêt propre échoue (Windows résiste souvent), forcer avec virsh
-        if result.returncode != 0:
-            print(f"Arrêt propre échoué, tentative d'arrêt forcé...")
-            domain_name = f"{vm_name}_default"
-            
-            # Forcer l'arrêt avec virsh destroy (équivalent à débrancher)
-            force_result = subprocess.run(
-                ['virsh', '-c', 'qemu:///system', 'destroy', domain_name],
-                capture_output=True,
-                text=True
-            )
-            
-            if force_result.returncode == 0:
-                return jsonify({'message': f'VM {vm_name} arrêtée (forcé).'}), 200
-            else:
-                print(f"Erreur virsh destroy: {force_result.stderr}")
-                return jsonify({'message': f'Erreur lors de l\'arrêt forcé : {force_result.stderr}'}), 500
-        
-        return jsonify({'message': f'VM {vm_name} arrêtée.'})
+        # Tentative d'arrêt propre d'abord (délai : classe 'vagrant halt' de COMMAND_TIMEOUTS)
+        code = jobs.run_logged(['vagrant', 'halt'], log, cwd=vm_path)
+        if code == 0:
+            return f'VM {vm_name} arrêtée.'
+
+        # Si l'arrêt propre échoue (Windows résiste souvent), forcer via libvirt
+        log("Arrêt propre échoué, tentative d'arrêt forcé...")
+        ok, error = libvirt_conn.destroy_domain(domain_name)
+        if not ok:
+            raise jobs.JobFailed(f"Erreur lors de l'arrêt forcé : {error}")
+        return f'VM {vm_name} arrêtée (forcé).'
     except subprocess.TimeoutExpired:
         # Timeout atteint, forcer l'arrêt immédiatement
-        print(f"Timeout vagrant halt, arrêt forcé de {vm_name}...")
-        domain_name = f"{vm_name}_default"
-        subprocess.run(['virsh', '-c', 'qemu:///system', 'destroy', domain_name], check=False)
-        return jsonify({'message': f'VM {vm_name} arrêtée (forcé après timeout).'}), 200
-    except Exception as e:
-        print(f"Erreur halt_vm: {e}")
-        return jsonify({'message': f'Erreur : {str(e)}'}), 500
+        log(f"Timeout vagrant halt ({commands.timeout_for(['vagrant', 'halt']):g}s), arrêt forcé de {vm_name}...")
+        libvirt_conn.destroy_domain(domain_name)
+        return f'VM {vm_name} arrêtée (forcé après timeout).'
+    finally:
+        vm_state_cache.refresh_domain(domain_name)
+
+@jobs.handler('reset')
+def _job_reset_vm(job, log):
+    """Réinitialisation matérielle d'une VM démarrée (opérations groupées) ; sans objet si elle est arrêtée."""
+    vm_name = job['vm_name']
+    vm_path = Path(job['payload']['path'])
+    domain_name = vm_domain_name(vm_name, vm_path)
+    if libvirt_conn.get_domain_state(domain_name) != 'running':
+        return f'VM {vm_name} non démarrée : rien à réinitialiser.'
+    try:
+        ok, error = lifecycle.reset(domain_name, log)
+    finally:
+        vm_state_cache.refresh_domain(domain_name)
+    if not ok:
+        raise jobs.JobFailed(f'Réinitialisation impossible : {error}')
+    return f'VM {vm_name} réinitialisée.'
+
+@jobs.handler('suspend')
+def _job_suspend_vm(job, log):
+    """Mise en veille d'une VM démarrée (opérations groupées, fin de séance) ; arrêt si la sauvegarde échoue."""
+    vm_name = job['vm_name']
+    vm_path = Path(job['payload']['path'])
+    domain_name = vm_domain_name(vm_name, vm_path)
+    if libvirt_conn.get_domain_state(domain_name) != 'running':
+        return f'VM {vm_name} non démarrée : rien à mettre en veille.'
+    try:
+        ok, error = idle_reaper.suspend(domain_name, log)
+        if ok:
+            return f'VM {vm_name} mise en veille.'
+        log(f"Sauvegarde gérée impossible ({error}), arrêt propre")
+        ok, forced, error = lifecycle.stop(domain_name, log)
+    finally:
+        vm_state_cache.refresh_domain(domain_name)
+    if not ok:
+        raise jobs.JobFailed(f"Arrêt impossible : {error}")
+    return f'VM {vm_name} arrêtée.'
 
 # -------------------- Supprimer une VM --------------------
 @app.route('/api/delete_vm', methods=['POST'])
@@ -783,29 +692,47 @@ def delete_vm():
     if not allowed:
         return jsonify({'message': 'VM introuvable ou accès refusé.'}), 403
     
+    vnc_proxies.release(vm_domain_name(vm_name, vm_path))
+    job_id = jobs.submit('delete', vm_name, vm_owner(vm_path),
+                         {'path': str(vm_path), 'requested_by': current_user.username})
+    return _job_accepted(job_id, f'Suppression de {vm_name} en cours')
+
+@jobs.handler('delete')
+def _job_delete_vm(job, log):
+    vm_name = job['vm_name']
+    vm_path = Path(job['payload']['path'])
+    domain_name = vm_domain_name(vm_name, vm_path)
+    if lifecycle.read_backend(vm_path) == 'native':
+        ok, error = lifecycle.delete(domain_name, log)
+        if not ok:
+            log(f"undefine: {error}")
+        shutil.rmtree(vm_path, ignore_errors=True)
+        warm_pool.forget(vm_path)
+        vm_store.remove(vm_path)
+        vm_state_cache.refresh_domain(domain_name)
+        return f'VM {vm_name} supprimée.' if ok else f'VM supprimée avec avertissements : {error}'
     try:
-        subprocess.run(['vagrant', 'destroy', '-f'], cwd=vm_path, check=True)
-        shutil.rmtree(vm_path)
-        return jsonify({'message': f'VM {vm_name} supprimée.'})
-        
+        code = jobs.run_logged(['vagrant', 'destroy', '-f'], log, cwd=vm_path)
+        if code == 0:
+            shutil.rmtree(vm_path, ignore_errors=True)
+            warm_pool.forget(vm_path)
+            vm_store.remove(vm_path)
+            return f'VM {vm_name} supprimée.'
+        log(f"vagrant destroy code {code}, nettoyage forcé...")
     except subprocess.TimeoutExpired:
         # En cas de timeout, forcer quand même
-        print(f"Timeout lors de la suppression de {vm_name}, nettoyage forcé...")
-        subprocess.run(['virsh', '-c', 'qemu:///system', 'destroy', domain_name], check=False, capture_output=True)
-        subprocess.run(['virsh', '-c', 'qemu:///system', 'undefine', domain_name, '--remove-all-storage'], check=False, capture_output=True)
-        if vm_path.exists():
-            shutil.rmtree(vm_path)
-        return jsonify({'message': f'VM {vm_name} supprimée (forcé après timeout).'})
-        
-    except Exception as e:
-        print(f"Erreur delete_vm: {e}")
-        # Même en cas d'erreur, essayer de nettoyer
-        try:
-            if vm_path.exists():
-                shutil.rmtree(vm_path)
-        except Exception as cleanup_err:
-            print(f"Erreur nettoyage final: {cleanup_err}")
-        return jsonify({'message': f'VM supprimée avec avertissements : {str(e)}'}), 200
+        log(f"Timeout lors de la suppression de {vm_name}, nettoyage forcé...")
+    finally:
+        vm_state_cache.refresh_domain(domain_name)
+
+    ok, error = libvirt_conn.undefine_domain(domain_name, remove_storage=True)
+    if not ok:
+        log(f"undefine: {error}")
+    shutil.rmtree(vm_path, ignore_errors=True)
+    warm_pool.forget(vm_path)
+    vm_store.remove(vm_path)
+    vm_state_cache.refresh_domain(domain_name)
+    return f'VM {vm_name} supprimée (forcé).' if ok else f'VM supprimée avec avertissements : {error}'
 
 # -------------------- Lancer GUI (actuel: virt-viewer local) --------------------
 @app.route('/api/view_vm', methods=['POST'])
@@ -822,15 +749,13 @@ def view_vm():
     if not allowed:
         return jsonify({'message': 'VM introuvable ou accès refusé.'}), 403
     
-    vagrantfile_path = vm_path / "Vagrantfile"
-    is_gui_vm = False
-    if vagrantfile_path.exists():
-        content = vagrantfile_path.read_text()
-        is_gui_vm = 'xfce' in content.lower() or 'windows' in content.lower()
+    vm = vm_store.for_path(vm_path)
+    is_gui_vm = bool(vm and vm['gui'])
 
-    domain_name = f"{vm_name}_default"
+    domain_name = vm_domain_name(vm_name, vm_path)
+    idle_reaper.touch(domain_name)
     try:
-        subprocess.Popen(['virt-viewer', '--connect', 'qemu:///system', domain_name])
+        commands.popen(['virt-viewer', '--connect', 'qemu:///system', domain_name])
         return jsonify({'message': f'Console de {vm_name} ouverte.' if not is_gui_vm else f'Interface graphique de {vm_name} ouverte.'})
     except FileNotFoundError:
         return jsonify({'message': 'virt-viewer non installé.'}), 500
@@ -838,107 +763,25 @@ def view_vm():
         return jsonify({'message': f'Erreur lancement console : {e}'}), 500
 
 # -------------------- Fonctions helper pour noVNC --------------------
-def get_vm_vnc_port(vm_name):
+def get_vm_vnc_port(vm_name, domain_name=None):
     """
-    Récupère le port VNC d'une VM via virsh dumpxml.
+    Récupère le port VNC d'une VM démarrée (cache par instance du domaine,
+    recherche ciblée libvirt au premier accès après chaque démarrage).
     Retourne le port ou None si introuvable.
     """
     try:
-        domain_name = f"{vm_name}_default"
-        result = subprocess.run(
-            ['virsh', '-c', 'qemu:///system', 'dumpxml', domain_name],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        # Parser le XML
-        root = ET.fromstring(result.stdout)
-        graphics = root.find(".//graphics[@type='vnc']")
-        
-        if graphics is not None:
-            port = graphics.get('port')
-            if port and port != '-1':
-                return int(port)
-        
-        return None
+        return vm_state_cache.get_vnc_port(domain_name or f"{vm_name}_default")
     except Exception as e:
         print(f"Erreur récupération port VNC: {e}")
         return None
 
-def find_free_port(start=6080, end=6180):
-    """
-    Trouve un port libre pour websockify.
-    """
-    for port in range(start, end):
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            if s.connect_ex(('127.0.0.1', port)) != 0:
-                return port
-    return None
-
-# Dictionnaire global pour tracker les processus websockify
-websockify_processes = {}
-
-def start_websockify(vm_name, vnc_port):
-    """
-    Démarre websockify pour une VM.
-    Retourne (ws_port, process) ou (None, None) en cas d'erreur.
-    """
-    ws_port = find_free_port()
-    if not ws_port:
-        return None, None
-    
-    try:
-        # Lancer websockify
-        process = subprocess.Popen(
-            [
-                'websockify',
-                '--web', '/usr/share/novnc',
-                f'{ws_port}',
-                f'127.0.0.1:{vnc_port}'
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-            preexec_fn=os.setpgrp  # Créer un nouveau groupe de processus
-        )
-        websockify_processes[vm_name] = {'process': process, 'ws_port': ws_port, 'vnc_port': vnc_port}
-        return ws_port, process
-    except Exception as e:
-        print(f"Erreur démarrage websockify: {e}")
-        return None, None
-
-def stop_websockify(vm_name):
-    """
-    Arrête websockify pour une VM.
-    """
-    if vm_name in websockify_processes:
-        try:
-            proc_info = websockify_processes[vm_name]
-            process = proc_info['process']
-            
-            # Vérifier si le processus existe encore
-            if process.poll() is None:  # None = processus actif
-                # Tuer le processus et son groupe
-                try:
-                    os.killpg(os.getpgid(process.pid), signal.SIGTERM)
-                    process.wait(timeout=5)
-                except ProcessLookupError:
-                    pass  # Processus déjà terminé
-                except Exception as e:
-                    print(f"Erreur kill websockify: {e}")
-        except Exception as e:
-            print(f"Erreur arrêt websockify: {e}")
-        finally:
-            # Toujours supprimer l'entrée du dictionnaire
-            del websockify_processes[vm_name]
-
 # -------------------- Obtenir l'URL noVNC --------------------
 @app.route('/api/get_vnc_url/<vm_name>')
 @login_required
 def get_vnc_url(vm_name):
     """
     Retourne l'URL noVNC pour accéder à la console de la VM.
-    Démarre websockify si nécessaire.
+    Passe par la passerelle noVNC si elle tourne, sinon démarre websockify si nécessaire.
     """
     if not vm_name:
         return jsonify({'success': False, 'message': 'Nom de VM requis'}), 400
@@ -949,43 +792,52 @@ def get_vnc_url(vm_name):
         return jsonify({'success': False, 'message': 'VM introuvable ou accès refusé'}), 403
     
     # Vérifier que la VM est démarrée
-    try:
-        domain_name = f"{vm_name}_default"
-        result = subprocess.run(
-            ['virsh', '-c', 'qemu:///system', 'domstate', domain_name],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        
-        state = result.stdout.strip().lower()
-        # Vérifier si la VM est running (en français ou anglais)
-        if 'running' not in state and 'exécution' not in state and 'execution' not in state:
-            return jsonify({
-                'success': False, 
-                'message': f'La VM doit être démarrée (état actuel: {state})'
-            }), 400
-    except subprocess.CalledProcessError:
+    domain_name = vm_domain_name(vm_name, vm_path)
+    idle_reaper.touch(domain_name)
+    state = vm_state_cache.get_state(domain_name)
+    if state == 'unknown':
         return jsonify({'success': False, 'message': 'VM introuvable dans libvirt'}), 404
+    if state != 'running' and idle_reaper.stopped_by(domain_name):
+        # Mise en veille pour inactivité : relance, la console s'ouvrira à la fin de la tâche
+        memory, cpus = read_vm_resources(vm_path)
+        capacity = scheduler.capacity_error(memory, cpus)
+        if capacity:
+            return jsonify({'success': False, 'message': f'Reprise impossible : {capacity}'}), 400
+        job_id = jobs.submit('launch', vm_name, vm_owner(vm_path),
+                             {'path': str(vm_path), 'memory': memory, 'cpus': cpus,
+                              'requested_by': current_user.username})
+        return _job_accepted(job_id, f'{vm_name} était en veille, reprise en cours')
+    if state != 'running':
+        return jsonify({
+            'success': False, 
+            'message': f'La VM doit être démarrée (état actuel: {state})'
+        }), 400
     
     # Récupérer le port VNC
-    vnc_port = get_vm_vnc_port(vm_name)
+    vnc_port = get_vm_vnc_port(vm_name, domain_name)
     if not vnc_port:
         return jsonify({
             'success': False,
             'message': 'Port VNC introuvable. La VM est-elle configurée en VNC ?'
         }), 500
     
-    # Démarrer websockify (ou réutiliser existant)
-    if vm_name in websockify_processes:
-        ws_port = websockify_processes[vm_name]['ws_port']
-    else:
-        ws_port, process = start_websockify(vm_name, vnc_port)
-        if not ws_port:
-            return jsonify({
-                'success': False,
-                'message': 'Impossible de démarrer le proxy WebSocket'
-            }), 500
+    # Passerelle noVNC unique : jeton signé de courte durée, aucun processus à lancer
+    if config.VNC_GATEWAY_ENABLED and vnc_gateway.is_running():
+        token = vnc_gateway.issue_token(domain_name, vnc_port, current_user.username)
+        return jsonify({
+            'success': True,
+            'url': vnc_gateway.console_url(token),
+            'ws_port': vnc_gateway.PORT,
+            'vnc_port': vnc_port
+        })
+    
+    # Repli : websockify par VM (ou réutiliser celui de la VM, registre partagé entre workers)
+    ws_port = vnc_proxies.acquire(domain_name, vm_name, vnc_port)
+    if not ws_port:
+        return jsonify({
+            'success': False,
+            'message': 'Impossible de démarrer le proxy WebSocket'
+        }), 500
     
     # Construire l'URL noVNC avec clavier AZERTY (français)
     vnc_url = f"http://localhost:{ws_port}/vnc.html?autoconnect=true&resize=scale&keyboard=fr"
@@ -997,111 +849,381 @@ def get_vnc_url(vm_name):
         'vnc_port': vnc_port
     })
 
-def ensure_box_installed(box_name, provider="libvirt"):
+# -------------------- Suivi des tâches asynchrones --------------------
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def get_job(job_id):
+    """Retourne l'état, les horodatages, le code de sortie et le journal d'une tâche."""
+    job = jobs.get(job_id)
+    if not job or (job['owner'] != current_user.username and not is_admin(current_user.username)):
+        return jsonify({'success': False, 'message': 'Tâche introuvable.'}), 404
+    if job['state'] == 'queued':
+        job['queue_position'] = scheduler.queue_position(job_id)
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs')
+@login_required
+def list_jobs():
+    """Dernières tâches de l'utilisateur (toutes pour un admin), filtrables par ?vm=<nom>."""
+    username = current_user.username
+    owner = None if is_admin(username) else username
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({'success': True, 'jobs': jobs.list_jobs(vm_name=request.args.get('vm'), owner=owner, limit=limit)})
+
+# -------------------- Télémétrie des VMs --------------------
+@app.route('/api/vms/<vm_name>/stats')
+@login_required
+def vm_stats(vm_name):
     """
-    Vérifie si la box Vagrant est installée pour le provider donné.
-    Sinon, tente de l'installer. Retourne True si OK, False sinon.
+    Consommation d'une VM : échantillons récents (tampon circulaire, ?since=<epoch>)
+    et, avec ?history=<secondes>, moyennes enregistrées sur cette durée.
     """
+    allowed, vm_path = check_vm_ownership(current_user.username, vm_name)
+    if not allowed:
+        return jsonify({'success': False, 'message': 'VM introuvable ou accès refusé'}), 403
+    domain_name = vm_domain_name(vm_name, vm_path)
+    result = {
+        'success': True,
+        'domain': domain_name,
+        'interval': telemetry.INTERVAL,
+        'samples': telemetry.recent(domain_name, since=request.args.get('since', 0.0, type=float)),
+    }
+    history_seconds = request.args.get('history', 0, type=int)
+    if history_seconds > 0:
+        result['history'] = telemetry.history(domain_name, time.time() - history_seconds)
+    return jsonify(result)
+
+@app.route('/api/admin/stats/top')
+@login_required
+def vm_stats_top():
+    """VMs les plus consommatrices : ?metric=cpu_pct|mem_used_mb|disk_read_bps|...&limit=10 (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
     try:
-        res = subprocess.run(["vagrant", "box", "list"], capture_output=True, text=True, check=True)
-        if box_name in res.stdout:
-            return True
-        print(f"[ensure_box_installed] Installation de {box_name} ({provider})...")
-        add = subprocess.run(["vagrant", "box", "add", box_name, "--provider", provider, "--clean"], check=True)
-        return add.returncode == 0
-    except subprocess.CalledProcessError as e:
-        print(f"[ensure_box_installed] Erreur: {e}")
-        return False
+        ranked = telemetry.top(request.args.get('metric', 'cpu_pct'), min(request.args.get('limit', 10, type=int), 100))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    aliases = warm_pool.domain_aliases()
+    vms = {aliases.get(vm['path'], f"{vm['name']}_default"): vm for vm in vm_store.list_vms()}
+    for entry in ranked:
+        vm = vms.get(entry['domain'])
+        entry['vm_name'], entry['owner'] = (vm['name'], vm['owner']) if vm else (None, None)
+    return jsonify({'success': True, 'updated_at': telemetry.latest()['updated_at'], 'top': ranked})
+
+@app.route('/api/admin/scheduler')
+@login_required
+def scheduler_status():
+    """État de l'ordonnanceur : démarrages en cours/en attente et ressources de l'hôte (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'scheduler': scheduler.status()})
+
+@app.route('/api/admin/commands/slowest')
+@login_required
+def slowest_commands():
+    """Commandes externes les plus longues : ?minutes=15&limit=20&command=vagrant halt (admins, tous workers)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    minutes = max(1, min(request.args.get('minutes', 15, type=int), config.COMMAND_LOG_RETENTION))
+    limit = max(1, min(request.args.get('limit', 20, type=int), 200))
+    return jsonify({
+        'success': True,
+        'minutes': minutes,
+        'timeouts': commands.TIMEOUTS,
+        'concurrency': commands.CONCURRENCY,
+        'commands': commands.slowest(minutes, limit, request.args.get('command')),
+    })
 
-# -------------------- Helpers capacité (parsing + email + log) --------------------
-def _parse_ram_to_mb(value: str):
+# -------------------- Métriques Prometheus --------------------
+def _metrics_allowed():
+    """Jeton METRICS_TOKEN (Bearer), session admin, ou accès local si aucun jeton n'est configuré."""
+    token = config.METRICS_TOKEN
+    if token and request.headers.get('Authorization') == f'Bearer {token}':
+        return True
+    if current_user.is_authenticated and is_admin(current_user.username):
+        return True
+    return not token and request.remote_addr in ('127.0.0.1', '::1')
+
+def _metrics_gauges():
+    """Jauges calculées à la lecture : domaines par état, consoles, tâches ; compteurs du pool préchauffé."""
+    by_state = {}
+    for state in vm_state_cache.get_states().values():
+        by_state[state] = by_state.get(state, 0) + 1
+    proxies = sum(1 for p in vnc_proxies.list_proxies() if p['alive'])
+    gateway = vnc_gateway.status() if vnc_gateway.is_running() else None
+    pool = sorted(warm_pool.hit_counts().items())
+    return [
+        ('vm_manager_domains', 'Domaines libvirt par état', [({'state': s}, n) for s, n in sorted(by_state.items())]),
+        ('vm_manager_vms', 'VMs enregistrées', [({}, vm_store.count())]),
+        ('vm_manager_console_proxies', 'Proxys websockify actifs', [({}, proxies)]),
+        ('vm_manager_console_gateway_connections', 'Consoles ouvertes sur la passerelle noVNC',
+         [({}, len(gateway['connections']) if gateway else 0)]),
+        ('vm_manager_jobs', 'Tâches en file et en cours', [({'state': s}, n) for s, n in jobs.counts().items()]),
+        ('vm_manager_warm_pool_hits', 'Créations servies par le pool préchauffé',
+         [({'template': t}, hits) for t, (hits, _) in pool], 'counter'),
+        ('vm_manager_warm_pool_misses', 'Créations sans VM prête dans le pool',
+         [({'template': t}, misses) for t, (_, misses) in pool], 'counter'),
+    ]
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Métriques au format texte Prometheus, agrégées sur tous les workers."""
+    if not _metrics_allowed():
+        return jsonify({'success': False, 'message': 'Accès refusé.'}), 403
+    return Response(metrics.render(_metrics_gauges()), mimetype='text/plain; version=0.0.4')
+
+# -------------------- Admin : proxys noVNC --------------------
+@app.route('/api/admin/vnc_proxies')
+@login_required
+def vnc_proxies_status():
+    """Proxys websockify en cours (tous workers) : VM, ports, pid, dernière activité (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'proxies': vnc_proxies.list_proxies()})
+
+@app.route('/api/admin/vnc_gateway')
+@login_required
+def vnc_gateway_status():
+    """Passerelle noVNC : connexions ouvertes, octets échangés et inactivité (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'running': vnc_gateway.is_running(), 'gateway': vnc_gateway.status()})
+
+@app.route('/api/admin/mail_outbox')
+@login_required
+def mail_outbox_status():
+    """File d'envoi des emails : messages en attente, envoyés, en échec et dernières erreurs (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'outbox': mail_outbox.status()})
+
+# -------------------- Admin : environnement Vagrant/libvirt --------------------
+@app.route('/api/admin/environment', methods=['GET', 'POST'])
+@login_required
+def environment_status():
     """
-    Convertit une valeur texte en Mégaoctets (MB) pour la RAM.
-    Exemples: '4096' -> 4096 MB, '4G'/'4GB'/'4Go' -> 4096 MB, '512M'/'512MB' -> 512 MB
+    GET : résultats des sondes en cache (versions, plugins, box, réseau) et leur âge.
+    POST : relance toutes les sondes (ex: après installation manuelle d'une box).
     """
-    if value is None:
-        return None
-    s = str(value).strip().lower().replace(',', '.')
-    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]{0,3})\s*$', s)
-    if not m:
-        return None
-    num = float(m.group(1))
-    unit = m.group(2)
-    if unit in ('', 'm', 'mb'):
-        mb = int(round(num))
-    elif unit in ('g', 'gb', 'go'):
-        mb = int(round(num * 1024))
-    else:
-        return None
-    return mb if mb > 0 else None
-
-def _parse_storage_to_gb(value: str):
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'POST':
+        environment.refresh()
+    return jsonify({'success': True, 'environment': environment.snapshot()})
+
+# -------------------- Admin : mise en veille des VMs inactives --------------------
+@app.route('/api/admin/idle_reaper', methods=['GET', 'POST'])
+@login_required
+def idle_reaper_admin():
     """
-    Convertit une valeur texte en Gigaoctets (GB) pour le stockage.
-    Par défaut: GB. Ex: '80' -> 80 GB, '80GB'/'80Go' -> 80 GB, '10240MB' -> 10 GB.
+    GET : activité des VMs (inactivité, CPU, console, veille), politiques et exemptions.
+    POST {action: exempt|unexempt, kind: vm|owner, vm_name, owner, note} : gère les exemptions.
     """
-    if value is None:
-        return None
-    s = str(value).strip().lower().replace(',', '.')
-    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([a-z]{0,3})\s*$', s)
-    if not m:
-        return None
-    num = float(m.group(1))
-    unit = m.group(2)
-    if unit in ('', 'g', 'gb', 'go'):
-        gb = int(round(num))
-    elif unit in ('m', 'mb'):
-        gb = int(round(num / 1024.0))
-    elif unit in ('t', 'tb'):
-        gb = int(round(num * 1024.0))
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, 'idle_reaper': idle_reaper.status()})
+
+    data = request.get_json() or {}
+    kind = data.get('kind')
+    owner = (data.get('owner') or '').strip()
+    if kind == 'vm':
+        vm_name = (data.get('vm_name') or '').strip()
+        vm = vm_store.get(owner, vm_name) if owner else vm_store.find(vm_name)
+        if vm is None:
+            return jsonify({'success': False, 'message': 'VM introuvable.'}), 404
+        value, label = vm['path'], f"{vm['owner']}/{vm['name']}"
+    elif kind == 'owner' and owner:
+        value, label = owner, owner
     else:
-        return None
-    return gb if gb > 0 else None
+        return jsonify({'success': False, 'message': "Exemption invalide : kind 'vm' (vm_name) ou 'owner' (owner)."}), 400
+    if data.get('action') == 'unexempt':
+        if not idle_reaper.remove_exemption(kind, value):
+            return jsonify({'success': False, 'message': f'Aucune exemption pour {label}.'}), 404
+        return jsonify({'success': True, 'message': f'Exemption de {label} retirée.'})
+    idle_reaper.add_exemption(kind, value, current_user.username, data.get('note', ''))
+    return jsonify({'success': True, 'message': f'{label} exempté(e) de la mise en veille.'})
+
+# -------------------- Admin : opérations groupées --------------------
+@app.route('/api/admin/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_operations():
+    """
+    GET : dernières opérations groupées et leur avancement.
+    POST {action: start|halt|suspend|delete|reset, selector: {owners, name, os, vm_type, state},
+          parallel, dry_run, confirm} : une tâche par VM sélectionnée, au plus `parallel` à la fois.
+    """
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'GET':
+        limit = min(request.args.get('limit', 20, type=int), 200)
+        return jsonify({'success': True, 'operations': bulk_ops.list_operations(limit)})
 
-def _append_capacity_request_log(user_dn: str, vm_name: str, resource: str, value_str: str, reason: str):
+    data = request.get_json() or {}
+    action = (data.get('action') or '').strip().lower()
+    if action not in bulk_ops.ACTIONS:
+        return jsonify({'success': False, 'message': f"Action invalide (attendu: {', '.join(bulk_ops.ACTIONS)})."}), 400
+    try:
+        selector = bulk_ops.normalize_selector(data.get('selector'))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    vms = bulk_ops.select(selector)
+    matched = [{'owner': vm['owner'], 'vm_name': vm['name'], 'state': vm['state']} for vm in vms]
+    if data.get('dry_run'):
+        return jsonify({'success': True, 'count': len(vms), 'vms': matched})
+    if not vms:
+        return jsonify({'success': False, 'message': 'Aucune VM ne correspond au sélecteur.'}), 404
+    if action == 'delete' and data.get('confirm') is not True:
+        return jsonify({'success': False, 'count': len(vms), 'vms': matched,
+                        'message': f'Suppression de {len(vms)} VM(s) : confirmer avec "confirm": true.'}), 400
+    parallel = data.get('parallel')
+    if parallel is not None and (not isinstance(parallel, int) or parallel < 1):
+        return jsonify({'success': False, 'message': 'parallel : entier positif attendu.'}), 400
+    bulk_id = bulk_ops.submit(action, vms, current_user.username, selector, parallel)
+    return jsonify({'success': True, 'bulk_id': bulk_id, 'count': len(vms), 'vms': matched,
+                    'message': f'{action} de {len(vms)} VM(s) en cours (opération #{bulk_id})'}), 202
+
+@app.route('/api/admin/bulk/<int:bulk_id>')
+@login_required
+def bulk_operation(bulk_id):
+    """Avancement d'une opération groupée : compteurs par état et état de chaque VM (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    operation = bulk_ops.get(bulk_id)
+    if operation is None:
+        return jsonify({'success': False, 'message': f'Opération {bulk_id} introuvable.'}), 404
+    return jsonify({'success': True, 'operation': operation})
+
+# -------------------- Admin : séances de TP --------------------
+@app.route('/api/admin/lab_sessions', methods=['GET', 'POST'])
+@login_required
+def lab_sessions_admin():
     """
-    Journalise la demande dans un CSV (capacity_requests.csv à la racine du projet).
+    GET : séances à venir et en cours (?past=1 : aussi les terminées).
+    POST {name, owners, template, starts_at, ends_at, preboot, end_action} : planifie une séance
+    (dates ISO 8601 ou secondes ; preboot en secondes avant le début ; end_action suspend|halt|none).
     """
-    csv_path = BASE_DIR / 'capacity_requests.csv'
-    header = ['timestamp', 'user_dn', 'username', 'vm_name', 'resource', 'requested_value', 'reason']
-    row = [
-        datetime.datetime.utcnow().isoformat(),
-        user_dn,
-        getattr(current_user, 'username', ''),
-        vm_name,
-        resource,
-        value_str,
-        reason.replace('\n', ' ').strip()[:2000],
-    ]
-    write_header = not csv_path.exists()
-    with open(csv_path, 'a', encoding='utf-8', newline='') as f:
-        w = csv.writer(f)
-        if write_header:
-            w.writerow(header)
-        w.writerow(row)
-
-def _send_capacity_request_email(username: str, vm_name: str, resource: str, human_value: str, reason: str) -> bool:
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'GET':
+        limit = min(request.args.get('limit', 50, type=int), 200)
+        past = request.args.get('past') == '1'
+        return jsonify({'success': True, 'sessions': lab_sessions.list_sessions(past, limit)})
+
+    data = request.get_json() or {}
+    try:
+        if data.get('starts_at') is None or data.get('ends_at') is None:
+            raise ValueError('Début et fin requis (starts_at, ends_at).')
+        preboot = data.get('preboot')
+        if preboot is not None and (not isinstance(preboot, int) or preboot < 0):
+            raise ValueError('preboot : nombre de secondes positif attendu.')
+        session_id = lab_sessions.create(
+            data.get('name'), data.get('owners'),
+            lab_sessions.parse_time(data['starts_at']), lab_sessions.parse_time(data['ends_at']),
+            current_user.username, template=data.get('template'), preboot=preboot, end_action=data.get('end_action'),
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    session = lab_sessions.get(session_id)
+    return jsonify({'success': True, 'session': session,
+                    'vms': [{'owner': vm['owner'], 'vm_name': vm['name'], 'state': vm['state']}
+                            for vm in lab_sessions.participants_vms(session)],
+                    'message': f"Séance #{session_id} planifiée."}), 201
+
+@app.route('/api/admin/lab_sessions/<int:session_id>', methods=['GET', 'DELETE'])
+@login_required
+def lab_session_admin(session_id):
+    """GET : séance et avancement du pré-démarrage / de la fin. DELETE : annule la séance (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'DELETE':
+        if not lab_sessions.cancel(session_id):
+            return jsonify({'success': False, 'message': f'Séance {session_id} introuvable ou déjà close.'}), 404
+        return jsonify({'success': True, 'message': f'Séance #{session_id} annulée.'})
+    session = lab_sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'message': f'Séance {session_id} introuvable.'}), 404
+    return jsonify({'success': True, 'session': session})
+
+# -------------------- Admin : ballon mémoire --------------------
+@app.route('/api/admin/memory_balancer')
+@login_required
+def memory_balancer_status():
+    """Mémoire des invités (actuelle, usage, plancher, souhait), cible de l'hôte et KSM (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'memory_balancer': memory_balancer.status()})
+
+# -------------------- Admin : pool préchauffé --------------------
+@app.route('/api/admin/warm_pool')
+@login_required
+def warm_pool_status():
+    """Pool préchauffé par modèle : taille cible, VMs par état, attributions réussies/manquées (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    return jsonify({'success': True, 'pools': warm_pool.status()})
+
+# -------------------- Admin : golden images --------------------
+@app.route('/api/admin/golden_images', methods=['GET', 'POST'])
+@login_required
+def golden_images_admin():
     """
-    Envoie un email aux admins pour une demande d’augmentation.
-    Requiert dans config.py: SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASSWORD, SMTP_FROM, ADMIN_EMAILS (liste).
-    Optionnels: SMTP_USE_TLS (True par défaut), SMTP_USE_SSL (False par défaut).
+    GET : liste des images (versions, état).
+    POST {os, vm_type} : construit une nouvelle version de l'image (tâche asynchrone).
     """
-    smtp_host = getattr(config, 'SMTP_HOST', None)
-    smtp_port = int(getattr(config, 'SMTP_PORT', 587))
-    smtp_user = getattr(config, 'SMTP_USER', None)
-    smtp_pass = getattr(config, 'SMTP_PASSWORD', None)
-    smtp_from = getattr(config, 'SMTP_FROM', None)
-    admins = getattr(config, 'ADMIN_EMAILS', [])
-    use_tls = bool(getattr(config, 'SMTP_USE_TLS', True))
-    use_ssl = bool(getattr(config, 'SMTP_USE_SSL', False))
-
-    if not smtp_host or not smtp_from or not admins:
-        print("Email non envoyé: configuration SMTP incomplète (voir config.py).")
-        return False
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, 'images': golden_images.list_images(),
+                        'enabled': config.GOLDEN_IMAGES_ENABLED})
 
-    subject = f"[VM Request] {username}/{vm_name} → {resource.upper()} {human_value}"
+    data = request.get_json() or {}
+    try:
+        image, job_id = golden_images.build(data.get('os', 'debian'), data.get('vm_type', 'client'),
+                                            current_user.username)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return _job_accepted(job_id, f"Construction de {image['box_name']} v{image['version']} en file")
+
+@app.route('/api/admin/golden_images/<int:image_id>/retire', methods=['POST'])
+@login_required
+def retire_golden_image(image_id):
+    """Retire une image : les nouvelles VMs reviennent à la version précédente ou au provisioning complet."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    if not golden_images.retire(image_id):
+        return jsonify({'success': False, 'message': 'Image introuvable ou en construction.'}), 404
+    return jsonify({'success': True, 'message': f'Image #{image_id} retirée.'})
+
+# -------------------- Admin : resynchronisation du cache d'états --------------------
+@app.route('/api/admin/state_cache/resync', methods=['POST'])
+@login_required
+def resync_state_cache():
+    """Force la relecture de l'état de tous les domaines (admins uniquement)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    snapshot = vm_state_cache.resync()
+    return jsonify({'success': True, 'version': snapshot['version'], 'domains': len(snapshot['states'])})
+
+# -------------------- Admin : réimport des métadonnées des VMs --------------------
+@app.route('/api/admin/vm_store/import', methods=['POST'])
+@login_required
+def import_vm_store():
+    """Relit vm_info.txt et le Vagrantfile de toutes les VMs (après une modification manuelle) (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    count = vm_store.import_tree(VMS_BASE_DIR)
+    return jsonify({'success': True, 'imported': count})
+
+# -------------------- Helpers capacité (email) --------------------
+def _queue_capacity_request_email(request_id: int, username: str, vm_name: str, resource: str, human_value: str, reason: str) -> int:
+    """
+    Met en file (mail_outbox) l'email aux admins pour une demande d’augmentation.
+    L'envoi SMTP est fait en arrière-plan ; destinataires: ADMIN_EMAILS (config.py).
+    """
+    subject = f"[VM Request #{request_id}] {username}/{vm_name} → {resource.upper()} {human_value}"
     body = (
-        f"Demande d’augmentation de capacité\n"
+        f"Demande d’augmentation de capacité n°{request_id}\n"
         f"- Utilisateur: {username}\n"
         f"- VM: {vm_name}\n"
         f"- Ressource: {resource}\n"
@@ -1109,33 +1231,7 @@ def _send_capacity_request_email(username: str, vm_name: str, resource: str, hum
         f"- Motif: {reason}\n"
         f"- Horodatage (UTC): {datetime.datetime.utcnow().isoformat()}\n"
     )
-
-    msg = EmailMessage()
-    msg['Subject'] = subject
-    msg['From'] = smtp_from
-    msg['To'] = ', '.join(admins)
-    msg.set_content(body)
-
-    try:
-        if use_ssl:
-            context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(smtp_host, smtp_port, context=context, timeout=30) as s:
-                if smtp_user and smtp_pass:
-                    s.login(smtp_user, smtp_pass)
-                s.send_message(msg)
-        else:
-            with smtplib.SMTP(smtp_host, smtp_port, timeout=30) as s:
-                s.ehlo()
-                if use_tls:
-                    s.starttls(context=ssl.create_default_context())
-                    s.ehlo()
-                if smtp_user and smtp_pass:
-                    s.login(smtp_user, smtp_pass)
-                s.send_message(msg)
-        return True
-    except Exception as e:
-        print(f"Erreur envoi email: {e}")
-        return False
+    return mail_outbox.enqueue(subject, body, digest=True)
 
 # -------------------- Nouvelle API: demande d’augmentation de capacité --------------------
 @app.route('/api/request_vm_capacity', methods=['POST'])
@@ -1159,7 +1255,7 @@ def request_vm_capacity():
 
     if not vm_name:
         return jsonify({'success': False, 'message': 'Nom de VM requis.'}), 400
-    if resource not in ('ram', 'storage', 'stockage', 'disk'):
+    if resource not in capacity_requests.RESOURCE_ALIASES:
         return jsonify({'success': False, 'message': "Ressource invalide. Utilisez 'ram' ou 'storage'."}), 400
     if not value_str:
         return jsonify({'success': False, 'message': 'Valeur demandée requise.'}), 400
@@ -1171,56 +1267,135 @@ def request_vm_capacity():
     if not allowed:
         return jsonify({'success': False, 'message': 'VM introuvable ou accès refusé.'}), 403
 
-    # Parsing des valeurs
-    human_value = None
-    if resource == 'ram':
-        mb = _parse_ram_to_mb(value_str)
-        if not mb:
-            return jsonify({'success': False, 'message': "Valeur RAM invalide (ex: '8192' ou '8GB')."}), 400
-        human_value = f"{mb} MB ({mb//1024} GB)"
-        # Garde-fous simples
-        if mb < 512 or mb > 131072:  # 512MB à 128GB
-            return jsonify({'success': False, 'message': 'RAM demandée hors limites (512MB - 128GB).'}), 400
-        normalized_resource = 'ram'
-    else:
-        gb = _parse_storage_to_gb(value_str)
-        if not gb:
-            return jsonify({'success': False, 'message': "Valeur stockage invalide (ex: '80' ou '80GB')."}), 400
-        human_value = f"{gb} GB"
-        if gb < 10 or gb > 1024:  # 10GB à 1TB
-            return jsonify({'success': False, 'message': 'Stockage demandé hors limites (10GB - 1TB).'}), 400
-        normalized_resource = 'storage'
-
-    # Journaliser
+    # Parsing des valeurs et garde-fous (512MB - 128GB, 10GB - 1TB)
     try:
-        _append_capacity_request_log(current_user.dn, vm_name, normalized_resource, value_str, reason)
+        normalized_resource, amount = capacity_requests.validate(resource, value_str)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+
+    # Enregistrer la demande (statut 'pending')
+    request_id = capacity_requests.record(current_user.dn, current_user.username, vm_name,
+                                          normalized_resource, value_str, amount, reason)
+    human_value = capacity_requests.human_value(normalized_resource, amount)
+
+    # Prévenir les admins (envoi en arrière-plan)
+    try:
+        _queue_capacity_request_email(request_id, current_user.username, vm_name, normalized_resource, human_value, reason)
     except Exception as e:
-        print(f"Erreur log demande capacité: {e}")
+        print(f"Erreur mise en file email: {e}")
+        return jsonify({'success': False, 'request_id': request_id, 'message': "Votre demande a été enregistrée mais l'email n'a pas pu être envoyé (voir logs serveur)."}), 202
 
-    # Envoyer l'email
-    ok = _send_capacity_request_email(current_user.username, vm_name, normalized_resource, human_value, reason)
-    if not ok:
-        return jsonify({'success': False, 'message': "Votre demande a été enregistrée mais l'email n'a pas pu être envoyé (voir logs serveur)."}), 202
+    return jsonify({'success': True, 'request_id': request_id, 'message': 'Demande envoyée aux administrateurs. Vous recevrez un retour prochainement.'}), 200
 
-    return jsonify({'success': True, 'message': 'Demande envoyée aux administrateurs. Vous recevrez un retour prochainement.'}), 200
+@app.route('/api/capacity_requests')
+@login_required
+def my_capacity_requests():
+    """Demandes de capacité de l'utilisateur courant (paginées : ?before=<id>&limit=)."""
+    requests_page, next_before = capacity_requests.list_requests(
+        username=current_user.username,
+        vm_name=request.args.get('vm'),
+        status=request.args.get('status'),
+        before=request.args.get('before', type=int),
+        limit=request.args.get('limit', 50, type=int),
+    )
+    return jsonify({'success': True, 'requests': requests_page, 'next_before': next_before})
+
+# -------------------- Admin : registre des demandes de capacité --------------------
+def _capacity_filters():
+    status = request.args.get('status') or None
+    resource = request.args.get('resource') or None
+    if status and status not in capacity_requests.STATUSES:
+        raise ValueError(f"Statut invalide: {status}")
+    if resource and resource not in capacity_requests.RESOURCES:
+        raise ValueError(f"Ressource invalide: {resource}")
+    return {
+        'username': request.args.get('user') or None,
+        'vm_name': request.args.get('vm') or None,
+        'status': status,
+        'resource': resource,
+    }
+
+@app.route('/api/admin/capacity_requests')
+@login_required
+def admin_capacity_requests():
+    """
+    Demandes de capacité, des plus récentes aux plus anciennes (admins).
+    Filtres: ?user=&vm=&status=pending|approved|rejected|applied&resource=ram|storage
+    Pagination: ?limit= (500 max) et ?before=<next_before de la page précédente>.
+    """
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    try:
+        filters = _capacity_filters()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    requests_page, next_before = capacity_requests.list_requests(
+        before=request.args.get('before', type=int), limit=request.args.get('limit', 50, type=int), **filters
+    )
+    return jsonify({'success': True, 'requests': requests_page, 'next_before': next_before,
+                    'counts': capacity_requests.counts()})
+
+@app.route('/api/admin/capacity_requests/<int:request_id>', methods=['POST'])
+@login_required
+def decide_capacity_request(request_id):
+    """
+    Change le statut d'une demande : {"status": "approved"|"rejected"|"applied", "note": "...", "apply": true} (admins).
+    Une approbation met en file son application (tâche 'capacity'), sauf "apply": false.
+    """
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    data = request.get_json() or {}
+    status = (data.get('status') or '').strip().lower()
+    try:
+        entry = capacity_requests.set_status(request_id, status, current_user.username, data.get('note') or '')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    if status == 'approved' and data.get('apply', True):
+        job_id = vm_resize.submit(entry, current_user.username)
+        return jsonify({'success': True, 'request': capacity_requests.get(request_id), 'job_id': job_id,
+                        'message': f"Demande #{request_id} approuvée, application en cours (tâche #{job_id})"}), 202
+    return jsonify({'success': True, 'request': entry})
+
+@app.route('/api/admin/capacity_requests/<int:request_id>/apply', methods=['POST'])
+@login_required
+def apply_capacity_request(request_id):
+    """(Re)lance l'application d'une demande approuvée (après un échec, ou approuvée avec "apply": false) (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    entry = capacity_requests.get(request_id)
+    if entry is None:
+        return jsonify({'success': False, 'message': f'Demande {request_id} introuvable.'}), 404
+    if entry['status'] != 'approved':
+        return jsonify({'success': False, 'message': f"Demande au statut '{entry['status']}' : seule une demande approuvée s'applique."}), 409
+    job_id = vm_resize.submit(entry, current_user.username)
+    return _job_accepted(job_id, f'Application de la demande #{request_id} en cours')
+
+@app.route('/api/admin/capacity_requests/export.csv')
+@login_required
+def export_capacity_requests():
+    """Export CSV (en flux) des demandes, mêmes filtres que la liste (admins)."""
+    if not is_admin(current_user.username):
+        return jsonify({'success': False, 'message': 'Accès réservé aux administrateurs.'}), 403
+    try:
+        filters = _capacity_filters()
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return Response(capacity_requests.export_csv(**filters), mimetype='text/csv',
+                    headers={'Content-Disposition': 'attachment; filename=capacity_requests.csv'})
 
 # -------------------- Vérifier et créer le réseau libvirt par défaut --------------------
 def ensure_libvirt_network():
     try:
-        out = subprocess.run(["virsh","net-list","--all"], capture_output=True, text=True)
-        if "default" in out.stdout:
+        if environment.network_ready():
             return True
         xml = ("<network><name>default</name><forward mode='nat'/>"
                "<bridge name='virbr0'/>"
                "<ip address='192.168.122.1' netmask='255.255.255.0'>"
                "<dhcp><range start='192.168.122.2' end='192.168.122.254'/></dhcp>"
                "</ip></network>")
-        tmp = "/tmp/default-net.xml"
-        open(tmp, "w").write(xml)
-        subprocess.run(["sudo","virsh","net-define", tmp], check=True)
-        subprocess.run(["sudo","virsh","net-start", "default"], check=True)
-        subprocess.run(["sudo","virsh","net-autostart", "default"], check=True)
-        return True
+        created = libvirt_conn.create_network(xml)
+        environment.invalidate('default_network')
+        return created
     except Exception as e:
         print(f"[ensure_libvirt_network] {e}")
         return False
@@ -1228,17 +1403,35 @@ def ensure_libvirt_network():
 
 # -------------------- Vérifier la présence de Vagrant/libvirt provider --------------------
 def ensure_libvirt_provider():
-    """Vérifie rapidement si `vagrant` et `virsh` sont disponibles sur le système.
+    """Vérifie rapidement si `vagrant` et `virsh` sont disponibles sur le système (sondes en cache).
     Retourne True si l'environnement semble prêt, False sinon.
     """
     try:
-        r1 = subprocess.run(['vagrant', '--version'], capture_output=True, text=True)
-        r2 = subprocess.run(['virsh', '--version'], capture_output=True, text=True)
-        return r1.returncode == 0 and r2.returncode == 0
+        return environment.provider_ready()
     except Exception as e:
         print(f"[ensure_libvirt_provider] {e}")
         return False
 
+# -------------------- Services de fond --------------------
+scheduler.install()
+vm_store.ensure_imported(VMS_BASE_DIR)
+capacity_requests.ensure_imported(BASE_DIR / 'capacity_requests.csv')
+if config.BACKGROUND_SERVICES:
+    environment.start()
+    vm_state_cache.start_collector()
+    jobs.start_workers()
+    warm_pool.start()
+    vnc_proxies.start_reaper()
+    mail_outbox.start()
+    if config.TELEMETRY_ENABLED:
+        telemetry.start_collector()
+    if config.IDLE_REAPER_ENABLED:
+        idle_reaper.start()
+    if config.MEMORY_BALANCER_ENABLED:
+        memory_balancer.start()
+    if config.LAB_SESSIONS_ENABLED:
+        lab_sessions.start()
+
 # -------------------- Lancement Flask --------------------
 if __name__ == '__main__':
     # Dev server
@@ -0,0 +1,352 @@
+"""
+Ballon mémoire des VMs : la mémoire de chaque invité suit son usage réel.
+
+Les domaines démarrent avec la mémoire du modèle (lv.memory) et un périphérique
+virtio-balloon ; leur maximum persistant est porté au-dessus
+(provisioning.balloon_maximum_mb, ensure_maximum()) avant chaque lancement par libvirt
+et après chaque `vagrant up`. Une fois le domaine défini, les lancements passent par
+libvirt : le maximum relevé s'applique dès le démarrage suivant. Un seul worker (leader
+"memory-balancer") lit toutes les MEMORY_BALANCER_INTERVAL secondes les statistiques
+mémoire des invités (statistiques groupées libvirt, un appel par passage) et fixe
+la cible du ballon de chaque VM :
+- usage de l'invité (hors cache récupérable) + MEMORY_GUEST_HEADROOM, au moins
+  MEMORY_GUEST_FREE_MB de libre, entre MEMORY_BALLOON_MIN_MB et le maximum du domaine ;
+- si la somme dépasse la cible de l'hôte (MEMORY_HOST_TARGET de la mémoire hors
+  réserve de l'ordonnanceur), les marges sont réduites proportionnellement ;
+- une VM sans statistiques invitées (pilote absent, démarrage en cours) est ramenée
+  à la mémoire de son modèle, jamais en dessous ;
+- réduction d'au plus MAX_SHRINK par passage, pas de changement de moins de STEP_MB.
+
+Chaque VM garde une réservation : le plus haut de sa mémoire actuelle et de sa plus
+forte demande depuis RESERVATION_WINDOW secondes. L'ordonnanceur compte ces
+réservations (reservations()) plutôt que le maximum des domaines : la mémoire rendue
+par les invités inactifs lui permet d'admettre plus de VMs par hôte, sans reprendre
+celle qu'une VM utilisée récemment risque de redemander. Optionnellement
+(MEMORY_KSM_ENABLED), KSM fusionne les pages identiques des nombreux invités Debian ;
+son effort de balayage suit la pression mémoire.
+
+plan() et guest_domains() sont des fonctions pures, utilisables avec des statistiques
+simulées (benchmarks/bench_balloon.py).
+"""
+from pathlib import Path
+import os
+import threading
+import time
+import config
+import coordination
+import libvirt_conn
+import provisioning
+import vm_store
+import warm_pool
+
+INTERVAL = config.MEMORY_BALANCER_INTERVAL
+MIN_MB = config.MEMORY_BALLOON_MIN_MB
+HEADROOM = config.MEMORY_GUEST_HEADROOM
+GUEST_FREE_MB = config.MEMORY_GUEST_FREE_MB
+HOST_TARGET = config.MEMORY_HOST_TARGET
+RESERVED_HOST_MB = config.SCHEDULER_RESERVED_MB
+RESERVATION_WINDOW = 3600  # secondes pendant lesquelles la plus forte demande reste réservée
+MAX_SHRINK = 0.25         # part de la mémoire courante rendue au plus par passage
+STEP_MB = 64              # écart minimal pour changer la cible d'un ballon
+STATS_PERIOD = 10         # période des statistiques invitées (secondes)
+STATS_PERIOD_RETRY = 600  # nouvel essai pour un invité qui ne publie rien
+
+STATUS_FILE = 'memory_balancer.json'
+KSM_DIR = Path('/sys/kernel/mm/ksm')
+KSM_PAGES_MIN = 64        # pages_to_scan sous faible pression
+KSM_PAGES_MAX = 1250      # pages_to_scan sous forte pression
+KSM_START_PRESSURE = 0.5  # en dessous (mémoire des invités / cible), KSM ne balaie pas
+PAGE_KIB = 4
+
+_status = {'mtime': None, 'snapshot': {}}
+_status_lock = threading.Lock()
+
+
+# -------------------- Calcul des cibles --------------------
+def guest_used_mb(stats):
+    """Mémoire utilisée par l'invité (MB, cache récupérable exclu), None sans statistiques invitées."""
+    available = stats.get('balloon.available')
+    free = stats.get('balloon.usable', stats.get('balloon.unused'))
+    if available is None or free is None:
+        return None
+    return max(0, available - free) / 1024
+
+
+def guest_domains(stats, nominal):
+    """
+    Domaines gérés à partir des statistiques groupées ('balloon') :
+    {domaine: {'current', 'maximum', 'used', 'nominal'}} en MB.
+    nominal: {domaine: mémoire du modèle (MB)} ; les autres domaines sont ignorés.
+    """
+    domains = {}
+    for name, values in stats.items():
+        if name not in nominal or not values.get('balloon.maximum'):
+            continue
+        domains[name] = {
+            'current': values.get('balloon.current', values['balloon.maximum']) / 1024,
+            'maximum': values['balloon.maximum'] / 1024,
+            'used': guest_used_mb(values),
+            'nominal': nominal[name],
+        }
+    return domains
+
+
+def _bounds(domain):
+    """(plancher, souhait) en MB pour un domaine."""
+    maximum = domain['maximum']
+    if domain['used'] is None:
+        fixed = min(maximum, domain['nominal'] or maximum)
+        return fixed, fixed
+    needed = min(maximum, max(MIN_MB, domain['used'] + GUEST_FREE_MB))
+    wanted = min(maximum, max(needed, domain['used'] * (1 + HEADROOM)))
+    return needed, wanted
+
+
+def plan(domains, budget_mb):
+    """
+    Cibles des ballons (MB) pour tenir dans `budget_mb`. Retourne
+    {domaine: {'target', 'floor', 'wanted'}} ; 'target' vaut la mémoire courante
+    quand le changement serait inférieur à STEP_MB.
+    """
+    bounds = {name: _bounds(domain) for name, domain in domains.items()}
+    floor_total = sum(floor for floor, _ in bounds.values())
+    wanted_total = sum(wanted for _, wanted in bounds.values())
+    ratio = 1.0
+    if wanted_total > budget_mb and wanted_total > floor_total:
+        ratio = max(0.0, (budget_mb - floor_total) / (wanted_total - floor_total))
+    targets = {}
+    for name, (floor, wanted) in bounds.items():
+        current = domains[name]['current']
+        target = floor + (wanted - floor) * ratio
+        if target < current:
+            target = max(target, current * (1 - MAX_SHRINK))
+        if abs(target - current) < STEP_MB:
+            target = current
+        targets[name] = {'target': int(target), 'floor': int(floor), 'wanted': int(wanted)}
+    return targets
+
+
+def budget_mb(host_memory_mb, unmanaged_mb=0):
+    """Mémoire (MB) que les invités gérés peuvent se partager."""
+    return host_memory_mb * HOST_TARGET - RESERVED_HOST_MB - unmanaged_mb
+
+
+def _host_memory_mb():
+    node = libvirt_conn.get_node_info() or {}
+    return node.get('memory_mb') or os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2**20
+
+
+def update_reservations(state, domains, targets, now):
+    """Réservation de chaque domaine (MB) : mémoire actuelle ou plus forte demande de la fenêtre."""
+    peaks = state['peaks']
+    reservations = {}
+    for name, domain in domains.items():
+        wanted = targets[name]['wanted']
+        peak, since = peaks.get(name, (0, now))
+        if wanted >= peak or now - since >= RESERVATION_WINDOW:
+            peak, since = wanted, now
+        peaks[name] = (peak, since)
+        reservations[name] = int(max(domain['current'], peak))
+    for name in set(peaks) - set(domains):
+        peaks.pop(name)
+    return reservations
+
+
+# -------------------- KSM --------------------
+def _ksm_read(name):
+    try:
+        return int((KSM_DIR / name).read_text().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def ksm_status():
+    """Compteurs KSM de l'hôte ; 'saved_mb' : mémoire économisée par la fusion des pages."""
+    values = {name: _ksm_read(name) for name in ('run', 'pages_to_scan', 'pages_shared', 'pages_sharing')}
+    if values['pages_sharing'] is not None:
+        values['saved_mb'] = round(values['pages_sharing'] * PAGE_KIB / 1024, 1)
+    return values
+
+
+def ksm_settings(pressure):
+    """(run, pages_to_scan) pour une pression mémoire donnée (mémoire des invités / budget)."""
+    if pressure < KSM_START_PRESSURE:
+        return 0, KSM_PAGES_MIN
+    share = min(1.0, (pressure - KSM_START_PRESSURE) / (1 - KSM_START_PRESSURE))
+    return 1, int(KSM_PAGES_MIN + (KSM_PAGES_MAX - KSM_PAGES_MIN) * share)
+
+
+def tune_ksm(pressure, state):
+    """Applique ksm_settings() (droits root requis ; l'échec n'est signalé qu'une fois)."""
+    run, pages = ksm_settings(pressure)
+    try:
+        if _ksm_read('pages_to_scan') != pages:
+            (KSM_DIR / 'pages_to_scan').write_text(str(pages))
+        if _ksm_read('run') != run:
+            (KSM_DIR / 'run').write_text(str(run))
+    except OSError as e:
+        if not state.get('ksm_error'):
+            print(f"[memory_balancer] Réglage KSM impossible: {e}")
+        state['ksm_error'] = str(e)
+        return
+    state['ksm_error'] = None
+
+
+# -------------------- Maximum des domaines --------------------
+def ensure_maximum(domain, memory_mb, log=print):
+    """
+    Porte le maximum de la définition persistante du domaine à balloon_maximum_mb(memory_mb),
+    la mémoire de démarrage restant memory_mb. vagrant-libvirt ramène le maximum à
+    lv.memory à chaque `vagrant up` : à rappeler après, les lancements suivants passant
+    par libvirt (main._job_launch_vm). Retourne True si la définition a été modifiée.
+    """
+    if not config.MEMORY_BALANCER_ENABLED:
+        return False
+    maximum_mb = provisioning.balloon_maximum_mb(memory_mb)
+    domain_max_kib, _ = libvirt_conn.memory_from_xml(libvirt_conn.get_domain_xml(domain))
+    if not domain_max_kib or domain_max_kib >= maximum_mb * 1024:
+        return False
+    ok, error = libvirt_conn.set_domain_memory_config(domain, maximum_mb * 1024, int(memory_mb) * 1024)
+    if not ok:
+        log(f"Maximum du ballon non fixé ({error})")
+        return False
+    log(f"Ballon : {memory_mb} MB au démarrage, maximum {maximum_mb} MB")
+    return True
+
+
+# -------------------- Passage du contrôleur --------------------
+def _nominal_by_domain():
+    """{domaine: mémoire du modèle (MB)} des VMs connues."""
+    aliases = warm_pool.domain_aliases()
+    nominal = {}
+    for vm in vm_store.list_vms():
+        memory = vm['memory'] or provisioning.get_template(vm['os'], vm['vm_type'])['memory']
+        nominal[aliases.get(vm['path'], f"{vm['name']}_default")] = int(memory)
+    return nominal
+
+
+def new_state():
+    """État du contrôleur : demandes de statistiques invitées, pics de demande, erreur KSM, ajustements."""
+    return {'stats_period': {}, 'peaks': {}, 'ksm_error': None, 'adjustments': 0}
+
+
+def balance_once(state, stats=None, nominal=None, host_memory_mb=None, apply=None, request_stats=None, now=None):
+    """
+    Un passage : lit les statistiques (ou `stats` simulées), calcule les cibles et les
+    applique (`apply(domaine, kib)`, par défaut libvirt_conn.set_domain_memory ;
+    `request_stats(domaine, secondes)`, par défaut libvirt_conn.set_memory_stats_period).
+    Retourne le résumé publié dans STATUS_FILE.
+    """
+    now = now or time.time()
+    if stats is None:
+        stats = libvirt_conn.get_all_domain_stats(('balloon',), active_only=True)
+    if nominal is None:
+        nominal = _nominal_by_domain()
+    if host_memory_mb is None:
+        host_memory_mb = _host_memory_mb()
+    apply = apply or libvirt_conn.set_domain_memory
+    request_stats = request_stats or libvirt_conn.set_memory_stats_period
+
+    domains = guest_domains(stats, nominal)
+    unmanaged_mb = sum(v.get('balloon.current', 0) for name, v in stats.items() if name not in domains) / 1024
+    budget = budget_mb(host_memory_mb, unmanaged_mb)
+    targets = plan(domains, budget)
+
+    for name, domain in domains.items():
+        target = targets[name]['target']
+        if target != int(domain['current']):
+            ok, error = apply(name, target * 1024)
+            if ok:
+                state['adjustments'] += 1
+                domain['current'] = target
+            else:
+                print(f"[memory_balancer] {name}: cible {target} MB refusée: {error}")
+        # Invité sans statistiques : demander leur publication (une fois par STATS_PERIOD_RETRY)
+        if domain['used'] is None and now - state['stats_period'].get(name, 0) >= STATS_PERIOD_RETRY:
+            request_stats(name, STATS_PERIOD)
+            state['stats_period'][name] = now
+    for name in set(state['stats_period']) - set(domains):
+        state['stats_period'].pop(name)
+    reservations = update_reservations(state, domains, targets, now)
+
+    guests_mb = sum(d['current'] for d in domains.values())
+    pressure = guests_mb / budget if budget > 0 else 1.0
+    if config.MEMORY_KSM_ENABLED:
+        tune_ksm(pressure, state)
+    summary = {
+        'updated_at': now,
+        'host': {
+            'memory_mb': host_memory_mb,
+            'budget_mb': int(budget),
+            'guests_mb': int(guests_mb),
+            'guests_nominal_mb': sum(d['nominal'] for d in domains.values()),
+            'reserved_mb': sum(reservations.values()),
+            'unmanaged_mb': int(unmanaged_mb),
+            'pressure': round(pressure, 3),
+        },
+        'adjustments': state['adjustments'],
+        'domains': {
+            name: {
+                'current_mb': int(d['current']),
+                'maximum_mb': int(d['maximum']),
+                'nominal_mb': d['nominal'],
+                'used_mb': round(d['used'], 1) if d['used'] is not None else None,
+                'reserved_mb': reservations[name],
+                **{key: value for key, value in targets[name].items() if key != 'target'},
+            }
+            for name, d in domains.items()
+        },
+    }
+    return summary
+
+
+def _snapshot():
+    """Dernier résumé publié par le leader (relu seulement s'il a changé)."""
+    path = coordination.data_path(STATUS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _status_lock:
+        if mtime != _status['mtime']:
+            _status['snapshot'] = coordination.read_json(path, {}) or {}
+            _status['mtime'] = mtime
+        return _status['snapshot']
+
+
+def reservations():
+    """{domaine: mémoire réservée (MB)} du dernier passage, pour l'ordonnanceur."""
+    return {name: d['reserved_mb'] for name, d in _snapshot().get('domains', {}).items()}
+
+
+def status():
+    """Dernier passage du contrôleur (hôte, domaines, KSM) et réglages, pour l'administration."""
+    return {
+        'enabled': config.MEMORY_BALANCER_ENABLED,
+        'interval': INTERVAL,
+        'max_factor': config.MEMORY_BALLOON_MAX_FACTOR,
+        'min_mb': MIN_MB,
+        'headroom': HEADROOM,
+        'guest_free_mb': GUEST_FREE_MB,
+        'host_target': HOST_TARGET,
+        'ksm': {'enabled': config.MEMORY_KSM_ENABLED, **ksm_status()},
+        **_snapshot(),
+    }
+
+
+def _loop():
+    state = new_state()
+    while True:
+        started = time.time()
+        try:
+            summary = balance_once(state)
+            summary['ksm_error'] = state['ksm_error']
+            coordination.atomic_write_json(coordination.data_path(STATUS_FILE), summary)
+        except Exception as e:
+            print(f"[memory_balancer] Passage impossible: {e}")
+        time.sleep(max(0.0, INTERVAL - (time.time() - started)))
+
+
+def start():
+    """Démarre le contrôleur dans le worker élu."""
+    return coordination.run_as_leader('memory-balancer', _loop)
@@ -0,0 +1,251 @@
+"""
+Métriques au format texte Prometheus (/metrics), agrégées sur tous les workers.
+
+- Requêtes HTTP : nombre et histogramme de latence par route Flask (règle, pas l'URL).
+- Commandes externes (virsh, vagrant, websockify...) : nombre, échecs et
+  histogramme de durée par commande ("virsh domstate", "vagrant box list"...).
+- Jauges (VMs par état, proxys de console, tâches en file) : calculées à la
+  lecture par l'appelant et passées à render().
+
+Chaque processus cumule en mémoire (quelques opérations sous verrou par
+mesure) et publie ses séries dans DATA_DIR/metrics/<pid>-<jeton>.json au plus
+toutes les METRICS_FLUSH_INTERVAL secondes. render() additionne les fichiers de
+tous les processus ; ceux des workers disparus sont fusionnés dans archive.json
+pour que les compteurs ne diminuent jamais.
+"""
+import os
+import threading
+import time
+import uuid
+import config
+import coordination
+
+FLUSH_INTERVAL = config.METRICS_FLUSH_INTERVAL
+METRICS_DIR = 'metrics'
+ARCHIVE_FILE = 'archive.json'
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, 3600.0)
+
+# Histogrammes : nom -> (aide, bornes) ; compteurs : nom -> aide
+HISTOGRAMS = {
+    'vm_manager_http_request_duration_seconds': ('Durée des requêtes HTTP par route', REQUEST_BUCKETS),
+    'vm_manager_command_duration_seconds': ('Durée des commandes externes', COMMAND_BUCKETS),
+}
+COUNTERS = {
+    'vm_manager_http_requests_total': 'Requêtes HTTP par route, méthode et code',
+    'vm_manager_command_failures_total': 'Commandes externes en échec (code non nul, délai dépassé, introuvable)',
+}
+
+# Sous-commandes vagrant sur deux mots ('vagrant box list')
+VAGRANT_GROUPS = {'box', 'plugin'}
+# Options virsh suivies d'une valeur
+VALUE_OPTIONS = {'-c', '--connect'}
+
+_token = uuid.uuid4().hex[:8]
+_series = {}  # {(nom, labels triés): {'name', 'labels', 'value'} ou {'name', 'labels', 'buckets', 'sum', 'count'}}
+_lock = threading.Lock()
+_state = {'dirty': False, 'flusher': False}
+
+
+def _dir():
+    directory = coordination.data_path(METRICS_DIR)
+    directory.mkdir(exist_ok=True)
+    return directory
+
+
+def _own_file():
+    return _dir() / f"{os.getpid()}-{_token}.json"
+
+
+# -------------------- Enregistrement (par processus) --------------------
+def _key(name, labels):
+    return name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+
+
+def inc(name, labels, value=1):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        entry = _series.get(key)
+        if entry is None:
+            entry = _series[key] = {'name': name, 'labels': labels, 'value': 0}
+        entry['value'] += value
+        _state['dirty'] = True
+    _ensure_flusher()
+
+
+def observe(name, labels, seconds):
+    key = (name, tuple(sorted(labels.items())))
+    bounds = HISTOGRAMS[name][1]
+    with _lock:
+        entry = _series.get(key)
+        if entry is None:
+            entry = _series[key] = {'name': name, 'labels': labels, 'buckets': [0] * len(bounds), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(bounds):
+            if seconds <= bound:
+                entry['buckets'][i] += 1
+                break
+        entry['sum'] += seconds
+        entry['count'] += 1
+        _state['dirty'] = True
+    _ensure_flusher()
+
+
+def observe_request(route, method, status, seconds):
+    """Requête HTTP terminée (route : règle Flask, ex. /api/vms/<vm_name>/stats)."""
+    inc('vm_manager_http_requests_total', {'route': route, 'method': method, 'status': str(status)})
+    observe('vm_manager_http_request_duration_seconds', {'route': route, 'method': method}, seconds)
+
+
+def command_label(argv):
+    """Libellé borné d'une commande : programme et sous-commande, sans arguments ('virsh domstate')."""
+    words = [str(a) for a in argv]
+    if words and words[0] == 'sudo':
+        words = words[1:]
+    if not words:
+        return 'unknown'
+    program = os.path.basename(words[0])
+    positional, skip = [], False
+    for word in words[1:]:
+        if skip:
+            skip = False
+        elif word in VALUE_OPTIONS:
+            skip = True
+        elif not word.startswith('-'):
+            positional.append(word)
+    if program not in ('virsh', 'vagrant') or not positional:
+        return program
+    if program == 'vagrant' and positional[0] in VAGRANT_GROUPS and len(positional) > 1:
+        return f"{program} {positional[0]} {positional[1]}"
+    return f"{program} {positional[0]}"
+
+
+def observe_command(argv, seconds, ok):
+    """Commande externe terminée (ok: code de sortie nul)."""
+    label = command_label(argv)
+    observe('vm_manager_command_duration_seconds', {'command': label}, seconds)
+    if not ok:
+        inc('vm_manager_command_failures_total', {'command': label})
+
+
+# -------------------- Publication et agrégation --------------------
+def flush():
+    """Publie les séries de ce processus (si elles ont changé)."""
+    with _lock:
+        if not _state['dirty']:
+            return
+        data = {_key(entry['name'], entry['labels']): dict(entry, buckets=list(entry['buckets']))
+                if 'buckets' in entry else dict(entry) for entry in _series.values()}
+        _state['dirty'] = False
+    coordination.atomic_write_json(_own_file(), data)
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"[metrics] Publication: {e}")
+
+
+def _ensure_flusher():
+    if _state['flusher']:
+        return
+    with _lock:
+        if _state['flusher']:
+            return
+        _state['flusher'] = True
+    threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def _merge(total, series):
+    for key, entry in series.items():
+        current = total.get(key)
+        if current is None:
+            total[key] = dict(entry, buckets=list(entry['buckets'])) if 'buckets' in entry else dict(entry)
+        elif 'buckets' in entry:
+            if len(current['buckets']) != len(entry['buckets']):
+                continue  # bornes modifiées entre deux versions : série ignorée
+            current['buckets'] = [a + b for a, b in zip(current['buckets'], entry['buckets'])]
+            current['sum'] += entry['sum']
+            current['count'] += entry['count']
+        else:
+            current['value'] += entry['value']
+    return total
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Séries de tous les processus (vivants et archivés), additionnées."""
+    flush()
+    directory = _dir()
+    with coordination.locked('metrics'):
+        archive = coordination.read_json(directory / ARCHIVE_FILE, {})
+        archived = False
+        total = {}
+        for path in directory.glob('*-*.json'):
+            series = coordination.read_json(path, {})
+            pid = int(path.name.split('-', 1)[0])
+            if _alive(pid) or pid == os.getpid():
+                _merge(total, series)
+            else:
+                _merge(archive, series)
+                path.unlink(missing_ok=True)
+                archived = True
+        if archived:
+            coordination.atomic_write_json(directory / ARCHIVE_FILE, archive)
+    return _merge(total, archive)
+
+
+# -------------------- Format texte Prometheus --------------------
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    items = [*sorted(labels.items()), *(extra or [])]
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}' if items else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=()):
+    """
+    Texte d'exposition Prometheus de toutes les séries, suivies des jauges
+    gauges: [(nom, aide, [(labels, valeur)])], ou (nom, aide, échantillons, 'counter')
+    pour un compteur tenu ailleurs (base SQLite...).
+    """
+    series = collect()
+    lines = []
+    for name, help_text in COUNTERS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        lines += [f"{name}{_labels(e['labels'])} {_number(e['value'])}"
+                  for e in sorted(series.values(), key=lambda e: _key(e['name'], e['labels'])) if e['name'] == name]
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for e in sorted(series.values(), key=lambda e: _key(e['name'], e['labels'])):
+            if e['name'] != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(bounds, e['buckets']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(e['labels'], [('le', _number(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(e['labels'], [('le', '+Inf')])} {e['count']}")
+            lines.append(f"{name}_sum{_labels(e['labels'])} {_number(float(e['sum']))}")
+            lines.append(f"{name}_count{_labels(e['labels'])} {e['count']}")
+    for name, help_text, samples, *kind in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind[0] if kind else 'gauge'}"]
+        lines += [f"{name}{_labels(labels)} {_number(value)}" for labels, value in samples]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,403 @@
+"""
+Modèles de VMs : box Vagrant, ressources et scripts de provisioning.
+
+Chaque script est découpé en deux parties :
+- la partie "base" (paquets, locale, clavier, bureau...) identique pour toutes
+  les VMs d'un modèle, intégrable dans une image de référence (golden image) ;
+- la partie "utilisateur" (compte, mots de passe) propre à chaque VM.
+"""
+import re
+import config
+
+# (os, type) -> box et ressources
+TEMPLATES = {
+    ('debian', 'client'): {'box': 'generic/debian12', 'memory': 4096, 'cpus': 2, 'serial_console': False},
+    ('debian', 'serveur'): {'box': 'generic/debian12', 'memory': 2048, 'cpus': 2, 'serial_console': True},
+    # TEMP: forcer Server 2022 pour client/serveur (Win10/11 trop lourdes / indisponibles)
+    ('windows', None): {'box': 'peru/windows-server-2022-standard-x64-eval', 'memory': 6144, 'cpus': 2, 'serial_console': False},
+}
+DEFAULT_TEMPLATE = {'box': 'generic/debian12', 'memory': 2048, 'cpus': 2, 'serial_console': False}
+
+
+def template_key(os_name, vm_type):
+    """Clé de TEMPLATES pour un couple (os, type) saisi par l'utilisateur, ou None."""
+    if os_name == "debian":
+        return ('debian', 'client') if vm_type == "client" else ('debian', 'serveur')
+    if os_name == "windows":
+        return ('windows', None)
+    return None
+
+
+def template_name(os_name, vm_type):
+    """Nom court d'un modèle ('debian-client', 'debian-serveur', 'windows'), ou None."""
+    key = template_key(os_name, vm_type)
+    if key is None:
+        return None
+    return '-'.join(k for k in key if k)
+
+
+def get_template(os_name, vm_type):
+    """Box et ressources (dict: box, memory, cpus, serial_console) pour un couple (os, type)."""
+    return dict(TEMPLATES.get(template_key(os_name, vm_type), DEFAULT_TEMPLATE))
+
+
+# -------------------- Debian client (XFCE) --------------------
+DEBIAN_CLIENT_BASE_SCRIPT = """
+export DEBIAN_FRONTEND=noninteractive
+apt-get update
+
+# Préselectionner LightDM comme display manager (évite l'invite non-interactive)
+echo "lightdm shared/default-x-display-manager select lightdm" | debconf-set-selections
+
+# Paquets clavier/locale
+apt-get install -y kbd console-setup keyboard-configuration locales
+
+# Locale FR
+sed -i 's/# fr_FR.UTF-8 UTF-8/fr_FR.UTF-8 UTF-8/' /etc/locale.gen
+locale-gen
+update-locale LANG=fr_FR.UTF-8
+
+# Clavier FR (console + X11)
+cat > /etc/default/keyboard << 'EOF'
+XKBMODEL="pc105"
+XKBLAYOUT="fr"
+XKBVARIANT=""
+XKBOPTIONS=""
+BACKSPACE="guess"
+EOF
+dpkg-reconfigure -f noninteractive keyboard-configuration || true
+setupcon --force --save || true
+loadkeys fr 2>/dev/null || true
+mkdir -p /etc/X11/xorg.conf.d
+cat > /etc/X11/xorg.conf.d/00-keyboard.conf << 'EOF'
+Section "InputClass"
+    Identifier "system-keyboard"
+    MatchIsKeyboard "on"
+    Option "XkbModel" "pc105"
+    Option "XkbLayout" "fr"
+    Option "XkbVariant" ""
+    Option "XkbOptions" ""
+EndSection
+EOF
+
+# Bureau XFCE + LightDM + Xorg (+ greeter) + drivers utiles
+apt-get install -y xorg dbus-x11 policykit-1 \
+    lightdm lightdm-gtk-greeter lightdm-gtk-greeter-settings \
+    xfce4 xfce4-goodies \
+    xserver-xorg-input-libinput xserver-xorg-video-qxl \
+    network-manager-gnome fonts-dejavu
+
+# S'assurer que LightDM est le display manager par défaut
+echo "/usr/sbin/lightdm" > /etc/X11/default-display-manager
+
+# Démarrage graphique par défaut et démarrage immédiat
+systemctl set-default graphical.target
+systemctl enable lightdm
+systemctl restart lightdm || systemctl start display-manager || true
+""".strip()
+
+
+def _debian_client_user_script(vm_username, vm_password, root_pass_snippet):
+    return f"""
+# Utilisateur
+useradd -m -s /bin/bash {vm_username} || true
+echo "{vm_username}:{vm_password}" | chpasswd
+usermod -aG sudo {vm_username}
+mkdir -p /home/{vm_username}
+echo "startxfce4" > /home/{vm_username}/.xsession
+chown -R {vm_username}:{vm_username} /home/{vm_username}
+
+# Autologin LightDM (optionnel)
+mkdir -p /etc/lightdm/lightdm.conf.d
+cat > /etc/lightdm/lightdm.conf.d/50-autologin.conf << 'EOF'
+[Seat:*]
+autologin-user={vm_username}
+autologin-user-timeout=0
+EOF
+
+# Mot de passe root obligatoire (déjà validé côté backend)
+{root_pass_snippet}
+
+echo "✅ XFCE + LightDM installés et démarrés (mode graphique)."
+""".strip()
+
+
+# -------------------- Debian serveur (console) --------------------
+DEBIAN_SERVER_BASE_SCRIPT = """
+export DEBIAN_FRONTEND=noninteractive
+apt-get update
+apt-get install -y kbd console-setup keyboard-configuration locales
+
+# Locale FR
+sed -i 's/# fr_FR.UTF-8 UTF-8/fr_FR.UTF-8 UTF-8/' /etc/locale.gen
+locale-gen
+update-locale LANG=fr_FR.UTF-8
+
+# Clavier FR (console)
+cat > /etc/default/keyboard << 'EOF'
+XKBMODEL="pc105"
+XKBLAYOUT="fr"
+XKBVARIANT=""
+XKBOPTIONS=""
+BACKSPACE="guess"
+EOF
+
+debconf-set-selections << 'DEB'
+keyboard-configuration keyboard-configuration/layoutcode string fr
+keyboard-configuration keyboard-configuration/modelcode string pc105
+DEB
+dpkg-reconfigure -f noninteractive keyboard-configuration
+setupcon --force --save || true
+loadkeys fr 2>/dev/null || true
+udevadm trigger --subsystem-match=input --action=change || true
+
+# Console série
+systemctl enable serial-getty@ttyS0.service
+systemctl start serial-getty@ttyS0.service
+echo "ttyS0" >> /etc/securetty
+""".strip()
+
+
+def _debian_server_user_script(vm_username, vm_password, root_pass_snippet):
+    return f"""
+{root_pass_snippet}# mot de passe root défini
+# utilisateur
+useradd -m -s /bin/bash {vm_username} || true
+echo "{vm_username}:{vm_password}" | chpasswd
+usermod -aG sudo {vm_username}
+
+echo "✅ Clavier FR activé (console)"
+""".strip()
+
+
+# -------------------- Windows --------------------
+def _windows_script(vm_username, vm_password, root_password):
+    return f"""
+# Configuration Windows - Clavier AZERTY uniquement
+# Interface reste en anglais pour eviter redemarrage
+
+Write-Host "=== Configuration Windows ==="
+
+# 1. Desactiver la complexite des mots de passe
+Write-Host "Desactivation complexite mots de passe..."
+secedit /export /cfg C:\\secpol.cfg | Out-Null
+(Get-Content C:\\secpol.cfg).replace("PasswordComplexity = 1", "PasswordComplexity = 0") | Out-File C:\\secpol.cfg
+secedit /configure /db C:\\windows\\security\\local.sdb /cfg C:\\secpol.cfg /areas SECURITYPOLICY | Out-Null
+Remove-Item -Force C:\\secpol.cfg -ErrorAction SilentlyContinue
+
+# 2. Configuration clavier AZERTY SYSTEME (pour toute la VM)
+Write-Host "Configuration clavier AZERTY systeme..."
+
+# METHODE PRINCIPALE: Forcer le clavier par defaut au niveau systeme
+# Cette commande force AZERTY pour TOUS les utilisateurs (y compris ecran de connexion)
+Set-WinDefaultInputMethodOverride -InputTip "040c:0000040c"
+
+# Configuration culture/region
+Set-Culture fr-FR -ErrorAction SilentlyContinue
+Set-WinHomeLocation -GeoId 84 -ErrorAction SilentlyContinue
+Set-TimeZone -Id "Romance Standard Time" -ErrorAction SilentlyContinue
+
+# Monter le registre HKU
+$null = New-PSDrive -Name HKU -PSProvider Registry -Root HKEY_USERS -ErrorAction SilentlyContinue
+
+# Configuration registre .DEFAULT (ecran de connexion et nouveaux comptes)
+New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Force -ErrorAction SilentlyContinue | Out-Null
+Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Name "1" -Value "0000040c" -Force
+
+# Substitutes pour forcer AZERTY
+New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Substitutes" -Force -ErrorAction SilentlyContinue | Out-Null
+Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Substitutes" -Name "00000409" -Value "0000040c" -Force
+
+# Configuration machine globale
+New-Item -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Keyboard Layout\\DosKeybCodes" -Force -ErrorAction SilentlyContinue | Out-Null
+Set-ItemProperty -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Keyboard Layout\\DosKeybCodes" -Name "0000040c" -Value "fr" -Force
+
+# Definir AZERTY comme clavier par defaut dans le profil par defaut
+New-Item -Path "HKU:\\.DEFAULT\\Control Panel\\International" -Force -ErrorAction SilentlyContinue | Out-Null
+Set-ItemProperty -Path "HKU:\\.DEFAULT\\Control Panel\\International" -Name "LocaleName" -Value "fr-FR" -Force
+
+# Configuration du clavier au niveau systeme (Apply to all users)
+$LangList = New-WinUserLanguageList fr-FR
+Set-WinUserLanguageList $LangList -Force
+Set-Culture fr-FR
+Set-WinSystemLocale fr-FR
+Set-WinUILanguageOverride fr-FR
+Set-TimeZone -Id "Romance Standard Time"
+
+# Clavier FR pour l'écran de logon
+New-Item -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Force | Out-Null
+Set-ItemProperty -Path "HKU:\\.DEFAULT\\Keyboard Layout\\Preload" -Name "1" -Value "0000040C"
+
+# Définir le mot de passe Administrator (obligatoire)
+$adminPass = ConvertTo-SecureString "{root_password}" -AsPlainText -Force
+Set-LocalUser -Name "Administrator" -Password $adminPass
+
+# Créer l'utilisateur élève si absent et l'ajouter aux admins
+$username = "{vm_username}"
+$password = ConvertTo-SecureString "{vm_password}" -AsPlainText -Force
+
+$userExists = Get-LocalUser -Name $username -ErrorAction SilentlyContinue
+if (-not $userExists) {{
+  New-LocalUser -Name $username -Password $password -FullName "{vm_username}" -PasswordNeverExpires
+  Add-LocalGroupMember -Group "Administrators" -Member $username
+}}
+
+# Activer RDP (utile pour debug)
+Set-ItemProperty -Path "HKLM:\\SYSTEM\\CurrentControlSet\\Control\\Terminal Server" -Name "fDenyTSConnections" -Value 0
+Enable-NetFirewallRule -DisplayGroup "Remote Desktop" -ErrorAction SilentlyContinue
+Set-Service -Name TermService -StartupType Automatic
+Start-Service TermService -ErrorAction SilentlyContinue
+
+Write-Host "✅ Windows configuré (FR + Admin + RDP)."
+""".strip()
+
+
+# -------------------- Agent invité --------------------
+# Canal déclaré dans le Vagrantfile (org.qemu.guest_agent.0) : permet d'agir
+# dans la VM sans SSH (comptes des VMs du pool préchauffé, etc.)
+GUEST_AGENT_SCRIPT = """
+apt-get install -y qemu-guest-agent
+systemctl enable --now qemu-guest-agent || true
+""".strip()
+
+
+# -------------------- Assemblage --------------------
+def root_password_snippet(root_password):
+    """Commandes shell définissant le mot de passe root (Debian uniquement)."""
+    if not root_password:
+        return ""
+    return f'''echo "root:{root_password}" | chpasswd
+usermod -U root || true
+'''
+
+
+def base_script(os_name, vm_type):
+    """Partie commune du provisioning (intégrable dans une golden image), '' si aucune."""
+    key = template_key(os_name, vm_type)
+    if key == ('debian', 'client'):
+        return DEBIAN_CLIENT_BASE_SCRIPT + "\n\n" + GUEST_AGENT_SCRIPT
+    if key == ('debian', 'serveur'):
+        return DEBIAN_SERVER_BASE_SCRIPT + "\n\n" + GUEST_AGENT_SCRIPT
+    return ""
+
+
+def user_script(os_name, vm_type, vm_username, vm_password, root_password):
+    """Partie propre à la VM : compte utilisateur et mots de passe."""
+    key = template_key(os_name, vm_type)
+    if key == ('debian', 'client'):
+        return _debian_client_user_script(vm_username, vm_password, root_password_snippet(root_password))
+    if key == ('debian', 'serveur'):
+        return _debian_server_user_script(vm_username, vm_password, root_password_snippet(root_password))
+    if key == ('windows', None):
+        return _windows_script(vm_username, vm_password, root_password)
+    return ""
+
+
+def full_script(os_name, vm_type, vm_username, vm_password, root_password):
+    """Script de provisioning complet (base + utilisateur) pour une VM construite depuis la box d'origine."""
+    parts = [base_script(os_name, vm_type), user_script(os_name, vm_type, vm_username, vm_password, root_password)]
+    return "\n\n".join(p for p in parts if p)
+
+
+# -------------------- Vagrantfile --------------------
+_LV_MEMORY_RE = re.compile(r'^([ \t]*)lv\.memory\s*=\s*(\d+)[ \t]*$', re.MULTILINE)
+
+
+def balloon_maximum_mb(memory):
+    """Mémoire maximale du domaine (MB) : celle du modèle, majorée si le ballon mémoire est actif."""
+    if not config.MEMORY_BALANCER_ENABLED:
+        return int(memory)
+    return int(int(memory) * max(1.0, config.MEMORY_BALLOON_MAX_FACTOR))
+
+
+def vagrantfile_memory_mb(content):
+    """Mémoire nominale (MB, lv.memory) d'un Vagrantfile, ou None."""
+    match = _LV_MEMORY_RE.search(content or '')
+    return int(match.group(2)) if match else None
+
+
+def set_vagrantfile_memory(content, memory_mb):
+    """Contenu du Vagrantfile avec lv.memory = `memory_mb` (mémoire nominale), ou None sans lv.memory."""
+    match = _LV_MEMORY_RE.search(content or '')
+    if match is None:
+        return None
+    return content[:match.start()] + f"{match.group(1)}lv.memory = {int(memory_mb)}" + content[match.end():]
+
+
+def render_vagrantfile(box_name, hostname, memory, cpus, serial_console=False, windows=False,
+                      provision_script="", box_version=None, insert_key=True):
+    """
+    Génère le contenu du Vagrantfile d'une VM (provider libvirt, console VNC).
+    Windows : le script doit être écrit à côté, dans provision.ps1.
+    insert_key=False conserve la clé Vagrant publique (VM destinée à devenir une box).
+    lv.memory est la mémoire nominale : vagrant-libvirt en fait la mémoire maximale et
+    actuelle du domaine, la VM démarre donc avec la mémoire du modèle (celle que
+    l'ordonnanceur admet). Avec le ballon mémoire (MEMORY_BALANCER_ENABLED), seul le
+    maximum de la définition persistante est relevé (memory_balancer.ensure_maximum),
+    les lancements suivants passant par libvirt ; memory_balancer ajuste ensuite le ballon.
+    """
+    vagrantfile_content = f"""# -*- mode: ruby -*-
+# vi: set ft=ruby :
+
+Vagrant.configure("2") do |config|
+  config.vm.box = "{box_name}"
+  config.vm.hostname = "{hostname}"
+"""
+    if box_version:
+        vagrantfile_content += f"""  config.vm.box_version = "{box_version}"
+"""
+    if not insert_key:
+        vagrantfile_content += """  config.ssh.insert_key = false
+"""
+
+    # Windows: communicator WinRM
+    if windows:
+        vagrantfile_content += """
+  config.vm.guest = :windows
+  config.vm.communicator = "winrm"
+  config.winrm.username = "vagrant"
+  config.winrm.password = "vagrant"
+  config.vm.boot_timeout = 1800
+  config.vm.graceful_halt_timeout = 900
+"""
+
+    vagrantfile_content += f"""
+  config.vm.provider :libvirt do |lv|
+    lv.memory = {int(memory)}
+    lv.cpus = {cpus}
+    lv.graphics_type = "vnc"
+    lv.graphics_websocket = -1
+    lv.graphics_ip = "127.0.0.1"
+    lv.video_type = "qxl"
+    lv.keymap = "fr"
+    lv.storage_pool_name = "default"
+    lv.channel :type => 'unix', :target_name => 'org.qemu.guest_agent.0', :target_type => 'virtio'
+"""
+    if config.MEMORY_BALANCER_ENABLED:
+        vagrantfile_content += """    lv.memballoon_enabled = true
+    lv.memballoon_model = "virtio"
+"""
+    if serial_console:
+        vagrantfile_content += """    lv.serial :type => "pty", :target_port => "0"
+"""
+    vagrantfile_content += """  end
+
+  config.vm.synced_folder ".", "/vagrant", type: "rsync", rsync__auto: true, disabled: true
+  config.vm.network "private_network", type: "dhcp", libvirt__network_name: "default"
+"""
+
+    # Provisioning
+    if provision_script:
+        if windows:
+            vagrantfile_content += """
+  config.vm.provision "shell", privileged: true, path: "provision.ps1"
+"""
+        else:
+            vagrantfile_content += f"""
+  config.vm.provision "shell", inline: <<-SHELL
+{provision_script}
+  SHELL
+"""
+
+    vagrantfile_content += "end\n"
+    return vagrantfile_content
@@ -0,0 +1,266 @@
+"""
+Ordonnanceur des démarrages de VMs (création, lancement, construction d'image) avec contrôle d'admission.
+
+Branché sur la file de tâches (jobs.set_selector) :
+- au plus SCHEDULER_MAX_CONCURRENT_BOOTS démarrages simultanés (tous workers confondus) ;
+- une tâche n'est admise que si l'hôte a la mémoire et les CPU nécessaires :
+  ressources de l'hôte (libvirt nodeinfo, sinon /proc/meminfo) moins ce qui est
+  déjà engagé par les domaines actifs (réservations de memory_balancer si le
+  ballon mémoire est actif) et les démarrages en cours ;
+- le reste attend, dans l'ordre FIFO ou équitable par utilisateur ('fair'). Une
+  demande qui dépasse ce que l'hôte vide pourrait admettre est refusée à la soumission
+  (capacity_error) ; une création ou un lancement encore en file après
+  SCHEDULER_MAX_QUEUE_WAIT secondes (hors opérations groupées, bridées à dessein)
+  échoue avec un message plutôt que d'attendre sans fin.
+
+Les ressources de l'hôte (appels libvirt, virsh en repli) sont relevées par prepare(),
+avant la transaction de réservation : le choix sous verrou de la base ne lit que
+l'instantané en cache.
+
+Les autres tâches (arrêt, suppression...) ne sont retenues que par la limite de
+leur opération groupée (bulk_ops : au plus payload['parallel'] tâches d'une même
+opération en cours). Le préchauffage du pool passe en dernier et laisse toujours
+un créneau de démarrage libre.
+"""
+import json
+import os
+import threading
+import time
+import config
+import db
+import jobs
+import libvirt_conn
+import memory_balancer
+
+BOOT_KINDS = {'create', 'launch', 'golden_build', 'pool_warm'}
+BACKGROUND_KINDS = {'pool_warm'}  # passent après les demandes des utilisateurs
+EXPIRING_KINDS = {'create', 'launch'}  # demandes des utilisateurs : échec plutôt qu'attente sans fin
+MAX_CONCURRENT_BOOTS = config.SCHEDULER_MAX_CONCURRENT_BOOTS
+POLICY = config.SCHEDULER_POLICY                # 'fifo' ou 'fair'
+RESERVED_HOST_MB = config.SCHEDULER_RESERVED_MB  # mémoire gardée pour l'hôte
+MEMORY_OVERCOMMIT = config.SCHEDULER_MEMORY_OVERCOMMIT
+CPU_OVERCOMMIT = config.SCHEDULER_CPU_OVERCOMMIT
+MAX_QUEUE_WAIT = config.SCHEDULER_MAX_QUEUE_WAIT
+HOST_CACHE_TTL = 5.0
+
+_host_cache = {'at': 0.0, 'host': None}
+_host_lock = threading.Lock()
+
+
+# -------------------- Ressources de l'hôte --------------------
+def _read_meminfo():
+    """Retourne (MemTotal, MemAvailable) en MB depuis /proc/meminfo, ou (None, None)."""
+    values = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                values[key] = int(rest.split()[0]) // 1024  # kB
+    except (OSError, ValueError, IndexError):
+        return None, None
+    return values.get('MemTotal'), values.get('MemAvailable')
+
+
+def committed_mb(stats):
+    """
+    Mémoire engagée par les domaines actifs (MB) : maximum de chaque domaine ou, avec
+    le ballon mémoire, sa réservation (memory_balancer), à défaut sa mémoire actuelle.
+    """
+    if not config.MEMORY_BALANCER_ENABLED:
+        return sum(s.get('balloon.maximum', 0) for s in stats.values()) // 1024  # KiB
+    reserved = memory_balancer.reservations()
+    return int(sum(max(s.get('balloon.current', 0) / 1024, reserved.get(name, 0)) for name, s in stats.items()))
+
+
+def host_snapshot():
+    """
+    Ressources de l'hôte et engagements des domaines actifs (mis en cache quelques secondes) :
+    {'memory_mb', 'available_mb', 'cpus', 'committed_mb', 'committed_vcpus'}
+    """
+    with _host_lock:
+        if _host_cache['host'] is not None and time.time() - _host_cache['at'] < HOST_CACHE_TTL:
+            return _host_cache['host']
+
+        mem_total, mem_available = _read_meminfo()
+        node = libvirt_conn.get_node_info() or {}
+        stats = libvirt_conn.get_all_domain_stats(('balloon', 'vcpu'), active_only=True)
+        host = {
+            'memory_mb': node.get('memory_mb') or mem_total or 0,
+            'available_mb': mem_available,
+            'cpus': node.get('cpus') or os.cpu_count() or 1,
+            'committed_mb': committed_mb(stats),
+            'committed_vcpus': sum(s.get('vcpu.current', 0) for s in stats.values()),
+        }
+        _host_cache.update(at=time.time(), host=host)
+        return host
+
+
+# -------------------- Politique --------------------
+def _resources(job):
+    payload = job['payload']
+    return int(payload.get('memory') or 0), int(payload.get('cpus') or 0)
+
+
+def ordered(queued, running, policy=None):
+    """
+    Ordre de passage des tâches en attente : FIFO, ou équitable (rang par utilisateur
+    puis ancienneté). Les tâches de fond (BACKGROUND_KINDS) passent toujours après.
+    """
+    if (policy or POLICY) != 'fair':
+        return sorted(queued, key=lambda j: (j['kind'] in BACKGROUND_KINDS, j['id']))
+    active = {}
+    for job in running:
+        active[job['owner']] = active.get(job['owner'], 0) + 1
+    ranked = []
+    for job in sorted(queued, key=lambda j: j['id']):
+        rank = active.get(job['owner'], 0)
+        active[job['owner']] = rank + 1
+        ranked.append((job['kind'] in BACKGROUND_KINDS, rank, job['id'], job))
+    return [t[-1] for t in sorted(ranked, key=lambda t: t[:3])]
+
+
+def capacity_error(memory, cpus, host=None):
+    """
+    Message si `memory` (MB) ou `cpus` dépassent ce que l'hôte, sans aucune VM active,
+    pourrait admettre (la tâche ne passerait jamais), None sinon.
+    """
+    host = host or host_snapshot()
+    if host['memory_mb']:
+        limit_mb = host['memory_mb'] * MEMORY_OVERCOMMIT - RESERVED_HOST_MB
+        if host.get('available_mb') is not None:
+            limit_mb = min(limit_mb, host['memory_mb'] - RESERVED_HOST_MB)
+        if memory > limit_mb:
+            return f"Mémoire demandée ({memory} MB) supérieure à la capacité de l'hôte ({max(0, int(limit_mb))} MB)."
+    if cpus > host['cpus'] * CPU_OVERCOMMIT:
+        return f"CPUs demandés ({cpus}) supérieurs à la capacité de l'hôte ({int(host['cpus'] * CPU_OVERCOMMIT)})."
+    return None
+
+
+def fits(job, running, host, max_boots=None):
+    """Vrai si la tâche de démarrage peut être admise maintenant (plafond + mémoire + CPU)."""
+    boots = [j for j in running if j['kind'] in BOOT_KINDS]
+    if len(boots) >= (max_boots or MAX_CONCURRENT_BOOTS):
+        return False
+    if job['kind'] in BACKGROUND_KINDS:
+        background = [j for j in boots if j['kind'] in BACKGROUND_KINDS]
+        if len(background) >= max(1, (max_boots or MAX_CONCURRENT_BOOTS) - 1):
+            return False
+    memory, cpus = _resources(job)
+    pending_mb = sum(_resources(j)[0] for j in boots)
+    pending_cpus = sum(_resources(j)[1] for j in boots)
+
+    if host['memory_mb']:
+        free_mb = host['memory_mb'] * MEMORY_OVERCOMMIT - host['committed_mb'] - RESERVED_HOST_MB - pending_mb
+        if host.get('available_mb') is not None:
+            free_mb = min(free_mb, host['available_mb'] - RESERVED_HOST_MB - pending_mb)
+        if memory > free_mb:
+            return False
+    return host['committed_vcpus'] + pending_cpus + cpus <= host['cpus'] * CPU_OVERCOMMIT
+
+
+def bulk_slot_free(job, running):
+    """Vrai si la tâche n'appartient à aucune opération groupée, ou si celle-ci a un créneau libre."""
+    bulk_id = job['payload'].get('bulk_id')
+    if bulk_id is None:
+        return True
+    active = sum(1 for j in running if j['payload'].get('bulk_id') == bulk_id)
+    return active < max(1, int(job['payload'].get('parallel') or 1))
+
+
+def pick_next(queued, running, host, policy=None, max_boots=None):
+    """
+    Choisit la prochaine tâche à exécuter. Les démarrages passent dans l'ordre de la
+    politique ; le premier qui ne rentre pas bloque les suivants (pas de famine), sauf
+    s'il dépasse la capacité de l'hôte : il ne passerait jamais, il est ignoré.
+    """
+    boot_blocked = False
+    for job in ordered(queued, running, policy):
+        if not bulk_slot_free(job, running):
+            continue
+        if job['kind'] not in BOOT_KINDS:
+            return job
+        if boot_blocked or capacity_error(*_resources(job), host):
+            continue
+        if fits(job, running, host, max_boots):
+            return job
+        boot_blocked = True
+    return None
+
+
+def _as_job(row):
+    job = dict(row)
+    job['payload'] = json.loads(row['payload'] or '{}')
+    return job
+
+
+def prepare(now=None):
+    """
+    Avant chaque réservation, hors transaction (jobs.set_selector) : relève les ressources
+    de l'hôte si des démarrages attendent, et termine en échec les créations/lancements
+    qui ne passeraient jamais ou attendent depuis plus de MAX_QUEUE_WAIT secondes.
+    """
+    rows = db.get_db().execute(
+        f"SELECT id, kind, payload, created_at FROM jobs WHERE state = 'queued' "
+        f"AND kind IN ({', '.join('?' for _ in BOOT_KINDS)})", tuple(BOOT_KINDS)
+    ).fetchall()
+    if not rows:
+        return
+    host = host_snapshot()
+    now = now or time.time()
+    for job in map(_as_job, rows):
+        if job['kind'] not in EXPIRING_KINDS:
+            continue
+        error = capacity_error(*_resources(job), host)
+        if error is None and job['payload'].get('bulk_id') is None and now - job['created_at'] > MAX_QUEUE_WAIT:
+            error = (f"Démarrage non admis après {MAX_QUEUE_WAIT // 60} min d'attente (hôte saturé), "
+                     "réessayez plus tard.")
+        if error and jobs.fail_queued(job['id'], error):
+            print(f"[scheduler] Tâche #{job['id']} ({job['kind']}) abandonnée : {error}")
+
+
+def _select(candidates, running):
+    """Adaptateur pour jobs.set_selector (lignes SQLite -> dicts), sans appel externe."""
+    queued = [_as_job(r) for r in candidates]
+    running = [_as_job(r) for r in running]
+    host = _host_cache['host']  # relevé par prepare()
+    if host is None:
+        queued = [j for j in queued if j['kind'] not in BOOT_KINDS]
+    job = pick_next(queued, running, host)
+    if job is None:
+        return None
+    return next(r for r in candidates if r['id'] == job['id'])
+
+
+# -------------------- Consultation --------------------
+def _queued_and_running():
+    rows = db.get_db().execute("SELECT * FROM jobs WHERE state IN ('queued', 'running')").fetchall()
+    queued = [_as_job(r) for r in rows if r['state'] == 'queued']
+    running = [_as_job(r) for r in rows if r['state'] == 'running']
+    return queued, running
+
+
+def queue_position(job_id):
+    """Position (1 = prochaine) d'une tâche de démarrage en attente, None sinon."""
+    queued, running = _queued_and_running()
+    boots = [j for j in ordered(queued, running) if j['kind'] in BOOT_KINDS]
+    for position, job in enumerate(boots, start=1):
+        if job['id'] == job_id:
+            return position
+    return None
+
+
+def status():
+    """État de l'ordonnanceur pour l'administration."""
+    queued, running = _queued_and_running()
+    return {
+        'policy': POLICY,
+        'max_concurrent_boots': MAX_CONCURRENT_BOOTS,
+        'running_boots': len([j for j in running if j['kind'] in BOOT_KINDS]),
+        'queued_boots': len([j for j in queued if j['kind'] in BOOT_KINDS]),
+        'host': host_snapshot(),
+    }
+
+
+def install():
+    """Active l'ordonnanceur sur la file de tâches."""
+    jobs.set_selector(_select, prepare)
@@ -0,0 +1,297 @@
+"""
+Télémétrie des VMs : CPU, mémoire, E/S disque et réseau par domaine.
+
+Un seul worker (leader "vm-telemetry") échantillonne tous les domaines actifs en
+un appel par intervalle (statistiques groupées libvirt, virConnectGetAllDomainStats,
+repli `virsh domstats`) : le nombre d'appels à l'hyperviseur ne dépend pas du
+nombre de VMs.
+
+- Historique récent : un tampon circulaire de taille fixe par domaine
+  (TELEMETRY_RING_SIZE échantillons), fichier DATA_DIR/telemetry/<domaine>.ring
+  projeté en mémoire (mmap) et lu comme un tableau de doubles. Mémoire bornée,
+  lisible sans copie par tous les workers.
+- Dernier échantillon de chaque domaine : telemetry_latest.json (classement top-N).
+- Historique long : moyennes sur TELEMETRY_HISTORY_INTERVAL secondes dans la table
+  SQLite `vm_stats_history`, conservées TELEMETRY_HISTORY_DAYS jours.
+"""
+from array import array
+import mmap
+import os
+import threading
+import time
+import config
+import coordination
+import db
+import libvirt_conn
+import vm_state_cache
+
+INTERVAL = config.TELEMETRY_INTERVAL
+RING_SIZE = config.TELEMETRY_RING_SIZE
+HISTORY_INTERVAL = config.TELEMETRY_HISTORY_INTERVAL
+HISTORY_DAYS = config.TELEMETRY_HISTORY_DAYS
+
+RING_DIR = 'telemetry'
+LATEST_FILE = 'telemetry_latest.json'
+STATS_GROUPS = ('cpu-total', 'balloon', 'vcpu', 'interface', 'block')
+
+# Champs d'un échantillon (un double chacun) ; 'time' en secondes epoch
+FIELDS = ('time', 'cpu_pct', 'mem_used_mb', 'mem_total_mb',
+          'disk_read_bps', 'disk_write_bps', 'net_rx_bps', 'net_tx_bps')
+METRICS = FIELDS[1:]
+
+# En-tête du fichier (doubles) : version, capacité, nombre de champs, échantillons écrits
+RING_VERSION = 1.0
+HEADER_SLOTS = 4
+
+db.register_schema(f"""
+CREATE TABLE IF NOT EXISTS vm_stats_history (
+    domain TEXT NOT NULL,
+    time REAL NOT NULL,
+    samples INTEGER NOT NULL,
+    {', '.join(f'{m} REAL' for m in METRICS)},
+    PRIMARY KEY (domain, time)
+);
+CREATE INDEX IF NOT EXISTS idx_vm_stats_history_time ON vm_stats_history(time);
+""")
+
+
+# -------------------- Tampon circulaire (fichier projeté en mémoire) --------------------
+class Ring:
+    """
+    Tampon circulaire de `capacity` échantillons, dans un fichier projeté en mémoire.
+    Un seul écrivain (le collecteur) ; les lecteurs écartent les échantillons que
+    l'écrivain a pu écraser pendant leur lecture.
+    """
+
+    def __init__(self, path, capacity=None, create=False):
+        self.path = path
+        if create:
+            capacity = capacity or RING_SIZE
+            size = (HEADER_SLOTS + (capacity + 1) * len(FIELDS)) * 8
+            try:
+                current = os.stat(path).st_size
+            except OSError:
+                current = None
+            if current != size:
+                # Nouveau fichier (absent ou capacité modifiée), remplacé par rename :
+                # les lecteurs qui projettent l'ancien ne le voient jamais rétrécir.
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, 'wb') as f:
+                    f.write(array('d', [RING_VERSION, capacity, len(FIELDS), 0]).tobytes())
+                    f.truncate(size)
+                os.replace(tmp, path)
+        fd = os.open(path, os.O_RDWR if create else os.O_RDONLY)
+        try:
+            self.inode = os.fstat(fd).st_ino
+            self._mmap = mmap.mmap(fd, 0, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self.data = memoryview(self._mmap).cast('d')
+        self.capacity = int(self.data[1])
+        self.slots = self.capacity + 1  # une case de plus : celle que l'écrivain remplit
+
+    @property
+    def written(self):
+        return int(self.data[3])
+
+    def append(self, values):
+        """Ajoute un échantillon (valeurs dans l'ordre de FIELDS), en écrasant le plus ancien."""
+        written = self.written
+        start = HEADER_SLOTS + (written % self.slots) * len(FIELDS)
+        self.data[start:start + len(FIELDS)] = array('d', values)
+        self.data[3] = written + 1  # publié après l'échantillon
+
+    def samples(self, since=0.0):
+        """Échantillons plus récents que `since`, du plus ancien au plus récent ([dict])."""
+        written = self.written
+        window = []
+        for n in range(max(0, written - self.capacity), written):
+            start = HEADER_SLOTS + (n % self.slots) * len(FIELDS)
+            window.append((n, self.data[start:start + len(FIELDS)].tolist()))
+        # L'échantillon n est écrasé par l'écriture n + slots (éventuellement en cours) :
+        # on écarte ceux que l'écrivain a pu atteindre pendant la lecture.
+        oldest_safe = self.written - self.slots + 1
+        return [dict(zip(FIELDS, row)) for n, row in window if n >= oldest_safe and row[0] > since]
+
+    def close(self):
+        self.data.release()
+        self._mmap.close()
+
+
+# -------------------- Lecture (tous workers) --------------------
+_readers = {}  # {nom_domaine: Ring} (par processus, projections en lecture seule)
+_readers_lock = threading.Lock()
+_latest = {'mtime': None, 'snapshot': None}
+
+
+def _ring_path(domain_name):
+    if '/' in domain_name or domain_name.startswith('.'):
+        raise ValueError(f"Nom de domaine invalide: {domain_name}")
+    directory = coordination.data_path(RING_DIR)
+    directory.mkdir(exist_ok=True)
+    return directory / f"{domain_name}.ring"
+
+
+def _reader(domain_name):
+    """Projection du tampon du domaine (rouverte si le collecteur l'a recréé), None s'il n'existe pas."""
+    path = _ring_path(domain_name)
+    try:
+        inode = os.stat(path).st_ino
+    except OSError:
+        with _readers_lock:
+            _readers.pop(domain_name, None)
+        return None
+    with _readers_lock:
+        ring = _readers.get(domain_name)
+        if ring is None or ring.inode != inode:
+            # L'ancienne projection est libérée quand plus aucun lecteur ne la tient
+            ring = _readers[domain_name] = Ring(path)
+        return ring
+
+
+def recent(domain_name, since=0.0):
+    """Échantillons du tampon circulaire du domaine, plus récents que `since` (epoch)."""
+    ring = _reader(domain_name)
+    return ring.samples(since) if ring else []
+
+
+def history(domain_name, since):
+    """Moyennes enregistrées depuis `since` (epoch), par tranches de HISTORY_INTERVAL."""
+    rows = db.get_db().execute(
+        "SELECT * FROM vm_stats_history WHERE domain = ? AND time >= ? ORDER BY time", (domain_name, since)
+    ).fetchall()
+    return [{key: row[key] for key in ('time', 'samples', *METRICS)} for row in rows]
+
+
+def latest():
+    """Dernier échantillon de chaque domaine actif : {'updated_at', 'interval', 'domains': {nom: échantillon}}."""
+    path = coordination.data_path(LATEST_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {'updated_at': None, 'interval': INTERVAL, 'domains': {}}
+    with _readers_lock:
+        if mtime != _latest['mtime']:
+            _latest['snapshot'] = coordination.read_json(path, {'updated_at': None, 'interval': INTERVAL, 'domains': {}})
+            _latest['mtime'] = mtime
+        return _latest['snapshot']
+
+
+def top(metric, limit=10):
+    """Les `limit` domaines les plus consommateurs pour `metric` (dernier échantillon)."""
+    if metric not in METRICS:
+        raise ValueError(f"Métrique inconnue: {metric} (attendu: {', '.join(METRICS)})")
+    domains = latest()['domains']
+    ranked = sorted(domains.items(), key=lambda item: item[1].get(metric, 0), reverse=True)
+    return [{'domain': name, **values} for name, values in ranked[:limit]]
+
+
+# -------------------- Échantillonnage --------------------
+def _totals(stats, group, fields):
+    """Somme, sur tous les disques/interfaces, des compteurs `group.<i>.<champ>`."""
+    count = stats.get(f"{group}.count", 0)
+    return [sum(stats.get(f"{group}.{i}.{field}", 0) for i in range(count)) for field in fields]
+
+
+def _counters(stats):
+    """Compteurs cumulés d'un domaine : (temps CPU ns, octets lus, écrits, reçus, émis)."""
+    read, written = _totals(stats, 'block', ('rd.bytes', 'wr.bytes'))
+    received, sent = _totals(stats, 'net', ('rx.bytes', 'tx.bytes'))
+    return stats.get('cpu.time', 0), read, written, received, sent
+
+
+def _memory_mb(stats):
+    """(mémoire utilisée, mémoire allouée) en MB : vue de l'invité si le ballon la donne, sinon RSS."""
+    total = stats.get('balloon.current', 0) / 1024
+    if 'balloon.available' in stats and 'balloon.unused' in stats:
+        used = (stats['balloon.available'] - stats['balloon.unused']) / 1024
+    elif 'balloon.rss' in stats:
+        used = stats['balloon.rss'] / 1024
+    else:
+        used = total
+    return round(used, 1), round(total, 1)
+
+
+def sample(stats, previous, now):
+    """
+    Échantillon d'un domaine (valeurs dans l'ordre de FIELDS) à partir de ses statistiques
+    groupées et des compteurs du passage précédent (previous: (instant, compteurs)).
+    Retourne (échantillon ou None au premier passage, nouveaux compteurs).
+    """
+    counters = _counters(stats)
+    if previous is None or now <= previous[0]:
+        return None, (now, counters)
+    elapsed = now - previous[0]
+    # Compteur revenu en arrière (domaine redémarré) : débit nul sur cet intervalle
+    rates = [max(0, current - before) / elapsed for current, before in zip(counters, previous[1])]
+    cpu_pct = rates[0] / 1e9 / max(1, stats.get('vcpu.current', 1)) * 100
+    used, total = _memory_mb(stats)
+    return [now, round(cpu_pct, 2), used, total, *(round(rate, 1) for rate in rates[1:])], (now, counters)
+
+
+def new_state(now=None):
+    """État du collecteur : compteurs précédents, tampons ouverts, sommes de la tranche d'historique."""
+    return {'previous': {}, 'rings': {}, 'sums': {}, 'window_start': now or time.time()}
+
+
+def collect_once(state, now=None):
+    """Un passage : un appel de statistiques groupées pour tous les domaines actifs. Retourne leur nombre."""
+    stats = libvirt_conn.get_all_domain_stats(STATS_GROUPS, active_only=True)
+    now = now or time.time()
+    domains = {}
+    for name, domain_stats in stats.items():
+        values, state['previous'][name] = sample(domain_stats, state['previous'].get(name), now)
+        if values is None:
+            continue
+        ring = state['rings'].get(name)
+        if ring is None:
+            ring = state['rings'][name] = Ring(_ring_path(name), create=True)
+        ring.append(values)
+        domains[name] = dict(zip(FIELDS, values))
+        sums = state['sums'].setdefault(name, [0] * len(FIELDS))
+        sums[0] += 1
+        for i, value in enumerate(values[1:], 1):
+            sums[i] += value
+    # Domaines arrêtés : compteurs oubliés (leur tampon reste lisible)
+    for name in set(state['previous']) - set(stats):
+        state['previous'].pop(name, None)
+        state['rings'].pop(name, None)
+    coordination.atomic_write_json(coordination.data_path(LATEST_FILE),
+                                   {'updated_at': now, 'interval': INTERVAL, 'domains': domains})
+    if now - state['window_start'] >= HISTORY_INTERVAL:
+        _flush_history(state, now)
+    return len(stats)
+
+
+def _flush_history(state, now):
+    """Enregistre les moyennes de la tranche écoulée, purge l'historique expiré et les tampons orphelins."""
+    rows = [(name, state['window_start'], sums[0], *(total / sums[0] for total in sums[1:]))
+            for name, sums in state['sums'].items() if sums[0]]
+    with db.transaction() as conn:
+        conn.executemany(
+            f"INSERT OR REPLACE INTO vm_stats_history (domain, time, samples, {', '.join(METRICS)}) "
+            f"VALUES ({', '.join('?' for _ in range(len(METRICS) + 3))})", rows
+        )
+        conn.execute("DELETE FROM vm_stats_history WHERE time < ?", (now - HISTORY_DAYS * 86400,))
+    state['sums'], state['window_start'] = {}, now
+    # Tampons des domaines supprimés
+    known = vm_state_cache.get_states()
+    for path in coordination.data_path(RING_DIR).glob('*.ring'):
+        if path.stem not in known:
+            path.unlink(missing_ok=True)
+
+
+def _collector():
+    state = new_state()
+    while True:
+        started = time.time()
+        try:
+            collect_once(state)
+        except Exception as e:
+            print(f"[telemetry] Collecteur: {e}")
+        time.sleep(max(0.0, INTERVAL - (time.time() - started)))
+
+
+def start_collector():
+    """Démarre le collecteur dans le worker élu (les autres ne font que lire)."""
+    return coordination.run_as_leader('vm-telemetry', _collector)
@@ -0,0 +1,19 @@
+"""
+Configuration commune des tests : modules de backend/ importables, données dans un
+répertoire temporaire, sans threads de fond, libvirt sur le pilote de test
+(test:///default, aucun hyperviseur).
+
+Depuis backend/ :
+
+    python -m pytest -q tests
+"""
+from pathlib import Path
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ['VM_MANAGER_DATA_DIR'] = tempfile.mkdtemp(prefix='vm_manager_tests_')
+os.environ['VM_MANAGER_BACKGROUND'] = '0'
+os.environ['LIBVIRT_URI'] = 'test:///default'
+os.environ.setdefault('LIBVIRT_BACKEND', 'auto')
@@ -0,0 +1,70 @@
+"""
+Mémoire nominale des VMs à ballon : lv.memory reste la mémoire du modèle (démarrage,
+import vm_store, redimensionnement), seul le maximum du domaine est relevé.
+"""
+import pytest
+import config
+import libvirt_conn
+import memory_balancer
+import provisioning
+import vm_resize
+import vm_store
+
+DOMAIN_XML = "<domain><name>alice-tp1_default</name><memory unit='KiB'>{}</memory>" \
+             "<currentMemory unit='KiB'>{}</currentMemory></domain>"
+
+
+@pytest.fixture
+def balloon(monkeypatch):
+    monkeypatch.setattr(config, 'MEMORY_BALANCER_ENABLED', True)
+    monkeypatch.setattr(config, 'MEMORY_BALLOON_MAX_FACTOR', 1.5)
+
+
+@pytest.fixture
+def domain(monkeypatch):
+    """Domaine simulé : {'max': KiB, 'current': KiB} de sa définition persistante."""
+    memory = {'max': 4096 * 1024, 'current': 4096 * 1024}
+
+    def set_config(name, maximum_kib, kib):
+        memory.update(max=maximum_kib, current=kib)
+        return True, ''
+
+    monkeypatch.setattr(libvirt_conn, 'get_domain_xml',
+                        lambda name: DOMAIN_XML.format(memory['max'], memory['current']))
+    monkeypatch.setattr(libvirt_conn, 'set_domain_memory_config', set_config)
+    return memory
+
+
+def _vagrantfile(memory):
+    return provisioning.render_vagrantfile('debian/bookworm64', 'tp1', memory, 2)
+
+
+def test_vagrantfile_boots_at_template_memory(balloon):
+    content = _vagrantfile(4096)
+    assert 'lv.memory = 4096' in content
+    assert 'lv.memballoon_enabled = true' in content
+    assert provisioning.vagrantfile_memory_mb(content) == 4096
+
+
+def test_resize_and_import_agree(balloon, tmp_path):
+    vm_path = tmp_path / 'alice' / 'tp1'
+    vm_path.mkdir(parents=True)
+    (vm_path / 'Vagrantfile').write_text(_vagrantfile(4096))
+    assert vm_resize._update_vagrantfile_memory(vm_path, 8192)
+    content = (vm_path / 'Vagrantfile').read_text()
+    assert 'lv.memory = 8192' in content
+    assert vm_store._from_files(vm_path, 'alice')['memory'] == 8192
+    assert not vm_resize._update_vagrantfile_memory(tmp_path / 'absente', 8192)
+
+
+def test_ensure_maximum_raises_only_maximum(balloon, domain):
+    assert memory_balancer.ensure_maximum('alice-tp1_default', 4096, log=lambda _: None)
+    assert domain == {'max': 6144 * 1024, 'current': 4096 * 1024}
+    # Déjà relevé : définition inchangée
+    assert not memory_balancer.ensure_maximum('alice-tp1_default', 4096, log=lambda _: None)
+
+
+def test_ensure_maximum_without_balloon(domain, monkeypatch):
+    monkeypatch.setattr(config, 'MEMORY_BALANCER_ENABLED', False)
+    assert not memory_balancer.ensure_maximum('alice-tp1_default', 4096, log=lambda _: None)
+    assert domain == {'max': 4096 * 1024, 'current': 4096 * 1024}
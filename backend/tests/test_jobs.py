@@ -0,0 +1,41 @@
+"""
+File de tâches : réservation sans deux tâches sur la même VM, fenêtre de candidats
+non masquée par une opération groupée saturée.
+"""
+import pytest
+import db
+import jobs
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    monkeypatch.setattr(jobs, '_selector', {'fn': jobs._fifo, 'prepare': None})
+    db.get_db().execute("DELETE FROM jobs")
+    return db.get_db()
+
+
+def _claim():
+    row = jobs._claim_next()
+    return row['id'] if row else None
+
+
+def test_one_job_per_vm(queue):
+    first = jobs.submit('launch', 'tp1', 'alice', {})
+    second = jobs.submit('halt', 'tp1', 'alice', {})
+    other_owner = jobs.submit('launch', 'tp1', 'bob', {})
+    assert _claim() == first
+    assert _claim() == other_owner
+    assert _claim() is None
+    queue.execute("UPDATE jobs SET state = 'succeeded' WHERE id = ?", (first,))
+    assert _claim() == second
+
+
+def test_saturated_bulk_operation_does_not_hide_later_jobs(queue):
+    bulk = [jobs.submit('launch', f'vm{i}', f'student{i}', {'bulk_id': 7, 'parallel': 2}) for i in range(600)]
+    assert _claim() == bulk[0]
+    assert _claim() == bulk[1]
+    late = jobs.submit('launch', 'tp1', 'alice', {})
+    assert _claim() == late
+    assert _claim() is None
+    queue.execute("UPDATE jobs SET state = 'succeeded' WHERE id = ?", (bulk[0],))
+    assert _claim() == bulk[2]
@@ -0,0 +1,143 @@
+"""
+Couche libvirt : pilote libvirt-python contre test:///default (ignoré si libvirt-python
+est absent), pilote virsh et repli libvirt -> virsh avec le faux virsh des benchmarks.
+"""
+import os
+import pytest
+import libvirt_conn
+import vm_state_cache
+from benchmarks import fakes
+
+DOMAINS = {'alice-tp1_default': 'running', 'bob-tp1_default': 'shut off'}
+
+
+@pytest.fixture
+def libvirt_driver():
+    pytest.importorskip('libvirt')
+    driver = libvirt_conn.LibvirtDriver('test:///default')
+    yield driver
+    # Le pilote de test partage son état dans le processus : domaine 'test' remis en route
+    driver.start('test')
+
+
+@pytest.fixture
+def fake_virsh(tmp_path, monkeypatch):
+    """Faux virsh en tête du PATH ; retourne le fichier des domaines qu'il sert."""
+    monkeypatch.setenv('PATH', os.environ['PATH'])
+    monkeypatch.setenv('FAKE_VIRSH_DOMAINS', '')
+    monkeypatch.setenv('FAKE_VIRSH_LATENCY', '')
+    fakes.install_fake_virsh(tmp_path / 'bin', DOMAINS)
+    return tmp_path / 'bin' / 'domains.txt'
+
+
+class FailingDriver(libvirt_conn.LibvirtDriver):
+    """Pilote libvirt dont tous les appels échouent (libvirtd injoignable)."""
+
+    def _call(self, fn):
+        raise RuntimeError('libvirtd injoignable')
+
+
+# -------------------- Pilote libvirt (test:///default) --------------------
+def test_libvirt_all_domains(libvirt_driver):
+    domains = libvirt_driver.all_domains()
+    assert domains['test']['state'] == 'running'
+    assert isinstance(domains['test']['id'], int)
+
+
+def test_libvirt_state_and_xml(libvirt_driver):
+    assert libvirt_driver.state('test') == 'running'
+    assert libvirt_driver.state('absent') == 'unknown'
+    assert '<name>test</name>' in libvirt_driver.xml('test')
+    assert libvirt_driver.xml('absent') is None
+    assert libvirt_driver.domain_id('absent') is None
+
+
+def test_libvirt_lifecycle(libvirt_driver):
+    assert libvirt_driver.destroy('test') == (True, '')
+    assert libvirt_driver.state('test') == 'shut off'
+    assert libvirt_driver.domain_id('test') is None
+    assert libvirt_driver.start('test') == (True, '')
+    assert libvirt_driver.state('test') == 'running'
+    # Déjà démarré : sans effet
+    assert libvirt_driver.start('test') == (True, '')
+    assert libvirt_driver.start('absent')[0] is False
+
+
+def test_libvirt_connection_reused(libvirt_driver):
+    assert libvirt_driver.connection() is libvirt_driver.connection()
+
+
+def test_libvirt_reconnects_after_close_callback(libvirt_driver):
+    conn = libvirt_driver.connection()
+    libvirt_driver._on_close(conn, 0, None)
+    assert libvirt_driver.connection() is not conn
+    assert libvirt_driver.state('test') == 'running'
+
+
+def test_libvirt_reconnects_after_lost_connection(libvirt_driver):
+    conn = libvirt_driver.connection()
+    conn.close()
+    assert libvirt_driver.state('test') == 'running'
+    assert libvirt_driver.connection() is not conn
+
+
+def test_state_cache_resync_from_test_driver(monkeypatch):
+    pytest.importorskip('libvirt')
+    monkeypatch.setattr(libvirt_conn, 'BACKEND', 'libvirt')
+    monkeypatch.setattr(libvirt_conn, '_drivers', {})
+    snapshot = vm_state_cache.resync()
+    assert snapshot['states']['test'] == 'running'
+    assert vm_state_cache.get_state('test') == 'running'
+    assert vm_state_cache.get_state('absent') == 'unknown'
+
+
+# -------------------- Pilote virsh --------------------
+def test_virsh_all_domains(fake_virsh):
+    domains = libvirt_conn.VirshDriver('test:///default').all_domains()
+    assert domains == {
+        'alice-tp1_default': {'state': 'running', 'id': 1},
+        'bob-tp1_default': {'state': 'shut off', 'id': None},
+    }
+
+
+def test_virsh_state_and_lifecycle(fake_virsh):
+    driver = libvirt_conn.VirshDriver('test:///default')
+    assert driver.state('bob-tp1_default') == 'shut off'
+    assert driver.state('absent_default') == 'unknown'
+    assert driver.start('bob-tp1_default') == (True, '')
+    assert driver.state('bob-tp1_default') == 'running'
+    assert driver.domain_id('bob-tp1_default') == 2
+    assert driver.shutdown('alice-tp1_default') == (True, '')
+    assert driver.state('alice-tp1_default') == 'shut off'
+    assert 'bob-tp1_default running' in fake_virsh.read_text()
+
+
+def test_virsh_driver_selected(fake_virsh, monkeypatch):
+    monkeypatch.setattr(libvirt_conn, 'BACKEND', 'virsh')
+    monkeypatch.setattr(libvirt_conn, '_drivers', {})
+    assert isinstance(libvirt_conn.get_driver(), libvirt_conn.VirshDriver)
+    assert libvirt_conn.get_all_domain_states() == {'alice-tp1_default': 'running', 'bob-tp1_default': 'shut off'}
+
+
+# -------------------- Repli libvirt -> virsh --------------------
+def test_fallback_to_virsh_when_libvirt_fails(fake_virsh, monkeypatch):
+    monkeypatch.setattr(libvirt_conn, 'get_driver', lambda: FailingDriver('test:///default'))
+    assert libvirt_conn.get_all_domain_states() == {'alice-tp1_default': 'running', 'bob-tp1_default': 'shut off'}
+    assert libvirt_conn.get_domain_state('alice-tp1_default') == 'running'
+    assert libvirt_conn.start_domain('bob-tp1_default') == (True, '')
+    assert libvirt_conn.get_domain_state('bob-tp1_default') == 'running'
+
+
+def test_fallback_default_when_virsh_missing(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))  # ni libvirt ni virsh
+    monkeypatch.setattr(libvirt_conn, 'get_driver', lambda: FailingDriver('test:///default'))
+    assert libvirt_conn.get_all_domains() == {}
+    assert libvirt_conn.get_domain_state('alice-tp1_default') == 'unknown'
+    assert libvirt_conn.start_domain('alice-tp1_default') == (False, 'libvirt indisponible')
+
+
+def test_virsh_errors_return_default(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    monkeypatch.setattr(libvirt_conn, 'get_driver', lambda: libvirt_conn.VirshDriver('test:///default'))
+    assert libvirt_conn.get_domain_xml('alice-tp1_default') is None
+    assert libvirt_conn.get_domain_id('alice-tp1_default') is None
@@ -0,0 +1,182 @@
+"""
+File d'envoi des emails contre un relais SMTP local (benchmarks.fakes.FakeSMTPServer,
+à la manière d'aiosmtpd) : remise, nouvel essai avec attente exponentielle, refus
+définitif, reprise après redémarrage, connexion réutilisée et résumé.
+"""
+import smtplib
+import threading
+import time
+import pytest
+import config
+import db
+import mail_outbox
+from benchmarks import fakes
+
+ADMINS = ['admin@example.com']
+
+
+@pytest.fixture
+def relay(monkeypatch):
+    server = fakes.FakeSMTPServer().start()
+    monkeypatch.setattr(config, 'SMTP_HOST', server.host, raising=False)
+    monkeypatch.setattr(config, 'SMTP_PORT', server.port, raising=False)
+    monkeypatch.setattr(config, 'SMTP_FROM', 'vm-manager@example.com', raising=False)
+    monkeypatch.setattr(config, 'SMTP_USER', None, raising=False)
+    monkeypatch.setattr(config, 'SMTP_PASSWORD', None, raising=False)
+    monkeypatch.setattr(config, 'SMTP_USE_TLS', False, raising=False)
+    monkeypatch.setattr(config, 'SMTP_USE_SSL', False, raising=False)
+    monkeypatch.setattr(mail_outbox, 'RETRY_BASE', 30)
+    monkeypatch.setattr(mail_outbox, 'RETRY_MAX', 100)
+    monkeypatch.setattr(mail_outbox, 'MAX_ATTEMPTS', 4)
+    monkeypatch.setattr(mail_outbox, 'DIGEST_INTERVAL', 0)
+    db.get_db().execute("DELETE FROM mail_outbox")
+    yield server
+    server.stop()
+
+
+def _row(mail_id):
+    return db.get_db().execute("SELECT * FROM mail_outbox WHERE id = ?", (mail_id,)).fetchone()
+
+
+def _make_due(mail_id):
+    db.get_db().execute("UPDATE mail_outbox SET next_attempt_at = 0 WHERE id = ?", (mail_id,))
+
+
+def test_enqueue_does_not_touch_the_network(relay):
+    mail_outbox.enqueue("Demande", "Corps", ADMINS)
+    assert relay.connections == 0
+    assert mail_outbox.status()['counts']['queued'] == 1
+
+
+def test_delivered(relay):
+    mail_id = mail_outbox.enqueue("[VM Request] alice", "RAM 8 GB pour alice-vm", ADMINS)
+    connection = mail_outbox._Connection()
+    assert mail_outbox.drain(connection) == 1
+    connection.close()
+    assert len(relay.messages) == 1
+    message = relay.messages[0]
+    assert '<admin@example.com>' in message['to'][0]
+    assert 'Subject: [VM Request] alice' in message['data']
+    assert 'RAM 8 GB pour alice-vm' in message['data']
+    row = _row(mail_id)
+    assert row['state'] == 'sent' and row['attempts'] == 1 and row['sent_at']
+
+
+def test_connection_reused(relay):
+    for i in range(3):
+        mail_outbox.enqueue(f"Demande {i}", "Corps", ADMINS)
+    connection = mail_outbox._Connection()
+    assert mail_outbox.drain(connection) == 3
+    mail_outbox.enqueue("Demande 3", "Corps", ADMINS)
+    assert mail_outbox.drain(connection) == 1
+    connection.close()
+    assert len(relay.messages) == 4
+    assert relay.connections == 1
+
+
+def test_transient_failure_retried_with_backoff(relay):
+    relay.fail = True  # 451 à MAIL FROM
+    mail_id = mail_outbox.enqueue("Demande", "Corps", ADMINS)
+    connection = mail_outbox._Connection()
+
+    before = time.time()
+    assert mail_outbox.drain(connection) == 0
+    row = _row(mail_id)
+    assert row['state'] == 'queued' and row['attempts'] == 1
+    assert '451' in row['last_error']
+    assert before + 30 <= row['next_attempt_at'] <= time.time() + 30
+
+    # Pas de nouvel essai avant l'échéance
+    connections = relay.connections
+    assert mail_outbox.drain(connection) == 0
+    assert relay.connections == connections and _row(mail_id)['attempts'] == 1
+
+    # Attente doublée à chaque échec, plafonnée à RETRY_MAX
+    delays = []
+    for _ in range(2):
+        _make_due(mail_id)
+        now = time.time()
+        mail_outbox.drain(connection)
+        delays.append(_row(mail_id)['next_attempt_at'] - now)
+    assert delays[0] == pytest.approx(60, abs=2)
+    assert delays[1] == pytest.approx(100, abs=2)
+
+    # Relais rétabli : remis au prochain essai
+    relay.fail = False
+    _make_due(mail_id)
+    assert mail_outbox.drain(connection) == 1
+    connection.close()
+    row = _row(mail_id)
+    assert row['state'] == 'sent' and row['attempts'] == 4 and row['last_error'] == ''
+    assert len(relay.messages) == 1
+
+
+def test_gives_up_after_max_attempts(relay):
+    relay.fail = True
+    mail_id = mail_outbox.enqueue("Demande", "Corps", ADMINS)
+    connection = mail_outbox._Connection()
+    for _ in range(mail_outbox.MAX_ATTEMPTS):
+        _make_due(mail_id)
+        mail_outbox.drain(connection)
+    row = _row(mail_id)
+    assert row['state'] == 'failed' and row['attempts'] == mail_outbox.MAX_ATTEMPTS
+    relay.fail = False
+    _make_due(mail_id)
+    assert mail_outbox.drain(connection) == 0
+    assert relay.messages == []
+    assert mail_outbox.status()['errors'][0]['id'] == mail_id
+
+
+def test_permanent_failure_dead_lettered(relay):
+    relay.fail = 550
+    mail_id = mail_outbox.enqueue("Demande", "Corps", ADMINS)
+    connection = mail_outbox._Connection()
+    assert mail_outbox.drain(connection) == 0
+    row = _row(mail_id)
+    assert row['state'] == 'failed' and row['attempts'] == 1
+    assert '550' in row['last_error']
+    relay.fail = False
+    _make_due(mail_id)
+    assert mail_outbox.drain(connection) == 0
+    assert relay.messages == []
+    assert mail_outbox.status()['counts']['failed'] == 1
+
+
+def test_queued_mail_survives_restart(relay):
+    relay.fail = True
+    mail_id = mail_outbox.enqueue("Demande", "Corps", ADMINS)
+    mail_outbox.drain(mail_outbox._Connection())
+    assert _row(mail_id)['state'] == 'queued'
+
+    # Nouveau processus : nouvelle connexion SQLite (autre thread) et nouvelle connexion SMTP
+    relay.fail = False
+    _make_due(mail_id)
+    result = {}
+    restarted = threading.Thread(target=lambda: result.update(sent=mail_outbox.drain(mail_outbox._Connection())))
+    restarted.start()
+    restarted.join(10)
+    assert result['sent'] == 1
+    assert _row(mail_id)['state'] == 'sent'
+    assert len(relay.messages) == 1
+
+
+def test_digest_groups_admin_requests(relay, monkeypatch):
+    monkeypatch.setattr(mail_outbox, 'DIGEST_INTERVAL', 60)
+    ids = [mail_outbox.enqueue(f"Demande {i}", f"Corps {i}", ADMINS, digest=True) for i in range(3)]
+    connection = mail_outbox._Connection()
+    assert mail_outbox.drain(connection) == 0  # intervalle pas encore écoulé
+    db.get_db().execute("UPDATE mail_outbox SET created_at = created_at - 120")
+    assert mail_outbox.drain(connection) == 3
+    connection.close()
+    assert len(relay.messages) == 1
+    assert '3 demande(s) en attente' in relay.messages[0]['data']
+    assert all(_row(i)['state'] == 'sent' for i in ids)
+
+
+def test_is_permanent():
+    assert mail_outbox.is_permanent(smtplib.SMTPSenderRefused(550, b'non', 'a@b'))
+    assert not mail_outbox.is_permanent(smtplib.SMTPSenderRefused(451, b'plus tard', 'a@b'))
+    assert not mail_outbox.is_permanent(smtplib.SMTPAuthenticationError(535, b'auth'))
+    assert mail_outbox.is_permanent(smtplib.SMTPRecipientsRefused({'a@b': (550, b'inconnu')}))
+    assert not mail_outbox.is_permanent(smtplib.SMTPRecipientsRefused({'a@b': (550, b''), 'c@d': (450, b'')}))
+    assert not mail_outbox.is_permanent(OSError('connexion refusée'))
@@ -0,0 +1,69 @@
+"""
+Ordonnanceur des démarrages : choix sans appel externe sous verrou, refus des tâches
+qui dépassent la capacité de l'hôte et attente maximale en file.
+"""
+import time
+import pytest
+import db
+import jobs
+import scheduler
+
+HOST = {'memory_mb': 16384, 'available_mb': 12000, 'cpus': 8, 'committed_mb': 0, 'committed_vcpus': 0}
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    db.get_db().execute("DELETE FROM jobs")
+    monkeypatch.setattr(scheduler, 'RESERVED_HOST_MB', 4096)
+    monkeypatch.setattr(scheduler, 'MAX_QUEUE_WAIT', 600)
+    monkeypatch.setattr(scheduler, '_host_cache', {'at': time.time(), 'host': dict(HOST)})
+    monkeypatch.setattr(scheduler, 'HOST_CACHE_TTL', 3600)
+    return db.get_db()
+
+
+def _job(job_id, kind='launch', owner='alice', memory=2048, cpus=2, **payload):
+    return {'id': job_id, 'kind': kind, 'owner': owner, 'vm_name': f'vm{job_id}',
+            'payload': {'memory': memory, 'cpus': cpus, **payload}}
+
+
+def test_capacity_error():
+    assert scheduler.capacity_error(8192, 2, HOST) is None
+    assert '12288 MB' in scheduler.capacity_error(20000, 2, HOST)
+    assert scheduler.capacity_error(2048, 64, HOST)
+
+
+def test_oversized_job_does_not_block_later_boots():
+    queued = [_job(1, memory=64000), _job(2, owner='bob')]
+    assert scheduler.pick_next(queued, [], HOST, policy='fifo')['id'] == 2
+
+
+def test_boot_that_does_not_fit_yet_blocks_later_boots():
+    host = dict(HOST, committed_mb=9000)
+    queued = [_job(1, memory=4096), _job(2, owner='bob', memory=1024), _job(3, kind='halt', owner='carol')]
+    assert scheduler.pick_next(queued, [], host, policy='fifo')['id'] == 3
+
+
+def test_select_uses_cached_host_only(queue, monkeypatch):
+    def no_external_call():
+        raise AssertionError("appel libvirt sous verrou de la base")
+    monkeypatch.setattr(scheduler, 'host_snapshot', no_external_call)
+    job_id = jobs.submit('launch', 'tp1', 'alice', {'memory': 2048, 'cpus': 2})
+    candidates = queue.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchall()
+    assert scheduler._select(candidates, [])['id'] == job_id
+    # Aucun instantané encore relevé : les démarrages attendent le prochain passage
+    monkeypatch.setattr(scheduler, '_host_cache', {'at': 0.0, 'host': None})
+    assert scheduler._select(candidates, []) is None
+
+
+def test_prepare_fails_oversized_and_expired_boots(queue):
+    oversized = jobs.submit('create', 'big', 'alice', {'memory': 64000, 'cpus': 2})
+    stale = jobs.submit('launch', 'tp1', 'bob', {'memory': 2048, 'cpus': 2})
+    bulk = jobs.submit('launch', 'tp2', 'carol', {'memory': 2048, 'cpus': 2, 'bulk_id': 1, 'parallel': 1})
+    fresh = jobs.submit('launch', 'tp3', 'dave', {'memory': 2048, 'cpus': 2})
+    queue.execute("UPDATE jobs SET created_at = created_at - 3600 WHERE id IN (?, ?)", (stale, bulk))
+    scheduler.prepare()
+    states = {job_id: jobs.get(job_id) for job_id in (oversized, stale, bulk, fresh)}
+    assert states[oversized]['state'] == 'failed' and 'capacité' in states[oversized]['message']
+    assert states[stale]['state'] == 'failed' and "d'attente" in states[stale]['message']
+    assert states[bulk]['state'] == 'queued'
+    assert states[fresh]['state'] == 'queued'
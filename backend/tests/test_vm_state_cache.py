@@ -0,0 +1,118 @@
+"""
+Cache des états : chemin événementiel (événements de cycle de vie libvirt simulés,
+sans libvirt-python) et version de l'instantané.
+"""
+import types
+import pytest
+import coordination
+import libvirt_conn
+import vm_state_cache
+
+EVENT_STARTED, EVENT_STOPPED = 2, 5
+
+
+class FakeDomain:
+    def __init__(self, name, state, domain_id=-1):
+        self._name, self._state, self._id = name, state, domain_id
+
+    def name(self):
+        return self._name
+
+    def state(self):
+        return [self._state, 0]
+
+    def ID(self):
+        return self._id
+
+
+class FakeEventConnection:
+    """Connexion en lecture seule : les événements simulés sont livrés pendant le premier battement."""
+
+    def __init__(self, events):
+        self.events = events
+        self.callback = None
+        self.alive = True
+
+    def domainEventRegisterAny(self, dom, event_id, callback, opaque):
+        self.callback = callback
+
+    def setKeepAlive(self, interval, count):
+        pass
+
+    def isAlive(self):
+        alive, self.alive = self.alive, False
+        if alive:
+            for dom, event in self.events:
+                self.callback(self, dom, event, 0, None)
+        return alive
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    coordination.data_path(vm_state_cache.SNAPSHOT_FILE).unlink(missing_ok=True)
+    monkeypatch.setattr(vm_state_cache, '_local', {'mtime': None, 'snapshot': None})
+    monkeypatch.setattr(vm_state_cache, 'MAX_AGE', 3600)
+    monkeypatch.setattr(libvirt_conn, 'get_all_domains', lambda: {
+        'alice-tp1_default': {'state': 'shut off', 'id': None},
+        'bob-tp1_default': {'state': 'running', 'id': 4},
+    })
+    vm_state_cache.resync()
+    return vm_state_cache
+
+
+def test_lifecycle_events_update_snapshot(cache):
+    version = cache.get_snapshot()['version']
+
+    cache._on_lifecycle_event(None, FakeDomain('alice-tp1_default', 1, 7), EVENT_STARTED, 0, None)
+    snapshot = cache.get_snapshot()
+    assert snapshot['version'] == version + 1
+    assert cache.get_state('alice-tp1_default') == 'running'
+    assert cache.get_domain_id('alice-tp1_default') == 7
+
+    cache._on_lifecycle_event(None, FakeDomain('bob-tp1_default', 5), EVENT_STOPPED, 0, None)
+    assert cache.get_snapshot()['version'] == version + 2
+    assert cache.get_state('bob-tp1_default') == 'shut off'
+    assert cache.get_domain_id('bob-tp1_default') is None
+
+    cache._on_lifecycle_event(None, FakeDomain('bob-tp1_default', 5), cache.EVENT_UNDEFINED, 0, None)
+    assert cache.get_snapshot()['version'] == version + 3
+    assert cache.get_state('bob-tp1_default') == 'unknown'
+
+
+def test_repeated_event_keeps_version(cache):
+    cache._on_lifecycle_event(None, FakeDomain('bob-tp1_default', 1, 4), EVENT_STARTED, 0, None)
+    version = cache.get_snapshot()['version']
+    cache._on_lifecycle_event(None, FakeDomain('bob-tp1_default', 1, 4), EVENT_STARTED, 0, None)
+    assert cache.get_snapshot()['version'] == version
+
+
+def test_event_error_is_ignored(cache):
+    class Broken(FakeDomain):
+        def state(self):
+            raise RuntimeError('domaine disparu')
+    version = cache.get_snapshot()['version']
+    cache._on_lifecycle_event(None, Broken('alice-tp1_default', 1), EVENT_STARTED, 0, None)
+    assert cache.get_snapshot()['version'] == version
+
+
+def test_collector_subscribes_and_applies_events(cache, monkeypatch):
+    conn = FakeEventConnection([(FakeDomain('alice-tp1_default', 1, 9), EVENT_STARTED),
+                                (FakeDomain('bob-tp1_default', 5), EVENT_STOPPED)])
+    fake_libvirt = types.SimpleNamespace(VIR_DOMAIN_EVENT_ID_LIFECYCLE=0, openReadOnly=lambda uri: conn)
+    monkeypatch.setattr(libvirt_conn, 'libvirt', fake_libvirt)
+    monkeypatch.setattr(libvirt_conn, 'get_driver', lambda: types.SimpleNamespace(name='libvirt'))
+    monkeypatch.setattr(vm_state_cache, '_event_loop', {'started': True})  # pas de vrai thread d'événements
+    monkeypatch.setattr(vm_state_cache, 'HEARTBEAT_INTERVAL', 0)
+    version = cache.get_snapshot()['version']
+
+    assert cache._collect_with_events() is True
+    assert conn.callback is cache._on_lifecycle_event
+    snapshot = cache.get_snapshot()
+    assert snapshot['version'] == version + 2
+    assert snapshot['states'] == {'alice-tp1_default': 'running', 'bob-tp1_default': 'shut off'}
+    assert snapshot['ids'] == {'alice-tp1_default': 9}
+
+
+def test_collector_without_libvirt_python(cache, monkeypatch):
+    monkeypatch.setattr(libvirt_conn, 'libvirt', None)
+    assert cache._collect_with_events() is False
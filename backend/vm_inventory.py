@@ -0,0 +1,160 @@
+"""
+Inventaire des VMs (nom, propriétaire, dossier, état), source unique des
+changements pour /api/list_vms (ETag) et /api/vms/stream (SSE).
+
+- Empreinte peu coûteuse : version du cache d'états + version de la table des
+  VMs (vm_store : toute VM créée, modifiée ou supprimée l'incrémente).
+- La liste n'est relue que si l'empreinte change, par un seul worker (verrou) ;
+  le résultat est partagé dans DATA_DIR/vm_inventory.json avec un numéro de
+  version qui n'augmente que si la liste change réellement.
+- Dans chaque worker, un seul thread surveille l'empreinte toutes les
+  VM_STREAM_POLL_INTERVAL secondes et réveille les flux SSE en attente.
+"""
+import os
+import threading
+import time
+import uuid
+import config
+import coordination
+import vm_state_cache
+import vm_store
+import warm_pool
+
+SNAPSHOT_FILE = 'vm_inventory.json'
+POLL_INTERVAL = config.VM_STREAM_POLL_INTERVAL
+
+# Copie locale de l'inventaire (par processus)
+_local = {'mtime': None, 'snapshot': None}
+_local_lock = threading.Lock()
+
+# Surveillance (un thread par processus) et réveil des flux
+_changed = threading.Condition()
+_watchers = set()
+
+
+def _path():
+    return coordination.data_path(SNAPSHOT_FILE)
+
+
+def _load():
+    """Inventaire partagé (relu uniquement si le fichier a changé)."""
+    path = _path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+    with _local_lock:
+        if mtime != _local['mtime']:
+            _local['snapshot'] = coordination.read_json(path)
+            _local['mtime'] = mtime
+        return _local['snapshot']
+
+
+# -------------------- Lecture --------------------
+def _fingerprint(base_dir):
+    """Empreinte de l'inventaire sans relire les VMs : [base, version des états, version de vm_store]."""
+    return [str(base_dir), vm_state_cache.get_snapshot()['version'], vm_store.version()]
+
+
+def _scan(base_dir):
+    """{dossier: {'name', 'owner', 'path', 'state'}} des VMs de base_dir, triées par propriétaire puis nom."""
+    states = vm_state_cache.get_states()
+    aliases = warm_pool.domain_aliases()
+    prefix = f"{base_dir}/"
+    return {
+        vm['path']: {
+            'name': vm['name'],
+            'owner': vm['owner'],
+            'path': vm['path'],
+            'state': states.get(aliases.get(vm['path'], f"{vm['name']}_default"), 'unknown')
+        }
+        for vm in vm_store.list_vms() if vm['path'].startswith(prefix)
+    }
+
+
+def current(base_dir):
+    """
+    Inventaire à jour {'epoch', 'version', 'fingerprint', 'vms'}.
+    La liste n'est relue que si l'empreinte a changé depuis la dernière lecture (tous workers).
+    """
+    fingerprint = _fingerprint(base_dir)
+    snapshot = _load()
+    if snapshot and snapshot['fingerprint'] == fingerprint:
+        return snapshot
+    with coordination.locked('vm-inventory'):
+        snapshot = coordination.read_json(_path())
+        if snapshot and snapshot['fingerprint'] == fingerprint:
+            return snapshot
+        vms = _scan(base_dir)
+        if snapshot is None:
+            snapshot = {'epoch': uuid.uuid4().hex[:8], 'version': 0, 'vms': {}}
+        snapshot = {
+            'epoch': snapshot['epoch'],
+            'version': snapshot['version'] + (vms != snapshot['vms']),
+            'fingerprint': fingerprint,
+            'vms': vms,
+        }
+        coordination.atomic_write_json(_path(), snapshot)
+    return snapshot
+
+
+# -------------------- Vues par utilisateur --------------------
+def visible(snapshot, username, admin):
+    """VMs visibles par l'utilisateur : toutes pour un admin, les siennes sinon."""
+    return {path: vm for path, vm in snapshot['vms'].items() if admin or vm['owner'] == username}
+
+
+def etag(snapshot, username):
+    """ETag de la liste d'un utilisateur : change dès que l'inventaire change."""
+    return f"{snapshot['epoch']}-{snapshot['version']}-{username}"
+
+
+def diff(old, new):
+    """Différence entre deux vues : (VMs nouvelles ou modifiées, dossiers supprimés)."""
+    changed = [vm for path, vm in new.items() if old.get(path) != vm]
+    removed = [path for path in old if path not in new]
+    return changed, removed
+
+
+# -------------------- Surveillance --------------------
+def _watch_loop(base_dir):
+    last = None
+    while True:
+        try:
+            snapshot = current(base_dir)
+            key = (snapshot['epoch'], snapshot['version'])
+            if key != last:
+                last = key
+                with _changed:
+                    _changed.notify_all()
+        except Exception as e:
+            print(f"[vm_inventory] Surveillance: {e}")
+        time.sleep(POLL_INTERVAL)
+
+
+def watch(base_dir):
+    """Démarre (une fois par processus et par dossier) le thread de surveillance de l'inventaire."""
+    with _changed:
+        if str(base_dir) in _watchers:
+            return
+        _watchers.add(str(base_dir))
+    threading.Thread(target=_watch_loop, args=(base_dir,), name='vm-inventory-watch', daemon=True).start()
+
+
+def wait_for_change(base_dir, snapshot, timeout):
+    """
+    Attend au plus `timeout` secondes un inventaire différent de `snapshot`.
+    Retourne le nouvel inventaire, ou None si rien n'a changé.
+    """
+    watch(base_dir)
+    key = (snapshot['epoch'], snapshot['version'])
+    deadline = time.time() + timeout
+    with _changed:
+        while True:
+            latest = _load()
+            if latest and (latest['epoch'], latest['version']) != key:
+                return latest
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            _changed.wait(remaining)
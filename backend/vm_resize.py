@@ -0,0 +1,216 @@
+"""
+Application des demandes de capacité approuvées : mémoire et disque des VMs.
+
+Une approbation met en file une tâche 'capacity' (une à la fois par VM, journal et
+résultat dans la file de tâches, rattachée à la demande) :
+- mémoire : changée à chaud (ballon) si la VM tourne et que la valeur tient dans le
+  maximum de son domaine ; la définition persistante, le Vagrantfile (lv.memory) et
+  la base sont mis à jour dans tous les cas, la valeur s'applique donc au plus tard
+  au prochain démarrage ;
+- disque : agrandi à chaud (virDomainBlockResize) si la VM tourne, sinon volume
+  agrandi hors ligne. La partition racine et son système de fichiers sont étendus
+  par l'agent invité, tout de suite ou au prochain lancement (vm_disk_growth).
+
+La demande passe à 'applied' quand la tâche réussit ; en échec elle reste 'approved'
+et peut être relancée (POST /api/admin/capacity_requests/<id>/apply).
+"""
+from pathlib import Path
+import time
+import capacity_requests
+import db
+import jobs
+import libvirt_conn
+import provisioning
+import vm_state_cache
+import vm_store
+import warm_pool
+
+AGENT_WAIT = 180      # secondes d'attente de l'agent invité après un démarrage
+GROW_TIMEOUT = 120    # durée maximale de l'extension du système de fichiers
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS vm_disk_growth (
+    domain TEXT PRIMARY KEY,
+    os TEXT,
+    size_gb INTEGER NOT NULL,
+    requested_at REAL NOT NULL
+);
+""")
+
+# Extension de la partition racine puis de son système de fichiers (ext4), dans l'invité
+LINUX_GROW_SCRIPT = r"""
+root=$(findmnt -no SOURCE /)
+disk=/dev/$(lsblk -no PKNAME "$root" | head -n1)
+part=$(cat "/sys/class/block/$(basename "$root")/partition")
+if command -v growpart >/dev/null 2>&1; then
+  growpart "$disk" "$part" || true
+else
+  echo ", +" | sfdisk --no-reread -N "$part" "$disk" && partx -u "$disk"
+fi
+resize2fs "$root"
+"""
+WINDOWS_GROW_SCRIPT = ("$size = (Get-PartitionSupportedSize -DriveLetter C).SizeMax; "
+                       "Resize-Partition -DriveLetter C -Size $size -ErrorAction SilentlyContinue; "
+                       "Get-Partition -DriveLetter C | Select-Object -ExpandProperty Size")
+
+
+def _domain(vm):
+    return warm_pool.domain_for(vm['path']) or f"{vm['name']}_default"
+
+
+# -------------------- Mémoire --------------------
+def _update_vagrantfile_memory(vm_path, memory_mb):
+    """
+    Fixe la mémoire nominale (lv.memory) du Vagrantfile, relue par vagrant-libvirt et par
+    l'import vm_store. Retourne False si le Vagrantfile est illisible ou sans lv.memory.
+    """
+    vagrantfile = Path(vm_path) / 'Vagrantfile'
+    try:
+        content = vagrantfile.read_text()
+    except OSError:
+        return False
+    updated = provisioning.set_vagrantfile_memory(content, memory_mb)
+    if updated is None:
+        return False
+    if updated != content:
+        vagrantfile.write_text(updated)
+    return True
+
+
+def apply_memory(vm, memory_mb, log):
+    """Mémoire de la VM portée à `memory_mb` (à chaud si possible). Retourne le message de résultat."""
+    domain = _domain(vm)
+    maximum_mb = provisioning.balloon_maximum_mb(memory_mb)
+    state = libvirt_conn.get_domain_state(domain)
+    live = False
+    if state == 'running':
+        domain_max_kib, _ = libvirt_conn.memory_from_xml(libvirt_conn.get_domain_xml(domain))
+        if domain_max_kib and memory_mb * 1024 <= domain_max_kib:
+            ok, error = libvirt_conn.set_domain_memory(domain, memory_mb * 1024)
+            if ok:
+                live = True
+                log(f"Mémoire portée à {memory_mb} MB à chaud")
+            else:
+                log(f"Changement à chaud impossible ({error})")
+        else:
+            log(f"{memory_mb} MB dépasse le maximum du domaine ({(domain_max_kib or 0) // 1024} MB) : "
+                "appliqué au prochain démarrage")
+    if state != 'unknown':
+        ok, error = libvirt_conn.set_domain_memory_config(domain, maximum_mb * 1024, memory_mb * 1024)
+        if not ok:
+            raise jobs.JobFailed(f"Définition du domaine non modifiée : {error}")
+        log(f"Définition du domaine : {memory_mb} MB (maximum {maximum_mb} MB)")
+    if _update_vagrantfile_memory(vm['path'], memory_mb):
+        log(f"Vagrantfile : lv.memory = {memory_mb}")
+    vm_store.update(vm['path'], memory=memory_mb)
+    if live:
+        return f"Mémoire de {vm['name']} portée à {memory_mb} MB."
+    return f"Mémoire de {vm['name']} portée à {memory_mb} MB au prochain démarrage."
+
+
+# -------------------- Disque --------------------
+def grow_filesystem(domain, os_name, log):
+    """Étend la partition racine et son système de fichiers via l'agent invité. Retourne True si réussi."""
+    if os_name == 'windows':
+        code, output = libvirt_conn.guest_exec(domain, 'powershell.exe', ['-NoProfile', '-Command', WINDOWS_GROW_SCRIPT],
+                                               timeout=GROW_TIMEOUT)
+    else:
+        code, output = libvirt_conn.guest_exec(domain, '/bin/sh', input_data=LINUX_GROW_SCRIPT, timeout=GROW_TIMEOUT)
+    for line in (output or '').splitlines():
+        log(f"  {line}")
+    if code != 0:
+        log(f"Extension du système de fichiers impossible ({'agent: ' + output if code is None else f'code {code}'})")
+        return False
+    log("Système de fichiers étendu")
+    return True
+
+
+def apply_storage(vm, size_gb, log):
+    """Disque système de la VM porté à `size_gb` GB. Retourne le message de résultat."""
+    domain = _domain(vm)
+    disks = libvirt_conn.disks_from_xml(libvirt_conn.get_domain_xml(domain))
+    if not disks:
+        raise jobs.JobFailed(f"Aucun disque pour le domaine {domain} (VM jamais démarrée ?)")
+    target, path = disks[0]
+    size = size_gb * 1024**3
+    capacity = libvirt_conn.get_disk_capacity(domain, target)
+    if capacity:
+        log(f"Disque {target} ({path}) : {capacity / 1024**3:.1f} GB")
+        if size == capacity:
+            return f"Disque de {vm['name']} déjà à {size_gb} GB."
+        if size < capacity:
+            raise jobs.JobFailed(f"Réduction du disque non prise en charge ({capacity / 1024**3:.1f} GB actuellement).")
+
+    if libvirt_conn.get_domain_state(domain) == 'running':
+        ok, error = libvirt_conn.resize_disk(domain, target, size)
+        if not ok:
+            raise jobs.JobFailed(f"Agrandissement à chaud impossible : {error}")
+        log(f"Disque {target} agrandi à chaud à {size_gb} GB")
+        if grow_filesystem(domain, vm['os'], log):
+            return f"Disque de {vm['name']} agrandi à {size_gb} GB."
+        return f"Disque de {vm['name']} agrandi à {size_gb} GB (partition à étendre dans l'invité)."
+
+    ok, error = libvirt_conn.resize_volume(path, size)
+    if not ok:
+        raise jobs.JobFailed(f"Agrandissement du volume impossible : {error}")
+    log(f"Volume {path} agrandi à {size_gb} GB (VM arrêtée)")
+    db.get_db().execute(
+        "INSERT OR REPLACE INTO vm_disk_growth (domain, os, size_gb, requested_at) VALUES (?, ?, ?, ?)",
+        (domain, vm['os'], size_gb, time.time())
+    )
+    return f"Disque de {vm['name']} agrandi à {size_gb} GB (système de fichiers étendu au prochain lancement)."
+
+
+def after_start(domain, log):
+    """Après un lancement : extension du système de fichiers en attente pour ce domaine, s'il y en a une."""
+    row = db.get_db().execute("SELECT * FROM vm_disk_growth WHERE domain = ?", (domain,)).fetchone()
+    if row is None:
+        return
+    db.get_db().execute("DELETE FROM vm_disk_growth WHERE domain = ?", (domain,))
+    log(f"Disque agrandi à {row['size_gb']} GB : attente de l'agent invité")
+    deadline = time.time() + AGENT_WAIT
+    while libvirt_conn.guest_agent_command(domain, {'execute': 'guest-ping'}, timeout=5) is None:
+        if time.time() >= deadline:
+            log("Agent invité injoignable : partition à étendre dans l'invité")
+            return
+        time.sleep(5)
+    grow_filesystem(domain, row['os'], log)
+
+
+# -------------------- Tâches --------------------
+def submit(entry, approved_by):
+    """Met en file l'application d'une demande approuvée ; retourne l'identifiant de la tâche."""
+    job_id = jobs.submit('capacity', entry['vm_name'], entry['username'],
+                         {'request_id': entry['id'], 'approved_by': approved_by})
+    capacity_requests.add_job(entry['id'], job_id)
+    return job_id
+
+
+@jobs.handler('capacity')
+def _job_capacity(job, log):
+    """Tâche: application d'une demande de capacité approuvée."""
+    payload = job['payload']
+    entry = capacity_requests.get(payload['request_id'])
+    if entry is None:
+        raise jobs.JobFailed(f"Demande {payload['request_id']} introuvable.")
+    if entry['status'] != 'approved':
+        raise jobs.JobFailed(f"Demande #{entry['id']} au statut '{entry['status']}' : rien à appliquer.")
+    vm = vm_store.get(entry['username'], entry['vm_name'])
+    if vm is None:
+        raise jobs.JobFailed(f"VM {entry['username']}/{entry['vm_name']} introuvable.")
+    # Mêmes analyse et limites qu'à la demande (les lignes importées de l'ancien CSV n'étaient pas bornées)
+    try:
+        resource, amount = capacity_requests.validate(entry['resource'], entry['requested_value'])
+    except ValueError as e:
+        raise jobs.JobFailed(f"Demande #{entry['id']} : {e}")
+    log(f"Demande #{entry['id']} approuvée par {payload.get('approved_by')} : "
+        f"{resource} {capacity_requests.human_value(resource, amount)}")
+    try:
+        if resource == 'ram':
+            message = apply_memory(vm, amount, log)
+        else:
+            message = apply_storage(vm, amount, log)
+    finally:
+        vm_state_cache.refresh_domain(_domain(vm))
+    capacity_requests.set_status(entry['id'], 'applied', payload.get('approved_by'))
+    return message
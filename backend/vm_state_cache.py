@@ -0,0 +1,227 @@
+"""
+Cache des états de domaines libvirt, partagé entre les workers gunicorn.
+
+Un seul worker (leader "vm-state-collector") alimente un instantané sur disque :
+- remplissage complet au démarrage puis resynchronisation périodique ;
+- mise à jour immédiate via les événements libvirt de cycle de vie
+  (démarré, arrêté, suspendu, supprimé) sur un thread de boucle d'événements ;
+- sans libvirt-python (pilote virsh), interrogation groupée à intervalle fixe.
+
+Les autres workers lisent l'instantané (rechargé seulement si le fichier change).
+Si l'instantané est plus vieux que STATE_CACHE_MAX_AGE, le lecteur resynchronise
+lui-même : l'état servi n'est donc jamais plus vieux que cette borne.
+
+L'instantané garde aussi l'identifiant libvirt des domaines actifs, nouveau à
+chaque démarrage : les ports VNC sont mis en cache par (domaine, identifiant)
+et oubliés dès que le domaine s'arrête ou redémarre.
+"""
+import os
+import threading
+import time
+import config
+import coordination
+import libvirt_conn
+
+SNAPSHOT_FILE = 'vm_states.json'
+MAX_AGE = config.STATE_CACHE_MAX_AGE
+HEARTBEAT_INTERVAL = max(1, MAX_AGE // 3)
+FULL_RESYNC_INTERVAL = config.STATE_CACHE_FULL_RESYNC
+POLL_INTERVAL = config.STATE_CACHE_POLL_INTERVAL
+
+# Copie locale de l'instantané (par processus)
+_local = {'mtime': None, 'snapshot': None}
+_local_lock = threading.Lock()
+
+# Ports VNC par instance (par processus) : {nom_domaine: (id_domaine, port)}
+_vnc_ports = {}
+
+
+def _snapshot_path():
+    return coordination.data_path(SNAPSHOT_FILE)
+
+
+def _write(states=None, changes=None, removed=(), ids=None, id_changes=None):
+    """
+    Met à jour l'instantané partagé sous verrou.
+    states/ids: remplacement complet ; changes/id_changes/removed: mise à jour partielle
+    (id None : domaine arrêté).
+    Le numéro de version n'augmente que si un état ou un identifiant change réellement.
+    """
+    path = _snapshot_path()
+    with coordination.locked('vm-states'):
+        current = coordination.read_json(path) or {'version': 0, 'states': {}}
+        current_ids = current.get('ids', {})
+        new_states = dict(current['states']) if states is None else dict(states)
+        new_ids = dict(current_ids) if ids is None else dict(ids)
+        for name, state in (changes or {}).items():
+            new_states[name] = state
+        for name, domain_id in (id_changes or {}).items():
+            if domain_id is None:
+                new_ids.pop(name, None)
+            else:
+                new_ids[name] = domain_id
+        for name in removed:
+            new_states.pop(name, None)
+            new_ids.pop(name, None)
+        changed = new_states != current['states'] or new_ids != current_ids
+        snapshot = {
+            'version': current['version'] + changed,
+            'updated_at': time.time(),
+            'states': new_states,
+            'ids': new_ids,
+        }
+        coordination.atomic_write_json(path, snapshot)
+    return snapshot
+
+
+def _load():
+    """Retourne l'instantané courant (relu uniquement si le fichier a changé)."""
+    path = _snapshot_path()
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    with _local_lock:
+        if mtime is not None and mtime != _local['mtime']:
+            _local['snapshot'] = coordination.read_json(path)
+            _local['mtime'] = mtime
+            _prune_vnc_ports(_local['snapshot'])
+        return _local['snapshot']
+
+
+def resync():
+    """Resynchronisation forcée : interroge tous les domaines en un appel et réécrit l'instantané."""
+    domains = libvirt_conn.get_all_domains()
+    return _write(
+        states={name: domain['state'] for name, domain in domains.items()},
+        ids={name: domain['id'] for name, domain in domains.items() if domain['id'] is not None},
+    )
+
+
+def refresh_domain(domain_name):
+    """Relit l'état (et l'identifiant) d'un seul domaine (après une action de cycle de vie)."""
+    state = libvirt_conn.get_domain_state(domain_name)
+    if state == 'unknown':
+        return _write(removed=[domain_name])
+    domain_id = libvirt_conn.get_domain_id(domain_name) if state != 'shut off' else None
+    return _write(changes={domain_name: state}, id_changes={domain_name: domain_id})
+
+
+def get_snapshot():
+    """Retourne l'instantané {'version', 'updated_at', 'states', 'ids'}, en respectant la borne de fraîcheur."""
+    snapshot = _load()
+    if snapshot is None or time.time() - snapshot.get('updated_at', 0) > MAX_AGE:
+        snapshot = resync()
+    return snapshot
+
+
+def get_states():
+    """Retourne {nom_domaine: état} depuis le cache."""
+    return get_snapshot()['states']
+
+
+def get_state(domain_name):
+    """Retourne l'état d'un domaine depuis le cache, 'unknown' s'il n'existe pas."""
+    return get_states().get(domain_name, 'unknown')
+
+
+def get_domain_id(domain_name):
+    """Identifiant libvirt du domaine actif depuis le cache, None s'il est arrêté ou inconnu."""
+    return get_snapshot().get('ids', {}).get(domain_name)
+
+
+# -------------------- Ports VNC par instance --------------------
+def _prune_vnc_ports(snapshot):
+    """Oublie les ports des domaines arrêtés ou redémarrés depuis leur mise en cache."""
+    ids = (snapshot or {}).get('ids', {})
+    for name, (domain_id, _) in list(_vnc_ports.items()):
+        if ids.get(name) != domain_id:
+            _vnc_ports.pop(name, None)
+
+
+def get_vnc_port(domain_name):
+    """
+    Port VNC du domaine actif. Mis en cache par (domaine, identifiant libvirt) :
+    une seule recherche par démarrage, puis lecture en mémoire.
+    """
+    domain_id = get_domain_id(domain_name)
+    cached = _vnc_ports.get(domain_name)
+    if cached is not None and domain_id is not None and cached[0] == domain_id:
+        return cached[1]
+    port = libvirt_conn.get_vnc_port(domain_name)
+    if port is not None and domain_id is not None:
+        _vnc_ports[domain_name] = (domain_id, port)
+    return port
+
+
+# -------------------- Collecteur (leader) --------------------
+# Événements de cycle de vie libvirt (virDomainEventType)
+EVENT_UNDEFINED = 1
+
+_event_loop = {'started': False}
+
+
+def _run_event_loop():
+    """Boucle d'événements libvirt (thread dédié)."""
+    lv = libvirt_conn.libvirt
+    while True:
+        lv.virEventRunDefaultImpl()
+
+
+def _on_lifecycle_event(conn, dom, event, detail, opaque):
+    try:
+        if event == EVENT_UNDEFINED:
+            _write(removed=[dom.name()])
+        else:
+            state = libvirt_conn.STATE_NAMES.get(dom.state()[0], 'unknown')
+            _write(changes={dom.name(): libvirt_conn.normalize_state(state)},
+                   id_changes={dom.name(): libvirt_conn.active_id(dom)})
+    except Exception as e:
+        print(f"[vm_state_cache] Événement {event} ignoré: {e}")
+
+
+def _collect_with_events():
+    """Abonnement aux événements libvirt ; retourne False si indisponible."""
+    lv = libvirt_conn.libvirt
+    if lv is None or libvirt_conn.get_driver().name != 'libvirt':
+        return False
+    try:
+        if not _event_loop['started']:
+            lv.virEventRegisterDefaultImpl()
+            threading.Thread(target=_run_event_loop, name='libvirt-events', daemon=True).start()
+            _event_loop['started'] = True
+        conn = lv.openReadOnly(libvirt_conn.URI)
+        conn.domainEventRegisterAny(None, lv.VIR_DOMAIN_EVENT_ID_LIFECYCLE, _on_lifecycle_event, None)
+        conn.setKeepAlive(5, 3)
+    except Exception as e:
+        print(f"[vm_state_cache] Événements libvirt indisponibles, mode interrogation: {e}")
+        return False
+
+    resync()
+    last_full = time.time()
+    while conn.isAlive():
+        time.sleep(HEARTBEAT_INTERVAL)
+        if time.time() - last_full >= FULL_RESYNC_INTERVAL:
+            resync()  # rattrape un éventuel événement manqué
+            last_full = time.time()
+        else:
+            _write()  # battement de cœur : l'instantané reste "frais"
+    print("[vm_state_cache] Connexion événements perdue")
+    return True
+
+
+def _collector():
+    while True:
+        try:
+            if not _collect_with_events():
+                resync()
+                time.sleep(POLL_INTERVAL)
+                continue
+        except Exception as e:
+            print(f"[vm_state_cache] Collecteur: {e}")
+        time.sleep(POLL_INTERVAL)
+
+
+def start_collector():
+    """Démarre le collecteur dans le worker élu (les autres restent lecteurs)."""
+    return coordination.run_as_leader('vm-state-collector', _collector)
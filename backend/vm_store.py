@@ -0,0 +1,216 @@
+"""
+Métadonnées des VMs dans la base SQLite partagée (table `vms`).
+
+Une ligne par VM : nom, propriétaire, dossier, OS, type, mémoire, CPUs,
+backend de cycle de vie, interface graphique, date de création. Index sur le
+propriétaire et le nom : propriété, listes et lecture des ressources sont des
+recherches indexées, sans parcours de student_vms/ ni lecture du Vagrantfile.
+
+Le numéro de version (table `vm_store_meta`, tenu par des triggers) augmente à
+chaque ajout, modification ou suppression ; il sert d'empreinte à l'inventaire.
+
+Les VMs créées avant la base sont importées une fois par dossier de base
+(ensure_imported) depuis vm_info.txt et le Vagrantfile. vm_info.txt reste écrit
+pour information ; après une modification manuelle, import_tree() le relit.
+"""
+from pathlib import Path
+import datetime
+import re
+import time
+import db
+import provisioning
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS vms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    os TEXT,
+    vm_type TEXT,
+    memory INTEGER NOT NULL DEFAULT 2048,
+    cpus INTEGER NOT NULL DEFAULT 2,
+    backend TEXT NOT NULL DEFAULT 'vagrant',
+    gui INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    UNIQUE (owner, name)
+);
+CREATE INDEX IF NOT EXISTS vms_owner ON vms (owner);
+CREATE INDEX IF NOT EXISTS vms_name ON vms (name);
+
+CREATE TABLE IF NOT EXISTS vm_store_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO vm_store_meta (key, value) VALUES ('version', 0);
+CREATE TRIGGER IF NOT EXISTS vms_version_insert AFTER INSERT ON vms
+BEGIN UPDATE vm_store_meta SET value = value + 1 WHERE key = 'version'; END;
+CREATE TRIGGER IF NOT EXISTS vms_version_update AFTER UPDATE ON vms
+BEGIN UPDATE vm_store_meta SET value = value + 1 WHERE key = 'version'; END;
+CREATE TRIGGER IF NOT EXISTS vms_version_delete AFTER DELETE ON vms
+BEGIN UPDATE vm_store_meta SET value = value + 1 WHERE key = 'version'; END;
+
+CREATE TABLE IF NOT EXISTS vm_store_imports (
+    base TEXT PRIMARY KEY,
+    imported_at REAL NOT NULL,
+    count INTEGER NOT NULL
+);
+""")
+
+FIELDS = ('name', 'owner', 'path', 'os', 'vm_type', 'memory', 'cpus', 'backend', 'gui', 'created_at')
+
+
+def _to_dict(row):
+    vm = dict(row)
+    vm['gui'] = bool(vm['gui'])
+    return vm
+
+
+def is_gui(os_name, vm_type):
+    """Interface graphique : Windows et Debian client (XFCE)."""
+    return os_name == 'windows' or vm_type == 'client'
+
+
+# -------------------- Lecture --------------------
+def version():
+    """Compteur de modifications de la table (toutes connexions confondues)."""
+    return db.get_db().execute("SELECT value FROM vm_store_meta WHERE key = 'version'").fetchone()['value']
+
+
+def count():
+    return db.get_db().execute("SELECT COUNT(*) AS n FROM vms").fetchone()['n']
+
+
+def get(owner, name):
+    row = db.get_db().execute("SELECT * FROM vms WHERE owner = ? AND name = ?", (owner, name)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def find(name):
+    """VM de ce nom, tous propriétaires confondus (premier propriétaire par ordre alphabétique)."""
+    row = db.get_db().execute("SELECT * FROM vms WHERE name = ? ORDER BY owner LIMIT 1", (name,)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def for_path(path):
+    row = db.get_db().execute("SELECT * FROM vms WHERE path = ?", (str(path),)).fetchone()
+    return _to_dict(row) if row else None
+
+
+def list_vms(owner=None):
+    """VMs d'un propriétaire (toutes si None), triées par propriétaire puis nom."""
+    if owner is None:
+        rows = db.get_db().execute("SELECT * FROM vms ORDER BY owner, name").fetchall()
+    else:
+        rows = db.get_db().execute("SELECT * FROM vms WHERE owner = ? ORDER BY name", (owner,)).fetchall()
+    return [_to_dict(r) for r in rows]
+
+
+# -------------------- Écriture --------------------
+def register(path, owner, name, os_name, vm_type, memory, cpus, backend, created_at=None):
+    """Enregistre (ou remplace) la VM du dossier `path`."""
+    db.get_db().execute(
+        "INSERT OR REPLACE INTO vms (name, owner, path, os, vm_type, memory, cpus, backend, gui, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, owner, str(path), os_name, vm_type, memory, cpus, backend,
+         int(is_gui(os_name, vm_type)), created_at or time.time())
+    )
+
+
+def update(path, **fields):
+    """Modifie des champs (memory, cpus, backend...) de la VM du dossier `path`."""
+    unknown = set(fields) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"Champs inconnus: {', '.join(sorted(unknown))}")
+    if not fields:
+        return
+    assignments = ', '.join(f"{key} = ?" for key in fields)
+    db.get_db().execute(f"UPDATE vms SET {assignments} WHERE path = ?", (*fields.values(), str(path)))
+
+
+def remove(path):
+    db.get_db().execute("DELETE FROM vms WHERE path = ?", (str(path),))
+
+
+# -------------------- Import des arborescences existantes --------------------
+def _read_vm_info(vm_path):
+    """Champs de vm_info.txt ("Clé: valeur") ; {} s'il est absent."""
+    info = {}
+    try:
+        with open(vm_path / "vm_info.txt") as f:
+            for line in f:
+                key, sep, value = line.partition(':')
+                if sep:
+                    info[key.strip()] = value.strip()
+    except OSError:
+        pass
+    return info
+
+
+def _from_files(vm_path, owner):
+    """Métadonnées d'une VM d'après vm_info.txt et son Vagrantfile (import)."""
+    info = _read_vm_info(vm_path)
+    try:
+        vagrantfile = (vm_path / "Vagrantfile").read_text()
+    except OSError:
+        vagrantfile = ''
+    memory = provisioning.vagrantfile_memory_mb(vagrantfile)
+    cpus = re.search(r'lv\.cpus\s*=\s*(\d+)', vagrantfile)
+    try:
+        created_at = datetime.datetime.fromisoformat(info['Created']).timestamp()
+    except (KeyError, ValueError):
+        created_at = vm_path.stat().st_mtime
+    os_name, vm_type = info.get('OS'), info.get('Type')
+    record = {
+        'name': vm_path.name,
+        'owner': owner,
+        'path': str(vm_path),
+        'os': os_name,
+        'vm_type': vm_type,
+        'memory': memory or 2048,
+        'cpus': int(cpus.group(1)) if cpus else 2,
+        'backend': info.get('Backend') if info.get('Backend') in ('vagrant', 'native') else 'vagrant',
+        'gui': int(is_gui(os_name, vm_type) if os_name else
+                   'xfce' in vagrantfile.lower() or 'windows' in vagrantfile.lower()),
+        'created_at': created_at,
+    }
+    return record
+
+
+def import_tree(base_dir):
+    """
+    (Ré)importe toutes les VMs de base_dir/<propriétaire>/<vm> depuis leurs fichiers,
+    et oublie celles dont le dossier a disparu. Retourne le nombre de VMs importées.
+    """
+    base_dir = Path(base_dir)
+    records = []
+    if base_dir.exists():
+        for user_dir in sorted(base_dir.iterdir()):
+            if user_dir.is_dir():
+                records.extend(_from_files(vm_dir, user_dir.name)
+                               for vm_dir in sorted(user_dir.iterdir()) if vm_dir.is_dir())
+    with db.transaction() as conn:
+        paths = {r['path'] for r in records}
+        for row in conn.execute("SELECT path FROM vms WHERE path LIKE ?", (f"{base_dir}/%",)).fetchall():
+            if row['path'] not in paths:
+                conn.execute("DELETE FROM vms WHERE path = ?", (row['path'],))
+        for record in records:
+            existing = conn.execute("SELECT * FROM vms WHERE path = ?", (record['path'],)).fetchone()
+            if existing is not None and all(existing[k] == record[k] for k in FIELDS):
+                continue
+            conn.execute(
+                f"INSERT OR REPLACE INTO vms ({', '.join(FIELDS)}) VALUES ({', '.join('?' for _ in FIELDS)})",
+                tuple(record[k] for k in FIELDS)
+            )
+        conn.execute("INSERT OR REPLACE INTO vm_store_imports (base, imported_at, count) VALUES (?, ?, ?)",
+                     (str(base_dir), time.time(), len(records)))
+    return len(records)
+
+
+def ensure_imported(base_dir):
+    """Import initial (une seule fois par dossier de base, tous workers confondus)."""
+    if db.get_db().execute("SELECT 1 FROM vm_store_imports WHERE base = ?", (str(base_dir),)).fetchone():
+        return False
+    count = import_tree(base_dir)
+    print(f"[vm_store] {count} VM(s) importée(s) depuis {base_dir}")
+    return True
@@ -0,0 +1,300 @@
+"""
+Passerelle noVNC unique : un seul processus, un seul port (VNC_GATEWAY_PORT),
+pour toutes les consoles, au lieu d'un websockify par VM.
+
+- get_vnc_url émet un jeton signé (SECRET_KEY) de courte durée contenant le
+  domaine et son port VNC ; la passerelle le vérifie à l'ouverture de la
+  connexion websocket (/websockify?token=...) puis relaie vers 127.0.0.1:<port VNC>.
+- Elle sert aussi les fichiers de noVNC (vnc.html...), comme `websockify --web`.
+- Octets échangés et inactivité sont suivis par connexion ; seule une saisie de
+  l'utilisateur (clavier, souris, presse-papiers) compte comme activité, pas les
+  mises à jour d'écran ni les demandes de rafraîchissement que noVNC envoie en
+  continu. Les connexions inactives depuis VNC_GATEWAY_IDLE_TIMEOUT sont fermées. L'état est publié
+  dans DATA_DIR/vnc_gateway.json (lu par /api/admin/vnc_gateway).
+
+Lancement (service vm_manager_vnc.service), depuis backend/ :
+
+    python vnc_gateway.py [--host 0.0.0.0] [--port 6080]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import itertools
+import mimetypes
+import os
+import struct
+import time
+import urllib.parse
+from pathlib import Path
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+import config
+import coordination
+
+SNAPSHOT_FILE = 'vnc_gateway.json'
+SNAPSHOT_INTERVAL = 5
+PORT = config.VNC_GATEWAY_PORT
+TOKEN_TTL = config.VNC_TOKEN_TTL
+IDLE_TIMEOUT = config.VNC_GATEWAY_IDLE_TIMEOUT
+NOVNC_DIR = Path(config.VNC_NOVNC_DIR)
+MAX_FRAME = 16 * 1024 * 1024
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+# -------------------- Jetons (côté Flask) --------------------
+def _serializer():
+    return URLSafeTimedSerializer(config.SECRET_KEY, salt='vnc-gateway')
+
+
+def issue_token(domain_name, vnc_port, username):
+    """Jeton signé donnant accès à la console d'un domaine pendant TOKEN_TTL secondes."""
+    return _serializer().dumps({'d': domain_name, 'p': int(vnc_port), 'u': username})
+
+
+def verify_token(token, max_age=None):
+    """Contenu du jeton ({'d', 'p', 'u'}) s'il est valide et non expiré, None sinon."""
+    try:
+        return _serializer().loads(token, max_age=max_age or TOKEN_TTL)
+    except BadSignature:  # inclut SignatureExpired
+        return None
+
+
+def console_url(token):
+    """URL noVNC (clavier AZERTY) passant par la passerelle."""
+    base = config.VNC_GATEWAY_PUBLIC_URL or f"http://localhost:{PORT}"
+    path = urllib.parse.quote(f"websockify?token={token}", safe='')
+    return f"{base}/vnc.html?autoconnect=true&resize=scale&keyboard=fr&path={path}"
+
+
+def status():
+    """Dernier état publié par la passerelle (connexions, octets, inactivité), ou None."""
+    return coordination.read_json(coordination.data_path(SNAPSHOT_FILE))
+
+
+def is_running():
+    """Vrai si la passerelle a publié son état récemment et que son processus vit."""
+    snapshot = status()
+    if not snapshot or time.time() - snapshot.get('updated_at', 0) > 3 * SNAPSHOT_INTERVAL:
+        return False
+    try:
+        os.kill(snapshot['pid'], 0)
+    except PermissionError:
+        return True  # processus vivant sous un autre utilisateur
+    except (ProcessLookupError, KeyError, TypeError):
+        return False
+    return True
+
+
+def active_domains():
+    """Domaines dont la console est ouverte via la passerelle (dernier état publié)."""
+    if not is_running():
+        return set()
+    return {c['domain'] for c in (status() or {}).get('connections', [])}
+
+
+# -------------------- Protocole WebSocket (RFC 6455) --------------------
+def _unmask(data, mask):
+    n = len(data)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(key, 'big')).to_bytes(n, 'big')
+
+
+def _frame(opcode, payload=b''):
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+async def _read_frame(reader):
+    b1, b2 = await reader.readexactly(2)
+    length = b2 & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > MAX_FRAME:
+        raise ValueError('trame trop grande')
+    mask = await reader.readexactly(4) if b2 & 0x80 else None
+    payload = await reader.readexactly(length)
+    return b1 & 0x0F, _unmask(payload, mask) if mask else payload
+
+
+# -------------------- Serveur --------------------
+_connections = {}   # id -> statistiques publiées
+_writers = {}       # id -> (websocket, VNC) pour la fermeture des connexions inactives
+_ids = itertools.count(1)
+
+
+def _http_response(writer, status, body=b'', content_type='text/plain; charset=utf-8', head=False):
+    writer.write(
+        f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + (b'' if head else body)
+    )
+
+
+def _serve_static(writer, path, head=False):
+    relative = urllib.parse.unquote(path).lstrip('/') or 'vnc.html'
+    file_path = (NOVNC_DIR / relative).resolve()
+    if NOVNC_DIR.resolve() not in file_path.parents or not file_path.is_file():
+        _http_response(writer, '404 Not Found', b'Introuvable')
+        return
+    content_type = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+    _http_response(writer, '200 OK', file_path.read_bytes(), content_type, head)
+
+
+# -------------------- Activité (messages client RFB) --------------------
+INPUT_MESSAGES = {4, 5, 6, 248}  # KeyEvent, PointerEvent, ClientCutText, message QEMU (touches étendues)
+CLIENT_MESSAGE_SIZES = {0: 20, 3: 10, 150: 10}  # SetPixelFormat, FramebufferUpdateRequest, EnableContinuousUpdates
+
+
+def is_user_input(data):
+    """
+    Vrai si les données client contiennent une saisie. Les messages de service
+    (formats, encodages, demandes de rafraîchissement) ne comptent pas ; des
+    données non reconnues (poignée de main RFB...) comptent comme activité.
+    """
+    i = 0
+    while i < len(data):
+        kind = data[i]
+        if kind in INPUT_MESSAGES:
+            return True
+        if kind == 2 and i + 4 <= len(data):  # SetEncodings : 4 octets + 4 par encodage
+            size = 4 + 4 * struct.unpack('!H', data[i + 2:i + 4])[0]
+        else:
+            size = CLIENT_MESSAGE_SIZES.get(kind)
+        if size is None:
+            return True
+        i += size
+    return False
+
+
+async def _pump_ws_to_vnc(ws_reader, ws_writer, vnc_writer, stats):
+    while True:
+        opcode, payload = await _read_frame(ws_reader)
+        if opcode == 0x8:  # fermeture
+            ws_writer.write(_frame(0x8, payload[:2]))
+            return
+        if opcode == 0x9:  # ping
+            ws_writer.write(_frame(0xA, payload))
+            continue
+        if opcode in (0x0, 0x1, 0x2):
+            vnc_writer.write(payload)
+            await vnc_writer.drain()
+            stats['bytes_up'] += len(payload)
+            if is_user_input(payload):
+                stats['last_activity'] = time.time()
+
+
+async def _pump_vnc_to_ws(vnc_reader, ws_writer, stats):
+    while True:
+        data = await vnc_reader.read(65536)
+        if not data:
+            ws_writer.write(_frame(0x8, struct.pack('!H', 1000)))
+            return
+        ws_writer.write(_frame(0x2, data))
+        await ws_writer.drain()
+        stats['bytes_down'] += len(data)
+
+
+async def _proxy(reader, writer, query, headers):
+    token = urllib.parse.parse_qs(query).get('token', [''])[0]
+    claims = verify_token(token) if token else None
+    key = headers.get('sec-websocket-key')
+    if claims is None or not key:
+        _http_response(writer, '403 Forbidden', b'Jeton invalide ou expire')
+        return
+    try:
+        vnc_reader, vnc_writer = await asyncio.open_connection('127.0.0.1', claims['p'])
+    except OSError:
+        _http_response(writer, '502 Bad Gateway', b'Console VNC injoignable')
+        return
+
+    accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+    protocols = [p.strip() for p in headers.get('sec-websocket-protocol', '').split(',')]
+    lines = ['HTTP/1.1 101 Switching Protocols', 'Upgrade: websocket', 'Connection: Upgrade',
+             f'Sec-WebSocket-Accept: {accept}']
+    if 'binary' in protocols:
+        lines.append('Sec-WebSocket-Protocol: binary')
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode())
+
+    conn_id = next(_ids)
+    now = time.time()
+    stats = {'id': conn_id, 'domain': claims['d'], 'user': claims['u'], 'vnc_port': claims['p'],
+             'started_at': now, 'last_activity': now, 'bytes_up': 0, 'bytes_down': 0}
+    _connections[conn_id] = stats
+    _writers[conn_id] = (writer, vnc_writer)
+    tasks = [asyncio.ensure_future(_pump_ws_to_vnc(reader, writer, vnc_writer, stats)),
+             asyncio.ensure_future(_pump_vnc_to_ws(vnc_reader, writer, stats))]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        vnc_writer.close()
+        _connections.pop(conn_id, None)
+        _writers.pop(conn_id, None)
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 10)
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), 10)
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        url = urllib.parse.urlsplit(target)
+        if headers.get('upgrade', '').lower() == 'websocket':
+            await _proxy(reader, writer, url.query, headers)
+        elif method in ('GET', 'HEAD'):
+            _serve_static(writer, url.path, head=(method == 'HEAD'))
+        else:
+            _http_response(writer, '405 Method Not Allowed')
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _housekeeping(port):
+    """Ferme les connexions inactives et publie l'état de la passerelle."""
+    path = coordination.data_path(SNAPSHOT_FILE)
+    while True:
+        now = time.time()
+        for conn_id, stats in list(_connections.items()):
+            if now - stats['last_activity'] > IDLE_TIMEOUT and conn_id in _writers:
+                print(f"[vnc_gateway] Connexion {conn_id} ({stats['domain']}) inactive, fermeture")
+                for w in _writers[conn_id]:
+                    w.close()
+        coordination.atomic_write_json(path, {
+            'pid': os.getpid(),
+            'port': port,
+            'updated_at': now,
+            'connections': [dict(s, idle=round(now - s['last_activity'], 1)) for s in _connections.values()],
+        })
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(_handle, host, port, reuse_address=True)
+    print(f"[vnc_gateway] Écoute sur {host}:{port} (noVNC: {NOVNC_DIR})")
+    asyncio.ensure_future(_housekeeping(port))
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Passerelle noVNC unique (jetons signés)")
+    parser.add_argument('--host', default=config.VNC_GATEWAY_HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,200 @@
+"""
+Registre des proxys websockify (accès noVNC), partagé entre les workers gunicorn.
+
+Table SQLite `vnc_proxies` : un proxy par domaine (VM), avec port websocket,
+port VNC, pid et dernière activité.
+- Les ports sont attribués sous transaction (BEGIN IMMEDIATE) dans la plage
+  VNC_PROXY_PORT_MIN..VNC_PROXY_PORT_MAX : deux workers ne peuvent pas prendre
+  le même port. Le port de la passerelle (VNC_GATEWAY_PORT, dans la plage par
+  défaut) n'est jamais attribué : libre pendant un redémarrage de la passerelle,
+  un proxy l'occuperait jusqu'à son arrêt.
+- Un proxy vivant pour la même VM (et le même port VNC) est réutilisé, quel que
+  soit le worker qui l'a lancé ; l'arrêt fonctionne aussi d'un worker à l'autre.
+- Le worker élu 'vnc-proxy-reaper' arrête les proxys inactifs (aucune connexion
+  websocket depuis VNC_PROXY_IDLE_TIMEOUT) et oublie ceux dont le processus a disparu.
+"""
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+import commands
+import config
+import coordination
+import db
+
+PORT_MIN = config.VNC_PROXY_PORT_MIN
+PORT_MAX = config.VNC_PROXY_PORT_MAX  # exclu
+RESERVED_PORTS = {config.VNC_GATEWAY_PORT} if config.VNC_GATEWAY_ENABLED else set()
+IDLE_TIMEOUT = config.VNC_PROXY_IDLE_TIMEOUT
+REAP_INTERVAL = 30
+NOVNC_DIR = '/usr/share/novnc'
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS vnc_proxies (
+    domain TEXT PRIMARY KEY,
+    vm_name TEXT NOT NULL,
+    ws_port INTEGER NOT NULL UNIQUE,
+    vnc_port INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    started_at REAL NOT NULL,
+    last_activity REAL NOT NULL
+);
+""")
+
+
+# -------------------- Processus --------------------
+def _alive(pid):
+    """Vrai si `pid` est un websockify vivant (ni terminé, ni zombie, ni pid réutilisé)."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            if f.read().rsplit(')', 1)[1].split()[0] == 'Z':
+                return False
+        with open(f'/proc/{pid}/cmdline', 'rb') as f:
+            return b'websockify' in f.read()
+    except (OSError, IndexError):
+        return False
+
+
+def _kill(pid):
+    try:
+        os.killpg(pid, signal.SIGTERM)  # lancé dans son propre groupe
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _port_free(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            s.bind(('', port))
+        except OSError:
+            return False
+    return True
+
+
+def _spawn(ws_port, vnc_port):
+    cmd = ['websockify', '--web', NOVNC_DIR, f'{ws_port}', f'127.0.0.1:{vnc_port}']
+    process = commands.popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        preexec_fn=os.setpgrp  # Créer un nouveau groupe de processus
+    )
+    # Récupère le code de sortie (pas de zombie si un autre worker l'arrête)
+    threading.Thread(target=process.wait, daemon=True).start()
+    return process.pid
+
+
+def _connected_ports():
+    """Ports locaux ayant au moins une connexion TCP établie (/proc/net/tcp*)."""
+    ports = set()
+    for name in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(name) as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if fields[3] == '01':  # ESTABLISHED
+                        ports.add(int(fields[1].rsplit(':', 1)[1], 16))
+        except (OSError, StopIteration):
+            continue
+    return ports
+
+
+# -------------------- Registre --------------------
+def acquire(domain_name, vm_name, vnc_port):
+    """
+    Retourne le port websocket du proxy de la VM, en le lançant si besoin.
+    None si aucun port n'est disponible ou si websockify ne démarre pas.
+    """
+    with db.transaction() as conn:
+        row = conn.execute("SELECT * FROM vnc_proxies WHERE domain = ?", (domain_name,)).fetchone()
+        if row is not None:
+            if _alive(row['pid']) and row['vnc_port'] == vnc_port:
+                conn.execute("UPDATE vnc_proxies SET last_activity = ? WHERE domain = ?", (time.time(), domain_name))
+                return row['ws_port']
+            _kill(row['pid'])
+            conn.execute("DELETE FROM vnc_proxies WHERE domain = ?", (domain_name,))
+
+        used = {r['ws_port'] for r in conn.execute("SELECT ws_port FROM vnc_proxies")} | RESERVED_PORTS
+        ws_port = next((p for p in range(PORT_MIN, PORT_MAX) if p not in used and _port_free(p)), None)
+        if ws_port is None:
+            print(f"[vnc_proxies] Plus de port libre ({PORT_MIN}-{PORT_MAX - 1})")
+            return None
+        try:
+            pid = _spawn(ws_port, vnc_port)
+        except Exception as e:
+            print(f"Erreur démarrage websockify: {e}")
+            return None
+        now = time.time()
+        conn.execute(
+            "INSERT INTO vnc_proxies (domain, vm_name, ws_port, vnc_port, pid, started_at, last_activity) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (domain_name, vm_name, ws_port, vnc_port, pid, now, now)
+        )
+    return ws_port
+
+
+def release(domain_name):
+    """Arrête le proxy d'une VM (quel que soit le worker qui l'a lancé)."""
+    with db.transaction() as conn:
+        row = conn.execute("SELECT pid FROM vnc_proxies WHERE domain = ?", (domain_name,)).fetchone()
+        if row is None:
+            return False
+        _kill(row['pid'])
+        conn.execute("DELETE FROM vnc_proxies WHERE domain = ?", (domain_name,))
+    return True
+
+
+def active_domains():
+    """Domaines dont le proxy a une connexion websocket établie (console ouverte)."""
+    connected = _connected_ports()
+    rows = db.get_db().execute("SELECT domain, ws_port FROM vnc_proxies").fetchall()
+    return {row['domain'] for row in rows if row['ws_port'] in connected}
+
+
+def list_proxies():
+    rows = db.get_db().execute("SELECT * FROM vnc_proxies ORDER BY ws_port").fetchall()
+    return [dict(r, alive=_alive(r['pid'])) for r in rows]
+
+
+def reap(now=None):
+    """
+    Met à jour l'activité des proxys (connexion websocket établie), arrête ceux
+    inactifs depuis IDLE_TIMEOUT et oublie ceux dont le processus a disparu.
+    Retourne la liste des domaines retirés.
+    """
+    now = now or time.time()
+    connected = _connected_ports()
+    removed = []
+    with db.transaction() as conn:
+        for row in conn.execute("SELECT * FROM vnc_proxies").fetchall():
+            if not _alive(row['pid']):
+                removed.append(row['domain'])
+            elif row['ws_port'] in connected:
+                conn.execute("UPDATE vnc_proxies SET last_activity = ? WHERE domain = ?", (now, row['domain']))
+                continue
+            elif now - row['last_activity'] > IDLE_TIMEOUT:
+                _kill(row['pid'])
+                removed.append(row['domain'])
+            else:
+                continue
+            conn.execute("DELETE FROM vnc_proxies WHERE domain = ?", (row['domain'],))
+    return removed
+
+
+def _reap_loop():
+    while True:
+        try:
+            for domain_name in reap():
+                print(f"[vnc_proxies] Proxy de {domain_name} arrêté (inactif ou disparu)")
+        except Exception as e:
+            print(f"[vnc_proxies] Nettoyage impossible: {e}")
+        time.sleep(REAP_INTERVAL)
+
+
+def start_reaper():
+    """Démarre le nettoyage périodique des proxys dans le worker élu."""
+    return coordination.run_as_leader('vnc-proxy-reaper', _reap_loop)
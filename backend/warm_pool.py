@@ -0,0 +1,374 @@
+"""
+Pool de VMs préchauffées : VMs déjà démarrées et provisionnées, attribuées
+immédiatement par create_vm.
+
+- Taille cible par modèle ('debian-serveur', 'debian-client', 'windows') :
+  WARM_POOL_SIZES, relevée pendant les créneaux de WARM_POOL_SCHEDULE
+  (ex: "1-5 07:30-12:00 debian-client=12" : du lundi au vendredi ; démarrer
+  le créneau un peu avant la séance pour laisser le temps au pool de chauffer).
+- Les VMs du pool vivent dans DATA_DIR/pool/ ; à l'attribution, le dossier est
+  déplacé dans student_vms/<user>/<vm>/ et le compte de l'étudiant est créé par
+  l'agent invité (canal org.qemu.guest_agent.0, sans redémarrage). Le script de
+  personnalisation (mots de passe compris) est déposé dans le dossier de la VM et
+  supprimé par la tâche : il ne passe pas par la table `jobs`.
+- Le domaine libvirt garde son nom d'origine (un domaine actif ne peut pas être
+  renommé) : domain_for() fait la correspondance dossier -> domaine.
+- Le worker élu 'warm-pool' complète (ou réduit) le pool en tâche de fond.
+"""
+from pathlib import Path
+import datetime
+import os
+import shutil
+import subprocess
+import time
+import config
+import coordination
+import db
+import golden_images
+import jobs
+import libvirt_conn
+import memory_balancer
+import provisioning
+import vm_state_cache
+
+TEMPLATES = {provisioning.template_name(*key): key for key in provisioning.TEMPLATES}
+MAX_RECENT_FAILURES = 3      # au-delà, plus de nouvelle VM pour ce modèle pendant FAILURE_WINDOW
+FAILURE_WINDOW = 600
+CLAIM_TIMEOUT = 300
+PERSONALIZE_FILE = '.personalize'  # script de personnalisation en attente (dossier de la VM)
+
+db.register_schema("""
+CREATE TABLE IF NOT EXISTS warm_pool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    template TEXT NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    domain TEXT NOT NULL DEFAULT '',
+    path TEXT NOT NULL DEFAULT '',
+    box_name TEXT NOT NULL,
+    box_version TEXT,
+    state TEXT NOT NULL DEFAULT 'warming',
+    job_id INTEGER,
+    created_at REAL NOT NULL,
+    ready_at REAL,
+    claimed_at REAL,
+    claimed_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_warm_pool_state ON warm_pool(template, state);
+CREATE INDEX IF NOT EXISTS idx_warm_pool_path ON warm_pool(path);
+CREATE TABLE IF NOT EXISTS warm_pool_stats (
+    template TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0
+);
+""")
+
+
+# -------------------- Tailles cibles --------------------
+def _parse_sizes(text):
+    """'debian-client=4,windows=1' -> {'debian-client': 4, 'windows': 1} (modèles inconnus ignorés)."""
+    sizes = {}
+    for item in text.split(','):
+        name, _, value = item.strip().partition('=')
+        if name in TEMPLATES and value.strip().isdigit():
+            sizes[name] = int(value)
+    return sizes
+
+
+def _parse_days(text):
+    if text == '*':
+        return set(range(1, 8))
+    days = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        days.update(range(int(first), int(last or first) + 1))
+    return days
+
+
+def parse_schedule(text):
+    """
+    Créneaux "jours HH:MM-HH:MM tailles" séparés par ';' (jours ISO : 1 = lundi, '*' = tous).
+    Retourne [(jours, début, fin, tailles)] ; les entrées mal formées sont ignorées.
+    """
+    windows = []
+    for entry in text.split(';'):
+        parts = entry.split()
+        if len(parts) != 3:
+            continue
+        try:
+            start, _, end = parts[1].partition('-')
+            windows.append((
+                _parse_days(parts[0]),
+                datetime.time.fromisoformat(start),
+                datetime.time.fromisoformat(end),
+                _parse_sizes(parts[2]),
+            ))
+        except ValueError:
+            print(f"[warm_pool] Créneau ignoré: {entry.strip()}")
+    return windows
+
+
+SIZES = _parse_sizes(config.WARM_POOL_SIZES)
+SCHEDULE = parse_schedule(config.WARM_POOL_SCHEDULE)
+
+
+def configured_templates():
+    """Modèles pour lesquels un pool est configuré (taille de base ou créneau)."""
+    names = set(SIZES)
+    for _, _, _, sizes in SCHEDULE:
+        names.update(sizes)
+    return names
+
+
+def targets(now=None):
+    """Taille cible de chaque modèle configuré à l'instant `now` (max de la base et des créneaux actifs)."""
+    now = now or datetime.datetime.now()
+    result = {name: SIZES.get(name, 0) for name in configured_templates()}
+    for days, start, end, sizes in SCHEDULE:
+        if now.isoweekday() in days and start <= now.time() < end:
+            for name, size in sizes.items():
+                result[name] = max(result[name], size)
+    return result
+
+
+# -------------------- Correspondance dossier -> domaine --------------------
+def domain_for(vm_path):
+    """Domaine libvirt d'une VM issue du pool, ou None pour une VM créée normalement."""
+    row = db.get_db().execute(
+        "SELECT domain FROM warm_pool WHERE path = ? AND state = 'claimed'", (str(vm_path),)
+    ).fetchone()
+    return row['domain'] if row else None
+
+
+def domain_aliases():
+    """{dossier: domaine} de toutes les VMs issues du pool (une seule requête, pour les listes)."""
+    rows = db.get_db().execute("SELECT path, domain FROM warm_pool WHERE state = 'claimed'").fetchall()
+    return {r['path']: r['domain'] for r in rows}
+
+
+def forget(vm_path):
+    """Oublie une VM issue du pool (appelé à sa suppression)."""
+    db.get_db().execute("DELETE FROM warm_pool WHERE path = ? AND state = 'claimed'", (str(vm_path),))
+
+
+# -------------------- Attribution --------------------
+def _count(conn, template, column):
+    conn.execute(
+        f"INSERT INTO warm_pool_stats (template, {column}) VALUES (?, 1) "
+        f"ON CONFLICT(template) DO UPDATE SET {column} = {column} + 1", (template,)
+    )
+
+
+def claim(template, vm_path, owner):
+    """
+    Attribue une VM prête du pool : son dossier est déplacé vers `vm_path`.
+    Retourne la ligne du pool (dict) ou None (pas de pool pour ce modèle, ou pool vide).
+    """
+    if template not in configured_templates():
+        return None
+    with db.transaction() as conn:
+        row = conn.execute(
+            "SELECT * FROM warm_pool WHERE template = ? AND state = 'ready' ORDER BY id LIMIT 1", (template,)
+        ).fetchone()
+        if row is None:
+            _count(conn, template, 'misses')
+            return None
+        conn.execute(
+            "UPDATE warm_pool SET state = 'claimed', claimed_at = ?, claimed_by = ?, path = ? WHERE id = ?",
+            (time.time(), owner, str(vm_path), row['id'])
+        )
+        _count(conn, template, 'hits')
+    try:
+        shutil.move(row['path'], str(vm_path))
+    except OSError as e:
+        print(f"[warm_pool] Déplacement de {row['name']} impossible: {e}")
+        db.get_db().execute("UPDATE warm_pool SET state = 'failed', path = ? WHERE id = ?", (row['path'], row['id']))
+        return None
+    pooled = dict(row)
+    pooled['path'] = str(vm_path)
+    return pooled
+
+
+def personalize_script(os_name, vm_type, vm_name, user_script):
+    """Script exécuté par l'agent invité à l'attribution : compte utilisateur, nom d'hôte, session."""
+    if os_name == "windows":
+        return user_script
+    extra = f"\nhostnamectl set-hostname {vm_name} || true\n"
+    if vm_type == "client":
+        extra += "systemctl restart lightdm || systemctl restart display-manager || true\n"
+    return user_script + "\n" + extra
+
+
+def stage_personalization(vm_path, os_name, vm_type, vm_name, user_script):
+    """Dépose le script de personnalisation dans le dossier de la VM (lisible par le seul service)."""
+    fd = os.open(Path(vm_path) / PERSONALIZE_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(personalize_script(os_name, vm_type, vm_name, user_script))
+
+
+@jobs.handler('pool_claim')
+def _job_claim(job, log):
+    """Tâche: personnalise une VM attribuée depuis le pool (via l'agent invité)."""
+    payload = job['payload']
+    staged = Path(payload['path']) / PERSONALIZE_FILE
+    try:
+        script = staged.read_text(encoding='utf-8')
+    except OSError:
+        raise jobs.JobFailed(f"Script de personnalisation de {job['vm_name']} introuvable.")
+    if payload['os'] == 'windows':
+        path, args = 'powershell.exe', ['-NoProfile', '-NonInteractive', '-Command', '-']
+    else:
+        path, args = '/bin/sh', ['-s']
+    log(f"Personnalisation de {payload['domain']} via l'agent invité")
+    try:
+        code, output = libvirt_conn.guest_exec(payload['domain'], path, args, input_data=script,
+                                               timeout=CLAIM_TIMEOUT)
+    finally:
+        staged.unlink(missing_ok=True)
+    for line in output.splitlines():
+        log(line)
+    if code != 0:
+        raise jobs.JobFailed(f"Personnalisation de {job['vm_name']} échouée : {output.strip()[-200:] or code}")
+    return f"VM {job['vm_name']} prête (pool préchauffé)."
+
+
+# -------------------- Remplissage --------------------
+def _spawn(template):
+    """Crée une VM de pool (dossier + Vagrantfile) et met son démarrage en file."""
+    os_name, vm_type = TEMPLATES[template]
+    spec = provisioning.get_template(os_name, vm_type)
+    golden = golden_images.current_image(os_name, vm_type) if config.GOLDEN_IMAGES_ENABLED else None
+    box_name, box_version = (golden['box_name'], golden['version']) if golden else (spec['box'], None)
+    script = "" if golden else provisioning.base_script(os_name, vm_type)
+
+    with db.transaction() as conn:
+        pool_id = conn.execute(
+            "INSERT INTO warm_pool (template, box_name, box_version, created_at) VALUES (?, ?, ?, ?)",
+            (template, box_name, box_version, time.time())
+        ).lastrowid
+        name = f"pool-{template}-{pool_id}"
+        vm_path = coordination.data_path('pool') / name
+        conn.execute("UPDATE warm_pool SET name = ?, domain = ?, path = ? WHERE id = ?",
+                     (name, f"{name}_default", str(vm_path), pool_id))
+
+    vm_path.mkdir(parents=True, exist_ok=True)
+    (vm_path / 'Vagrantfile').write_text(provisioning.render_vagrantfile(
+        box_name, name, spec['memory'], spec['cpus'],
+        serial_console=spec['serial_console'],
+        windows=(os_name == 'windows'),
+        provision_script=script,
+        box_version=box_version
+    ))
+    job_id = jobs.submit('pool_warm', name, None, {
+        'pool_id': pool_id, 'path': str(vm_path), 'memory': spec['memory'], 'cpus': spec['cpus'],
+    })
+    db.get_db().execute("UPDATE warm_pool SET job_id = ? WHERE id = ?", (job_id, pool_id))
+
+
+@jobs.handler('pool_warm')
+def _job_warm(job, log):
+    """Tâche: démarre et provisionne une VM de pool."""
+    payload = job['payload']
+    try:
+        code = jobs.run_logged(['vagrant', 'up', '--provider', 'libvirt'], log, cwd=payload['path'],
+                               timeout=config.VAGRANT_UP_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        code = None
+    finally:
+        vm_state_cache.refresh_domain(f"{job['vm_name']}_default")
+    if code != 0:
+        db.get_db().execute("UPDATE warm_pool SET state = 'failed' WHERE id = ?", (payload['pool_id'],))
+        _destroy(payload['path'], log)
+        raise jobs.JobFailed(f"Préchauffage de {job['vm_name']} échoué (vagrant up code {code})", code or 1)
+    memory_balancer.ensure_maximum(f"{job['vm_name']}_default", payload['memory'], log)
+    db.get_db().execute("UPDATE warm_pool SET state = 'ready', ready_at = ? WHERE id = ? AND state = 'warming'",
+                        (time.time(), payload['pool_id']))
+    return f"VM {job['vm_name']} prête dans le pool."
+
+
+@jobs.handler('pool_drain')
+def _job_drain(job, log):
+    """Tâche: supprime une VM de pool en surplus."""
+    payload = job['payload']
+    _destroy(payload['path'], log)
+    vm_state_cache.refresh_domain(f"{job['vm_name']}_default")
+    db.get_db().execute("DELETE FROM warm_pool WHERE id = ?", (payload['pool_id'],))
+    return f"VM {job['vm_name']} retirée du pool."
+
+
+def _destroy(vm_path, log):
+    try:
+        jobs.run_logged(['vagrant', 'destroy', '-f'], log, cwd=vm_path, timeout=config.VAGRANT_DESTROY_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        log("vagrant destroy : délai dépassé")
+    shutil.rmtree(vm_path, ignore_errors=True)
+
+
+def refill(now=None):
+    """Ajuste chaque pool à sa taille cible : nouvelles VMs si manque, suppression des VMs prêtes en surplus."""
+    conn = db.get_db()
+    for template, target in targets(now).items():
+        rows = conn.execute(
+            "SELECT id, name, path, state, created_at FROM warm_pool WHERE template = ? AND state IN "
+            "('warming', 'ready', 'failed', 'draining') ORDER BY id", (template,)
+        ).fetchall()
+        live = [r for r in rows if r['state'] in ('warming', 'ready')]
+        recent_failures = [r for r in rows if r['state'] == 'failed' and r['created_at'] > time.time() - FAILURE_WINDOW]
+
+        if len(live) < target:
+            if len(recent_failures) >= MAX_RECENT_FAILURES:
+                print(f"[warm_pool] {template}: trop d'échecs récents, remplissage suspendu")
+                continue
+            for _ in range(target - len(live)):
+                _spawn(template)
+        elif len(live) > target:
+            surplus = [r for r in live if r['state'] == 'ready'][:len(live) - target]
+            for r in surplus:
+                conn.execute("UPDATE warm_pool SET state = 'draining' WHERE id = ? AND state = 'ready'", (r['id'],))
+                jobs.submit('pool_drain', r['name'], None, {'pool_id': r['id'], 'path': r['path']})
+
+
+def _refill_loop():
+    while True:
+        try:
+            refill()
+        except Exception as e:
+            print(f"[warm_pool] Remplissage impossible: {e}")
+        time.sleep(config.WARM_POOL_INTERVAL)
+
+
+def start():
+    """Démarre le remplissage du pool dans le worker élu (rien si aucun pool n'est configuré)."""
+    if not configured_templates():
+        return None
+    return coordination.run_as_leader('warm-pool', _refill_loop)
+
+
+# -------------------- Consultation --------------------
+def hit_counts():
+    """{modèle: (attributions depuis le pool, créations sans VM prête)} ; modèles configurés compris."""
+    counts = {template: (0, 0) for template in configured_templates()}
+    for row in db.get_db().execute("SELECT template, hits, misses FROM warm_pool_stats"):
+        counts[row['template']] = (row['hits'], row['misses'])
+    return counts
+
+
+def status():
+    """Taille cible, VMs par état et taux de succès d'attribution, par modèle."""
+    conn = db.get_db()
+    counts = {}
+    for row in conn.execute("SELECT template, state, COUNT(*) AS n FROM warm_pool GROUP BY template, state"):
+        counts.setdefault(row['template'], {})[row['state']] = row['n']
+    stats = {r['template']: r for r in conn.execute("SELECT * FROM warm_pool_stats")}
+    result = {}
+    current = targets()
+    for template in sorted(set(current) | set(counts) | set(stats)):
+        hits = stats[template]['hits'] if template in stats else 0
+        misses = stats[template]['misses'] if template in stats else 0
+        result[template] = {
+            'target': current.get(template, 0),
+            'states': counts.get(template, {}),
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else None,
+        }
+    return result
@@ -11,6 +11,7 @@ echo "======================================="
 APP_DIR="/home/iris/sisr/vm_manager"
 VENV_DIR="$APP_DIR/.venv"
 SERVICE_NAME="vm_manager.service"
+VNC_SERVICE_NAME="vm_manager_vnc.service"
 LOG_DIR="/var/log/vm_manager"
 
 # Vérifier qu'on est sur le serveur
@@ -24,6 +25,9 @@ if systemctl is-active --quiet $SERVICE_NAME; then
     echo "⏸️  Arrêt du service existant..."
     sudo systemctl stop $SERVICE_NAME
 fi
+if systemctl is-active --quiet $VNC_SERVICE_NAME; then
+    sudo systemctl stop $VNC_SERVICE_NAME
+fi
 
 # Créer le répertoire de logs
 echo "📁 Création du répertoire de logs..."
@@ -59,12 +63,15 @@ fi
 # Installer le service systemd
 echo "🔧 Installation du service systemd..."
 sudo cp $APP_DIR/vm_manager.service /etc/systemd/system/
+sudo cp $APP_DIR/vm_manager_vnc.service /etc/systemd/system/
 sudo systemctl daemon-reload
 sudo systemctl enable $SERVICE_NAME
+sudo systemctl enable $VNC_SERVICE_NAME
 
 # Démarrer le service
 echo "▶️  Démarrage du service..."
 sudo systemctl start $SERVICE_NAME
+sudo systemctl start $VNC_SERVICE_NAME
 
 # Vérifier le statut
 echo ""
@@ -72,6 +79,7 @@ echo "✅ Déploiement terminé !"
 echo ""
 echo "📊 Statut du service :"
 sudo systemctl status $SERVICE_NAME --no-pager
+sudo systemctl status $VNC_SERVICE_NAME --no-pager
 
 echo ""
 echo "📝 Commandes utiles :"
@@ -1,5 +1,8 @@
 // -------------------- Variables globales --------------------
 let autoRefreshInterval = null;
+let vmStream = null;
+let vmRecords = new Map();   // dossier -> VM (liste tenue à jour par le flux SSE)
+let vmListIsAdmin = false;
 let launchOptions = null;
 
 document.addEventListener("DOMContentLoaded", () => {
@@ -46,6 +49,24 @@ document.addEventListener("DOMContentLoaded", () => {
         apiLog.scrollTop = apiLog.scrollHeight;
     }
 
+    // -------------------- Suivi des tâches asynchrones --------------------
+    async function followJob(jobId, onDone) {
+        while (true) {
+            await new Promise(resolve => setTimeout(resolve, 3000));
+            try {
+                const res = await fetch(`/api/jobs/${jobId}`);
+                if (!res.ok) return;
+                const job = (await res.json()).job;
+                if (job.state === "queued" || job.state === "running") continue;
+                logMessage(job.message || `Tâche #${jobId} : ${job.state}`, job.state === "succeeded" ? "success" : "error");
+                if (onDone) onDone(job);
+                return;
+            } catch(err) {
+                return;
+            }
+        }
+    }
+
     // -------------------- Login --------------------
     loginForm?.addEventListener("submit", async (e) => {
         e.preventDefault();
@@ -273,6 +294,7 @@ document.addEventListener("DOMContentLoaded", () => {
             clearTimeout(timeoutId);
             const data = await res.json();
             logMessage(data.message, res.ok ? "success" : "error");
+            if (data.job_id) followJob(data.job_id, () => displayVMs());
             if (res.ok) {
                 // Message spécial pour Windows
                 if (payload.os === "windows") {
@@ -319,60 +341,63 @@ document.addEventListener("DOMContentLoaded", () => {
         }
         
         try {
+            // Réponse 304 (ETag) gérée par le navigateur : le corps en cache est réutilisé
             const res = await fetch("/api/list_vms");
             const data = await res.json();
-            const vms = data.vms || [];
-
-            if(vms.length === 0) {
-                noVmsDiv.style.display = "block";
-                vmList.innerHTML = "";
-                return;
-            } else {
-                noVmsDiv.style.display = "none";
-            }
-
-            vmList.innerHTML = "";
-            vms.forEach(vm => {
-                const card = document.createElement("div");
-                card.className = "vm-card";
-                
-                const isRunning = vm.state === 'running';
-                const stateClass = isRunning ? 'running' : 'stopped';
-                const stateText = isRunning ? 'En cours' : 'Arrêtée';
-                const ownerBadge = data.is_admin ? `<span class="owner-badge">👤 ${vm.owner}</span>` : '';
-                
-                card.innerHTML = `
-                    <div class="vm-header">
-                        <h3>${vm.name}</h3>
-                        ${ownerBadge}
-                        <span class="vm-state ${stateClass}">${stateText}</span>
-                    </div>
-                    <div class="vm-actions">
-                        <button class="launch-vm-btn" data-vm="${vm.name}" ${isRunning ? 'disabled' : ''}>
-                            ${isRunning ? '✓ Lancée' : '▶ Lancer'}
-                        </button>
-                        <button class="halt-vm-btn" data-vm="${vm.name}" ${!isRunning ? 'disabled' : ''}>
-                            ⏹ Arrêter
-                        </button>
-                        <button class="view-vm-btn" data-vm="${vm.name}" ${!isRunning ? 'disabled' : ''}>
-                            🖥 GUI
-                        </button>
-                        <button class="resource-btn" onclick="openResourceModal('${vm.name}')">
-                            📊 Demander ressources
-                        </button>
-                        <button class="delete-vm-btn" data-vm="${vm.name}" ${isRunning ? 'disabled' : ''}>
-                            🗑 Supprimer
-                        </button>
-                    </div>
-                `;
-                vmList.appendChild(card);
-            });
+            renderVMs(data.vms || [], data.is_admin);
         } catch(err) {
             console.error("Erreur displayVMs:", err);
             logMessage("Erreur lors du chargement des VMs", "error");
         }
     };
 
+    window.renderVMs = function(vms, isAdmin) {
+        if(vms.length === 0) {
+            noVmsDiv.style.display = "block";
+            vmList.innerHTML = "";
+            return;
+        } else {
+            noVmsDiv.style.display = "none";
+        }
+
+        vmList.innerHTML = "";
+        vms.forEach(vm => {
+            const card = document.createElement("div");
+            card.className = "vm-card";
+            
+            const isRunning = vm.state === 'running';
+            const stateClass = isRunning ? 'running' : 'stopped';
+            const stateText = isRunning ? 'En cours' : 'Arrêtée';
+            const ownerBadge = isAdmin ? `<span class="owner-badge">👤 ${vm.owner}</span>` : '';
+            
+            card.innerHTML = `
+                <div class="vm-header">
+                    <h3>${vm.name}</h3>
+                    ${ownerBadge}
+                    <span class="vm-state ${stateClass}">${stateText}</span>
+                </div>
+                <div class="vm-actions">
+                    <button class="launch-vm-btn" data-vm="${vm.name}" ${isRunning ? 'disabled' : ''}>
+                        ${isRunning ? '✓ Lancée' : '▶ Lancer'}
+                    </button>
+                    <button class="halt-vm-btn" data-vm="${vm.name}" ${!isRunning ? 'disabled' : ''}>
+                        ⏹ Arrêter
+                    </button>
+                    <button class="view-vm-btn" data-vm="${vm.name}" ${!isRunning ? 'disabled' : ''}>
+                        🖥 GUI
+                    </button>
+                    <button class="resource-btn" onclick="openResourceModal('${vm.name}')">
+                        📊 Demander ressources
+                    </button>
+                    <button class="delete-vm-btn" data-vm="${vm.name}" ${isRunning ? 'disabled' : ''}>
+                        🗑 Supprimer
+                    </button>
+                </div>
+            `;
+            vmList.appendChild(card);
+        });
+    };
+
     // -------------------- Actions VM --------------------
     vmList?.addEventListener("click", async (e) => {
         const btn = e.target;
@@ -395,8 +420,8 @@ document.addEventListener("DOMContentLoaded", () => {
                     body:JSON.stringify({vm_name:vmName})
                 });
                 const data = await res.json();
-                logMessage(data.message, "success");
-                setTimeout(() => displayVMs(), 2000);
+                logMessage(data.message, res.ok ? "info" : "error");
+                if (data.job_id) followJob(data.job_id, () => displayVMs());
             } catch(err) {
                 logMessage(`Erreur lancement ${vmName}`, "error");
                 btn.disabled = false;
@@ -413,8 +438,8 @@ document.addEventListener("DOMContentLoaded", () => {
                     body:JSON.stringify({vm_name:vmName})
                 });
                 const data = await res.json();
-                logMessage(data.message, "success");
-                setTimeout(() => displayVMs(), 1000);
+                logMessage(data.message, res.ok ? "info" : "error");
+                if (data.job_id) followJob(data.job_id, () => displayVMs());
             } catch(err) {
                 logMessage(`Erreur arrêt ${vmName}`, "error");
                 btn.disabled = false;
@@ -437,8 +462,8 @@ document.addEventListener("DOMContentLoaded", () => {
                     body:JSON.stringify({vm_name:vmName})
                 });
                 const data = await res.json();
-                logMessage(data.message, "success");
-                displayVMs();
+                logMessage(data.message, res.ok ? "info" : "error");
+                if (data.job_id) followJob(data.job_id, () => displayVMs());
             } catch(err) {
                 logMessage(`Erreur suppression ${vmName}`, "error");
                 btn.disabled = false;
@@ -484,7 +509,11 @@ document.addEventListener("DOMContentLoaded", () => {
         fetch(`/api/get_vnc_url/${vmName}`)
         .then(r => r.json())
         .then(data => {
-            if (data.success) {
+            if (data.job_id) {
+                // VM en veille : reprise en cours, la console s'ouvre ensuite
+                logMessage(data.message, "info");
+                followJob(data.job_id, job => { if (job.state === "succeeded") viewVM(vmName); });
+            } else if (data.success) {
                 window.open(data.url, '_blank', 'width=1280,height=720');
                 logMessage(`Console web de ${vmName} ouverte`, "success");
             } else {
@@ -501,7 +530,47 @@ document.addEventListener("DOMContentLoaded", () => {
 });
 
 // -------------------- Auto-refresh (HORS DOMContentLoaded) --------------------
+// Flux SSE /api/vms/stream : liste complète à la connexion puis seulement les changements.
+// Repli sur l'interrogation toutes les 5 s si EventSource est indisponible ou le flux fermé.
+function renderVMRecords() {
+    if (launchOptions && launchOptions.style.display !== 'none') {
+        window.renderVMs(Array.from(vmRecords.values()), vmListIsAdmin);
+    }
+}
+
 function startAutoRefresh() {
+    stopAutoRefresh();
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+
+    vmStream = new EventSource("/api/vms/stream");
+    vmStream.addEventListener("snapshot", (e) => {
+        const data = JSON.parse(e.data);
+        vmRecords = new Map(data.vms.map(vm => [vm.path, vm]));
+        vmListIsAdmin = data.is_admin;
+        renderVMRecords();
+    });
+    vmStream.addEventListener("delta", (e) => {
+        const data = JSON.parse(e.data);
+        data.removed.forEach(path => vmRecords.delete(path));
+        data.changed.forEach(vm => vmRecords.set(vm.path, vm));
+        // Ordre du serveur : propriétaire puis nom
+        vmRecords = new Map([...vmRecords.entries()].sort(([, a], [, b]) =>
+            a.owner.localeCompare(b.owner) || a.name.localeCompare(b.name)));
+        renderVMRecords();
+    });
+    vmStream.onerror = () => {
+        // EventSource se reconnecte seul ; s'il abandonne (session expirée...), repli sur l'interrogation
+        if (vmStream && vmStream.readyState === EventSource.CLOSED) {
+            vmStream = null;
+            startPolling();
+        }
+    };
+}
+
+function startPolling() {
     if (autoRefreshInterval) clearInterval(autoRefreshInterval);
     
     autoRefreshInterval = setInterval(() => {
@@ -512,6 +581,10 @@ function startAutoRefresh() {
 }
 
 function stopAutoRefresh() {
+    if (vmStream) {
+        vmStream.close();
+        vmStream = null;
+    }
     if (autoRefreshInterval) {
         clearInterval(autoRefreshInterval);
         autoRefreshInterval = null;